@@ -11,6 +11,7 @@
 #
 
 # Common
+import collections
 import os
 import sys
 import traceback
@@ -33,6 +34,7 @@ import storm_control.dave.sequenceViewer as sequenceViewer
 
 # Communication
 import storm_control.sc_library.tcpClient as tcpClient
+import storm_control.sc_library.tcpMessage as tcpMessage
 
 # UI
 import storm_control.dave.qtdesigner.dave_ui as daveUi
@@ -142,6 +144,234 @@ class CommandEngine(QtCore.QObject):
         self.warning.emit(message)
         self.handleActionComplete(message)
 
+## ValidationEngine
+#
+# This class validates a command sequence by sending the actions to HAL / Kilroy
+# in test mode. Only one action is sent for each validation key, several messages
+# are sent at once, and the responses are cached so that only the actions that
+# changed are sent when the sequence is validated again.
+#
+class ValidationEngine(QtCore.QObject):
+    done = QtCore.pyqtSignal()
+    problem = QtCore.pyqtSignal(object, object)
+
+    ## __init__
+    #
+    # @param clients A dictionary of TCPClients, keyed by action type.
+    # @param batch_size (Optional) The maximum number of messages waiting for a response from each client.
+    # @param parent (Optional) The PyQt parent of this object.
+    #
+    def __init__(self, clients, batch_size = 20, parent = None):
+        QtCore.QObject.__init__(self, parent)
+
+        self.batch_size = batch_size
+        self.cache = {}
+        self.clients = clients
+        self.in_flight = {}
+        self.model = None
+        self.problems = []
+        self.queue = collections.deque()
+        self.sending = False
+
+        self.lost_message_timer = QtCore.QTimer(self)
+        self.lost_message_timer.setSingleShot(True)
+        self.lost_message_timer.timeout.connect(self.handleTimerDone)
+
+    ## abort
+    #
+    # Stop validating, responses to messages that were already sent are ignored.
+    #
+    def abort(self):
+        self.queue.clear()
+        self.in_flight = {}
+        self.problems = []
+        self.finish()
+
+    ## clearCache
+    #
+    # Forget the cached responses, i.e. because HAL's state changed.
+    #
+    def clearCache(self):
+        self.cache = {}
+
+    ## finish
+    #
+    # Called when there are no more responses to wait for.
+    #
+    def finish(self):
+        self.lost_message_timer.stop()
+        self.model = None
+
+        # Actions disconnect everything from the client when they are done, so
+        # we only connect to the clients while validating.
+        for client in self.clients.values():
+            try:
+                client.messageReceived.disconnect(self.handleMessageReceived)
+            except TypeError:
+                pass
+
+        # This is usually called from handleMessageReceived(), and Dave shows
+        # the problems in (modal) dialog boxes, so they are reported once we
+        # are no longer handling a message from the socket.
+        problems = self.problems
+        self.problems = []
+        QtCore.QTimer.singleShot(0, lambda : self.reportProblems(problems))
+
+    ## getNumberToSend
+    #
+    # @return The number of messages that will be sent to validate the current sequence.
+    #
+    def getNumberToSend(self):
+        return len(self.queue) + len(self.in_flight)
+
+    ## handleMessageReceived
+    #
+    # Handle a response from HAL or Kilroy.
+    #
+    # @param message A TCP message object.
+    #
+    def handleMessageReceived(self, message):
+        if not (message.getID() in self.in_flight):
+            return
+
+        [item, dave_action, client] = self.in_flight.pop(message.getID())
+
+        # Responses to messages that were re-sent to restore the test state
+        # are not used, the first action with this state is validated.
+        if item is not None:
+            dave_action.handleReply(message)
+            dave_action.resetPause()
+            validation_key = item.getValidationKey()
+
+            if message.hasError():
+                self.model.setGroupValid(validation_key, False)
+                self.problems.append([item, message])
+            else:
+                estimates = [dave_action.getUsage(), dave_action.getDuration()]
+                self.cache[validation_key] = estimates
+                self.model.setGroupEstimates(validation_key, *estimates)
+
+        if (self.model is not None):
+            self.startTimer()
+            self.sendMessages()
+
+    ## handleTimerDone
+    #
+    # The remaining messages were never returned.
+    #
+    def handleTimerDone(self):
+        in_flight = self.in_flight
+        self.in_flight = {}
+        for [item, dave_action, client] in in_flight.values():
+            if item is not None:
+                message = dave_action.getMessage()
+                error_str = "A message of type " + message.getType() + " was never received.\n"
+                error_str += "Perhaps a module is missing?"
+                message.setError(True, error_str)
+                self.model.setGroupValid(item.getValidationKey(), False)
+                self.problems.append([item, message])
+        self.sendMessages()
+
+    ## reportProblems
+    #
+    # Emit a problem signal for each invalid action, then the done signal.
+    #
+    # @param problems A list of [DaveActionItem, TCP message].
+    #
+    def reportProblems(self, problems):
+        for [item, message] in problems:
+            self.problem.emit(item, message)
+        self.done.emit()
+
+    ## sendMessages
+    #
+    # Send queued messages until each client has batch_size messages waiting for a response.
+    #
+    def sendMessages(self):
+
+        # The client returns the message with an error if it is not connected,
+        # in which case we'll end up back here.
+        if self.sending:
+            return
+        self.sending = True
+
+        # Messages are sent in sequence order. The actions are only created as they
+        # are sent, and we keep them as the model can release them at any time.
+        waiting = collections.Counter([client for [item, dave_action, client] in self.in_flight.values()])
+        while (len(self.queue) > 0) and (waiting[self.queue[0][2]] < self.batch_size):
+            [item, message, client] = self.queue.popleft()
+            dave_action = None
+            if item is not None:
+                dave_action = item.getDaveAction()
+                message = dave_action.getMessage()
+            waiting[client] += 1
+            self.in_flight[message.getID()] = [item, dave_action, client]
+            self.startTimer()
+            message.setTestMode(True)
+            client.sendMessage(message)
+
+            # Count the messages that were returned while sending.
+            waiting = collections.Counter([client for [item, dave_action, client] in self.in_flight.values()])
+
+        self.sending = False
+        if (len(self.queue) == 0) and (len(self.in_flight) == 0) and (self.model is not None):
+            self.finish()
+
+    ## start
+    #
+    # Start validating a sequence. The cached responses are used for actions
+    # that were already validated.
+    #
+    # @param model A DaveSequenceModel.
+    #
+    def start(self, model):
+        self.model = model
+        self.problems = []
+        self.queue.clear()
+        self.in_flight = {}
+        for client in self.clients.values():
+            client.messageReceived.connect(self.handleMessageReceived)
+
+        sent_context = {}
+        for item in self.model.getValidationItems():
+            validation_key = item.getValidationKey()
+            if validation_key in self.cache:
+                self.model.setGroupEstimates(validation_key, *self.cache[validation_key])
+                continue
+
+            # Some actions are only sent to restore the test state, so the state that
+            # HAL sees might not be the one in the sequence. Re-send the action that
+            # set the state if necessary.
+            for [name, value] in item.getValidationContext().items():
+                setter = self.model.getContextSetter(name, value)
+                if (setter is not None) and (sent_context.get(name) != value):
+                    setter_message = setter.getDaveAction().getMessage()
+                    message = tcpMessage.TCPMessage(message_type = setter_message.getType(),
+                                                    message_data = setter_message.getMessageData())
+                    self.queue.append([None, message, self.clients[setter.getActionType()]])
+                    sent_context[name] = value
+
+            self.queue.append([item, None, self.clients[item.getActionType()]])
+            sent_context.update(item.getValidationState())
+
+        self.sendMessages()
+
+    ## startTimer
+    #
+    # (Re)start the timer for the messages that are waiting for a response.
+    #
+    def startTimer(self):
+        delay = 0
+        for [item, dave_action, client] in self.in_flight.values():
+            if item is None:
+                delay = max(delay, 2000)
+            else:
+                delay = max(delay, dave_action.lost_message_delay)
+        if (delay > 0):
+            self.lost_message_timer.start(delay)
+        else:
+            self.lost_message_timer.stop()
+
 ## Dave
 #
 # The main window of Dave.
@@ -242,6 +472,12 @@ class Dave(QtWidgets.QMainWindow):
         self.command_engine.warning.connect(self.handleWarning)
         self.command_engine.dave_action.connect(self.handleDaveAction)
 
+        # Validation engine.
+        self.validation_engine = ValidationEngine({"hal" : self.command_engine.HALClient,
+                                                   "kilroy" : self.command_engine.kilroyClient})
+        self.validation_engine.done.connect(self.handleValidationDone)
+        self.validation_engine.problem.connect(self.handleValidationProblem)
+
     ## cleanUp
     #
     # Saves (most of) the notification settings at program exit.
@@ -332,11 +568,7 @@ class Dave(QtWidgets.QMainWindow):
             self.test_mode = False
             self.sequence_validated = False
             self.ui.commandSequenceTreeView.setTestMode(False)
-            
-            if (self.running):
-                self.command_engine.abort()
-            else:
-                self.handleDone()
+            self.validation_engine.abort()
 
     ## handleClearWarnings
     #
@@ -579,20 +811,7 @@ class Dave(QtWidgets.QMainWindow):
 
         else: # Test mode
             self.ui.commandSequenceTreeView.setCurrentItemValid(False)
-            message_str += "\nSuppress remaining warnings?"
-            if not self.skip_warning:
-                messageBox = QtWidgets.QMessageBox(parent = self)
-                messageBox.setWindowTitle("Invalid Command")
-                messageBox.setText(message_str)
-                messageBox.setStandardButtons(QtWidgets.QMessageBox.No |
-                                              QtWidgets.QMessageBox.YesToAll)
-                messageBox.setIcon(QtWidgets.QMessageBox.Warning)
-                messageBox.setDefaultButton(QtWidgets.QMessageBox.YesToAll)
-                button_ID = messageBox.exec_()
-                if button_ID == QtWidgets.QMessageBox.YesToAll:
-                    self.skip_warning = True # Skip additional warnings
-
-            print("Invalid command: " + current_item.getDaveAction().getDescriptor())
+            self.handleValidationProblem(current_item, message, message_str = message_str)
 
     ## handleRunButton
     #
@@ -647,6 +866,10 @@ class Dave(QtWidgets.QMainWindow):
             self.ui.validateSequenceButton.setEnabled(False)
             self.running = True
             self.updateRunStatusDisplay()
+
+            # Running changes HAL's state (i.e. there are new movies), so the
+            # validation responses will have to be checked again.
+            self.validation_engine.clearCache()
             self.command_engine.startCommand(self.ui.commandSequenceTreeView.getCurrentItem().getDaveAction(),
                                              self.test_mode)
 
@@ -682,21 +905,68 @@ class Dave(QtWidgets.QMainWindow):
             
             # Reset command properties.
             self.ui.commandSequenceTreeView.setAllValid(True)
-            
-            # Place commandSequence into test mode.
             self.ui.commandSequenceTreeView.resetItemIndex()
             self.updateRunStatusDisplay()
-            self.ui.commandSequenceTreeView.setTestMode(True)
 
-            # Send first command.
-            self.command_engine.startCommand(self.ui.commandSequenceTreeView.getCurrentItem().getDaveAction(),
-                                             self.test_mode)
+            # Send the test messages.
+            self.validation_engine.start(self.ui.commandSequenceTreeView.getModel())
 
         # Mark all commands as invalid
         else: 
             self.ui.commandSequenceTreeView.setAllValid(False)
             self.updateEstimates()
 
+    ## handleValidationDone
+    #
+    # Handles completion (or abort) of the validation of a command sequence.
+    #
+    @hdebug.debug
+    def handleValidationDone(self):
+        self.ui.runButton.setText("Start")
+        self.ui.runButton.setEnabled(True)
+        self.ui.abortButton.setEnabled(False)
+        self.ui.validateSequenceButton.setEnabled(True)
+        self.ui.commandSequenceTreeView.resetItemIndex()
+
+        # test_mode is False if the validation was aborted.
+        self.running = False
+        self.sequence_validated = self.test_mode
+        self.test_mode = False
+        self.updateEstimates()
+
+        # Stop TCP communication
+        if self.needs_hal:
+            self.command_engine.HALClient.stopCommunication()
+        if self.needs_kilroy:
+            self.command_engine.kilroyClient.stopCommunication()
+
+    ## handleValidationProblem
+    #
+    # Handles an invalid command, the operator can choose to suppress the remaining warnings.
+    #
+    # @param item The DaveActionItem of the invalid command.
+    # @param message The problem message.
+    # @param message_str A informative string regarding the error. Defaults to False.
+    #
+    @hdebug.debug
+    def handleValidationProblem(self, item, message, message_str = False):
+        if not message_str:
+            message_str = item.getDaveAction().getDescriptor() + "\n" + message.getErrorMessage()
+        message_str += "\nSuppress remaining warnings?"
+        if not self.skip_warning:
+            messageBox = QtWidgets.QMessageBox(parent = self)
+            messageBox.setWindowTitle("Invalid Command")
+            messageBox.setText(message_str)
+            messageBox.setStandardButtons(QtWidgets.QMessageBox.No |
+                                          QtWidgets.QMessageBox.YesToAll)
+            messageBox.setIcon(QtWidgets.QMessageBox.Warning)
+            messageBox.setDefaultButton(QtWidgets.QMessageBox.YesToAll)
+            button_ID = messageBox.exec_()
+            if button_ID == QtWidgets.QMessageBox.YesToAll:
+                self.skip_warning = True # Skip additional warnings
+
+        print("Invalid command: " + item.getDaveAction().getDescriptor())
+
     ## handleWarning
     #
     # Handles the warning signal from the command engine and determines if Dave should pause
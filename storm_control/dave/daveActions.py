@@ -10,6 +10,9 @@
 # Hazen 09/14
 #
 
+import hashlib
+import json
+
 from xml.etree import ElementTree
 from PyQt5 import QtCore
 
@@ -26,6 +29,16 @@ def addField(block, name, value):
     field.set("type", str(type(value).__name__))
     field.text = str(value)
 
+## validationKey
+#
+# @param payload A JSON serializable object.
+#
+# @return A hash of payload, actions with the same key get the same response to a test message.
+#
+def validationKey(payload):
+    payload_str = json.dumps(payload, sort_keys = True, default = str)
+    return hashlib.sha1(payload_str.encode("utf-8")).hexdigest()
+
 ## DaveAction
 #
 # The base class for a dave action (DA for short).
@@ -59,10 +72,8 @@ class DaveAction(QtCore.QObject):
         self.should_pause_default = False    # Default pause state for reset
         self.should_pause_after_error = True # Pause after an error
                 
-        # Initialize internal timer
-        self.lost_message_timer = QtCore.QTimer(self)
-        self.lost_message_timer.setSingleShot(True)
-        self.lost_message_timer.timeout.connect(self.handleTimerDone)
+        # The internal timer is created when it is first needed, there can be a lot of actions.
+        self.lost_message_timer = None
         self.lost_message_delay = 2000 # Wait for a test message to be returned before issuing an error
 
     ## abort
@@ -191,6 +202,33 @@ class DaveAction(QtCore.QObject):
     def getUsage(self):
         return self.disk_usage
 
+    ## getValidationContext
+    #
+    # @return A dictionary of the test state (i.e. "directory", "parameters") that this action changes.
+    #
+    def getValidationContext(self):
+        return {}
+
+    ## getValidationDependencies
+    #
+    # @return A list of the test state names that the response to a test message depends on.
+    #
+    def getValidationDependencies(self):
+        return []
+
+    ## getValidationKey
+    #
+    # @param context A dictionary with the test state that this action depends on.
+    #
+    # @return A key for the response to a test message, or None if the action does not require validation.
+    #
+    def getValidationKey(self, context):
+        if self.id is None:
+            return None
+        return validationKey([self.action_type,
+                              self.message.getType(),
+                              self.message.getMessageData()])
+
     ## handleReply
     #
     # handle the return of a message
@@ -201,7 +239,8 @@ class DaveAction(QtCore.QObject):
     def handleReply(self, message, warning = False):
 
         # Stop lost message timer
-        self.lost_message_timer.stop()
+        if self.lost_message_timer is not None:
+            self.lost_message_timer.stop()
 
         # Check to see if the same message got returned
         if not (message.getID() == self.message.getID()):
@@ -300,6 +339,10 @@ class DaveAction(QtCore.QObject):
 
         self.tcp_client.messageReceived.connect(self.handleReply)
         if self.message.isTest():
+            if self.lost_message_timer is None:
+                self.lost_message_timer = QtCore.QTimer(self)
+                self.lost_message_timer.setSingleShot(True)
+                self.lost_message_timer.timeout.connect(self.handleTimerDone)
             self.lost_message_timer.start(self.lost_message_delay)
         self.tcp_client.sendMessage(self.message)
 
@@ -461,7 +504,8 @@ class DADelay(DaveAction):
     # Handle an external abort call
     #
     def abort(self):
-        self.delay_timer.stop()
+        if self.delay_timer is not None:
+            self.delay_timer.stop()
         self.completeAction(self.message)
 
     ## cleanUp
@@ -506,10 +550,8 @@ class DADelay(DaveAction):
     #
     def setup(self, node):
 
-        # Prepare delay timer
-        self.delay_timer = QtCore.QTimer(self)
-        self.delay_timer.setSingleShot(True)
-        self.delay_timer.timeout.connect(self.handleTimerComplete)
+        # The delay timer is created when the action is started.
+        self.delay_timer = None
         self.delay = int(node.find("delay").text)
         
         # Create message and add delay time for accurate dave time estimates
@@ -530,6 +572,10 @@ class DADelay(DaveAction):
         if self.message.isTest():
             self.completeAction(self.message)
         else:
+            if self.delay_timer is None:
+                self.delay_timer = QtCore.QTimer(self)
+                self.delay_timer.setSingleShot(True)
+                self.delay_timer.timeout.connect(self.handleTimerComplete)
             self.delay_timer.start(self.delay)
             print("Delaying " + str(self.delay) + " ms")
 
@@ -874,6 +920,13 @@ class DASetDirectory(DaveAction):
     def getDescriptor(self):
         return "change directory to " + self.directory
 
+    ## getValidationContext
+    #
+    # @return A dictionary of the test state that this action changes.
+    #
+    def getValidationContext(self):
+        return {"directory" : self.directory}
+
     ## setup
     #
     # Perform post creation initialization.
@@ -970,6 +1023,13 @@ class DASetParameters(DaveAction):
     def getDescriptor(self):
         return "set parameters to " + str(self.parameters)
 
+    ## getValidationContext
+    #
+    # @return A dictionary of the test state that this action changes.
+    #
+    def getValidationContext(self):
+        return {"parameters" : self.parameters}
+
     ## setup
     #
     # Perform post creation initialization.
@@ -1138,6 +1198,33 @@ class DATakeMovie(DaveAction):
         else:
             return "take movie " + self.name + ", " + str(self.length) + " frames"
 
+    ## getValidationDependencies
+    #
+    # @return A list of the test state names that the response to a test message depends on.
+    #
+    def getValidationDependencies(self):
+        return ["directory", "parameters"]
+
+    ## getValidationKey
+    #
+    # The movie size and duration depend on the parameters, and HAL checks
+    # for an existing movie with the same name in the directory.
+    #
+    # @param context A dictionary with the test state that this action depends on.
+    #
+    # @return A key for the response to a test message.
+    #
+    def getValidationKey(self, context):
+        message_data = dict(self.message.getMessageData())
+        for name in self.getValidationDependencies():
+            if message_data.get(name) is None:
+                message_data[name] = context.get(name)
+        if message_data.get("overwrite", False):
+            del message_data["name"]
+        return validationKey([self.action_type,
+                              self.message.getType(),
+                              message_data])
+
     ## handleReply
     #
     # Overload of default handleReply to allow comparison of min_spots
@@ -21,7 +21,7 @@ class DaveWarning(QtGui.QStandardItem):
 
     ## __init__
     #
-    # @param dave_action_si The daveActionStandardItem on which the error was generated
+    # @param dave_action_si The DaveActionItem on which the error was generated
     # @param message_str A string describing the error (Typically provided by the message)
     #
     def __init__(self, dave_action_si,
@@ -40,7 +40,7 @@ class DaveWarning(QtGui.QStandardItem):
     
     ## getDaveStandardItem
     #
-    # @return The DaveActionStandardItem associated with this item.
+    # @return The DaveActionItem associated with this item.
     #
     def getDaveActionStandardItem(self):
         return self.dave_action_si
@@ -4,6 +4,10 @@
 #
 # Handles viewing (and parsing) sequence xml files and generating DaveActions.
 #
+# Sequences can have tens of thousands of actions, so the model only keeps
+# the XML node of each action, the DaveActions are created when they are
+# needed and released again once they are far from the current action.
+#
 # Hazen 06/14
 #
 
@@ -13,32 +17,134 @@ from PyQt5 import QtCore, QtGui, QtWidgets
 import storm_control.dave.daveActions as daveActions
 
 
-DaveActionType = QtGui.QStandardItem.UserType
+# The types of the DaveAction classes, keyed by class name.
+action_types = {}
+
+## actionType
+#
+# @param tag The name of a DaveAction class (i.e. "DATakeMovie").
+#
+# @return The type of the action (i.e. "hal", "kilroy", ..).
+#
+def actionType(tag):
+    if not tag in action_types:
+        action_types[tag] = getattr(daveActions, tag)().getActionType()
+    return action_types[tag]
 
-## DaveActionStandardItem
+## DaveBranchItem
 #
-# A QStandardItem specialized to hold a DaveAction.
+# A branch of the sequence tree (i.e. a loop or a movie).
 #
-class DaveActionStandardItem(QtGui.QStandardItem):
+class DaveBranchItem(object):
 
     ## __init__
     #
-    # @param node A XML node describing the DaveAction.
+    # @param name The name of the branch.
+    # @param parent (Optional) The DaveBranchItem that contains this branch.
+    #
+    def __init__(self, name, parent = None):
+        self.children = []
+        self.name = name
+        self.parent = parent
+        self.row = 0
+
+        if self.parent is not None:
+            self.row = len(self.parent.children)
+            self.parent.children.append(self)
+
+    ## getDescriptor
+    #
+    # @return The name of the branch.
     #
-    def __init__(self, node):
-        dave_action_class = getattr(daveActions, node.tag)
-        self.dave_action = dave_action_class()
-        self.dave_action.setup(node)
+    def getDescriptor(self):
+        return self.name
+
+    ## getParent
+    #
+    # @return The DaveBranchItem that contains this branch, or None.
+    #
+    def getParent(self):
+        return self.parent
+
+    ## isValid
+    #
+    # @return True, branches are always valid.
+    #
+    def isValid(self):
+        return True
+
+## DaveActionItem
+#
+# A leaf of the sequence tree, this holds the XML node of a DaveAction and
+# creates the DaveAction when it is needed.
+#
+class DaveActionItem(object):
+
+    # There can be a lot of these.
+    __slots__ = ["dave_action",
+                 "descriptor",
+                 "disk_usage",
+                 "duration",
+                 "index",
+                 "model",
+                 "node",
+                 "parent",
+                 "row",
+                 "valid",
+                 "validation_context",
+                 "validation_key",
+                 "validation_state"]
+
+    ## __init__
+    #
+    # @param node A XML node describing the DaveAction.
+    # @param parent The DaveBranchItem that contains this item.
+    # @param index The position of the DaveAction in the sequence.
+    # @param model The DaveSequenceModel that this item belongs to.
+    #
+    def __init__(self, node, parent, index, model):
+        self.dave_action = None
+        self.descriptor = None
+        self.disk_usage = 0
+        self.duration = 0
+        self.index = index
+        self.model = model
+        self.node = node
+        self.parent = parent
+        self.row = len(self.parent.children)
         self.valid = True
+        self.validation_context = {}
+        self.validation_key = None
+        self.validation_state = None
 
-        QtGui.QStandardItem.__init__(self, self.dave_action.getDescriptor())
-        self.setFlags(QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEnabled)
+        self.parent.children.append(self)
+
+    ## createDaveAction
+    #
+    # @return A new DaveAction created from the XML node.
+    #
+    def createDaveAction(self):
+        dave_action = getattr(daveActions, self.node.tag)()
+        dave_action.setup(self.node)
+        dave_action.setDiskUsage(self.disk_usage)
+        dave_action.setDuration(self.duration)
+        return dave_action
+
+    ## getActionType
+    #
+    # @return The type of the DaveAction (i.e. "hal", "kilroy", ..).
+    #
+    def getActionType(self):
+        return actionType(self.node.tag)
 
     ## getDaveAction
     #
     # @return The DaveAction associated with this item.
     #
     def getDaveAction(self):
+        if self.dave_action is None:
+            self.dave_action = self.createDaveAction()
+            self.model.daveActionCreated(self)
         return self.dave_action
 
     ## getDaveActionID
@@ -46,7 +152,67 @@ class DaveActionStandardItem(QtGui.QStandardItem):
     # @return The id associated with the DaveAction associated with this item.
     #
     def getDaveActionID(self):
-        return self.dave_action.getID()
+        return self.getDaveAction().getID()
+
+    ## getDescriptor
+    #
+    # @return A string that describes the DaveAction.
+    #
+    def getDescriptor(self):
+        if self.descriptor is None:
+            self.descriptor = self.getDaveAction().getDescriptor()
+        return self.descriptor
+
+    ## getDiskUsage
+    #
+    # @return The estimated disk usage of the DaveAction.
+    #
+    def getDiskUsage(self):
+        return self.disk_usage
+
+    ## getDuration
+    #
+    # @return The estimated duration of the DaveAction.
+    #
+    def getDuration(self):
+        return self.duration
+
+    ## getParent
+    #
+    # @return The DaveBranchItem that contains this item.
+    #
+    def getParent(self):
+        return self.parent
+
+    ## getParentName
+    #
+    # @return The display text of any associated parent
+    #
+    def getParentName(self):
+        return self.parent.getDescriptor()
+
+    ## getValidationContext
+    #
+    # @return The test state that the validation of the DaveAction depends on.
+    #
+    def getValidationContext(self):
+        return self.validation_context
+
+    ## getValidationKey
+    #
+    # @return The validation key of the DaveAction, or None if it does not require validation.
+    #
+    def getValidationKey(self):
+        return self.validation_key
+
+    ## getValidationState
+    #
+    # @return The test state that the DaveAction changes.
+    #
+    def getValidationState(self):
+        if self.validation_state is None:
+            return {}
+        return self.validation_state
 
     ## isValid
     #
@@ -55,43 +221,44 @@ class DaveActionStandardItem(QtGui.QStandardItem):
     def isValid(self):
         return self.valid
 
+    ## releaseDaveAction
+    #
+    # Forget the DaveAction, it will be created again if it is needed.
+    #
+    def releaseDaveAction(self):
+        self.dave_action = None
+
     ## setUsageEstimates
     #
     # @param disk_usage The estimated disk_usage for the action
     # @param duration The estimated duration of the action
     #
     def setUsageEstimates(self, disk_usage, duration):
-        self.dave_action.setDiskUsage(disk_usage)
-        self.dave_action.setDuration(duration)
-
-    ## setValid
-    #
-    # @param valid True/False if the DaveAction associated with this item is valid.
-    #
-    def setValid(self, valid):
-        self.valid = valid
-        if self.valid:
-            self.setBackground(QtGui.QBrush(QtGui.QColor(255,255,255)))
-        else:
-            self.setBackground(QtGui.QBrush(QtGui.QColor(255,200,200)))
+        self.disk_usage = disk_usage
+        self.duration = duration
+        if self.dave_action is not None:
+            self.dave_action.setDiskUsage(disk_usage)
+            self.dave_action.setDuration(duration)
 
-    ## type
+    ## setValidation
     #
-    # @return The type of the object (an int).
+    # @param validation_key The key of the response to a test message.
+    # @param validation_context The test state that this key depends on.
+    # @param validation_state (Optional) The test state that the DaveAction changes.
     #
-    def type(self):
-        return DaveActionType
+    def setValidation(self, validation_key, validation_context, validation_state = None):
+        self.validation_context = validation_context
+        self.validation_key = validation_key
+        self.validation_state = validation_state or None
 
-    ## getParentName
+    ## setValid
     #
-    # @return The display text of any associated parent
+    # @param valid True/False if the DaveAction associated with this item is valid.
     #
-    def getParentName(self):
-        parent = self.parent()
-        if parent == 0: # No parent
-            return ""
-        else:
-            return str(parent.text())
+    def setValid(self, valid):
+        if (self.valid != valid):
+            self.valid = valid
+            self.model.itemChanged(self)
 
 ## DaveCommandTreeViewer
 #
@@ -148,7 +315,7 @@ class DaveCommandTreeViewer(QtWidgets.QTreeView):
 
     ## getCurrentItem
     #
-    # @return The current DaveActionStandardItem or None if there are no items.
+    # @return The current DaveActionItem or None if there are no items.
     #
     def getCurrentItem(self):
         if self.dv_model is not None:
@@ -164,11 +331,18 @@ class DaveCommandTreeViewer(QtWidgets.QTreeView):
         else:
             return [0, 0]
 
+    ## getModel
+    #
+    # @return The DaveSequenceModel associated with the tree (or None).
+    #
+    def getModel(self):
+        return self.dv_model
+
     ## getNextItem
     #
     # @param (Optional) skip_invalid True/False to skip invalid commands. Defaults to True.
     #
-    # @return The next DaveActionStandardItem or None if there are no more items.
+    # @return The next DaveActionItem or None if there are no more items.
     #
     def getNextItem(self, skip_invalid = True):
         if self.aborted:
@@ -208,7 +382,7 @@ class DaveCommandTreeViewer(QtWidgets.QTreeView):
     def handleClick(self, model_index):
         if self.dv_model is not None:
             qt_item = self.dv_model.itemFromIndex(model_index)
-            if (qt_item.type() == DaveActionType):
+            if isinstance(qt_item, DaveActionItem):
                 self.update.emit(qt_item.getDaveAction().getLongDescriptor())
 
     ## handleDoubleClick
@@ -218,7 +392,7 @@ class DaveCommandTreeViewer(QtWidgets.QTreeView):
     def handleDoubleClick(self, model_index):
         if self.dv_model is not None:
             qt_item = self.dv_model.itemFromIndex(model_index)
-            if (qt_item.type() == DaveActionType):
+            if isinstance(qt_item, DaveActionItem):
                 self.double_clicked.emit(qt_item)
     
     ## haveNextItem
@@ -254,8 +428,8 @@ class DaveCommandTreeViewer(QtWidgets.QTreeView):
             cur_item = self.dv_model.getCurrentItem()
             qt_model_index = self.dv_model.indexFromItem(cur_item)
             v_rect = self.visualRect(qt_model_index)
-            while (v_rect.width() == 0) and (cur_item.parent() is not None):
-                cur_item = cur_item.parent()
+            while (v_rect.width() == 0) and (cur_item.getParent() is not None):
+                cur_item = cur_item.getParent()
                 qt_model_index = self.dv_model.indexFromItem(cur_item)
                 v_rect = self.visualRect(qt_model_index)
             if (v_rect.width() != 0):
@@ -286,7 +460,7 @@ class DaveCommandTreeViewer(QtWidgets.QTreeView):
 
     ## setCurrentAction
     #
-    # @param an_action The DaveActionStandardItem to use as the current item.
+    # @param an_action The DaveActionItem to use as the current item.
     #
     def setCurrentAction(self, an_item):
         if self.dv_model is not None:
@@ -303,7 +477,7 @@ class DaveCommandTreeViewer(QtWidgets.QTreeView):
 
     ## setModel
     #
-    # @param qt_model The DaveStandardItemModel associated with the tree.
+    # @param qt_model The DaveSequenceModel associated with the tree.
     #
     def setModel(self, dv_model):
         self.dv_model = dv_model
@@ -312,7 +486,7 @@ class DaveCommandTreeViewer(QtWidgets.QTreeView):
 
     ## setTestMode
     #
-    # @param test_mode True/False sets the test mode of the DaveStandardItemModel.
+    # @param test_mode True/False sets the test mode of the DaveSequenceModel.
     #
     def setTestMode(self, test_mode):
         if self.dv_model is not None:
@@ -335,51 +509,123 @@ class DaveCommandTreeViewer(QtWidgets.QTreeView):
         self.update.emit(item.getDaveAction().getLongDescriptor())
 
 
-## DaveStandardItemModel
+
+## DaveSequenceModel
 #
-# A QStandardItemModel specialized for Dave.
+# A (virtual) item model specialized for Dave. The model indexes point
+# directly at the DaveBranchItems and DaveActionItems of the sequence tree.
 #
-class DaveStandardItemModel(QtGui.QStandardItemModel):
+class DaveSequenceModel(QtCore.QAbstractItemModel):
 
     ## __init__
     #
-    def __init__(self):
-        QtGui.QStandardItemModel.__init__(self)
+    # @param window_size (Optional) The number of DaveActions to keep on either side of the current action.
+    # @param parent (Optional) The PyQt parent of this object.
+    #
+    def __init__(self, window_size = 100, parent = None):
+        QtCore.QAbstractItemModel.__init__(self, parent)
 
+        self.context_setters = {}
         self.dave_action_index = 0
-        self.dave_actions_cur = []   # The active list of DaveActionStandardItems
-        self.dave_actions_all = []   # The full list of DaveActionStandardItems
-        
-        # Lists for fast validation.
+        self.dave_actions_cur = []   # The active list of DaveActionItems
+        self.dave_actions_all = []   # The full list of DaveActionItems
+        self.dave_actions_created = {} # The DaveActionItems that currently have a DaveAction
+
+        # Lists for fast validation, these are created when they are first needed.
         self.dave_actions_test = []  # A list of actions to validate
-        self.dave_actions_test_dict = dict() # A dictionary of test ids and lists of actions that have these
+        self.dave_actions_test_dict = dict() # A dictionary of validation keys and lists of actions that have these
+        self.have_validation = False
 
+        self.root = DaveBranchItem("")
         self.test_mode = False
+        self.validation_context = {} # The test state (i.e. parameters) at the end of the sequence.
+        self.window_size = window_size
+
+    ## addBranch
+    #
+    # @param name The name of the branch.
+    # @param parent (Optional) The DaveBranchItem to add the branch to, defaults to the root.
+    #
+    # @return The new DaveBranchItem.
+    #
+    def addBranch(self, name, parent = None):
+        if parent is None:
+            parent = self.root
+        return DaveBranchItem(name, parent)
 
     ## addItem
     #
-    # @param dave_action_si A DaveActionStandardItem.
+    # @param node A XML node describing a DaveAction.
+    # @param parent (Optional) The DaveBranchItem to add the item to, defaults to the root.
     #
-    def addItem(self, dave_action_si):
+    # @return The new DaveActionItem.
+    #
+    def addItem(self, node, parent = None):
+        if parent is None:
+            parent = self.root
+
+        # Check that this is a DaveAction.
+        actionType(node.tag)
+
+        dave_action_si = DaveActionItem(node, parent, len(self.dave_actions_all), self)
         self.dave_actions_all.append(dave_action_si)
         self.dave_actions_cur.append(dave_action_si) # Build current actions simultaneously
-        
-        # Check if action requires validation
-        action_id = dave_action_si.getDaveAction().getID()
-        if action_id is not None:
-            # Check for existing id
-            is_present = False
-            for id_value in self.dave_actions_test_dict.keys():
-                if action_id == id_value:
-                    is_present = True
-
-            # Add to list if the id is not currently on the id list
-            if not is_present:
-                self.dave_actions_test.append(dave_action_si)
-                self.dave_actions_test_dict[action_id] = [dave_action_si] # Start list
-            else: # Add to current list of actions with the same id
-                self.dave_actions_test_dict[action_id].append(dave_action_si)
-        
+        self.have_validation = False
+        return dave_action_si
+
+    ## columnCount
+    #
+    # @param parent A QModelIndex.
+    #
+    # @return 1.
+    #
+    def columnCount(self, parent = QtCore.QModelIndex()):
+        return 1
+
+    ## data
+    #
+    # @param index A QModelIndex.
+    # @param role The data role.
+    #
+    # @return The data for the item at index.
+    #
+    def data(self, index, role = QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        item = index.internalPointer()
+        if (role == QtCore.Qt.DisplayRole):
+            return item.getDescriptor()
+        elif (role == QtCore.Qt.BackgroundRole) and not item.isValid():
+            return QtGui.QBrush(QtGui.QColor(255,200,200))
+        return None
+
+    ## daveActionCreated
+    #
+    # Called by DaveActionItems when they create their DaveAction. If there are
+    # a lot of DaveActions this releases the ones that are far from the current
+    # action.
+    #
+    # @param dave_action_si A DaveActionItem.
+    #
+    def daveActionCreated(self, dave_action_si):
+        if (len(self.dave_actions_created) >= 4 * self.window_size):
+            self.releaseDaveActions()
+        self.dave_actions_created[dave_action_si] = True
+
+    ## flags
+    #
+    # @param index A QModelIndex.
+    #
+    # @return The item flags, only DaveActionItems can be selected.
+    #
+    def flags(self, index):
+        if not index.isValid():
+            return QtCore.Qt.NoItemFlags
+        elif isinstance(index.internalPointer(), DaveActionItem):
+            return QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEnabled
+        else:
+            return QtCore.Qt.ItemIsEnabled
+
     ## getActionTypes
     #
     # @return A list of DaveAction types (i.e. "hal" or "kilroy").
@@ -387,11 +633,22 @@ class DaveStandardItemModel(QtGui.QStandardItemModel):
     def getActionTypes(self):
         types = []
         for item in self.dave_actions_cur:
-            type = item.getDaveAction().getActionType()
+            type = item.getActionType()
             if not type in types:
                 types.append(type)
         return types
 
+    ## getContextSetter
+    #
+    # @param name The name of the test state (i.e. "parameters").
+    # @param value The value of the test state.
+    #
+    # @return The first DaveActionItem that sets name to value, or None.
+    #
+    def getContextSetter(self, name, value):
+        self.updateValidation()
+        return self.context_setters.get((name, value))
+
     ## getCurrentIndex
     #
     # @return The current item index.
@@ -401,7 +658,7 @@ class DaveStandardItemModel(QtGui.QStandardItemModel):
 
     ## getCurrentItem
     #
-    # @return The current DaveActionStandardItem.
+    # @return The current DaveActionItem.
     #
     def getCurrentItem(self):
         return self.dave_actions_cur[self.dave_action_index]
@@ -410,7 +667,7 @@ class DaveStandardItemModel(QtGui.QStandardItemModel):
     #
     # @param skip_invalid True/False to skip invalid commands.
     #
-    # @return The next DaveActionStandardItem or none if there are no more items.
+    # @return The next DaveActionItem or none if there are no more items.
     #
     def getNextItem(self, skip_invalid):
         self.dave_action_index += 1
@@ -444,7 +701,7 @@ class DaveStandardItemModel(QtGui.QStandardItemModel):
         while (i < len(self.dave_actions_cur)):
             item = self.dave_actions_cur[i]
             if item.isValid():
-                est_time += item.getDaveAction().getDuration()
+                est_time += item.getDuration()
             i += 1
         return est_time
 
@@ -456,9 +713,17 @@ class DaveStandardItemModel(QtGui.QStandardItemModel):
         est_space = 0
         for item in self.dave_actions_cur:
             if item.isValid():
-                est_space += item.getDaveAction().getUsage()
+                est_space += item.getDiskUsage()
         return est_space
 
+    ## getValidationItems
+    #
+    # @return The DaveActionItems to validate, one for each validation key, in sequence order.
+    #
+    def getValidationItems(self):
+        self.updateValidation()
+        return self.dave_actions_test
+
     ## haveNextItem
     #
     # @return True/False if there is a next item available.
@@ -469,6 +734,30 @@ class DaveStandardItemModel(QtGui.QStandardItemModel):
         else:
             return True
 
+    ## index
+    #
+    # @param row The row of the item.
+    # @param column The column of the item.
+    # @param parent The QModelIndex of the parent of the item.
+    #
+    # @return The QModelIndex of the item.
+    #
+    def index(self, row, column, parent = QtCore.QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QtCore.QModelIndex()
+        return self.createIndex(row, column, self.itemFromIndex(parent).children[row])
+
+    ## indexFromItem
+    #
+    # @param item A DaveBranchItem or a DaveActionItem.
+    #
+    # @return The QModelIndex of the item.
+    #
+    def indexFromItem(self, item):
+        if (item is None) or (item is self.root):
+            return QtCore.QModelIndex()
+        return self.createIndex(item.row, 0, item)
+
     ## isAllValid
     #
     # @return True/False if all the items are valid.
@@ -480,13 +769,72 @@ class DaveStandardItemModel(QtGui.QStandardItemModel):
                 all_valid = False
         return all_valid
 
+    ## itemChanged
+    #
+    # Called by DaveActionItems when their validity changes.
+    #
+    # @param item A DaveActionItem.
+    #
+    def itemChanged(self, item):
+        index = self.indexFromItem(item)
+        self.dataChanged.emit(index, index)
+
+    ## itemFromIndex
+    #
+    # @param index A QModelIndex.
+    #
+    # @return The DaveBranchItem or DaveActionItem at index.
+    #
+    def itemFromIndex(self, index):
+        if index.isValid():
+            return index.internalPointer()
+        return self.root
+
+    ## parent
+    #
+    # @param index A QModelIndex.
+    #
+    # @return The QModelIndex of the parent of the item at index.
+    #
+    def parent(self, index):
+        if not index.isValid():
+            return QtCore.QModelIndex()
+        return self.indexFromItem(index.internalPointer().getParent())
+
+    ## releaseDaveActions
+    #
+    # Release the DaveActions that are not within window_size of the current action.
+    #
+    def releaseDaveActions(self):
+        current = 0
+        if (self.dave_action_index < len(self.dave_actions_cur)):
+            current = self.dave_actions_cur[self.dave_action_index].index
+        for item in list(self.dave_actions_created):
+            if (abs(item.index - current) > self.window_size):
+                item.releaseDaveAction()
+                del self.dave_actions_created[item]
+
     ## resetItemIndex
     #
-    # Reset to the first DaveActionStandardItem.
+    # Reset to the first DaveActionItem.
     #
     def resetItemIndex(self):
         self.dave_action_index = 0
 
+    ## rowCount
+    #
+    # @param parent A QModelIndex.
+    #
+    # @return The number of children of the item at parent.
+    #
+    def rowCount(self, parent = QtCore.QModelIndex()):
+        if (parent.column() > 0):
+            return 0
+        item = self.itemFromIndex(parent)
+        if isinstance(item, DaveBranchItem):
+            return len(item.children)
+        return 0
+
     ## setAllValid
     #
     # @param valid True/False Sets the valid status of all the items.
@@ -497,7 +845,7 @@ class DaveStandardItemModel(QtGui.QStandardItemModel):
 
     ## setCurrentItem
     #
-    # @param an_item The desired DaveActionStandardItem.
+    # @param an_item The desired DaveActionItem.
     #
     def setCurrentAction(self, an_item):
         self.dave_action_index = 0
@@ -516,19 +864,31 @@ class DaveStandardItemModel(QtGui.QStandardItemModel):
         if self.test_mode:
             # Find current id
             current_item = self.dave_actions_cur[self.dave_action_index]
-            current_action = current_item.getDaveAction()
-            current_id = current_action.getID()
-
-            print(current_id, is_valid)
-            
-            # Change validity of all actions that have this id
-            for item in self.dave_actions_test_dict[current_id]:
-                item.setValid(is_valid)
-                
+            self.setGroupValid(current_item.getValidationKey(), is_valid)
+
         else: # Not used
             item = self.dave_actions_cur[self.dave_action_index]
             item.setValid(is_valid)
-                    
+
+    ## setGroupEstimates
+    #
+    # @param validation_key The validation key of the actions to update.
+    # @param disk_usage The estimated disk_usage for the actions.
+    # @param duration The estimated duration of the actions.
+    #
+    def setGroupEstimates(self, validation_key, disk_usage, duration):
+        for item in self.dave_actions_test_dict[validation_key]:
+            item.setUsageEstimates(disk_usage, duration)
+
+    ## setGroupValid
+    #
+    # @param validation_key The validation key of the actions to update.
+    # @param is_valid True/False the validity of the actions.
+    #
+    def setGroupValid(self, validation_key, is_valid):
+        for item in self.dave_actions_test_dict[validation_key]:
+            item.setValid(is_valid)
+
     ## setTestMode
     #
     # @param test_mode True/False sets the test mode.
@@ -541,6 +901,7 @@ class DaveStandardItemModel(QtGui.QStandardItemModel):
                 self.resetItemIndex()
         else:
             if test_mode:
+                self.updateValidation()
                 self.test_mode = True
                 self.dave_actions_cur = self.dave_actions_test # Set to test list
                 self.resetItemIndex()
@@ -550,52 +911,87 @@ class DaveStandardItemModel(QtGui.QStandardItemModel):
     def updateEstimates(self):
         if self.test_mode: # Only needed in test mode
 
-            # Find current id and the current disk usage and duration.
+            # Update usage estimated for all actions that have the current key.
             current_item = self.dave_actions_cur[self.dave_action_index]
             current_action = current_item.getDaveAction()
-            current_id = current_action.getID()
-            disk_usage = current_action.getUsage()
-            duration = current_action.getDuration()
-            
-            # Update usage estimated for all actions that have this id.
-            for item in self.dave_actions_test_dict[current_id]:
-                item.setUsageEstimates(disk_usage, duration)
+            self.setGroupEstimates(current_item.getValidationKey(),
+                                   current_action.getUsage(),
+                                   current_action.getDuration())
+
+    ## updateValidation
+    #
+    # Find the validation key of each action. Actions with the same payload
+    # and test state only need to be validated once.
+    #
+    def updateValidation(self):
+        if self.have_validation:
+            return
+        self.have_validation = True
+
+        self.context_setters = {}
+        self.dave_actions_test = []
+        self.dave_actions_test_dict = dict()
+        self.validation_context = {}
+        for dave_action_si in self.dave_actions_all:
+
+            # This does not keep the DaveAction (if it was not already created).
+            dave_action = dave_action_si.dave_action
+            if dave_action is None:
+                dave_action = dave_action_si.createDaveAction()
+
+            # Check if action requires validation.
+            context = {}
+            for name in dave_action.getValidationDependencies():
+                context[name] = self.validation_context.get(name)
+            action_key = dave_action.getValidationKey(context)
+            action_state = dave_action.getValidationContext()
+            dave_action_si.setValidation(action_key, context, action_state)
+            if action_key is not None:
+
+                # Add to list if the key is not currently on the key list
+                if not (action_key in self.dave_actions_test_dict):
+                    self.dave_actions_test.append(dave_action_si)
+                    self.dave_actions_test_dict[action_key] = [dave_action_si] # Start list
+                else: # Add to current list of actions with the same key
+                    self.dave_actions_test_dict[action_key].append(dave_action_si)
+
+            # Update the test state, and record the first action that sets each value.
+            for [name, value] in action_state.items():
+                self.validation_context[name] = value
+                if not ((name, value) in self.context_setters):
+                    self.context_setters[(name, value)] = dave_action_si
 
 ## parseSequenceFile
 #
 # @param xml_file The xml_file to parse to create the command sequence.
 #
-# @return A DaveStandardItemModel object for using in a DaveCommandTreeViewer.
+# @return A DaveSequenceModel object for using in a DaveCommandTreeViewer.
 #
 def parseSequenceFile(xml_file):
-    model = DaveStandardItemModel()
+    model = DaveSequenceModel()
     xml = ElementTree.parse(xml_file).getroot()
-    recursiveParse(model, model, xml)
+    recursiveParse(model, model.root, xml)
     return model
 
 ## recursiveParse
 #
 # Recursively parse the XML tree.
 #
-# @param model The root DaveStandardItemModel.
-# @param model_branch_model A branch of a DaveStandardItemModel.
+# @param model The DaveSequenceModel.
+# @param model_branch A DaveBranchItem of the model.
 # @param xml_branch The current xml branch
-# 
+#
 def recursiveParse(model, model_branch, xml_branch):
     for node in xml_branch:
 
         # Everything is either a branch.
         if (node.tag == "branch"):
-            parent = QtGui.QStandardItem(node.get("name", "NA"))
-            parent.setFlags(QtCore.Qt.ItemIsEnabled)
-            model_branch.appendRow(parent)
+            parent = model.addBranch(node.get("name", "NA"), model_branch)
             recursiveParse(model, parent, node)
 
         # Or a leaf (DaveAction).
         else:
-            action = DaveActionStandardItem(node)
-            model.addItem(action)
-            model_branch.appendRow(action)
+            model.addItem(node, model_branch)
 
 #
 # The MIT License
@@ -38,6 +38,19 @@ class Camera(halModule.HalModule):
     """
     def __init__(self, module_params = None, qt_settings = None, **kwds):
         super().__init__(**kwds)
+
+        # The messages that this module handles.
+        self.addHandledMessages(["configuration",
+                                 "configure1",
+                                 "current parameters",
+                                 "get functionality",
+                                 "new parameters",
+                                 "shutter clicked",
+                                 "start camera",
+                                 "start film",
+                                 "stop camera",
+                                 "stop film"])
+
         self.film_settings = None
 
         camera_params = module_params.get("camera")
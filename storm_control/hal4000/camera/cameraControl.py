@@ -10,12 +10,15 @@ Hazen 2/17
 """
 
 from PyQt5 import QtCore
+import numpy
 import time
 
 import storm_control.sc_library.halExceptions as halExceptions
+import storm_control.sc_library.hdebug as hdebug
 import storm_control.sc_library.parameters as params
 
 import storm_control.hal4000.camera.frame as frame
+import storm_control.hal4000.camera.framePool as framePool
 
 
 class CameraException(halExceptions.HardwareException):
@@ -46,7 +49,19 @@ class CameraControl(QtCore.QThread):
 
         # The length of a fixed length film.
         self.film_length = None
-        
+
+        # This is a flag for whether or not we are filming.
+        self.filming = False
+
+        #
+        # Pre-allocated storage for the frames from the camera. The amount
+        # of memory to use (in MB) is set by 'frame_pool_mb' in the config
+        # XML file, a value of 0 turns off the frame pool. The pool is
+        # (re)sized in newParameters() as this depends on the frame size.
+        # This is the maximum, the memory is only allocated as it is needed.
+        #
+        self.frame_pool = framePool.FramePool(max_bytes = 1024 * 1024 * config.get("frame_pool_mb", 256))
+
         # The current frame number, this gets reset by startCamera().
         self.frame_number = 0
 
@@ -210,6 +225,56 @@ class CameraControl(QtCore.QThread):
         self.running = False
         self.wait()
 
+    def createFrame(self, np_data, image_x, image_y, pool_slot = None):
+        """
+        Create a frame.Frame object for the data from the camera. If we are
+        using the frame pool then the data is copied into a frame pool slot,
+        so the camera driver can re-use it's buffer once this returns.
+
+        pool_slot - (Optional) The frame pool slot (from getFrameSlot()) that
+                    the camera driver already copied the data into.
+
+        This returns None if the frame pool is exhausted and we are not
+        filming, i.e. the frame should be dropped.
+        """
+        n_pixels = image_x * image_y
+        if (pool_slot is not None):
+            if (pool_slot.getData().size == n_pixels):
+                return frame.Frame(pool_slot.getData(),
+                                   self.frame_number,
+                                   image_x,
+                                   image_y,
+                                   self.camera_name,
+                                   pool_slot = pool_slot)
+            np_data = numpy.copy(pool_slot.getData())
+            pool_slot.release()
+
+        if self.frame_pool.isEnabled() and (self.frame_pool.n_pixels == n_pixels):
+            slot = self.frame_pool.acquireSlot()
+            if slot is not None:
+                np_slot = slot.getData(n_pixels)
+                numpy.copyto(np_slot, numpy.reshape(np_data, n_pixels))
+                return frame.Frame(np_slot,
+                                   self.frame_number,
+                                   image_x,
+                                   image_y,
+                                   self.camera_name,
+                                   pool_slot = slot)
+
+            # Don't drop frames when filming, fall back to the
+            # (un-pooled) camera data.
+            elif self.filming:
+                self.frame_pool.addOverflow()
+            else:
+                self.frame_pool.addDropped()
+                return None
+
+        return frame.Frame(np_data,
+                           self.frame_number,
+                           image_x,
+                           image_y,
+                           self.camera_name)
+        
     def closeShutter(self):
         """
         Close the shutter.
@@ -221,8 +286,26 @@ class CameraControl(QtCore.QThread):
         if (self.camera_functionality.parameters != self.parameters):
             msg = "The parameters in the camera functionality are different from the actual camera parameters."
             raise CameraException(msg)
+        self.camera_functionality.frame_pool = self.frame_pool
         return self.camera_functionality
 
+    def getFramePoolStatistics(self):
+        return self.frame_pool.getStatistics()
+
+    def getFrameSlot(self):
+        """
+        Camera drivers that have to copy each frame out of the camera's
+        buffers can call this (in the camera thread) to get a frame pool
+        slot to copy the frame into. This saves copying the frame again
+        in createFrame(). The slot should be returned by the drivers
+        getFrames() method in place of it's own frame data object.
+
+        Returns None if the frame pool is disabled or exhausted.
+        """
+        if self.frame_pool.isEnabled():
+            return self.frame_pool.acquireSlot()
+        return None
+
     def getParameters(self):
         return self.parameters
 
@@ -236,22 +319,32 @@ class CameraControl(QtCore.QThread):
                                                     "state" : "unstable"})
 
     def handleFinished(self):
+        if self.frame_pool.isEnabled():
+            stats = self.frame_pool.getStatistics()
+            hdebug.logText(" ".join([self.camera_name, "frame pool"] +
+                                    [key + "=" + str(stats[key]) for key in sorted(stats)]))
         self.camera_functionality.stopped.emit()
         
     def handleNewData(self, frames):
         """
         Data from the camera should go through this method on it's
         way to the camera functionality object.
+
+        Once all the newFrame slots have returned we release our
+        reference to the frame, consumers that still need the frame
+        will have called frame.hold().
         """
-        for frame in frames:
+        for a_frame in frames:
             if self.film_length is not None:
 
                 # This keeps us from emitting more than the expected number
                 # of newFrame signals.
-                if (frame.frame_number >= self.film_length):
-                    break
+                if (a_frame.frame_number >= self.film_length):
+                    a_frame.release()
+                    continue
                 
-            self.camera_functionality.newFrame.emit(frame)
+            self.camera_functionality.newFrame.emit(a_frame)
+            a_frame.release()
 
     def newParameters(self, parameters):
         """
@@ -298,6 +391,9 @@ class CameraControl(QtCore.QThread):
         self.parameters.setv("extension", parameters.get("extension"))
         self.parameters.setv("saved", parameters.get("saved"))
 
+        # Resize the frame pool (if necessary).
+        self.frame_pool.resize(parameters.get("x_pixels") * parameters.get("y_pixels"))
+
     def openShutter(self):
         """
         Open the shutter.
@@ -342,6 +438,7 @@ class CameraControl(QtCore.QThread):
         If this is a fixed length film and this camera is the time
         base for the film, then set the film_length attribute.
         """
+        self.filming = True
         if film_settings.isFixedLength() and is_time_base:
             self.film_length = film_settings.getFilmLength()
 
@@ -354,6 +451,7 @@ class CameraControl(QtCore.QThread):
 
     def stopFilm(self):
         self.film_length = None
+        self.filming = False
 
     def toggleShutter(self):
         if self.camera_functionality.getShutterState():
@@ -396,12 +494,15 @@ class HWCameraControl(CameraControl):
                 # Create frame objects.
                 frame_data = []
                 for cam_frame in frames:
-                    aframe = frame.Frame(cam_frame.getData(),
-                                         self.frame_number,
-                                         frame_size[0],
-                                         frame_size[1],
-                                         self.camera_name)
-                    frame_data.append(aframe)
+                    pool_slot = None
+                    if isinstance(cam_frame, framePool.FramePoolSlot):
+                        pool_slot = cam_frame
+                    aframe = self.createFrame(cam_frame.getData(),
+                                              frame_size[0],
+                                              frame_size[1],
+                                              pool_slot = pool_slot)
+                    if aframe is not None:
+                        frame_data.append(aframe)
                     self.frame_number += 1
 
                     if self.film_length is not None:                    
@@ -409,7 +510,8 @@ class HWCameraControl(CameraControl):
                             self.running = False
                             
                 # Emit new data signal.
-                self.newData.emit(frame_data)
+                if (len(frame_data) > 0):
+                    self.newData.emit(frame_data)
             self.msleep(5)
 
         self.camera.stopAcquisition()
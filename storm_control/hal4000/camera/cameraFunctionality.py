@@ -59,6 +59,9 @@ class CameraFunctionality(halFunctionality.HalFunctionality):
         # The camera has temperature control.
         self.have_temperature = have_temperature
 
+        # The camera's frame pool (if any), this is set by the camera control.
+        self.frame_pool = None
+
         # The camera provides it own timing.
         self.is_master = is_master
 
@@ -94,6 +97,15 @@ class CameraFunctionality(halFunctionality.HalFunctionality):
         ym = self.getParameter("y_bin") * self.getParameter("y_pixels")
         return xm if (xm > ym) else ym
     
+    def getFramePoolStatistics(self):
+        """
+        Returns a dictionary with the frame pool high water mark,
+        dropped frames, etc. or None if there is no frame pool.
+        """
+        if self.frame_pool is None:
+            return None
+        return self.frame_pool.getStatistics()
+
     def getFrameScale(self):
         return [self.getParameter("x_bin"),
                 self.getParameter("y_bin")]
@@ -6,6 +6,12 @@ or the data from a feed and it's meta-information.
 Notes: 
  (1) The numpy data field (np_data) is expected to
      be of type numpy.uint16.
+
+ (2) If the frame is a view of a framePool.FramePoolSlot
+     then consumers that want to keep the frame after their
+     newFrame slot has returned must call hold(), and then
+     release() once they are done with it. These are no-ops
+     for frames that are not from a frame pool.
  
 Hazen 3/17
 """
@@ -16,7 +22,7 @@ class Frame(object):
     and it's meta-information.
     """
 
-    def __init__(self, np_data, frame_number, image_x, image_y, which_camera):
+    def __init__(self, np_data, frame_number, image_x, image_y, which_camera, pool_slot = None):
         """
         Create a camera frame object.
         FIXME: Are we consistent in the use of master vs. camera1?
@@ -25,12 +31,14 @@ class Frame(object):
         frame_number - The frame number of this frame.
         image_x - The size of the frame in pixels in x.
         image_y - The size of the frame in pixels in y.
+        pool_slot - The framePool.FramePoolSlot that np_data is a view of (if any).
         """
 
         self.image_x = image_x
         self.image_y = image_y
         self.np_data = np_data
         self.frame_number = frame_number
+        self.pool_slot = pool_slot
         self.which_camera = which_camera
 
     def getData(self):
@@ -46,6 +54,23 @@ class Frame(object):
         """
         return self.np_data.ctypes.data
 
+    def hold(self):
+        """
+        Increment the reference count of the frame pool slot.
+        """
+        if self.pool_slot is not None:
+            self.pool_slot.hold()
+
+    def isPooled(self):
+        return (self.pool_slot is not None)
+
+    def release(self):
+        """
+        Decrement the reference count of the frame pool slot.
+        """
+        if self.pool_slot is not None:
+            self.pool_slot.release()
+
 
 #
 # The MIT License
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+"""
+A pre-allocated pool of camera frame buffers.
+
+The idea is that the camera thread copies each new frame into one of
+these buffers and the frame.Frame objects that are passed around HAL
+are just views onto them. This way we are not allocating a new (large)
+numpy array for every frame that the camera acquires. Camera drivers
+that have to copy the frame out of the camera's buffers anyway can
+copy it directly into a buffer, see CameraControl.getFrameSlot().
+
+Buffers are allocated as they are needed, up to the size of the pool,
+so the pool only uses as much memory as the consumers actually hold on
+to (the high water mark).
+
+Buffers are reference counted. A buffer starts with a reference count
+of 1 (held by the camera control) when it is acquired. Consumers of
+the camera's newFrame signal that want to keep the frame around after
+their slot returns (the display, the spot counter, etc.) need to call
+frame.hold() and then frame.release() when they are done with it.
+The buffer goes back to the pool when the count reaches zero.
+
+Notes:
+ (1) Consumers that only use the frame data in their slot (for
+     example the image writers) do not need to do anything.
+
+ (2) If the pool is exhausted then we can't just stop the camera.
+     During filming the frame is copied into a newly allocated
+     buffer so that no data is lost, otherwise the frame is dropped.
+     Both are counted so that we know if the pool is too small.
+"""
+
+import collections
+import ctypes
+import numpy
+
+from PyQt5 import QtCore
+
+import storm_control.sc_library.halExceptions as halExceptions
+
+
+class FramePoolException(halExceptions.HalException):
+    pass
+
+
+class FramePoolSlot(object):
+    """
+    A single buffer in the frame pool.
+    """
+    def __init__(self, frame_pool = None, generation = None, size = None, **kwds):
+        """
+        frame_pool - The FramePool object this slot belongs to.
+        generation - The pool generation this slot was allocated in.
+        size - The size of the buffer in pixels.
+        """
+        super().__init__(**kwds)
+        self.frame_pool = frame_pool
+        self.generation = generation
+        self.np_array = numpy.empty(size, dtype = numpy.uint16)
+        self.ref_count = 0
+
+    def copyData(self, address):
+        """
+        Copy a frame from address in memory into the buffer, this
+        is the same as HCamData.copyData() for Hamamatsu cameras.
+        """
+        ctypes.memmove(self.np_array.ctypes.data, address, self.np_array.nbytes)
+
+    def getData(self, n_pixels = None):
+        """
+        Returns a view of the first n_pixels of the buffer, or
+        the whole buffer if n_pixels is not specified.
+        """
+        if n_pixels is None:
+            return self.np_array
+        return self.np_array[:n_pixels]
+
+    def getDataPtr(self):
+        """
+        Returns a C style pointer to the buffer, for the benefit of
+        camera drivers that want to write directly into the buffer.
+        """
+        return self.np_array.ctypes.data
+
+    def hold(self):
+        self.frame_pool.holdSlot(self)
+
+    def release(self):
+        self.frame_pool.releaseSlot(self)
+
+
+class FramePool(object):
+    """
+    Pool of FramePoolSlot objects. This is thread safe as slots
+    are acquired in the camera thread and released in the main
+    thread (or a worker thread).
+    """
+    def __init__(self, max_bytes = 0, max_slots = 1000, min_slots = 4, **kwds):
+        """
+        max_bytes - The maximum amount of memory to use for the pool. If
+                    this is zero then the pool is disabled.
+        max_slots - The maximum number of slots, regardless of the memory.
+        min_slots - The minimum number of slots.
+        """
+        super().__init__(**kwds)
+        self.free_slots = collections.deque()
+        self.generation = 0
+        self.max_bytes = max_bytes
+        self.max_slots = max_slots
+        self.min_slots = min_slots
+        self.mutex = QtCore.QMutex()
+        self.n_allocated = 0
+        self.n_pixels = 0
+        self.n_slots = 0
+
+        self.resetStatistics()
+
+    def acquireSlot(self):
+        """
+        Returns a free slot with a reference count of 1, or None
+        if there are no free slots. A new slot is allocated if all
+        the slots are in use and the pool is not full yet.
+        """
+        self.mutex.lock()
+        slot = None
+        if (len(self.free_slots) > 0):
+            slot = self.free_slots.popleft()
+        elif (self.n_allocated < self.n_slots):
+            slot = self.newSlot()
+        if slot is not None:
+            slot.ref_count = 1
+            in_use = self.n_allocated - len(self.free_slots)
+            if (in_use > self.high_water):
+                self.high_water = in_use
+        self.mutex.unlock()
+        return slot
+
+    def addDropped(self):
+        self.mutex.lock()
+        self.dropped += 1
+        self.mutex.unlock()
+
+    def addOverflow(self):
+        self.mutex.lock()
+        self.overflow += 1
+        self.mutex.unlock()
+
+    def getStatistics(self):
+        """
+        Returns a dictionary with the current state of the pool.
+        """
+        self.mutex.lock()
+        stats = {"allocated" : self.n_allocated,
+                 "dropped" : self.dropped,
+                 "high_water" : self.high_water,
+                 "in_use" : self.n_allocated - len(self.free_slots),
+                 "overflow" : self.overflow,
+                 "slots" : self.n_slots}
+        self.mutex.unlock()
+        return stats
+
+    def holdSlot(self, slot):
+        self.mutex.lock()
+        if (slot.ref_count <= 0):
+            self.mutex.unlock()
+            raise FramePoolException("Attempt to hold a frame that was already released.")
+        slot.ref_count += 1
+        self.mutex.unlock()
+
+    def isEnabled(self):
+        return (self.n_slots > 0)
+
+    def newSlot(self):
+        """
+        Allocate a new slot, the mutex must be locked.
+        """
+        self.n_allocated += 1
+        return FramePoolSlot(frame_pool = self,
+                             generation = self.generation,
+                             size = self.n_pixels)
+
+    def releaseSlot(self, slot):
+        self.mutex.lock()
+        if (slot.ref_count <= 0):
+            self.mutex.unlock()
+            raise FramePoolException("Attempt to release a frame that was already released.")
+        slot.ref_count -= 1
+
+        # Slots from a previous generation (i.e. before the frame size
+        # changed) are not returned to the pool.
+        if (slot.ref_count == 0) and (slot.generation == self.generation):
+            self.free_slots.append(slot)
+        self.mutex.unlock()
+
+    def resetStatistics(self):
+        self.dropped = 0
+        self.high_water = 0
+        self.overflow = 0
+
+    def resize(self, n_pixels):
+        """
+        (Re)allocate the pool for frames of n_pixels. This is only
+        done if the frame size actually changed. This should only
+        be called when the camera is not running.
+
+        Only min_slots are allocated here, the others are allocated
+        by acquireSlot() when they are needed.
+        """
+        if (n_pixels == self.n_pixels):
+            return
+
+        self.mutex.lock()
+        self.generation += 1
+        self.free_slots.clear()
+        self.n_allocated = 0
+        self.n_pixels = n_pixels
+        self.n_slots = 0
+        if (self.max_bytes > 0) and (n_pixels > 0):
+            self.n_slots = int(self.max_bytes/(2 * n_pixels))
+            self.n_slots = max(self.min_slots, min(self.n_slots, self.max_slots))
+            for i in range(min(self.min_slots, self.n_slots)):
+                self.free_slots.append(self.newSlot())
+        self.resetStatistics()
+        self.mutex.unlock()
+
+
+#
+# The MIT License
+#
+# Copyright (c) 2017 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
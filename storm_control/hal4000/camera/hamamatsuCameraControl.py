@@ -28,6 +28,7 @@ class HamamatsuCameraControl(cameraControl.HWCameraControl):
 
         # Load the library and start the camera.
         self.camera = hcam.HamamatsuCameraMR(camera_id = config.get("camera_id"))
+        self.camera.setFrameSlotFunction(self.getFrameSlot)
 
         # Dictionary of the Hamamatsu camera properties we'll support.
         self.hcam_props = {"binning" : True,
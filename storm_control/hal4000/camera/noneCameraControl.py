@@ -14,7 +14,6 @@ from PyQt5 import QtCore
 import storm_control.sc_library.parameters as params
 import storm_control.hal4000.camera.cameraControl as cameraControl
 import storm_control.hal4000.camera.cameraFunctionality as cameraFunctionality
-import storm_control.hal4000.camera.frame as frame
 
 
 class NoneCameraControl(cameraControl.CameraControl):
@@ -150,12 +149,10 @@ class NoneCameraControl(cameraControl.CameraControl):
         self.running = True
         self.thread_started = True
         while(self.running):
-            aframe = frame.Frame(numpy.roll(self.fake_frame,
-                                            int(self.frame_number * self.parameters.get("roll"))),
-                                 self.frame_number,
-                                 self.fake_frame_size[0],
-                                 self.fake_frame_size[1],
-                                 self.camera_name)
+            aframe = self.createFrame(numpy.roll(self.fake_frame,
+                                                 int(self.frame_number * self.parameters.get("roll"))),
+                                      self.fake_frame_size[0],
+                                      self.fake_frame_size[1])
             self.frame_number += 1
 
             if self.film_length is not None:
@@ -163,7 +160,8 @@ class NoneCameraControl(cameraControl.CameraControl):
                     self.running = False
 
             # Emit new data signal.
-            self.newData.emit([aframe])
+            if aframe is not None:
+                self.newData.emit([aframe])
 
             # Sleep if we're still running.
             if self.running:
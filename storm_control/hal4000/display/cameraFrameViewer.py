@@ -21,6 +21,7 @@ import storm_control.sc_library.halExceptions as halExceptions
 import storm_control.sc_library.parameters as params
 
 import storm_control.hal4000.colorTables.colorTables as colorTables
+import storm_control.hal4000.display.frameRenderer as frameRenderer
 import storm_control.hal4000.halLib.halFunctionality as halFunctionality
 import storm_control.hal4000.halLib.halMessage as halMessage
 
@@ -40,12 +41,18 @@ class CameraFrameViewerFunctionality(halFunctionality.HalFunctionality):
     and disconnect() methods. We do it this way so that we know
     whether or not anybody is actually listening. If no one is
     listening then we don't need to generate QPixmaps().
+
+    Connected users get a new QPixmap every time the displayed image
+    changes. Users that only need the occasional QPixmap should call
+    requestPixmap() instead, they will get a single QPixmap (via the
+    newPixmap signal) the next time the display updates.
     """
     newPixmap = QtCore.pyqtSignal(object)
 
     def __init__(self, **kwds):
         super().__init__(**kwds)
         self.connections = 0
+        self.pixmap_requested = False
 
     def connect(self, slot_fn):
         self.newPixmap.connect(slot_fn)
@@ -56,10 +63,22 @@ class CameraFrameViewerFunctionality(halFunctionality.HalFunctionality):
         self.connections -= 1
 
     def handleNewPixmap(self, pixmap):
+        self.pixmap_requested = False
         self.newPixmap.emit(pixmap)
         
     def isConnected(self):
         return (self.connections > 0)
+
+    def needsPixmap(self, image_changed):
+        """
+        Returns True if someone wants a QPixmap of the current display.
+        """
+        if self.pixmap_requested:
+            return True
+        return image_changed and self.isConnected()
+
+    def requestPixmap(self):
+        self.pixmap_requested = True
     
 
 class CameraFrameViewer(QtWidgets.QFrame):
@@ -111,6 +130,7 @@ class CameraFrameViewer(QtWidgets.QFrame):
         self.display_timer = QtCore.QTimer(self)
         self.filming = False
         self.frame = False
+        self.frame_renderer = None
         self.parameters = False
         self.rubber_band_rect = None
         self.show_grid = False
@@ -142,6 +162,19 @@ class CameraFrameViewer(QtWidgets.QFrame):
         self.camera_scene.addItem(self.camera_widget)
         self.camera_view.setScene(self.camera_scene)
         self.camera_view.setBackgroundBrush(QtGui.QBrush(QtGui.QColor(0,0,0)))
+
+        # Render frames in a worker thread, if configured. In this case we
+        # also show the render latency and the number of dropped renders.
+        self.ui.renderLabel = QtWidgets.QLabel(self.ui.infoWidget)
+        self.ui.renderLabel.setAlignment(QtCore.Qt.AlignRight|QtCore.Qt.AlignTrailing|QtCore.Qt.AlignVCenter)
+        self.ui.renderLabel.setToolTip("Render latency (milliseconds) / dropped renders")
+        self.ui.horizontalLayout_3.insertWidget(self.ui.horizontalLayout_3.indexOf(self.ui.intensityIntLabel) + 1,
+                                                self.ui.renderLabel)
+        if frameRenderer.isEnabled():
+            self.frame_renderer = frameRenderer.FrameRenderer(parent = self)
+            self.frame_renderer.newImage.connect(self.handleRenderedImage)
+        else:
+            self.ui.renderLabel.hide()
         
         # Display range slider.
         self.ui.rangeSlider = qtRangeSlider.QVRangeSlider()
@@ -323,13 +356,32 @@ class CameraFrameViewer(QtWidgets.QFrame):
         self.color_gradient.newColorTable(color_table)
 
     def handleDisplayTimer(self):
+        """
+        The camera widget does nothing if the frame and the display
+        settings have not changed since the last update, so in this
+        case there is also no need to update the info or to grab a
+        new QPixmap (unless one was specifically requested).
+
+        If we have a frame renderer then the frame is rendered in a
+        worker thread and the image is displayed by handleRenderedImage().
+        """
         if self.frame:
-            self.camera_widget.updateImageWithFrame(self.frame)
-            if self.show_info:
-                self.handleIntensityInfo(*self.camera_widget.getIntensityInfo())
-            if self.cfv_functionality.isConnected():
-                q_pixmap = self.camera_view.grab()
-                self.cfv_functionality.handleNewPixmap(q_pixmap)
+            if self.frame_renderer is None:
+                self.handleImageChanged(self.camera_widget.updateImageWithFrame(self.frame))
+            else:
+                if self.camera_widget.needsUpdate(self.frame):
+                    self.frame_renderer.render(self.frame, self.camera_widget.startRender(self.frame))
+                self.handleImageChanged(False)
+
+    def handleImageChanged(self, image_changed):
+        if image_changed and self.show_info:
+            self.handleIntensityInfo(*self.camera_widget.getIntensityInfo())
+            if self.frame_renderer is not None:
+                stats = self.frame_renderer.getStatistics()
+                self.ui.renderLabel.setText("{0:.0f}/{1:d}".format(stats["latency"], stats["dropped"]))
+        if self.cfv_functionality.needsPixmap(image_changed):
+            q_pixmap = self.camera_view.grab()
+            self.cfv_functionality.handleNewPixmap(q_pixmap)
 
     def handleDragMove(self, dx, dy):
         self.stage_functionality.dragMove(dx, dy)
@@ -352,6 +404,10 @@ class CameraFrameViewer(QtWidgets.QFrame):
         #
         if self.cam_fn is not None:
             self.cam_fn.newFrame.disconnect(self.handleNewFrame)
+
+        # Drop any frames from the old feed that are still being rendered.
+        if self.frame_renderer is not None:
+            self.frame_renderer.reset()
             
         self.parameters.setv("feed_name", str(feed_name))
         self.feedChange.emit(feed_name)
@@ -371,11 +427,16 @@ class CameraFrameViewer(QtWidgets.QFrame):
             self.ui.infoAct.setText("Show Info")
             self.ui.intensityPosLabel.hide()
             self.ui.intensityIntLabel.hide()
+            self.ui.renderLabel.hide()
         else:
             self.show_info = True
             self.ui.infoAct.setText("Hide Info")
             self.ui.intensityPosLabel.show()
             self.ui.intensityIntLabel.show()
+            if self.frame_renderer is not None:
+                self.ui.renderLabel.show()
+            if self.frame:
+                self.handleIntensityInfo(*self.camera_widget.getIntensityInfo())
 
     def handleIntensityInfo(self, x, y, i):
         self.ui.intensityPosLabel.setText("({0:d},{1:d})".format(x, y, i))
@@ -389,9 +450,9 @@ class CameraFrameViewer(QtWidgets.QFrame):
     def handleNewFrame(self, frame):
         if self.filming and (self.getParameter("sync") != 0):
             if((frame.frame_number % self.cycle_length) == (self.getParameter("sync") - 1)):
-                self.frame = frame
+                self.setFrame(frame)
         else:
-            self.frame = frame
+            self.setFrame(frame)
 
     def handleNewScale(self, scale):
         self.setParameter("scale", scale)
@@ -406,6 +467,10 @@ class CameraFrameViewer(QtWidgets.QFrame):
         self.setParameter("display_min", int(scale_min))
         self.updateRange()
 
+    def handleRenderedImage(self, rendered):
+        self.camera_widget.setRenderedImage(rendered)
+        self.handleImageChanged(True)
+
     def handleRubberBandChanged(self, rubber_band_rect, from_scene_point, to_scene_point):
         print(">hrbc", rubber_band_rect)
         print(">hrbc", from_scene_point)
@@ -574,6 +639,16 @@ class CameraFrameViewer(QtWidgets.QFrame):
         # Switch to the correct feed.
         self.handleFeedChange(self.getFeedName())
 
+    def setFrame(self, frame):
+        """
+        Keep the frame until the display timer fires. As we store the
+        frame we need to hold it (if it is from the frame pool).
+        """
+        frame.hold()
+        if self.frame:
+            self.frame.release()
+        self.frame = frame
+
     def setParameter(self, pname, pvalue):
         """
         Wrapper to make it easier to set the appropriate parameter value.
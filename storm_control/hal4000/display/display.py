@@ -11,6 +11,7 @@ import storm_control.sc_library.parameters as params
 
 import storm_control.hal4000.camera.cameraControl as cameraControl
 import storm_control.hal4000.display.cameraViewers as cameraViewers
+import storm_control.hal4000.display.frameRenderer as frameRenderer
 import storm_control.hal4000.feeds.feeds as feeds
 
 import storm_control.hal4000.halLib.halDialog as halDialog
@@ -25,6 +26,17 @@ class Display(halModule.HalModule):
     def __init__(self, module_params = None, qt_settings = None, **kwds):
         super().__init__(**kwds)
 
+        # The messages that this module handles.
+        self.addHandledMessages(["configuration",
+                                 "configure1",
+                                 "current parameters",
+                                 "get functionality",
+                                 "new parameters",
+                                 "show",
+                                 "start",
+                                 "start film",
+                                 "stop film"])
+
         self.have_stage = False
         self.is_classic = (module_params.get("ui_type") == "classic")
         self.parameters = module_params.get("parameters")
@@ -35,6 +47,10 @@ class Display(halModule.HalModule):
         
         self.viewers = []
 
+        # The number of threads to use for rendering camera frames, if
+        # this is 0 then the frames are rendered in the GUI thread.
+        frameRenderer.setRenderThreads(self.parameters.get("render_threads", 0))
+
         #
         # There is always at least one display by default.
         # This display provides a CameraFrameViewerFunctionality().
@@ -59,6 +75,7 @@ class Display(halModule.HalModule):
     def cleanUp(self, qt_settings):
         for viewer in self.viewers:
             viewer.cleanUp(qt_settings)
+        frameRenderer.cleanUp()
 
     def findChild(self, qt_type, name, options):
         """
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+"""
+Renders camera frames for display in a pool of worker threads.
+
+Converting a frame to a QImage (rescaling and applying the color
+table) is done in the GUI thread by default. With several viewers
+this can keep the GUI thread busy enough that HAL message processing
+is delayed. A FrameRenderer instead does this in a worker thread and
+hands the finished image back to the viewer (in the GUI thread) with
+its newImage signal.
+
+Each viewer has its own FrameRenderer, and each FrameRenderer has at
+most one frame being rendered at a time. If new frames arrive while
+a frame is being rendered only the newest one is kept, the others
+are dropped (and counted). Images from before a reset() (i.e. from
+the previous feed) are also dropped.
+
+The renderers share a dedicated thread pool so that rendering does
+not compete with HAL workers in halModule.threadpool. The number of
+threads is set with setRenderThreads(), this is 0 (rendering in the
+GUI thread) unless the display module changes it. The pool is created
+the first time it is needed, not when this module is imported.
+"""
+
+import time
+import traceback
+
+from PyQt5 import QtCore
+
+import storm_control.hal4000.qtWidgets.qtCameraGraphicsScene as qtCameraGraphicsScene
+
+
+render_pool = None
+render_threads = 0
+
+
+def cleanUp():
+    """
+    Wait for any frames that are being rendered.
+    """
+    if render_pool is not None:
+        render_pool.waitForDone()
+
+def getRenderPool():
+    """
+    Returns the render thread pool, this is created the first time it is needed.
+    """
+    global render_pool
+    if render_pool is None:
+        render_pool = QtCore.QThreadPool()
+        render_pool.setMaxThreadCount(max(1, render_threads))
+    return render_pool
+
+def isEnabled():
+    return (render_threads > 0)
+
+def setRenderThreads(n_threads):
+    """
+    Set the number of worker threads, 0 means render in the GUI thread.
+    """
+    global render_threads
+    render_threads = n_threads
+    if (n_threads > 0) and (render_pool is not None):
+        render_pool.setMaxThreadCount(n_threads)
+
+
+class RenderTaskSignaler(QtCore.QObject):
+    """
+    A signaler class for RenderTask.
+    """
+    renderDone = QtCore.pyqtSignal(object)
+
+
+class RenderTask(QtCore.QRunnable):
+    """
+    Render a single frame in a worker thread.
+    """
+    def __init__(self, frame = None, generation = None, image_buffer = None, settings = None, **kwds):
+        super().__init__(**kwds)
+        self.error = None
+        self.frame = frame
+        self.generation = generation
+        self.image_buffer = image_buffer
+        self.rendered = None
+        self.settings = settings
+        self.start_time = time.perf_counter()
+
+        self.rtsignaler = RenderTaskSignaler()
+
+    def run(self):
+        try:
+            self.rendered = self.image_buffer.render(self.frame, self.settings)
+        except Exception:
+            self.error = traceback.format_exc()
+        self.rtsignaler.renderDone.emit(self)
+
+
+class FrameRenderer(QtCore.QObject):
+    """
+    Renders frames for a single viewer.
+    """
+    newImage = QtCore.pyqtSignal(object)
+
+    def __init__(self, **kwds):
+        super().__init__(**kwds)
+        self.generation = 0
+        self.pending = None
+        self.task = None
+
+        # Two buffers, one for the image that is being displayed and
+        # one for the image that is being rendered.
+        self.image_buffers = [qtCameraGraphicsScene.ImageBuffer(),
+                              qtCameraGraphicsScene.ImageBuffer()]
+        self.render_buffer = 0
+
+        self.resetStatistics()
+
+    def getStatistics(self):
+        """
+        Latencies are in milliseconds from when render() was called to
+        when the image was handed back to the viewer.
+        """
+        mean_latency = 0.0
+        if (self.n_rendered > 0):
+            mean_latency = self.total_latency/self.n_rendered
+        return {"dropped" : self.n_dropped,
+                "latency" : self.last_latency,
+                "max_latency" : self.max_latency,
+                "mean_latency" : mean_latency,
+                "rendered" : self.n_rendered}
+
+    def handleRenderDone(self, task):
+        self.task = None
+        task.frame.release()
+
+        if (task.generation != self.generation):
+            self.n_dropped += 1
+
+        elif task.error is not None:
+            print("Rendering failed:")
+            print(task.error)
+
+        elif task.rendered is not None:
+            latency = 1000.0 * (time.perf_counter() - task.start_time)
+            self.last_latency = latency
+            self.max_latency = max(self.max_latency, latency)
+            self.n_rendered += 1
+            self.total_latency += latency
+
+            # The buffer for this image is now being displayed, so render
+            # the next image into the other buffer.
+            self.render_buffer = 1 - self.render_buffer
+            self.newImage.emit(task.rendered)
+
+        if self.pending is not None:
+            [frame, settings] = self.pending
+            self.pending = None
+            self.startTask(frame, settings)
+
+    def isBusy(self):
+        return (self.task is not None)
+
+    def render(self, frame, settings):
+        """
+        Render frame using settings (from QtCameraGraphicsItem.startRender()).
+        """
+        frame.hold()
+        if self.isBusy():
+            if self.pending is not None:
+                self.pending[0].release()
+                self.n_dropped += 1
+            self.pending = [frame, settings]
+        else:
+            self.startTask(frame, settings)
+
+    def reset(self):
+        """
+        Call this when the feed changes. Any frames that are waiting to
+        be rendered are dropped, as is the frame that is being rendered.
+        """
+        self.generation += 1
+        if self.pending is not None:
+            self.pending[0].release()
+            self.pending = None
+            self.n_dropped += 1
+
+    def resetStatistics(self):
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.n_dropped = 0
+        self.n_rendered = 0
+        self.total_latency = 0.0
+
+    def startTask(self, frame, settings):
+        self.task = RenderTask(frame = frame,
+                               generation = self.generation,
+                               image_buffer = self.image_buffers[self.render_buffer],
+                               settings = settings)
+        self.task.rtsignaler.renderDone.connect(self.handleRenderDone)
+
+        # As with HalWorker we manage the task ourselves.
+        self.task.setAutoDelete(False)
+        getRenderPool().start(self.task)
+
+
+#
+# The MIT License
+#
+# Copyright (c) 2018 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
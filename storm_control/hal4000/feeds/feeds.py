@@ -131,7 +131,8 @@ class FeedFunctionality(cameraFunctionality.CameraFunctionality):
                                        new_frame.frame_number,
                                        self.x_pixels,
                                        self.y_pixels,
-                                       self.camera_name))
+                                       self.camera_name,
+                                       pool_slot = self.poolSlot(new_frame, sliced_data)))
 
     def handleStarted(self):
         self.started.emit()
@@ -160,6 +161,15 @@ class FeedFunctionality(cameraFunctionality.CameraFunctionality):
     def isMaster(self):
         return False
 
+    def poolSlot(self, new_frame, sliced_data):
+        """
+        If the sliced data is still a view of the camera frame then the
+        feed frame needs to share the camera frame's frame pool slot.
+        """
+        if numpy.may_share_memory(sliced_data, new_frame.np_data):
+            return new_frame.pool_slot
+        return None
+
     def reset(self):
         self.frame_number = 0
 
@@ -296,7 +306,8 @@ class FeedFunctionalityInterval(FeedFunctionality):
                                            self.frame_number,
                                            self.x_pixels,
                                            self.y_pixels,
-                                           self.camera_name))
+                                           self.camera_name,
+                                           pool_slot = self.poolSlot(new_frame, sliced_data)))
             self.frame_number += 1
 
 
@@ -449,6 +460,16 @@ class Feeds(halModule.HalModule):
     """
     def __init__(self, module_params = None, qt_settings = None, **kwds):
         super().__init__(**kwds)
+
+        # The messages that this module handles.
+        self.addHandledMessages(["configure1",
+                                 "get feed names",
+                                 "get functionality",
+                                 "new parameters",
+                                 "start film",
+                                 "stop film",
+                                 "updated parameters"])
+
         self.camera_names = []
         self.feed_controller = None
         self.feed_names = []
@@ -84,6 +84,12 @@ class FilmBox(QtWidgets.QGroupBox):
                                                        name = "want_bell",
                                                        value = True))
 
+        self.parameters.add(params.ParameterRangeInt(description = "Frames to queue for saving in a background thread (0 = no background thread)",
+                                                     name = "writer_queue",
+                                                     value = 0,
+                                                     min_value = 0,
+                                                     max_value = 10000))
+
         # Initial UI configuration.
         self.ui = filmUi.Ui_GroupBox()
         self.ui.setupUi(self)
@@ -145,7 +151,8 @@ class FilmBox(QtWidgets.QGroupBox):
                                              film_length = film_request.getFrames(),
                                              overwrite = film_request.overwriteOk(),
                                              run_shutters = self.ui.autoShuttersCheckBox.isChecked(),
-                                             tcp_request = True)
+                                             tcp_request = True,
+                                             writer_queue = self.parameters.get("writer_queue"))
 
         else:
             reply = QtWidgets.QMessageBox.Yes
@@ -171,7 +178,8 @@ class FilmBox(QtWidgets.QGroupBox):
                                              filetype = self.parameters.get("filetype"),
                                              film_length = self.parameters.get("frames"),
                                              run_shutters = self.ui.autoShuttersCheckBox.isChecked(),
-                                             save_film = self.ui.saveMovieCheckBox.isChecked())
+                                             save_film = self.ui.saveMovieCheckBox.isChecked(),
+                                             writer_queue = self.parameters.get("writer_queue"))
 
     def getParameters(self):
         return self.parameters.copy()
@@ -283,11 +291,18 @@ class FilmBox(QtWidgets.QGroupBox):
     def updateFrames(self, new_number):
         self.ui.framesText.setText(str(new_number))
 
-    def updateSize(self, new_size):
+    def updateSize(self, new_size, queue_depth = None, write_rate = None):
+        """
+        queue_depth and write_rate are only available when using
+        background image writers.
+        """
         if (new_size < 1000.0):
-            self.ui.sizeText.setText("{0:.1f} MB".format(new_size))
+            text = "{0:.1f} MB".format(new_size)
         else:
-            self.ui.sizeText.setText("{0:.1f} GB".format(new_size * 0.00097656))
+            text = "{0:.1f} GB".format(new_size * 0.00097656)
+        if write_rate is not None:
+            text += " ({0:d}, {1:.0f} MB/s)".format(queue_depth, write_rate)
+        self.ui.sizeText.setText(text)
 
 
 class Film(halModule.HalModule):
@@ -329,6 +344,24 @@ class Film(halModule.HalModule):
     def __init__(self, module_params = None, qt_settings = None, **kwds):
         super().__init__(**kwds)
 
+        # The messages that this module handles.
+        self.addHandledMessages(["change directory",
+                                 "configuration",
+                                 "configure1",
+                                 "current parameters",
+                                 "live mode",
+                                 "new parameters",
+                                 "new shutters file",
+                                 "ready to film",
+                                 "start",
+                                 "start camera",
+                                 "start film request",
+                                 "stop camera",
+                                 "stop film",
+                                 "stop film request",
+                                 "updated parameters",
+                                 "wait for"])
+
         self.active_cameras = 0
         self.camera_functionalities = []
         self.feed_names = None
@@ -441,11 +474,18 @@ class Film(halModule.HalModule):
         # Update display of the number of frames.
         self.view.updateFrames(self.number_frames)
 
-        # Update display of the (total) storage used.
+        # Update display of the (total) storage used, and of the
+        # background writers queue depth and throughput (if any).
         total_size = 0.0
+        queue_depth = 0
+        write_rate = None
         for writer in self.writers:
             total_size += writer.getSize()
-        self.view.updateSize(total_size)
+            rate = writer.getWriteRate()
+            if rate is not None:
+                queue_depth += writer.getQueueDepth()
+                write_rate = rate if write_rate is None else (write_rate + rate)
+        self.view.updateSize(total_size, queue_depth, write_rate)
         
     def handleResponses(self, message):
 
@@ -17,6 +17,7 @@ class FilmSettings(object):
                  run_shutters = False,
                  save_film = True,
                  tcp_request = False,
+                 writer_queue = 0,
                  **kwds):
     
         super().__init__(**kwds)
@@ -29,6 +30,7 @@ class FilmSettings(object):
         assert(isinstance(run_shutters, bool))
         assert(isinstance(save_film, bool))
         assert(isinstance(tcp_request, bool))
+        assert(isinstance(writer_queue, int))
 
         # Either "run_till_abort" or "fixed_length"
         self.acq_mode = acq_mode
@@ -55,6 +57,10 @@ class FilmSettings(object):
         # Whether the film request came from the record button or TCP.
         self.tcp_request = tcp_request
 
+        # The maximum number of frames in the (background) image writer
+        # queue. If this is zero the frames are saved in the main thread.
+        self.writer_queue = writer_queue
+
     def getBasename(self):
         return self.basename
 
@@ -66,6 +72,9 @@ class FilmSettings(object):
 
     def getPixelSize(self):
         return self.pixel_size
+
+    def getWriterQueue(self):
+        return self.writer_queue
     
     def isFixedLength(self):
         return (self.acq_mode == "fixed_length")
@@ -214,6 +214,19 @@ class FocusLock(halModule.HalModule):
 
     def __init__(self, module_params = None, qt_settings = None, **kwds):
         super().__init__(**kwds)
+
+        # The messages that this module handles.
+        self.addHandledMessages(["configuration",
+                                 "configure1",
+                                 "configure2",
+                                 "lock jump",
+                                 "new parameters",
+                                 "show",
+                                 "start",
+                                 "start film",
+                                 "stop film",
+                                 "tcp message"])
+
         self.configuration = module_params.get("configuration")
 
         self.control = lockControl.LockControl(configuration = module_params.get("configuration"))
@@ -0,0 +1,420 @@
+#!/usr/bin/env python
+"""
+Offline (headless) replay of QPD and camera data through the focus
+lock modes, for tuning the lock and testing performance changes
+without a microscope.
+
+The lock mode under test drives a simulated z stage (a
+noneZStageModule.NoneZStageFunctionality). The QPD offset at each
+update is the distance between the simulated stage and the position
+of the focus, which comes from a ReplayTrace. The trace can either be
+loaded from a recorded file (the .off file saved by
+lockControl.LockControl while filming, or the dlm_XXX.txt file saved
+by lockModes.DiagnosticsLockMode) or be synthetic.
+
+Replay runs as fast as the lock mode can process the updates, the
+results include the lock loop latency, the CPU time per update and
+the time the lock took to settle (in simulated time).
+
+Usage:
+
+python lockReplay.py --mode AlwaysOnLockMode --trace movie_01.off
+python lockReplay.py --mode JumpLockMode --updates 10000 --drift 0.1 --noise 0.01
+"""
+
+import math
+import numpy
+import time
+
+import storm_control.hal4000.camera.frame as frame
+import storm_control.hal4000.focusLock.lockModes as lockModes
+import storm_control.sc_hardware.none.noneZStageModule as noneZStageModule
+import storm_control.sc_library.parameters as params
+
+
+class ReplayTrace(object):
+    """
+    The position of the focus (in microns, in z stage coordinates) at
+    each QPD update, and optionally the recorded sum signal and whether
+    the recorded QPD reading was good. z_start is the z stage position
+    at the start of the trace.
+
+    If the sum signal is not specified it is calculated from the offset
+    as in noneQPDModule.NoneQPDFunctionality.
+    """
+    def __init__(self, focus = None, is_good = None, power = None, z_start = 0.0, **kwds):
+        super().__init__(**kwds)
+        self.focus = numpy.asarray(focus, dtype = numpy.float64)
+        self.is_good = is_good
+        self.power = power
+        self.z_start = z_start
+
+    def getQPDState(self, index, z_position):
+        index = index % self.focus.size
+        offset = z_position - self.focus[index]
+        if self.power is None:
+            power = 600.0 * math.exp(-0.250 * (offset * offset))
+        else:
+            power = float(self.power[index])
+        is_good = True
+        if self.is_good is not None:
+            is_good = bool(self.is_good[index])
+        return {"is_good" : is_good,
+                "offset" : offset,
+                "sum" : power,
+                "x" : 100.0 * offset,
+                "y" : 0.0}
+
+    def getSize(self):
+        return self.focus.size
+
+    def getZStart(self):
+        return self.z_start
+
+
+class ReplayZStageFunctionality(noneZStageModule.NoneZStageFunctionality):
+    """
+    A simulated z stage that also 'supports' hardware timing, so that
+    lockModes.HardwareZScanLockMode can be replayed. The waveform is
+    played back one point per frame by LockReplay.
+    """
+    def getDaqWaveform(self, waveform):
+        return waveform
+
+    def haveHardwareTiming(self):
+        return True
+
+
+class SyntheticCamera(object):
+    """
+    Creates camera frames whose sharpness (as measured by focusQuality)
+    depends on the distance from the best focus. best_offset is the QPD
+    offset (in microns) at which the image is in focus.
+    """
+    def __init__(self, best_offset = 0.0, depth = 0.5, size = 64, **kwds):
+        super().__init__(**kwds)
+        self.best_offset = best_offset
+        self.depth = depth
+        self.frame_number = 0
+        self.size = size
+
+        random_state = numpy.random.RandomState(1)
+        self.texture = random_state.uniform(0.0, 1000.0, size * size)
+
+    def getFrame(self, offset):
+        defocus = (offset - self.best_offset)/self.depth
+        contrast = math.exp(-0.5 * defocus * defocus)
+        data = (100.0 + contrast * self.texture).astype(numpy.uint16)
+        a_frame = frame.Frame(data, self.frame_number, self.size, self.size, "camera1")
+        self.frame_number += 1
+        return a_frame
+
+
+class LockReplay(object):
+    """
+    Replays a ReplayTrace through a lock mode.
+    """
+    def __init__(self,
+                 camera = None,
+                 lock_mode = "JumpLockMode",
+                 qpd_per_frame = 1,
+                 settings = None,
+                 trace = None,
+                 update_interval = 0.01,
+                 z_center = None,
+                 z_range = 100.0,
+                 **kwds):
+        """
+        camera - A SyntheticCamera, the default is a SyntheticCamera().
+        lock_mode - The name of the lockModes class to use.
+        qpd_per_frame - The number of QPD updates per camera frame.
+        settings - A dictionary of lock parameter values, for example
+                   {"locked.lock_gain" : 0.6}.
+        trace - A ReplayTrace.
+        update_interval - The (simulated) time between QPD updates in seconds.
+        z_center - The center position of the z stage, the default is
+                   the z stage position at the start of the trace.
+        z_range - The range of the z stage.
+        """
+        super().__init__(**kwds)
+        self.camera = camera
+        self.qpd_per_frame = qpd_per_frame
+        self.trace = trace
+        self.update_interval = update_interval
+
+        if self.camera is None:
+            self.camera = SyntheticCamera()
+
+        # Create the lock parameters the same way as focusLock.FocusLockView.
+        self.parameters = params.StormXMLObject()
+        self.parameters.add(params.ParameterFloat(description = "Z stage jump size",
+                                                  name = "jump_size",
+                                                  value = 0.1))
+        lockModes.FindSumMixin.addParameters(self.parameters)
+        lockModes.LockedMixin.addParameters(self.parameters)
+        lockModes.ScanMixin.addParameters(self.parameters)
+
+        self.lock_mode = getattr(lockModes, lock_mode)(parameters = self.parameters)
+        if settings is not None:
+            for pname in sorted(settings):
+                self.parameters.setv(pname, settings[pname])
+        self.lock_mode.newParameters(self.parameters)
+
+        if z_center is None:
+            z_center = self.trace.getZStart()
+        z_parameters = params.StormXMLObject()
+        z_parameters.add("center", z_center)
+        z_parameters.add("maximum", z_center + 0.5 * z_range)
+        z_parameters.add("minimum", z_center - 0.5 * z_range)
+        self.z_stage = ReplayZStageFunctionality(parameters = z_parameters)
+        self.z_stage.recenter()
+        self.lock_mode.setZStageFunctionality(self.z_stage)
+
+    def run(self, film = False, lock = True, n_updates = None, target = None):
+        """
+        Replay the trace.
+
+        film - Call the lock modes startFilm() / stopFilm() methods at the
+               start and end of the replay.
+        lock - Start the lock at the start of the replay.
+        n_updates - The number of QPD updates, the default is the length
+                    of the trace. The trace repeats if this is longer.
+        target - The lock target, the default is the offset at the start.
+
+        Returns a ReplayResults object.
+        """
+        if n_updates is None:
+            n_updates = self.trace.getSize()
+
+        results = ReplayResults(n_updates = n_updates,
+                                update_interval = self.update_interval)
+
+        # The lock mode needs a QPD reading before we can start.
+        self.lock_mode.handleQPDUpdate(self.trace.getQPDState(0, self.z_stage.getCurrentPosition()))
+
+        if lock:
+            self.lock_mode.startLock()
+            if target is None:
+                target = self.lock_mode.getQPDState()["offset"]
+            self.lock_mode.setLockTarget(target)
+
+        waveform = None
+        if film:
+            waveform = self.lock_mode.getWaveform()
+            self.lock_mode.startFilm()
+
+        n_frames = 0
+        start_time = time.perf_counter()
+        start_cpu = time.process_time()
+        for i in range(n_updates):
+            qpd_state = self.trace.getQPDState(i, self.z_stage.getCurrentPosition())
+
+            update_start = time.perf_counter()
+            self.lock_mode.handleQPDUpdate(qpd_state)
+            if ((i % self.qpd_per_frame) == 0):
+                if waveform is not None:
+                    self.z_stage.goAbsolute(waveform[n_frames % waveform.size])
+                self.lock_mode.handleNewFrame(self.camera.getFrame(qpd_state["offset"]))
+                n_frames += 1
+            results.latency[i] = time.perf_counter() - update_start
+
+            results.good_lock[i] = self.lock_mode.isGoodLock()
+            results.offset[i] = qpd_state["offset"]
+            results.stage_z[i] = self.z_stage.getCurrentPosition()
+            results.target[i] = self.lock_mode.getLockTarget()
+
+        results.cpu_time = time.process_time() - start_cpu
+        results.wall_time = time.perf_counter() - start_time
+
+        if film:
+            self.lock_mode.stopFilm()
+
+        return results
+
+
+class ReplayResults(object):
+    """
+    The offset, stage position, lock target, lock status and update
+    latency at each QPD update.
+    """
+    def __init__(self, n_updates = None, update_interval = None, **kwds):
+        super().__init__(**kwds)
+        self.cpu_time = 0.0
+        self.good_lock = numpy.zeros(n_updates, dtype = numpy.bool_)
+        self.latency = numpy.zeros(n_updates)
+        self.offset = numpy.zeros(n_updates)
+        self.stage_z = numpy.zeros(n_updates)
+        self.target = numpy.zeros(n_updates)
+        self.update_interval = update_interval
+        self.wall_time = 0.0
+
+    def getSettleIndex(self):
+        """
+        Returns the index of the first QPD update with a good lock, or
+        None if the lock was never good. Note that a good lock means that
+        the offset was within offset_threshold of the target for the last
+        buffer_length updates.
+        """
+        good = numpy.nonzero(self.good_lock)[0]
+        if (good.size == 0):
+            return None
+        return int(good[0])
+
+    def getStatistics(self):
+        """
+        Times are in milliseconds except settle_time, which is in
+        (simulated) seconds.
+        """
+        n_updates = self.latency.size
+        settle_index = self.getSettleIndex()
+        settle_time = None
+        rms_error = None
+        if settle_index is not None:
+            settle_time = settle_index * self.update_interval
+            error = self.offset[settle_index:] - self.target[settle_index:]
+            rms_error = math.sqrt(numpy.mean(error * error))
+
+        sim_time = n_updates * self.update_interval
+        return {"cpu_per_update" : 1000.0 * self.cpu_time/n_updates,
+                "max_latency" : 1000.0 * numpy.max(self.latency),
+                "mean_latency" : 1000.0 * numpy.mean(self.latency),
+                "realtime_factor" : sim_time/max(self.wall_time, 1.0e-9),
+                "rms_error" : rms_error,
+                "settle_time" : settle_time,
+                "updates" : n_updates}
+
+
+def loadTrace(filename):
+    """
+    Load a trace recorded by lockControl.LockControl (.off file) or by
+    lockModes.DiagnosticsLockMode (dlm_XXX.txt file). Offsets are in
+    microns in both.
+
+    The focus position is the recorded stage position minus the recorded
+    offset. The diagnostics files do not include the stage position, but
+    the stage is not moved in this mode so we use 0.0.
+    """
+    with open(filename) as fp:
+        first = fp.readline().split()
+
+    has_header = False
+    try:
+        float(first[0])
+    except ValueError:
+        has_header = True
+
+    data = numpy.loadtxt(filename, skiprows = int(has_header), ndmin = 2)
+
+    # lockControl.LockControl format, 'frame offset power stage-z good-offset'.
+    if (data.shape[1] >= 5):
+        return ReplayTrace(focus = data[:,3] - data[:,1],
+                           is_good = data[:,4] > 0,
+                           power = data[:,2],
+                           z_start = data[0,3])
+
+    # DiagnosticsLockMode format, 'offset sum is_good'.
+    else:
+        return ReplayTrace(focus = -data[:,0],
+                           is_good = data[:,2] > 0,
+                           power = data[:,1])
+
+def syntheticTrace(n_updates, drift = 0.0, noise = 0.0, sine_amplitude = 0.0, sine_period = 1000, steps = None, update_interval = 0.01):
+    """
+    Create a synthetic trace, the focus starts at 0.0.
+
+    n_updates - The number of QPD updates.
+    drift - Focus drift in microns per second.
+    noise - Standard deviation of the QPD noise in microns.
+    sine_amplitude - Amplitude of a sinusoidal focus variation in microns.
+    sine_period - Period of the sinusoidal focus variation in updates.
+    steps - A list of [update, size] focus steps.
+    update_interval - The time between QPD updates in seconds.
+    """
+    t = numpy.arange(n_updates)
+    focus = drift * update_interval * t
+    if (sine_amplitude > 0.0):
+        focus += sine_amplitude * numpy.sin(2.0 * math.pi * t/sine_period)
+    if steps is not None:
+        for [index, size] in steps:
+            focus[index:] += size
+    if (noise > 0.0):
+        focus += numpy.random.normal(scale = noise, size = n_updates)
+    return ReplayTrace(focus = focus)
+
+
+if (__name__ == "__main__"):
+
+    import argparse
+
+    from PyQt5 import QtCore
+
+    parser = argparse.ArgumentParser(description = 'Replay QPD traces through the focus lock modes.')
+    parser.add_argument('--mode', dest = 'mode', type = str, required = False, default = "JumpLockMode",
+                        help = "The lock mode to use, default is JumpLockMode.")
+    parser.add_argument('--trace', dest = 'trace', type = str, required = False, default = None,
+                        help = "A recorded trace (.off or dlm_XXX.txt file), default is a synthetic trace.")
+    parser.add_argument('--updates', dest = 'updates', type = int, required = False, default = 10000,
+                        help = "The number of QPD updates for a synthetic trace.")
+    parser.add_argument('--interval', dest = 'interval', type = float, required = False, default = 0.01,
+                        help = "The time between QPD updates in seconds.")
+    parser.add_argument('--drift', dest = 'drift', type = float, required = False, default = 0.1,
+                        help = "Synthetic focus drift in microns per second.")
+    parser.add_argument('--noise', dest = 'noise', type = float, required = False, default = 0.01,
+                        help = "Synthetic QPD noise in microns.")
+    parser.add_argument('--qpd_per_frame', dest = 'qpd_per_frame', type = int, required = False, default = 1,
+                        help = "The number of QPD updates per camera frame.")
+    parser.add_argument('--film', dest = 'film', action = 'store_true',
+                        help = "Replay as if filming.")
+    parser.add_argument('--set', dest = 'settings', type = str, nargs = '*', default = [],
+                        help = "Lock parameters, for example locked.lock_gain=0.6.")
+
+    args = parser.parse_args()
+
+    app = QtCore.QCoreApplication([])
+
+    if args.trace is not None:
+        trace = loadTrace(args.trace)
+    else:
+        trace = syntheticTrace(args.updates,
+                               drift = args.drift,
+                               noise = args.noise,
+                               update_interval = args.interval)
+
+    settings = {}
+    for setting in args.settings:
+        [pname, value] = setting.split("=")
+        settings[pname] = float(value)
+
+    replay = LockReplay(lock_mode = args.mode,
+                        qpd_per_frame = args.qpd_per_frame,
+                        settings = settings,
+                        trace = trace,
+                        update_interval = args.interval)
+    stats = replay.run(film = args.film).getStatistics()
+    for key in sorted(stats):
+        print(key, stats[key])
+
+
+#
+# The MIT License
+#
+# Copyright (c) 2018 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
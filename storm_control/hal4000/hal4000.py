@@ -30,6 +30,7 @@ from PyQt5 import QtCore, QtGui, QtWidgets
 import storm_control.sc_library.halExceptions as halExceptions
 import storm_control.sc_library.hdebug as hdebug
 import storm_control.sc_library.hgit as hgit
+import storm_control.sc_library.htrace as htrace
 import storm_control.sc_library.parameters as params
 
 import storm_control.hal4000.halLib.halDialog as halDialog
@@ -60,6 +61,15 @@ class HalController(halModule.HalModule):
     def __init__(self, module_params = None, qt_settings = None, **kwds):
         super().__init__(**kwds)
 
+        # The messages that this module handles.
+        self.addHandledMessages(["add to menu",
+                                 "add to ui",
+                                 "change directory",
+                                 "start",
+                                 "start film",
+                                 "stop film",
+                                 "tests done"])
+
         if (module_params.get("ui_type") == "classic"):
             self.view = ClassicView(module_params = module_params,
                                     qt_settings = qt_settings,
@@ -383,11 +393,17 @@ class HalCore(QtCore.QObject):
                  **kwds):
         super().__init__(**kwds)
 
+        self.deliveries = 0
+        self.deliveries_saved = 0
         self.modules = []
         self.module_name = "core"
+        self.dispatch_stats = halModule.DispatchStatistics(name = self.module_name)
         self.qt_settings = QtCore.QSettings("storm-control", "hal4000" + config.get("setup_name").lower())
         self.queued_messages = deque()
         self.queued_messages_timer = QtCore.QTimer(self)
+        self.routing = config.get("message_routing", True)
+        self.routing_generation = None
+        self.routing_table = {}
         self.running = True # This is solely for the benefit of unit tests.
         self.sent_messages = []
         self.strict = config.get("strict", False)
@@ -399,6 +415,9 @@ class HalCore(QtCore.QObject):
         # Initialize messages.
         halMessage.initializeMessages()
 
+        # Maximum time to spend processing queued messages per timer event.
+        halModule.dispatch_budget_ms = config.get("dispatch_budget_ms", 10)
+
         # In strict mode we all workers must finish in 60 seconds.
         if self.strict:
             halModule.max_job_time = 60000
@@ -545,6 +564,18 @@ class HalCore(QtCore.QObject):
         self.cleanUp()
         
     def cleanUp(self):
+        stats = self.getRoutingStatistics()
+        print("Sent " + str(stats["deliveries"]) + " messages to modules, " + str(stats["saved"]) + " deliveries saved by routing.")
+        hdebug.logText("message deliveries " + str(stats["deliveries"]) + ", saved " + str(stats["saved"]))
+
+        stats = self.getDispatchStatistics()
+        print("Sent " + str(stats["messages"]) + " messages in " + str(stats["ticks"]) + " timer events, at most " + str(stats["max"]) + " per event.")
+
+        if htrace.isTracing():
+            stats = htrace.getStatistics()
+            print("Traced " + str(stats["events"]) + " message events, " + str(stats["dropped"]) + " dropped.")
+            htrace.stopTracing()
+        
         print("Stopping modules")
         for module in self.modules:
             print("  " + module.module_name)
@@ -567,6 +598,35 @@ class HalCore(QtCore.QObject):
                 return m_child
         assert False, "UI element " + name + " not found."
 
+    def getDispatchStatistics(self):
+        return self.dispatch_stats.getStatistics()
+
+    def getModulesFor(self, m_type):
+        """
+        Returns the list of modules that handle messages of type m_type. 
+        This is cached, and the cache is cleared if any module changes
+        the message types that it handles.
+        """
+        if not self.routing:
+            return self.modules
+        
+        if (self.routing_generation != halModule.routing_generation):
+            self.routing_generation = halModule.routing_generation
+            self.routing_table = {}
+
+        if not m_type in self.routing_table:
+            self.routing_table[m_type] = [x for x in self.modules if x.handlesMessage(m_type)]
+        return self.routing_table[m_type]
+
+    def getRoutingStatistics(self):
+        """
+        Returns how many messages were delivered to modules and how
+        many deliveries were saved by only sending messages to the
+        modules that handle them.
+        """
+        return {"deliveries" : self.deliveries,
+                "saved" : self.deliveries_saved}
+
     def handleErrors(self, message):
         """
         Handle errors in messages from 'core'
@@ -663,10 +723,14 @@ class HalCore(QtCore.QObject):
 
     def handleSendMessage(self):
         """
-        Handle sending the current message to all the modules.
+        Handle sending queued messages to the modules. This keeps sending
+        messages until the queue is empty, a sync message has to wait or
+        we've used up the dispatch time budget.
         """
-        # Process the next message.
-        if (len(self.queued_messages) > 0):
+        start_time = time.perf_counter()
+        n_sent = 0
+        waiting = False
+        while (len(self.queued_messages) > 0):
             cur_message = self.queued_messages.popleft()
             
             #
@@ -681,6 +745,8 @@ class HalCore(QtCore.QObject):
                     print(text)
                 print("")
                 self.queued_messages.appendleft(cur_message)
+                waiting = True
+                break
             
             #
             # Otherwise process the message.
@@ -704,13 +770,29 @@ class HalCore(QtCore.QObject):
 
                         cur_message.processed.connect(self.handleProcessed)
                         self.sent_messages.append(cur_message)
-                        for module in self.modules:
-                            cur_message.ref_count += 1
+
+                        modules = self.getModulesFor(cur_message.m_type)
+                        self.deliveries += len(modules)
+                        self.deliveries_saved += len(self.modules) - len(modules)
+                        cur_message.ref_count += len(modules)
+                        for module in modules:
                             module.handleMessage(cur_message)
 
-                    # Process any remaining messages with immediate timeout.
-                    if (len(self.queued_messages) > 0):
-                        self.startMessageTimer()
+                        # If none of the modules handle this message then it
+                        # is already processed.
+                        if (len(modules) == 0):
+                            self.handleProcessed(cur_message)
+
+                    n_sent += 1
+                    if halModule.overBudget(start_time):
+                        break
+
+        if (n_sent > 0):
+            self.dispatch_stats.addTick(n_sent)
+            
+        # Process any remaining messages with immediate timeout.
+        if (len(self.queued_messages) > 0) and not waiting:
+            self.startMessageTimer()
 
     def startMessageTimer(self, interval = 0):
         if not self.queued_messages_timer.isActive():
@@ -750,6 +832,13 @@ if (__name__ == "__main__"):
 
     # Start logger.
     hdebug.startLogging(config.get("directory") + "logs/", "hal4000")
+
+    # Start message tracing. This records message events in a binary file
+    # instead of in the text log file.
+    if hdebug.getLogBasename() is not None:
+        htrace.startTracing(hdebug.getLogBasename(),
+                            level = config.get("trace_level", 1),
+                            sample_every = config.get("trace_sample_every", 1))
     
     # Setup HAL and all of the modules.
     hal = HalCore(config = config,
@@ -762,6 +851,7 @@ if (__name__ == "__main__"):
     signal.signal(signal.SIGINT, ctrlCHandler)
     
     app.exec_()
+    htrace.stopTracing()
 
 
 #
@@ -7,8 +7,16 @@ was that for large images, such as those from a sCMOS camera, using numpy
 to do the image scaling and type conversion was not fast enough.
 
 Hazen 09/15
+
+If the C library is not available we use NumpyRescaler instead. This
+uses a 64k element look up table for the conversion from uint16 to
+uint8 and processes the image in blocks of rows so that each block is
+still in the cache when we go over it a second time. This is about as
+fast as the C library and fast enough to display 2048 x 2048 images
+at 30Hz (see the benchmark at the end of this file).
 """
 
+import collections
 import ctypes
 import math
 import numpy
@@ -51,6 +59,120 @@ except OSError:
     image_manip = None
 
 
+class NumpyRescaler(object):
+    """
+    Numpy version of the C rescaleImage functions.
+    """
+    def __init__(self, block_rows = 32, max_luts = 8, **kwds):
+        """
+        block_rows - The number of image rows to process at a time.
+        max_luts - The maximum number of look up tables to cache. We
+                   cache more than one as there might be several
+                   viewers with different display ranges.
+        """
+        super().__init__(**kwds)
+        self.block_rows = block_rows
+        self.luts = collections.OrderedDict()
+        self.max_luts = max_luts
+        self.scratch = None
+
+    def getLUT(self, display_min, display_max, saturated_value, max_range):
+        """
+        Returns the uint16 to uint8 look up table, this is only
+        re-calculated if one of the parameters changes.
+        """
+        key = (display_min, display_max, saturated_value, max_range)
+        if key in self.luts:
+            self.luts.move_to_end(key)
+            return self.luts[key]
+
+        # This should match what the C library does.
+        d_range = display_max - display_min
+        if (d_range == 0):
+            d_range = 1
+        lut = numpy.arange(65536, dtype = numpy.float64)
+        lut = (lut - display_min) * (max_range/d_range)
+        lut = numpy.clip(lut, 0.0, max_range) + 0.5
+        lut = lut.astype(numpy.uint8)
+        if (saturated_value < 65536):
+            lut[max(saturated_value, 0):] = 255
+
+        self.luts[key] = lut
+        if (len(self.luts) > self.max_luts):
+            self.luts.popitem(last = False)
+        return lut
+
+    def rescale(self, image, flip_h, flip_v, transpose, display_range, saturated_value, max_range, out = None):
+        """
+        See rescaleImage(). Returns [rescaled, image minimum, image maximum].
+        """
+        [h, w] = image.shape
+        if transpose:
+            shape = (w, h)
+        else:
+            shape = (h, w)
+        rescaled = checkOutputBuffer(out, shape)
+
+        lut = self.getLUT(int(display_range[0]), int(display_range[1]), int(saturated_value), max_range)
+
+        #
+        # Create a view of the output array with the same orientation as
+        # the original image. Flips are their own inverse, so the order in
+        # which these are applied does not matter.
+        #
+        view = rescaled
+        if transpose:
+            view = view.T
+        if flip_v:
+            view = view[::-1, :]
+        if flip_h:
+            view = view[:, ::-1]
+
+        # We need a temporary buffer for transposes, otherwise numpy.take()
+        # does a lot of strided writes to the output array.
+        if transpose:
+            if (self.scratch is None) or (self.scratch.shape != (self.block_rows, w)):
+                self.scratch = numpy.empty((self.block_rows, w), dtype = numpy.uint8)
+
+        image_min = None
+        image_max = None
+        for i in range(0, h, self.block_rows):
+            block = image[i:i+self.block_rows]
+
+            # Block minimum and maximum.
+            b_min = int(block.min())
+            b_max = int(block.max())
+            if (image_min is None) or (b_min < image_min):
+                image_min = b_min
+            if (image_max is None) or (b_max > image_max):
+                image_max = b_max
+
+            # Rescale. We can use mode = 'clip' as a uint16 image can't
+            # have values outside of the look up table. This mode is faster
+            # as numpy doesn't have to check the values.
+            if transpose:
+                scratch = self.scratch[:block.shape[0]]
+                numpy.take(lut, block, out = scratch, mode = 'clip')
+                view[i:i+self.block_rows] = scratch
+            else:
+                numpy.take(lut, block, out = view[i:i+self.block_rows], mode = 'clip')
+
+        return [rescaled, image_min, image_max]
+
+
+numpy_rescaler = NumpyRescaler()
+
+
+def checkOutputBuffer(out, shape):
+    """
+    Returns out if it can be used to store the rescaled image,
+    otherwise returns a new array.
+    """
+    if (out is not None) and (out.shape == shape) and (out.dtype == numpy.uint8) and out.flags['C_CONTIGUOUS']:
+        return out
+    return numpy.empty(shape, dtype = numpy.uint8)
+
+
 def compare(image1, image2):
     """
     This does a bytewise comparison of two images.
@@ -67,7 +189,7 @@ def compare(image1, image2):
     return image_manip.compare(image1, image2, image1.size)
 
 
-def rescaleImage(image, flip_h, flip_v, transpose, display_range, saturated_value, use_numpy = False):
+def rescaleImage(image, flip_h, flip_v, transpose, display_range, saturated_value, use_numpy = False, out = None, rescaler = None):
     """
     This converts a uint16 image into a uint8 image based on the display
     range. As a side effect it also returns the minimum and maximum values
@@ -80,6 +202,12 @@ def rescaleImage(image, flip_h, flip_v, transpose, display_range, saturated_valu
     display_range - [image value that equals 0, image value that equals 255].
     saturated_value - The value above which the image has saturated the camera.
     use_numpy - (optional) Use numpy even if the C library exists, defaults to False.
+    out - (optional) A numpy.uint8 array to store the result in. This is only
+          used if it has the right shape, so it is safe to pass the array that
+          was returned by the previous call.
+    rescaler - (optional) The NumpyRescaler to use if we fall back to numpy. A
+               NumpyRescaler is not thread safe, so each thread that renders
+               images should have its own one.
 
     return [numpy.uint8 image, original image minimum, original image maximum]
     """
@@ -103,9 +231,9 @@ def rescaleImage(image, flip_h, flip_v, transpose, display_range, saturated_valu
     if (image_manip is not None) and (not use_numpy):
 
         if transpose:
-            rescaled = numpy.empty((image.shape[1], image.shape[0]), dtype = numpy.uint8)
+            rescaled = checkOutputBuffer(out, (image.shape[1], image.shape[0]))
         else:
-            rescaled = numpy.empty((image.shape[0], image.shape[1]), dtype = numpy.uint8)
+            rescaled = checkOutputBuffer(out, (image.shape[0], image.shape[1]))
 
         image_min = ctypes.c_int(0)
         image_max = ctypes.c_int(0)
@@ -129,34 +257,54 @@ def rescaleImage(image, flip_h, flip_v, transpose, display_range, saturated_valu
 
     # Fall back to using numpy.
     else:
-        image_min = numpy.min(image)
-        image_max = numpy.max(image)
-            
-        if flip_h:
-            image = numpy.fliplr(image)
+        if rescaler is None:
+            rescaler = numpy_rescaler
+        [rescaled, image_min, image_max] = rescaler.rescale(image,
+                                                            flip_h,
+                                                            flip_v,
+                                                            transpose,
+                                                            display_range,
+                                                            saturated_value,
+                                                            max_range,
+                                                            out = out)
+
+    return [rescaled, image_min, image_max]
+
             
-        if flip_v:
-            image = numpy.flipud(image)
 
-        if transpose:
-            image = numpy.transpose(image)
-        
-        rescaled = image.astype(numpy.float64)
-        rescaled = max_range*(rescaled - display_range[0])/(display_range[1] - display_range[0])
-        rescaled[(rescaled > max_range)] = max_range 
-        rescaled[(rescaled < 0.0)] = 0.0
-        
-        # Check for saturated pixels
-        if saturated_value is not None:
-            rescaled[(image >= saturated_value)] = 255.0
+if (__name__ == "__main__"):
 
-        # Convert to contiguous uint8 array.
-        rescaled += 0.5
-        rescaled = rescaled.astype(numpy.uint8, order='C')
+    #
+    # Benchmark the numpy and C versions (if available) with a 2048 x 2048
+    # image for all the flip / transpose variants.
+    #
+    import time
 
-    return [rescaled, image_min, image_max]
+    n_reps = 30
+    image = numpy.random.randint(0, 4096, size = (2048, 2048)).astype(numpy.uint16)
+
+    versions = [["numpy", True]]
+    if image_manip is not None:
+        versions.append(["C", False])
+
+    for [name, use_numpy] in versions:
+        print(name)
+        for op_code in range(8):
+            [flip_h, flip_v, transpose] = map(lambda x: bool(op_code & x), [4, 2, 1])
+            rescaled = None
+            start_time = time.perf_counter()
+            for i in range(n_reps):
+                [rescaled, image_min, image_max] = rescaleImage(image,
+                                                                flip_h,
+                                                                flip_v,
+                                                                transpose,
+                                                                [100, 4000],
+                                                                4000,
+                                                                use_numpy = use_numpy,
+                                                                out = rescaled)
+            elapsed = (time.perf_counter() - start_time)/n_reps
+            print("  {0:d}{1:d}{2:d} {3:.2f}ms".format(flip_h, flip_v, transpose, 1000.0 * elapsed))
 
-            
 #
 # The MIT License
 #
@@ -12,6 +12,7 @@ from PyQt5 import QtCore
 
 import storm_control.sc_library.halExceptions as halExceptions
 import storm_control.sc_library.hdebug as hdebug
+import storm_control.sc_library.htrace as htrace
 import storm_control.sc_library.parameters as params
 
 import storm_control.hal4000.halLib.halFunctionality as halFunctionality
@@ -293,7 +294,7 @@ class HalMessage(QtCore.QObject):
     def decRefCount(self, name = None):
 
         # This is helpful for debugging who has not responded to the message.
-        if True:
+        if not htrace.traceEvent("handled by", self.m_id, name, self.m_type):
             hdebug.logText(",".join(["handled by", str(self.m_id), str(name), self.m_type]))
             
         self.ref_count -= 1
@@ -353,7 +354,8 @@ class HalMessage(QtCore.QObject):
         return (self.m_type == m_type)
 
     def logEvent(self, event_name):
-        hdebug.logText(",".join([event_name, str(self.m_id), self.source.module_name, self.m_type]))
+        if not htrace.traceEvent(event_name, self.m_id, self.source.module_name, self.m_type):
+            hdebug.logText(",".join([event_name, str(self.m_id), self.source.module_name, self.m_type]))
 
 #    def refCountIsZero(self):
 #        return (self.ref_count == 0)
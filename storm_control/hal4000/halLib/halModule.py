@@ -7,6 +7,7 @@ Hazen 01/17
 """
 
 import faulthandler
+import time
 import traceback
 
 from collections import deque
@@ -14,6 +15,8 @@ from collections import deque
 from PyQt5 import QtCore, QtWidgets
 
 import storm_control.sc_library.halExceptions as halExceptions
+import storm_control.sc_library.hdebug as hdebug
+import storm_control.sc_library.htrace as htrace
 
 import storm_control.hal4000.halLib.halMessage as halMessage
 import storm_control.hal4000.halLib.halMessageBox as halMessageBox
@@ -26,6 +29,16 @@ threadpool = QtCore.QThreadPool.globalInstance()
 # benefit of QT signalling.
 max_job_time = -1
 
+# Maximum time in milliseconds to spend processing queued messages
+# each time the message timer fires. If this is 0 then only one message
+# is processed per timer event. HalCore sets this from the 'dispatch_budget_ms'
+# configuration parameter.
+dispatch_budget_ms = 0
+
+# This is incremented every time a module changes the message types
+# that it handles so that HalCore knows to rebuild its routing table.
+routing_generation = 0
+
 def runWorkerTask(module, message, task, job_time_ms = None):
     """
     Use this to handle long running (non-GUI) tasks. See
@@ -58,6 +71,39 @@ def runWorkerTask(module, message, task, job_time_ms = None):
     threadpool.start(ct_task)
 
 
+class DispatchStatistics(object):
+    """
+    Keeps track of how many messages were processed each time the
+    message timer fired.
+    """
+    def __init__(self, name = "", **kwds):
+        super().__init__(**kwds)
+        self.max_messages = 0
+        self.n_messages = 0
+        self.n_ticks = 0
+        self.name = name
+
+    def addTick(self, n_messages):
+        if not htrace.traceEvent("drained", n_messages, self.name):
+            hdebug.logText(",".join(["drained", self.name, str(n_messages)]))
+        self.n_messages += n_messages
+        self.n_ticks += 1
+        if (n_messages > self.max_messages):
+            self.max_messages = n_messages
+
+    def getStatistics(self):
+        return {"max" : self.max_messages,
+                "messages" : self.n_messages,
+                "ticks" : self.n_ticks}
+
+
+def overBudget(start_time):
+    """
+    Returns True if we have used up the message dispatch time budget.
+    """
+    return ((time.perf_counter() - start_time) >= 1.0e-3 * dispatch_budget_ms)
+
+
 class HalWorkerSignaler(QtCore.QObject):
     """
     A signaler class for HalWorker.
@@ -122,7 +168,15 @@ class HalModule(QtCore.QObject):
 
     Incoming messages are stored in queue and passed to processMessage() in
     the order they were received. If a worker is started the next message 
-    will get passed to processMessage() until the worker finishes.
+    will get passed to processMessage() until the worker finishes. If there
+    are several messages in the queue then as many of them as possible are
+    processed in one go (see dispatch_budget_ms).
+
+    By default a module is sent every message. Modules can use
+    addHandledMessages() to tell HalCore which message types they
+    actually handle, in which case HalCore will only send them messages
+    of these types. Note that a sub-class that handles additional message
+    types will also need to add them.
 
     Conventions:
        1. self.view is the GUI view, if any that is associated with this module.
@@ -133,7 +187,9 @@ class HalModule(QtCore.QObject):
 
     def __init__(self, module_name = "", **kwds):
         super().__init__(**kwds)
+        self.handled_messages = None
         self.module_name = module_name
+        self.dispatch_stats = DispatchStatistics(name = module_name)
 
         self.queued_messages = deque()
         self.worker = None
@@ -151,6 +207,17 @@ class HalModule(QtCore.QObject):
 
         self.view = None
         
+    def addHandledMessages(self, m_types):
+        """
+        Add to the list of message types that this module handles. This
+        is usually called in __init__().
+        """
+        global routing_generation
+        if self.handled_messages is None:
+            self.handled_messages = set()
+        self.handled_messages.update(m_types)
+        routing_generation += 1
+
     def cleanUp(self, qt_settings):
         """
         Override to provide module specific clean up and to save
@@ -187,6 +254,21 @@ class HalModule(QtCore.QObject):
             else:
                 return self.view.findChild(qt_type, name, options)
 
+    def getDispatchStatistics(self):
+        """
+        Returns a dictionary with the number of timer events ('ticks'),
+        the number of messages processed and the maximum number of
+        messages processed in a single timer event.
+        """
+        return self.dispatch_stats.getStatistics()
+
+    def getHandledMessages(self):
+        """
+        Returns the set of message types that this module handles, or
+        None if the module handles all messages.
+        """
+        return self.handled_messages
+
     def handleError(self, message, m_error):
         """
         Override this with class specific error handling.
@@ -226,6 +308,14 @@ class HalModule(QtCore.QObject):
         if (len(self.queued_messages) == 1) and self.worker is None:
             self.queued_messages_timer.start()
  
+    def handlesMessage(self, m_type):
+        """
+        Returns True if the module wants to get messages of type m_type.
+        """
+        if self.handled_messages is None:
+            return True
+        return (m_type in self.handled_messages)
+
     def handleResponse(self, message, response):
         """
         Override this if you expect only singleton message responses.
@@ -315,22 +405,39 @@ class HalModule(QtCore.QObject):
     def nextMessage(self):
         """
         Don't override..
-        """
-        # Get the next message from the queue.
-        message = self.queued_messages.popleft()
 
-        try:
-            self.processMessage(message)
-        except Exception as exception:
-            message.addError(halMessage.HalMessageError(source = self.module_name,
-                                                        message = str(exception),
-                                                        m_exception = exception,
-                                                        stack_trace = traceback.format_exc()))
-        message.decRefCount(name = self.module_name)
+        This processes queued messages until the queue is empty, a 
+        worker is started or we've used up the dispatch time budget.
+        """
+        start_time = time.perf_counter()
+        n_processed = 0
+        while (len(self.queued_messages) > 0):
+            
+            # Get the next message from the queue.
+            message = self.queued_messages.popleft()
+
+            try:
+                self.processMessage(message)
+            except Exception as exception:
+                message.addError(halMessage.HalMessageError(source = self.module_name,
+                                                            message = str(exception),
+                                                            m_exception = exception,
+                                                            stack_trace = traceback.format_exc()))
+            message.decRefCount(name = self.module_name)
+            n_processed += 1
+
+            # Check if this is being handled by a worker. If it is then we
+            # wait until the worker is done before moving on to process the
+            # next message.
+            if self.worker is not None:
+                break
+
+            if overBudget(start_time):
+                break
+
+        if (n_processed > 0):
+            self.dispatch_stats.addTick(n_processed)
 
-        # Check if this is being handled by a worker. If it is then we
-        # wait until the worker is done before moving on to process the
-        # next message.
         if self.worker is not None:
             return
             
@@ -2,11 +2,19 @@
 """
 Image file writers for various formats.
 
+By default the frames are written in the newFrame() slot, i.e. in
+the main thread. If the film settings specify a writer queue then
+the frames are instead passed to a BackgroundWriter thread which
+writes them out in batches. This means that a slow disk won't
+stall HAL, at least until the queue fills up.
+
 Hazen 03/17
 """
 
 import copy
 import datetime
+import os
+import queue
 import struct
 import tifffile
 import time
@@ -61,11 +69,134 @@ def createFileWriter(camera_functionality, film_settings):
     else:
         raise ImageWriterException("Unknown output file format '" + ft + "'")
 
+def writeBuffers(fp, buffers):
+    """
+    Write a list of buffers (i.e. numpy arrays) to a file with
+    as few system calls as possible. fp should be unbuffered.
+    """
+    if hasattr(os, "writev"):
+        views = [memoryview(buf).cast("B") for buf in buffers]
+        fd = fp.fileno()
+        i = 0
+        while (i < len(views)):
+
+            # Limit the number of buffers per call to be less than IOV_MAX.
+            n_written = os.writev(fd, views[i:i+512])
+
+            # Handle partial writes.
+            while (n_written > 0):
+                if (n_written >= len(views[i])):
+                    n_written -= len(views[i])
+                    i += 1
+                else:
+                    views[i] = views[i][n_written:]
+                    n_written = 0
+    else:
+        for buf in buffers:
+            fp.write(memoryview(buf).cast("B"))
+
+
+class BackgroundWriter(QtCore.QThread):
+    """
+    Writes frames to disk in a separate thread. Frames are passed to the
+    thread using a bounded queue. If the queue is full then addFrame()
+    will block until there is space, so frames are never lost but the
+    main thread will stall if the disk is too slow.
+    """
+    def __init__(self, file_writer = None, max_batch = 64, queue_size = None, **kwds):
+        """
+        file_writer - The BaseFileWriter object that this is writing for.
+        max_batch - The maximum number of frames to write in a single call.
+        queue_size - The maximum number of frames in the queue.
+        """
+        super().__init__(**kwds)
+        self.bytes_written = 0
+        self.error = None
+        self.file_writer = file_writer
+        self.frame_queue = queue.Queue(maxsize = queue_size)
+        self.max_batch = max_batch
+        self.max_depth = 0
+        self.stalls = 0
+        self.start_time = None
+        self.write_time = 0.0
+
+    def addFrame(self, frame):
+        """
+        Add a frame to the queue, this is called from the main thread.
+        """
+        self.checkError()
+        if self.frame_queue.full():
+            self.stalls += 1
+        self.frame_queue.put(frame)
+        depth = self.frame_queue.qsize()
+        if (depth > self.max_depth):
+            self.max_depth = depth
+
+    def checkError(self):
+        """
+        Re-raise any exception that happened in the writer thread.
+        """
+        if self.error is not None:
+            raise ImageWriterException("Background writer failed for '" + self.file_writer.filename + "', " + str(self.error))
+
+    def finish(self):
+        """
+        Wait for all the queued frames to be written and stop the thread.
+        """
+        self.frame_queue.put(None)
+        self.wait()
+        self.checkError()
+
+    def getQueueDepth(self):
+        return self.frame_queue.qsize()
+
+    def getWriteRate(self):
+        """
+        Returns the average throughput (since the start of the film) in MB/s.
+        """
+        if self.start_time is None:
+            return 0.0
+        elapsed = time.perf_counter() - self.start_time
+        if (elapsed <= 0.0):
+            return 0.0
+        return self.bytes_written * 0.000000953674 / elapsed
+
+    def run(self):
+        self.start_time = time.perf_counter()
+        running = True
+        while running:
+
+            # Wait for a frame, then grab whatever else is in the queue.
+            frames = [self.frame_queue.get()]
+            while (len(frames) < self.max_batch):
+                try:
+                    frames.append(self.frame_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if frames[-1] is None:
+                frames.pop()
+                running = False
+
+            if (len(frames) > 0) and (self.error is None):
+                start = time.perf_counter()
+                try:
+                    self.file_writer.writeFrames(frames)
+                except Exception as exception:
+                    self.error = exception
+                self.write_time += time.perf_counter() - start
+                for frame in frames:
+                    self.bytes_written += frame.np_data.nbytes
+                    
+            for frame in frames:
+                frame.release()
+
 
 class BaseFileWriter(object):
 
     def __init__(self, camera_functionality = None, film_settings = None, **kwds):
         super().__init__(**kwds)
+        self.bg_writer = None
         self.cam_fn = camera_functionality
         self.film_settings = film_settings
         self.stopped = False
@@ -85,12 +216,31 @@ class BaseFileWriter(object):
         self.cam_fn.stopped.connect(self.handleStopped)
 
     def closeWriter(self):
+        """
+        Sub-classes should call this before closing their file as this
+        will also flush any frames that are still in the writer queue.
+
+        This raises an ImageWriterException if the background writer
+        failed, sub-classes should still close their file if it does.
+        """
         assert self.stopped
         self.cam_fn.newFrame.disconnect(self.saveFrame)
         self.cam_fn.stopped.disconnect(self.handleStopped)
+        if self.bg_writer is not None:
+            self.bg_writer.finish()
 
+    def getQueueDepth(self):
+        if self.bg_writer is not None:
+            return self.bg_writer.getQueueDepth()
+        return 0
+        
     def getSize(self):
         return self.frame_size * self.number_frames
+
+    def getWriteRate(self):
+        if self.bg_writer is not None:
+            return self.bg_writer.getWriteRate()
+        return None
     
     def handleStopped(self):
         self.stopped = True
@@ -98,8 +248,37 @@ class BaseFileWriter(object):
     def isStopped(self):
         return self.stopped
         
-    def saveFrame(self):
+    def saveFrame(self, frame):
         self.number_frames += 1
+        if self.bg_writer is not None:
+
+            # Frames that are not from the frame pool could be in memory
+            # that the camera driver will re-use, so we need a copy.
+            if frame.isPooled():
+                frame.hold()
+            else:
+                frame = copy.copy(frame)
+                frame.np_data = frame.np_data.copy()
+            self.bg_writer.addFrame(frame)
+        else:
+            self.writeFrames([frame])
+
+    def startBackgroundWriter(self):
+        """
+        Sub-classes should call this once they are ready to write frames.
+        """
+        queue_size = self.film_settings.getWriterQueue()
+        if (queue_size > 0):
+            self.bg_writer = BackgroundWriter(file_writer = self,
+                                              queue_size = queue_size)
+            self.bg_writer.start(QtCore.QThread.NormalPriority)
+
+    def writeFrames(self, frames):
+        """
+        Write a list of frames to disk. This will be called from the
+        background writer thread if there is one.
+        """
+        raise NotImplementedError("writeFrames() is not implemented for " + type(self).__name__)
 
 
 class DaxFile(BaseFileWriter):
@@ -108,15 +287,18 @@ class DaxFile(BaseFileWriter):
     """
     def __init__(self, **kwds):
         super().__init__(**kwds)
-        self.fp = open(self.filename, "wb")
+        self.fp = open(self.filename, "wb", buffering = 0)
+        self.startBackgroundWriter()
 
     def closeWriter(self):
         """
         Close the file and write a very simple .inf file. All the metadata is
         now stored in the .xml file that is saved with each recording.
         """
-        super().closeWriter()
-        self.fp.close()
+        try:
+            super().closeWriter()
+        finally:
+            self.fp.close()
 
         w = str(self.cam_fn.getParameter("x_pixels"))
         h = str(self.cam_fn.getParameter("y_pixels"))
@@ -132,10 +314,8 @@ class DaxFile(BaseFileWriter):
                 inf_fp.write("y_end = " + h + "\n")
             inf_fp.close()
 
-    def saveFrame(self, frame):
-        super().saveFrame()
-        np_data = frame.getData()
-        np_data.tofile(self.fp)
+    def writeFrames(self, frames):
+        writeBuffers(self.fp, [frame.getData() for frame in frames])
 
 
 class SPEFile(BaseFileWriter):
@@ -172,16 +352,19 @@ class SPEFile(BaseFileWriter):
         self.fp.write(struct.pack("h", self.feed_info.getParameter("y_pixels")))
 
         self.fp.seek(4100)
+        self.startBackgroundWriter()
 
     def closeWriter(self):
-        super().closeWriter()
-        self.fp.seek(1446)
-        self.fp.write(struct.pack("i", self.number_frames))
+        try:
+            super().closeWriter()
+            self.fp.seek(1446)
+            self.fp.write(struct.pack("i", self.number_frames))
+        finally:
+            self.fp.close()
 
-    def saveFrame(self, frame):
-        super().saveFrame()
-        np_data = frame.getData()
-        np_data.tofile(self.file_ptrs[index])
+    def writeFrames(self, frames):
+        for frame in frames:
+            frame.getData().tofile(self.fp)
 
 
 class TestFile(DaxFile):
@@ -219,17 +402,20 @@ class TIFFile(BaseFileWriter):
             self.resolution = (1.0/self.film_settings.getPixelSize(), 1.0/self.film_settings.getPixelSize())
             self.tif = tifffile.TiffWriter(self.filename,
                                            imagej = True)
+        self.startBackgroundWriter()
 
     def closeWriter(self):
-        super().closeWriter()
-        self.tif.close()
-        
-    def saveFrame(self, frame):
-        super().saveFrame()
-        image = frame.getData()
-        self.tif.save(image.reshape((frame.image_y, frame.image_x)),
-                      metadata = self.metadata,
-                      resolution = self.resolution)
+        try:
+            super().closeWriter()
+        finally:
+            self.tif.close()
+
+    def writeFrames(self, frames):
+        for frame in frames:
+            image = frame.getData()
+            self.tif.save(image.reshape((frame.image_y, frame.image_x)),
+                          metadata = self.metadata,
+                          resolution = self.resolution)
 
 
 #
@@ -306,6 +306,18 @@ class Illumination(halModule.HalModule):
     def __init__(self, module_params = None, qt_settings = None, **kwds):
         super().__init__(**kwds)
 
+        # The messages that this module handles.
+        self.addHandledMessages(["configuration",
+                                 "configure1",
+                                 "current parameters",
+                                 "get functionality",
+                                 "new parameters",
+                                 "new shutters file",
+                                 "show",
+                                 "start",
+                                 "start film",
+                                 "stop film"])
+
         configuration = module_params.get("configuration")
 
         self.view = IlluminationView(module_name = self.module_name,
@@ -89,6 +89,13 @@ class FilterWheel(halModule.HalModule):
 
     def __init__(self, module_params = None, qt_settings = None, **kwds):
         super().__init__(**kwds)
+
+        # The messages that this module handles.
+        self.addHandledMessages(["configure1",
+                                 "new parameters",
+                                 "show",
+                                 "start"])
+
         self.configuration = module_params.get("configuration")
 
         self.view = FilterWheelView(module_name = self.module_name,
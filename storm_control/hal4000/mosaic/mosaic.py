@@ -49,6 +49,12 @@ class Mosaic(halModule.HalModule):
     def __init__(self, module_params = None, qt_settings = None, **kwds):
         super().__init__(**kwds)
 
+        # The messages that this module handles.
+        self.addHandledMessages(["configure1",
+                                 "new parameters",
+                                 "stop film",
+                                 "tcp message"])
+
         self.parameters = module_params.get("parameters")
         for param in self.parameters.getAttrs():
             if (param != "objective"):
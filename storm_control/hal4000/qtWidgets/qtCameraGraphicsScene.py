@@ -6,13 +6,116 @@ data from a camera.
 Hazen 3/17.
 """
 
-from PyQt5 import QtCore, QtGui, QtWidgets
+from PyQt5 import QtCore, QtGui, QtWidgets, sip
 
 import numpy
 
 import storm_control.hal4000.halLib.c_image_manipulation_c as c_image
 
 
+class ImageBuffer(object):
+    """
+    A uint8 buffer and the (Indexed8) QImage that wraps it. The buffer
+    and the QImage are re-used from frame to frame, they are only
+    re-created when the frame size changes.
+
+    This does not use any QWidgets so render() can be called from a
+    worker thread, but only one thread should use a buffer at a time.
+    Each buffer has its own NumpyRescaler as these are not thread safe.
+    """
+    def __init__(self, **kwds):
+        super().__init__(**kwds)
+        self.q_colortable = None
+        self.q_image = None
+        self.rescaled = None
+        self.rescaler = c_image.NumpyRescaler()
+
+    def render(self, frame, settings):
+        """
+        Convert the frame to a QImage using settings, which is the
+        dictionary from QtCameraGraphicsItem.startRender().
+
+        Returns a RenderedImage, or None if the frame could not be
+        rendered.
+        """
+        #
+        # For reasons lost in the mists of time 'frame' is a 1D numpy array
+        # and needs to be reshaped before rescaling and converting to a QImage.
+        #
+        w = frame.image_x
+        h = frame.image_y
+        image_data = frame.getData()
+        try:
+            image_data = image_data.reshape((h,w))
+        except ValueError as e:
+            print("Got an image with an unexpected size, ", image_data.shape, "expected [", w, ",", h, "]")
+            return None
+
+        # Rescale the image & record it's minimum and maximum. This is
+        # done in place in the array from the previous frame (if it is
+        # the right size), which is also the buffer of our QImage.
+        [temp, image_min, image_max] = c_image.rescaleImage(image_data,
+                                                            False,
+                                                            False,
+                                                            False,
+                                                            settings["display_range"],
+                                                            settings["max_intensity"],
+                                                            out = self.rescaled,
+                                                            rescaler = self.rescaler)
+
+        # Create a new QImage only if we had to allocate a new buffer.
+        #
+        # Note that the QImage is created with a (non-const) pointer to
+        # the buffer. Otherwise the QImage thinks the buffer is read-only
+        # and copies it when we change the color table.
+        #
+        if (temp is not self.rescaled) or (self.q_image is None):
+            self.rescaled = temp
+            self.q_image = QtGui.QImage(sip.voidptr(temp.ctypes.data), w, h, w, QtGui.QImage.Format_Indexed8)
+            self.q_image.ndarray = temp
+            self.q_colortable = None
+
+        # Set the images color table. If you don't do this Qt will segfault
+        # without giving you a traceback or any kind of warning message..
+        if self.q_colortable is not settings["q_colortable"]:
+            self.q_colortable = settings["q_colortable"]
+            self.q_image.setColorTable(self.q_colortable)
+
+        # Re-scale to compensate for binning, if any.
+        [scale_x, scale_y] = settings["scale"]
+        if (scale_x != 1) or (scale_y != 1):
+            q_image = self.q_image.scaled(w * scale_x, h * scale_y)
+        else:
+            q_image = self.q_image
+
+        # Record the intensity where the user last clicked on the image.
+        # The click position is in frame coordinates.
+        [xl, yl] = settings["click"]
+        if ((xl >= 0) and (xl < w) and (yl >= 0) and (yl < h)):
+            intensity_info = image_data[yl, xl]
+        else:
+            intensity_info = 0
+
+        return RenderedImage(frame = frame,
+                             image_max = image_max,
+                             image_min = image_min,
+                             intensity_info = intensity_info,
+                             q_image = q_image)
+
+
+class RenderedImage(object):
+    """
+    The result of ImageBuffer.render().
+    """
+    def __init__(self, frame = None, image_max = 0, image_min = 0, intensity_info = 0, q_image = None, **kwds):
+        super().__init__(**kwds)
+        self.frame = frame
+        self.image_max = image_max
+        self.image_min = image_min
+        self.intensity_info = intensity_info
+        self.q_image = q_image
+
+
 class QtCameraGraphicsItem(QtWidgets.QGraphicsItem):
     """
     The idea is to display the image as it would appear on the 
@@ -23,6 +126,12 @@ class QtCameraGraphicsItem(QtWidgets.QGraphicsItem):
 
     If the image is binned then the rendered image needs to be
     up-sampled appropriately to compensate for the binning.
+
+    Updates are skipped if neither the frame nor any of the display
+    settings have changed since the last update. Frames are either
+    rendered here with updateImageWithFrame(), or elsewhere (i.e. in a
+    worker thread) using the settings from startRender(), in which
+    case the result is displayed with setRenderedImage().
     """
     def __init__(self, **kwds):
         super().__init__(**kwds)
@@ -40,9 +149,13 @@ class QtCameraGraphicsItem(QtWidgets.QGraphicsItem):
         self.frame_x_offset = 0
         self.frame_y_offset = 0
         self.image_max = 0
+        self.image_buffer = ImageBuffer()
         self.image_min = 0
+        self.image_stale = True
         self.intensity_info = 0
+        self.last_frame = None
         self.max_intensity = None
+        self.q_colortable = self.makeQColorTable(None)
         self.q_image = None
         self.scale_x = 1
         self.scale_y = 1
@@ -65,8 +178,26 @@ class QtCameraGraphicsItem(QtWidgets.QGraphicsItem):
     def getIntensityInfo(self):
         return [self.click_x, self.click_y, self.intensity_info]
         
+    def makeQColorTable(self, colortable):
+        """
+        Returns the color table as a list of QRgb values.
+        """
+        if colortable:
+            return [QtGui.qRgb(colortable[i][0], colortable[i][1], colortable[i][2]) for i in range(256)]
+        else:
+            return [QtGui.qRgb(i, i, i) for i in range(256)]
+
+    def needsUpdate(self, frame):
+        """
+        Returns True if frame is not the frame that we last displayed, or
+        if something that affects how it is displayed has changed.
+        """
+        return self.image_stale or (frame is not self.last_frame)
+
     def newColorTable(self, colortable):
         self.colortable = colortable
+        self.image_stale = True
+        self.q_colortable = self.makeQColorTable(colortable)
         if "_sat.ctbl" in colortable:
             self.display_saturated_pixels = True
         else:
@@ -84,9 +215,11 @@ class QtCameraGraphicsItem(QtWidgets.QGraphicsItem):
             self.chip_y = chip_y
             self.chip_size_changed = True
             self.prepareGeometryChange()
+        self.image_stale = True
 
     def newRange(self, d_min, d_max):
         self.display_range = [d_min, d_max]
+        self.image_stale = True
 
     def paint(self, painter, option, widget):
         if self.q_image is not None:
@@ -115,79 +248,62 @@ class QtCameraGraphicsItem(QtWidgets.QGraphicsItem):
     def setClickPos(self, cx, cy):
         self.click_x = cx
         self.click_y = cy
+        self.image_stale = True
 
-    def setColorTable(self):
+    def setRenderedImage(self, rendered):
         """
-        Sets the color table of the new image. If you don't do this Qt
-        will segfault without giving you a traceback or any kind of
-        warning message..
+        Display a RenderedImage.
         """
-        if self.colortable:
-            for i in range(256):
-                self.q_image.setColor(i, QtGui.qRgb(self.colortable[i][0], 
-                                                    self.colortable[i][1], 
-                                                    self.colortable[i][2]))
-        else:
-            for i in range(256):
-                self.q_image.setColor(i,QtGui.qRgb(i,i,i))        
+        self.image_max = rendered.image_max
+        self.image_min = rendered.image_min
+        self.intensity_info = rendered.intensity_info
+        self.q_image = rendered.q_image
+
+        # Force re-paint.
+        self.update()
 
     def setShowGrid(self, show):
         self.draw_grid = show
+        self.update()
         
     def setShowTarget(self, show):
         self.draw_target = show
+        self.update()
         
-    def updateImageWithFrame(self, frame):
+    def startRender(self, frame):
         """
-        Convert the frame to a QImage, then call update() to display it.
+        Returns the settings that ImageBuffer.render() needs to render
+        frame. After this needsUpdate() will return False until either
+        the frame or the settings change.
         """
-        #
-        # For reasons lost in the mists of time 'frame' is a 1D numpy array
-        # and needs to be reshaped before rescaling and converting to a QImage.
-        #
-        w = frame.image_x
-        h = frame.image_y
-        image_data = frame.getData()
-        try:
-            image_data = image_data.reshape((h,w))
-        except ValueError as e:
-            print("Got an image with an unexpected size, ", image_data.shape, "expected [", w, ",", h, "]")
-            return
-
         max_intensity = self.max_intensity
         if not self.display_saturated_pixels:
             max_intensity = None
 
-        # Rescale the image & record it's minimum and maximum.
-        [temp, self.image_min, self.image_max] = c_image.rescaleImage(image_data,
-                                                                      False,
-                                                                      False,
-                                                                      False,
-                                                                      self.display_range,
-                                                                      max_intensity)
-        
-        # Create QImage & re-scale to compensate for binning, if any.
-        temp_image = QtGui.QImage(temp.data, w, h, QtGui.QImage.Format_Indexed8)
-        if (self.scale_x != 1) or (self.scale_y != 1):
-            self.q_image = temp_image.scaled(w * self.scale_x, h * self.scale_y)
-        else:
-            self.q_image = temp_image
-        self.q_image.ndarray = temp
+        self.image_stale = False
+        self.last_frame = frame
+        return {"click" : [self.click_x, self.click_y],
+                "display_range" : self.display_range,
+                "max_intensity" : max_intensity,
+                "q_colortable" : self.q_colortable,
+                "scale" : [self.scale_x, self.scale_y]}
 
-        # Set the images color table.
-        self.setColorTable()
+    def updateImageWithFrame(self, frame):
+        """
+        Convert the frame to a QImage, then call update() to display it.
 
-        # Record the intensity where the user last clicked on the image.
-        # self.click_x and self.click_y are in frame coordinates.
-        xl = self.click_x
-        yl = self.click_y
-        if ((xl >= 0) and (xl < w) and (yl >= 0) and (yl < h)):
-            self.intensity_info = image_data[yl, xl]
-        else:
-            self.intensity_info = 0
+        Returns False if there was nothing to do because this frame is
+        already being displayed with the current settings.
+        """
+        if not self.needsUpdate(frame):
+            return False
 
-        # Force re-paint.
-        self.update()
+        rendered = self.image_buffer.render(frame, self.startRender(frame))
+        if rendered is None:
+            return False
+
+        self.setRenderedImage(rendered)
+        return True
 
 
 class QtCameraGraphicsScene(QtWidgets.QGraphicsScene):
@@ -2,13 +2,42 @@
 """
 Analyze frames using QRunnables and QThreadPool.
 
+Large frames can be split into tiles (bands of rows), in which case
+each tile is analyzed by a different worker and the results are
+combined once all the tiles are done.
+
+New frames are put in a (bounded) queue for each camera and analyzed
+when a worker is available. What happens when the frames arrive faster
+than they can be analyzed depends on the scheduling policy:
+
+  "drop" - Frames that can't be analyzed immediately are dropped. This
+           is the original behavior.
+
+  "drop_oldest" - Frames are queued, if the queue is full the oldest
+                  frame is dropped.
+
+  "every_nth" - Only analyze every Nth frame (by frame number), these
+                are queued as with "drop_oldest". This is deterministic
+                as long as N is large enough that the queue does not
+                overflow.
+
+  "latest" - Only the most recent frame is kept.
+
+Dropped frames are counted, as are frames that are skipped by design
+in the "every_nth" policy, so the analyzed fraction is always known.
+
 Hazen 05/17
 """
+import math
+import numpy
 import time
 
+from collections import deque
+
 from PyQt5 import QtCore
 
-import storm_control.hal4000.halLib.halModule as halModule
+import storm_control.sc_library.halExceptions as halExceptions
+
 import storm_control.hal4000.spotCounter.lmmObjectFinder as lmmObjectFinder
 
 
@@ -16,31 +45,121 @@ class AnalysisWorker(QtCore.QRunnable):
     """
     Runnable for performing image analysis.
     """
-    def __init__(self, **kwds):
+    def __init__(self, max_locs = None, **kwds):
         super().__init__(**kwds)
         self.aw_signaler = AnalysisWorkerSignaler()
         self.frame_analysis = None
         self.busy = False
+        self.tile = 0
+
+        # Each worker has its own object finder (and scratch buffers).
+        self.finder = lmmObjectFinder.LMMomentFinder(max_locs = max_locs)
 
     def isBusy(self):
         return self.busy
         
     def run(self):
-        self.frame_analysis.analyzeImage()
-        self.aw_signaler.analysisDone.emit(self.frame_analysis)
+        self.frame_analysis.analyzeTile(self.finder, self.tile)
+        self.aw_signaler.analysisDone.emit(self.frame_analysis, self)
+
+    def setDone(self):
+        """
+        This is called (in the main thread) when the spot counter handles
+        the analysisDone signal, we're not busy until then so that we won't
+        be given a new frame while run() is still running.
+        """
         self.busy = False
         
-    def setFrameAnalysis(self, frame_analysis):
+    def setFrameAnalysis(self, frame_analysis, tile = 0):
         self.frame_analysis = frame_analysis
+        self.tile = tile
         self.busy = True
 
 
 class AnalysisWorkerSignaler(QtCore.QObject):
     """
     Signal class used by the AnalysisWorker to indicate that
-    the analysis of a frame is complete.
+    the analysis of a frame (or tile) is complete.
     """
-    analysisDone = QtCore.pyqtSignal(object)
+    analysisDone = QtCore.pyqtSignal(object, object)
+
+    
+class CameraQueue(object):
+    """
+    The frames from a single camera that are waiting to be analyzed.
+    """
+    def __init__(self, decimation = 1, policy = "drop", queue_size = 1, **kwds):
+        super().__init__(**kwds)
+        self.decimation = decimation
+        self.frame_interval = None
+        self.frames = deque()
+        self.last_time = None
+        self.policy = policy
+
+        self.max_len = queue_size
+        if (policy == "latest"):
+            self.max_len = 1
+
+        self.n_analyzed = 0
+        self.n_dropped = 0
+        self.n_received = 0
+        self.n_skipped = 0
+
+    def addFrame(self, frame, threshold):
+        self.n_received += 1
+
+        # Estimate the time between frames.
+        cur_time = time.perf_counter()
+        if self.last_time is not None:
+            interval = cur_time - self.last_time
+            if self.frame_interval is None:
+                self.frame_interval = interval
+            else:
+                self.frame_interval = 0.9 * self.frame_interval + 0.1 * interval
+        self.last_time = cur_time
+
+        if (self.policy == "every_nth") and ((frame.frame_number % self.decimation) != 0):
+            self.n_skipped += 1
+            return
+
+        frame.hold()
+        self.frames.append([frame, threshold])
+        if (len(self.frames) > self.max_len):
+            self.frames.popleft()[0].release()
+            self.n_dropped += 1
+
+    def clear(self):
+        """
+        Drop all the frames that are waiting.
+        """
+        while (len(self.frames) > 0):
+            self.frames.popleft()[0].release()
+            self.n_dropped += 1
+
+    def getAnalysisRate(self):
+        """
+        Returns the expected number of frames per second to analyze.
+        """
+        if (self.frame_interval is None) or (self.frame_interval <= 0.0):
+            return 0.0
+        rate = 1.0/self.frame_interval
+        if (self.policy == "every_nth"):
+            rate = rate/self.decimation
+        return rate
+
+    def getStatistics(self):
+        return {"analyzed" : self.n_analyzed,
+                "dropped" : self.n_dropped,
+                "queued" : len(self.frames),
+                "received" : self.n_received,
+                "skipped" : self.n_skipped}
+
+    def isEmpty(self):
+        return (len(self.frames) == 0)
+
+    def nextFrame(self):
+        self.n_analyzed += 1
+        return self.frames.popleft()
 
     
 class FrameAnalysis(QtCore.QObject):
@@ -53,19 +172,43 @@ class FrameAnalysis(QtCore.QObject):
     def __init__(self,
                  camera_name = None,
                  frame = None,
+                 max_locs = None,
+                 n_tiles = 1,
                  threshold = None,
                  **kwds):
         super().__init__(**kwds)
         self.camera_name = camera_name
         self.frame = frame
         self.locs_count = 0
+        self.max_locs = max_locs
+        self.overflow = False
         self.threshold = threshold
+        self.analysis_time = 0.0
+        self.tile_results = [None] * n_tiles
+        self.tile_rows = lmmObjectFinder.tileRows(frame.image_y, n_tiles)
+        self.tiles_remaining = n_tiles
         self.x_locs = None
         self.y_locs = None
         
-    def analyzeImage(self):
-        [self.x_locs, self.y_locs, self.locs_count] = lmmObjectFinder.findObjects(self.frame,
-                                                                                  self.threshold)
+    def analyzeTile(self, finder, tile):
+        """
+        This is called by an AnalysisWorker (in a different thread).
+        """
+        start_time = time.perf_counter()
+        n_overflow = finder.getOverflowCount()
+        [start, stop] = self.tile_rows[tile]
+        [x, y, n] = finder.findObjects(self.frame,
+                                       self.threshold,
+                                       start = start,
+                                       stop = stop)
+        self.tile_results[tile] = [x, y, (finder.getOverflowCount() != n_overflow), time.perf_counter() - start_time]
+
+    def getAnalysisTime(self):
+        """
+        Returns the total time (in seconds) that it took to analyze all
+        the tiles of the frame.
+        """
+        return self.analysis_time
 
     def getCameraName(self):
         return self.camera_name
@@ -79,33 +222,100 @@ class FrameAnalysis(QtCore.QObject):
     def getLocalizations(self):
         return [self.x_locs[:self.locs_count],
                 self.y_locs[:self.locs_count]]
+
+    def isOverflow(self):
+        """
+        Returns True if there were more than max_locs objects in the frame.
+        """
+        return self.overflow
+
+    def tileDone(self):
+        """
+        This is called (in the main thread) when a tile is done. Once all the
+        tiles are done it combines the results and returns True.
+        """
+        self.tiles_remaining -= 1
+        if (self.tiles_remaining > 0):
+            return False
+
+        self.x_locs = numpy.concatenate([result[0] for result in self.tile_results])
+        self.y_locs = numpy.concatenate([result[1] for result in self.tile_results])
+        self.locs_count = self.x_locs.size
+        self.overflow = any(result[2] for result in self.tile_results)
+        self.analysis_time = sum(result[3] for result in self.tile_results)
+        if (self.locs_count > self.max_locs):
+            self.locs_count = self.max_locs
+            self.overflow = True
+        self.tile_results = None
+        return True
         
 
 class SpotCounter(QtCore.QObject):
     imageProcessed = QtCore.pyqtSignal(object)
 
-    def __init__(self, max_threads = None, max_size = 0, **kwds):
+    def __init__(self,
+                 auto_threads = False,
+                 decimation = 1,
+                 max_locs = lmmObjectFinder.default_max_locs,
+                 max_threads = None,
+                 max_size = 0,
+                 n_tiles = 1,
+                 policy = "drop",
+                 queue_size = 4,
+                 **kwds):
+        """
+        auto_threads - Only use as many workers as we need to keep up, based
+                       on the measured analysis time and frame rate.
+        decimation - Analyze every Nth frame for the "every_nth" policy.
+        max_locs - The maximum number of localizations per frame.
+        max_threads - The number of analysis workers.
+        max_size - The maximum size (in pixels) of the frame (or tile) to analyze.
+        n_tiles - The number of tiles to split each frame into.
+        policy - The scheduling policy, one of "drop", "drop_oldest", "every_nth"
+                 or "latest".
+        queue_size - The maximum number of frames to queue per camera.
+        """
         super().__init__(**kwds)
 
-        self.dropped = 0
+        if not policy in ["drop", "drop_oldest", "every_nth", "latest"]:
+            raise halExceptions.HalException("Unknown spot counter scheduling policy '" + policy + "'")
+
+        self.analysis_time = None
+        self.auto_threads = auto_threads
+        self.decimation = max(1, decimation)
+        self.max_locs = max_locs
         self.max_size = max_size
-        self.threadpool = halModule.threadpool
-        self.total = 0
+        self.n_tiles = max(1, min(n_tiles, max_threads))
+        self.n_workers = max_threads
+        self.next_queue = 0
+        self.overflow = 0
+        self.policy = policy
+        self.queue_size = max(1, queue_size)
+        self.queues = {}
+        # This is the same thread pool as halModule.threadpool, but we get it
+        # here as the module level reference is from when halModule was
+        # imported, and is not valid after the QApplication is deleted.
+        self.threadpool = QtCore.QThreadPool.globalInstance()
         self.workers = []
 
         # Create analysis workers.
         for i in range(max_threads):
-            aw = AnalysisWorker()
+            aw = AnalysisWorker(max_locs = max_locs)
             aw.setAutoDelete(False)
             aw.aw_signaler.analysisDone.connect(self.handleAnalysisDone)
             self.workers.append(aw)
 
-        # Initialize object finder.
-        lmmObjectFinder.initialize()
+        if self.auto_threads:
+            self.n_workers = self.n_tiles
             
     def cleanUp(self):
 
-        # Wait for workers to finish.
+        # Drop frames that are waiting.
+        for queue in self.queues.values():
+            queue.clear()
+
+        # Wait for workers to finish. Workers are busy until we've handled
+        # their analysisDone signal, so we need to process events here.
         still_busy = True
         while still_busy:
             all_busy = False
@@ -114,39 +324,115 @@ class SpotCounter(QtCore.QObject):
                     all_busy = True
                     break
             still_busy = all_busy
-            time.sleep(0.1)
+            if still_busy:
+                QtCore.QCoreApplication.processEvents()
+                time.sleep(0.01)
         
-        # Object finder cleanup.
-        lmmObjectFinder.cleanUp()
-
         # Print statistics.
-        print("> spot counter dropped", self.dropped, "images out of", self.total, "total images")
+        for camera_name in sorted(self.queues):
+            stats = self.queues[camera_name].getStatistics()
+            print("> spot counter", camera_name, "analyzed", stats["analyzed"], "dropped", stats["dropped"],
+                  "skipped", stats["skipped"], "images out of", stats["received"], "total images")
+        print("> spot counter found more than", self.max_locs, "objects in", self.overflow, "images")
 
-    def handleAnalysisDone(self, frame_analysis):
-        self.imageProcessed.emit(frame_analysis)
+    def getFreeWorkers(self):
+        free_workers = []
+        for worker in self.workers[:self.n_workers]:
+            if not worker.isBusy():
+                free_workers.append(worker)
+        return free_workers
+
+    def getNumberWorkers(self):
+        return self.n_workers
+    
+    def getStatistics(self, camera_name):
+        """
+        Returns a dictionary with the number of frames from camera_name
+        that were analyzed, dropped, skipped, etc.
+        """
+        if camera_name in self.queues:
+            return self.queues[camera_name].getStatistics()
+        return CameraQueue().getStatistics()
+
+    def handleAnalysisDone(self, frame_analysis, worker):
+        worker.setDone()
+        if frame_analysis.tileDone():
+            frame_analysis.frame.release()
+            if frame_analysis.isOverflow():
+                self.overflow += 1
+            self.updateAnalysisTime(frame_analysis.getAnalysisTime())
+            self.imageProcessed.emit(frame_analysis)
+        self.startAnalysis()
         
     def newFrameToAnalyze(self, camera_name, frame, threshold):
         
-        # Check if the current camera image is small
+        # Check if the current camera image (or tile) is small
         # enough that we can analyze it.
-        if ((frame.image_x * frame.image_y) > self.max_size):
+        if ((frame.image_x * frame.image_y) > (self.max_size * self.n_tiles)):
             return
-        
-        self.total += 1
 
-        # Check if there is a thread available to analyze the image.
-        was_dropped = True
-        for worker in self.workers:
-            if not worker.isBusy():
-                worker.setFrameAnalysis(FrameAnalysis(camera_name = camera_name,
-                                                      frame = frame,
-                                                      threshold = threshold))
+        if not camera_name in self.queues:
+            self.queues[camera_name] = CameraQueue(decimation = self.decimation,
+                                                   policy = self.policy,
+                                                   queue_size = self.queue_size)
+        queue = self.queues[camera_name]
+        queue.addFrame(frame, threshold)
+        self.startAnalysis()
+
+        # With the "drop" policy we don't keep frames that we can't
+        # start analyzing immediately.
+        if (self.policy == "drop"):
+            queue.clear()
+
+    def startAnalysis(self):
+        """
+        Start analyzing queued frames, if there are enough free workers.
+        The camera queues are serviced in turn.
+        """
+        names = sorted(self.queues)
+        free_workers = self.getFreeWorkers()
+        while (len(free_workers) >= self.n_tiles):
+
+            # Find the next camera with a frame to analyze.
+            queue = None
+            for i in range(len(names)):
+                name = names[(self.next_queue + i) % len(names)]
+                if not self.queues[name].isEmpty():
+                    queue = self.queues[name]
+                    self.next_queue = (self.next_queue + i + 1) % len(names)
+                    break
+            if queue is None:
+                return
+
+            [frame, threshold] = queue.nextFrame()
+            frame_analysis = FrameAnalysis(camera_name = name,
+                                           frame = frame,
+                                           max_locs = self.max_locs,
+                                           n_tiles = self.n_tiles,
+                                           threshold = threshold)
+            for i in range(self.n_tiles):
+                worker = free_workers.pop(0)
+                worker.setFrameAnalysis(frame_analysis, tile = i)
                 self.threadpool.start(worker)
-                was_dropped = False
-                break
 
-        if was_dropped:
-            self.dropped += 1
+    def updateAnalysisTime(self, analysis_time):
+        """
+        Keep track of how long it takes to analyze a frame and (if
+        auto_threads is True) use this to decide how many workers
+        we need to keep up with the cameras.
+        """
+        if self.analysis_time is None:
+            self.analysis_time = analysis_time
+        else:
+            self.analysis_time = 0.9 * self.analysis_time + 0.1 * analysis_time
+
+        if self.auto_threads:
+            frames_per_second = sum(map(lambda q: q.getAnalysisRate(), self.queues.values()))
+
+            # Allow a 25% margin so that we're not always just barely keeping up.
+            n_workers = int(math.ceil(1.25 * frames_per_second * self.analysis_time))
+            n_workers = self.n_tiles * int(math.ceil(n_workers/self.n_tiles))
+            self.n_workers = max(self.n_tiles, min(n_workers, len(self.workers)))
 
 
 #
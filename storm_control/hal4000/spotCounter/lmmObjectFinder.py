@@ -1,68 +1,261 @@
 #!/usr/bin/env python
 """
-Python interface to the LMMoment object finder. This object finder
-works by indentifying local maxima, then computing their first moment.
+The LMMoment object finder. This object finder works by identifying
+local maxima, checking that they have a peak like shape, then
+computing their first moment.
 
-Note that the maximum number of objects found per image is limited to 1000.
+This is a numpy version of LMMoment.c, it finds the same objects
+in the same order. The one difference is that the C version treats
+the image as signed 16 bit integers, so it does not work for pixel
+values above 32767.
+
+The maximum number of objects found per image is limited to max_locs
+(1000 by default). Images with more objects than this are counted as
+overflows.
+
+Each LMMomentFinder has its own scratch buffers, so use a separate
+finder in each thread. The module level findObjects() function does
+this for you.
+
+Large images can be split into tiles (bands of rows) that are analyzed
+separately, possibly in different threads, with tileRows() and the
+start / stop arguments of LMMomentFinder.findObjects().
 
 Hazen 09/13
 """
 
-import ctypes
 import numpy
-from numpy.ctypeslib import ndpointer
-import os
-import sys
+import threading
+import time
+
+
+#
+# Peak definition, see LMMoment.c.
+#
+# 1 in the peak definition means boundary.
+# 2 in the peak definition means center.
+#
+peak = numpy.array([[0, 0, 0, 1, 1, 1, 0, 0, 0],
+                    [0, 0, 1, 2, 2, 2, 1, 0, 0],
+                    [0, 1, 2, 2, 2, 2, 2, 1, 0],
+                    [1, 2, 2, 2, 2, 2, 2, 2, 1],
+                    [1, 2, 2, 2, 2, 2, 2, 2, 1],
+                    [1, 2, 2, 2, 2, 2, 2, 2, 1],
+                    [0, 1, 2, 2, 2, 2, 2, 1, 0],
+                    [0, 0, 1, 2, 2, 2, 1, 0, 0],
+                    [0, 0, 0, 1, 1, 1, 0, 0, 0]])
+
+# Objects closer than this to the edge of the image are ignored.
+bsize = 5
+
+[bdy_dy, bdy_dx] = numpy.nonzero(peak == 1)
+bdy_dx -= bsize - 1
+bdy_dy -= bsize - 1
+
+[cnt_dy, cnt_dx] = numpy.nonzero(peak == 2)
+cnt_dx -= bsize - 1
+cnt_dy -= bsize - 1
+
+#
+# A local maxima has to be greater than the neighbors that come before
+# it (in raster order) and greater than or equal to the neighbors that
+# come after it, so that we only find one maxima in a flat topped peak.
+#
+greater_than = [[-1, -1], [-1, 0], [-1, 1], [0, -1], [1, -1]]
+greater_equal = [[0, 1], [1, 0], [1, 1]]
+
+default_max_locs = 1000
+
+finders = threading.local()
+
+
+class LMMomentFinder(object):
+    """
+    Finds objects in images.
+    """
+    def __init__(self, max_locs = default_max_locs, **kwds):
+        """
+        max_locs - The maximum number of objects to return per image.
+        """
+        super().__init__(**kwds)
+        self.is_max = None
+        self.max_locs = max_locs
+        self.n_overflow = 0
+        self.temp = None
+
+    def findObjects(self, frame, threshold, start = None, stop = None):
+        """
+        Find the objects in the image.
+
+        frame - A camera frame.
+        threshold - Peak height above the background ring to be considered a peak.
+        start - Only look for objects that are in this row or later.
+        stop - Only look for objects that are before this row.
+
+        Returns [x, y, n], x and y are float32 numpy arrays of length n.
+        """
+        image = frame.getData().reshape((frame.image_y, frame.image_x))
+        [rows, cols] = self.localMaxima(image, threshold, start, stop)
+
+        # Check that the local maxima are a peak, i.e. they are above
+        # threshold relative to all the pixels on the boundary.
+        bdy = image[rows[:,None] + bdy_dy, cols[:,None] + bdy_dx]
+        center = image[rows, cols].astype(numpy.int64)
+        mask = (center >= (bdy.max(axis = 1).astype(numpy.int64) + threshold))
+
+        # Peaks with a background of zero are also ignored.
+        mean = bdy.sum(axis = 1, dtype = numpy.int64)//bdy_dx.size
+        mask &= (mean > 0)
 
-import storm_control.c_libraries.loadclib as loadclib
+        rows = rows[mask]
+        cols = cols[mask]
+        mean = mean[mask]
+        if (rows.size > self.max_locs):
+            self.n_overflow += 1
+            rows = rows[:self.max_locs]
+            cols = cols[:self.max_locs]
+            mean = mean[:self.max_locs]
 
-lmmoment = False
-max_locs = 1000
+        # First moment of the peak, relative to the mean of the boundary.
+        cnt = image[rows[:,None] + cnt_dy, cols[:,None] + cnt_dx].astype(numpy.int64) - mean[:,None]
+        total = cnt.sum(axis = 1)
+        good = (total > 0)
+        total[~good] = 1
+        x = numpy.where(good, cols + numpy.dot(cnt, cnt_dx)/total, -1.0).astype(numpy.float32)
+        y = numpy.where(good, rows + numpy.dot(cnt, cnt_dy)/total, -1.0).astype(numpy.float32)
+
+        return [x, y, x.size]
+
+    def getOverflowCount(self):
+        """
+        Returns the number of images that had more than max_locs objects.
+        """
+        return self.n_overflow
+
+    def localMaxima(self, image, threshold, start, stop):
+        """
+        Returns the rows and columns of the local maxima that are
+        above threshold, in raster order.
+        """
+        [size_y, size_x] = image.shape
+        if start is None:
+            start = 0
+        if stop is None:
+            stop = size_y
+        start = max(start, bsize)
+        stop = min(stop, size_y - bsize)
+        if (stop <= start):
+            return [numpy.zeros(0, dtype = numpy.intp), numpy.zeros(0, dtype = numpy.intp)]
+
+        n_rows = stop - start
+        n_cols = size_x - 2*bsize
+
+        # (Re)allocate scratch buffers if necessary.
+        if (self.is_max is None) or (self.is_max.shape[0] < n_rows) or (self.is_max.shape[1] != n_cols):
+            self.is_max = numpy.empty((n_rows, n_cols), dtype = numpy.bool_)
+            self.temp = numpy.empty((n_rows, n_cols), dtype = numpy.bool_)
+        is_max = self.is_max[:n_rows]
+        temp = self.temp[:n_rows]
+
+        def neighbor(dy, dx):
+            return image[start+dy:stop+dy, bsize+dx:size_x-bsize+dx]
+
+        # A peak has to be at least threshold above the boundary, so we can
+        # start by discarding everything that is below threshold.
+        cur = neighbor(0, 0)
+        numpy.greater_equal(cur, threshold, out = is_max)
+        for [dy, dx] in greater_than:
+            numpy.greater(cur, neighbor(dy, dx), out = temp)
+            numpy.logical_and(is_max, temp, out = is_max)
+        for [dy, dx] in greater_equal:
+            numpy.greater_equal(cur, neighbor(dy, dx), out = temp)
+            numpy.logical_and(is_max, temp, out = is_max)
+
+        [rows, cols] = numpy.nonzero(is_max)
+        return [rows + start, cols + bsize]
+
+    def setMaxLocs(self, max_locs):
+        self.max_locs = max_locs
 
 
 def cleanUp():
     """
-    Called at program shutdown to free arrays allocated in C.
+    Free the scratch buffers of this threads finder.
     """
-    lmmoment.cleanup()
+    finders.__dict__.pop("finder", None)
 
+def findObjects(frame, threshold):
+    """
+    Find the objects in the image using this threads finder.
+    """
+    return getFinder().findObjects(frame, threshold)
 
-def initialize():
+def getFinder():
     """
-    Called at program start up to allocate array and perform other
-    initialization in C.
+    Returns the LMMomentFinder for the current thread.
     """
-    
-    global lmmoment
-    lmmoment = loadclib.loadCLibrary("LMMoment")
-
-    lmmoment.initialize.argtypes = []
-    lmmoment.cleanup.argtypes = []
-    lmmoment.numberAndLocObjects.argtypes = [ndpointer(dtype=numpy.uint16),
-                                             ctypes.c_int,
-                                             ctypes.c_int,
-                                             ctypes.c_int,
-                                             ndpointer(dtype=numpy.float32),
-                                             ndpointer(dtype=numpy.float32),
-                                             ctypes.c_void_p]
-    lmmoment.initialize()
+    if not hasattr(finders, "finder"):
+        finders.finder = LMMomentFinder()
+    return finders.finder
 
+def initialize():
+    """
+    Called at program start up, this no longer needs to do anything as the
+    finders allocate their buffers as needed.
+    """
+    pass
 
-def findObjects(frame, threshold):
+def tileRows(image_y, n_tiles):
     """
-    Find the objects in the image.
+    Returns a list of [start, stop] row ranges that divide an image
+    with image_y rows into n_tiles (roughly) equal tiles.
     """
-    x = numpy.zeros((max_locs), dtype = numpy.float32)
-    y = numpy.zeros((max_locs), dtype = numpy.float32)
-    n = ctypes.c_int(max_locs)
-    lmmoment.numberAndLocObjects(numpy.ascontiguousarray(frame.getData(), dtype = numpy.uint16),
-                                 frame.image_y,
-                                 frame.image_x,
-                                 threshold,
-                                 x,
-                                 y,
-                                 ctypes.byref(n))
-    return [x, y, n.value]
+    edges = numpy.linspace(0, image_y, n_tiles + 1).astype(numpy.int64)
+    return [[int(edges[i]), int(edges[i+1])] for i in range(n_tiles)]
+
+
+#
+# Testing / benchmarking with synthetic STORM images.
+#
+if (__name__ == "__main__"):
+    import concurrent.futures
+
+    import storm_control.hal4000.camera.frame as frame
+
+    def syntheticFrame(size, n_objects, background = 100, height = 1000, sigma = 1.3):
+        x = numpy.random.uniform(10, size - 10, n_objects)
+        y = numpy.random.uniform(10, size - 10, n_objects)
+        image = numpy.zeros((size, size))
+        [yy, xx] = numpy.mgrid[-5:6, -5:6]
+        for i in range(n_objects):
+            ix = int(round(x[i]))
+            iy = int(round(y[i]))
+            image[iy-5:iy+6, ix-5:ix+6] += height * numpy.exp(-((xx + ix - x[i])**2 + (yy + iy - y[i])**2)/(2.0*sigma*sigma))
+        image = numpy.random.poisson(image + background).astype(numpy.uint16)
+        return frame.Frame(image.flatten(), 0, size, size, "camera1")
+
+    for [size, n_objects] in [[256, 100], [512, 400], [2048, 4000]]:
+        a_frame = syntheticFrame(size, n_objects)
+        finder = LMMomentFinder(max_locs = 10 * n_objects)
+        n_reps = 20
+        start_time = time.perf_counter()
+        for i in range(n_reps):
+            [x, y, n] = finder.findObjects(a_frame, 250)
+        elapsed = (time.perf_counter() - start_time)/n_reps
+        print("{0:d}x{0:d}, {1:d} objects, found {2:d} in {3:.2f}ms".format(size, n_objects, n, 1000.0 * elapsed))
+
+        # Tiled, one finder per thread.
+        for n_tiles in [2, 4]:
+            tiles = tileRows(size, n_tiles)
+            finders_list = [LMMomentFinder(max_locs = 10 * n_objects) for tile in tiles]
+            with concurrent.futures.ThreadPoolExecutor(max_workers = n_tiles) as executor:
+                start_time = time.perf_counter()
+                for i in range(n_reps):
+                    results = list(executor.map(lambda j: finders_list[j].findObjects(a_frame, 250, tiles[j][0], tiles[j][1]),
+                                                range(n_tiles)))
+                elapsed = (time.perf_counter() - start_time)/n_reps
+            n_tiled = sum(map(lambda r: r[2], results))
+            print("  {0:d} tiles, found {1:d} in {2:.2f}ms".format(n_tiles, n_tiled, 1000.0 * elapsed))
 
 
 #
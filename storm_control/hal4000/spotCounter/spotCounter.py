@@ -72,6 +72,9 @@ class Analyzer(QtCore.QObject):
 
     def getSpotPicture(self):
         return self.spot_picture
+
+    def getStatistics(self):
+        return self.spot_counter.getStatistics(self.camera_fn.getCameraName())
     
     def handleNewFrame(self, frame):
         self.spot_counter.newFrameToAnalyze(self.camera_fn.getCameraName(),
@@ -125,7 +128,10 @@ class SpotCounterView(halDialog.HalDialog):
         super().__init__(**kwds)
         self.analyzers = []
         self.cur_analyzer = None
+        self.last_stats = None
+        self.last_time = None
         self.parameters = None
+        self.rates_timer = QtCore.QTimer(self)
 
         # UI setup.
         self.ui = spotcounterUi.Ui_Dialog()
@@ -133,6 +139,12 @@ class SpotCounterView(halDialog.HalDialog):
 
         self.ui.countsLabel1.setText("0")
         self.ui.countsLabel2.setText("0")
+
+        # Live analysis rates.
+        self.ui.ratesLabel = QtWidgets.QLabel(self.ui.countsTab)
+        self.ui.ratesLabel.setAlignment(QtCore.Qt.AlignRight|QtCore.Qt.AlignTrailing|QtCore.Qt.AlignVCenter)
+        self.ui.ratesLabel.setToolTip("Frames per second analyzed / dropped (skipped)")
+        self.ui.horizontalLayout_3.addWidget(self.ui.ratesLabel)
         
         self.ui.analyzerComboBox.currentIndexChanged.connect(self.handleAnalyzerChange)
         self.ui.maxSpinBox.valueChanged.connect(self.handleMaxSpinBox)
@@ -142,6 +154,10 @@ class SpotCounterView(halDialog.HalDialog):
         
         self.setEnabled(False)
 
+        self.rates_timer.setInterval(1000)
+        self.rates_timer.timeout.connect(self.handleRatesTimer)
+        self.rates_timer.start()
+
     def handleAnalyzerChange(self, index):
 
         # Disconnect old analyzer.
@@ -158,6 +174,7 @@ class SpotCounterView(halDialog.HalDialog):
 
         # Connect new analyzer.
         self.cur_analyzer.totalCount.connect(self.handleTotalCount)
+        self.last_stats = None
 
         # Save current analyzer in the parameters.
         self.parameters.setv("which_camera", self.cur_analyzer.getCameraName())
@@ -167,6 +184,26 @@ class SpotCounterView(halDialog.HalDialog):
             analyzer.setMaxSpots(new_max)
         self.parameters.setv("max_spots", new_max)
 
+    def handleRatesTimer(self):
+        """
+        Update the analyzed / dropped frame rates for the current analyzer.
+        """
+        if self.cur_analyzer is None:
+            return
+
+        cur_stats = self.cur_analyzer.getStatistics()
+        cur_time = time.time()
+        if self.last_stats is not None:
+            elapsed = cur_time - self.last_time
+            rates = {}
+            for name in ["analyzed", "dropped", "skipped"]:
+                rates[name] = (cur_stats[name] - self.last_stats[name])/elapsed
+            self.ui.ratesLabel.setText("{0:.1f} / {1:.1f} ({2:.1f}) fps".format(rates["analyzed"],
+                                                                               rates["dropped"],
+                                                                               rates["skipped"]))
+        self.last_stats = cur_stats
+        self.last_time = cur_time
+
     def handleTotalCount(self, total_count):
         self.ui.countsLabel1.setText(str(total_count))
         self.ui.countsLabel2.setText(str(total_count))
@@ -208,6 +245,17 @@ class SpotCounter(halModule.HalModule):
 
     def __init__(self, module_params = None, qt_settings = None, **kwds):
         super().__init__(**kwds)
+
+        # The messages that this module handles.
+        self.addHandledMessages(["changing parameters",
+                                 "configuration",
+                                 "configure1",
+                                 "new parameters",
+                                 "show",
+                                 "start",
+                                 "start film",
+                                 "stop film"])
+
         self.analyzers = []
         self.basename = None
         self.feed_names = []
@@ -217,8 +265,14 @@ class SpotCounter(halModule.HalModule):
 
         configuration = module_params.get("configuration")
 
-        self.spot_counter = findSpots.SpotCounter(max_threads = configuration.get("max_threads"),
-                                                  max_size = configuration.get("max_size"))
+        self.spot_counter = findSpots.SpotCounter(auto_threads = configuration.get("auto_threads", False),
+                                                  decimation = configuration.get("decimation", 1),
+                                                  max_locs = configuration.get("max_locs", 1000),
+                                                  max_threads = configuration.get("max_threads"),
+                                                  max_size = configuration.get("max_size"),
+                                                  n_tiles = configuration.get("tiles", 1),
+                                                  policy = configuration.get("policy", "drop"),
+                                                  queue_size = configuration.get("queue_size", 4))
 
         self.view = SpotCounterView(module_name = self.module_name,
                                     configuration = configuration)
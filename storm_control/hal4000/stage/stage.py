@@ -235,6 +235,14 @@ class Stage(halModule.HalModule):
     def __init__(self, module_params = None, qt_settings = None, **kwds):
         super().__init__(**kwds)
 
+        # The messages that this module handles.
+        self.addHandledMessages(["change directory",
+                                 "configure1",
+                                 "new parameters",
+                                 "show",
+                                 "start",
+                                 "stop film"])
+
         self.stage_fn_name = module_params.get("configuration.stage_functionality")
         
         self.view = StageView(module_name = self.module_name)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+"""
+Measures the throughput (imaging cycles per minute) of the TCP control
+protocol over loopback, with the client waiting for each response
+(sequential) or sending an entire cycle at once (pipelined).
+
+HAL is simulated, each step takes a fixed amount of time. In parallel
+mode the stage moves while the other steps are handled, and the
+'Check Focus Lock' sync waits for the stage to finish moving.
+"""
+
+import time
+
+from PyQt5 import QtCore, QtWidgets
+
+import storm_control.sc_library.tcpClient as tcpClient
+import storm_control.sc_library.tcpMessage as tcpMessage
+import storm_control.sc_library.tcpServer as tcpServer
+
+import storm_control.hal4000.halLib.halMessage as halMessage
+import storm_control.hal4000.tcpControl.tcpControl as tcpControl
+
+
+# How long each step takes in HAL in milliseconds.
+default_timing = {"Check Focus Lock" : 20,
+                  "Move Stage" : 40,
+                  "Set Parameters" : 30,
+                  "Take Movie" : 100}
+
+
+class SimulatedHal(QtCore.QObject):
+    """
+    Handles the actions and messages from a tcpControl.Controller.
+    """
+    def __init__(self, controller = None, timing = None, **kwds):
+        super().__init__(**kwds)
+        self.controller = controller
+        self.stage_done = 0.0
+        self.sync_done = 0.0
+        self.timing = timing
+
+        self.controller.controlAction.connect(self.handleControlAction)
+        self.controller.controlMessage.connect(self.handleControlMessage)
+
+    def finishAction(self, action):
+        action.was_handled = True
+        self.controller.actionDone(action)
+
+    def handleControlAction(self, action):
+        now = time.perf_counter()
+        m_type = action.tcp_message.getType()
+
+        # Actions can't start until the sync (if any) is done.
+        start = max(now, self.sync_done)
+        done = start + 0.001 * self.timing.get(m_type, 0)
+        if (m_type == "Move Stage"):
+            self.stage_done = done
+        QtCore.QTimer.singleShot(int(round(1000.0 * (done - now))), lambda : self.finishAction(action))
+
+    def handleControlMessage(self, message):
+        now = time.perf_counter()
+        if message.isType("sync"):
+            self.sync_done = max(now, self.stage_done)
+
+        # In parallel mode HAL responds immediately to 'Move Stage', the stage
+        # then moves while the next messages are handled.
+        elif message.isType("tcp message"):
+            tcp_message = message.getData()["tcp message"]
+            if tcp_message.isType("Move Stage"):
+                self.stage_done = max(now, self.stage_done) + 0.001 * self.timing["Move Stage"]
+
+
+class BenchmarkClient(QtCore.QObject):
+    """
+    Runs imaging cycles, either one message at a time or one cycle at a time.
+    """
+    done = QtCore.pyqtSignal()
+
+    def __init__(self, client = None, n_cycles = 20, pipelined = False, **kwds):
+        super().__init__(**kwds)
+        self.client = client
+        self.cycle = 0
+        self.errors = 0
+        self.messages = []
+        self.n_cycles = n_cycles
+        self.pipelined = pipelined
+        self.start_time = None
+
+        self.client.messageReceived.connect(self.handleMessageReceived)
+        self.client.allReceived.connect(self.handleAllReceived)
+
+    def cycleMessages(self):
+        move = tcpMessage.TCPMessage(message_type = "Move Stage",
+                                     message_data = {"stage_x" : self.cycle, "stage_y" : 0.0})
+        params = tcpMessage.TCPMessage(message_type = "Set Parameters",
+                                       message_data = {"parameters" : "default"})
+        focus = tcpMessage.TCPMessage(message_type = "Check Focus Lock",
+                                      message_data = {"focus_scan" : False, "num_focus_checks" : 1})
+        focus.setSync(True)
+        movie = tcpMessage.TCPMessage(message_type = "Take Movie",
+                                      message_data = {"length" : 1, "name" : "movie_" + str(self.cycle), "overwrite" : True})
+        movie.addDependency(focus)
+        return [move, params, focus, movie]
+
+    def getCyclesPerMinute(self):
+        return 60.0 * self.n_cycles/(time.perf_counter() - self.start_time)
+
+    def handleAllReceived(self):
+        if self.pipelined:
+            self.nextCycle()
+
+    def handleMessageReceived(self, message):
+        if message.hasError():
+            self.errors += 1
+        if not self.pipelined:
+            if (len(self.messages) > 0):
+                self.client.sendMessage(self.messages.pop(0))
+            else:
+                self.nextCycle()
+
+    def nextCycle(self):
+        if (self.cycle == self.n_cycles):
+            self.done.emit()
+            return
+        self.messages = self.cycleMessages()
+        self.cycle += 1
+        if self.pipelined:
+            for message in self.messages:
+                self.client.sendMessage(message)
+            self.messages = []
+        else:
+            self.client.sendMessage(self.messages.pop(0))
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        self.nextCycle()
+
+
+def benchmark(n_cycles = 20, parallel = False, port = 9600, timing = None):
+    """
+    Returns [cycles per minute, number of errors].
+    """
+    app = QtWidgets.QApplication.instance()
+    if app is None:
+        app = QtWidgets.QApplication([])
+
+    if timing is None:
+        timing = default_timing
+
+    # These are normally added by HAL.
+    for m_type in ["sync", "tcp message"]:
+        halMessage.addMessage(m_type, check_exists = False)
+
+    server = tcpServer.TCPServer(port = port, server_name = "Hal")
+    controller = tcpControl.Controller(parallel_mode = parallel,
+                                       server = server,
+                                       verbose = False)
+    client = tcpClient.TCPClient(port = port, server_name = "Hal")
+    bench = BenchmarkClient(client = client, n_cycles = n_cycles, pipelined = parallel)
+    bench.hal = SimulatedHal(controller = controller, timing = timing)
+
+    loop = QtCore.QEventLoop()
+    bench.done.connect(loop.quit)
+    client.startCommunication()
+    bench.start()
+    loop.exec_()
+
+    results = [bench.getCyclesPerMinute(), bench.errors]
+    client.stopCommunication()
+    client.close()
+    server.close()
+    return results
+
+
+if (__name__ == "__main__"):
+    import argparse
+
+    parser = argparse.ArgumentParser(description = 'TCP control throughput benchmark')
+
+    parser.add_argument('--cycles', dest='cycles', type=int, required=False, default=20,
+                        help = "The number of imaging cycles.")
+    parser.add_argument('--port', dest='port', type=int, required=False, default=9600,
+                        help = "The (loopback) port to use.")
+
+    args = parser.parse_args()
+
+    app = QtWidgets.QApplication([])
+    for [name, parallel] in [["sequential", False], ["pipelined", True]]:
+        [cpm, errors] = benchmark(n_cycles = args.cycles, parallel = parallel, port = args.port)
+        print("{0:s}: {1:.1f} cycles per minute, {2:d} errors".format(name, cpm, errors))
+
+
+#
+# The MIT License
+#
+# Copyright (c) 2018 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
@@ -367,8 +367,13 @@ class Controller(QtCore.QObject):
     4. 'Take Movie'
     In this sequence 1 and 2 can happen in parallel.
 
-    Note also the expectation that the TCP client does not send another message
-    until it gets a response to the first message.
+    The TCP client can send several messages without waiting for the responses.
+    These are queued and handled in order, one action at a time. Messages that
+    depend on another message are not handled if that message failed, and sync
+    messages (and messages with dependencies) are not handled until HAL has
+    finished processing the previous messages. In parallel mode this lets the
+    client send an entire imaging cycle at once, which saves a round trip to the
+    client for each step.
     """
     controlAction = QtCore.pyqtSignal(object)
     controlMessage = QtCore.pyqtSignal(object)
@@ -376,7 +381,10 @@ class Controller(QtCore.QObject):
     
     def __init__(self, parallel_mode = None, server = None, verbose = True, **kwds):
         super().__init__(**kwds)
-        self.parallel_mode = None
+        self.current_action = None
+        self.failed = set()
+        self.parallel_mode = parallel_mode
+        self.pending = []
         self.server = server
         self.test_directory = None
         self.test_parameters = None
@@ -394,35 +402,48 @@ class Controller(QtCore.QObject):
         if "parameters" in data:
             self.test_parameters = data["parameters"]
         tcp_action.sendResponse(self.server)
+        if tcp_action.tcp_message.hasError():
+            self.failed.add(tcp_action.tcp_message.getID())
+
+        self.current_action = None
+        self.handleNextMessage()
 
     def cleanUp(self):
         self.server.close()
+
+    def emitAction(self, action):
+        self.current_action = action
+        self.controlAction.emit(action)
+
+    def getPending(self):
+        """
+        Return the number of TCP messages that are waiting to be handled.
+        """
+        return len(self.pending)
         
     def handleLostConnection(self):
+        self.current_action = None
+        self.failed = set()
+        self.pending = []
         self.gotConnection.emit(False)
 
-    def handleMessageReceived(self, tcp_message):
+    def handleMessage(self, tcp_message):
         """
         TCP message handling.
         """
-        if self.verbose:
-            print(">TCP message received:")
-            print(tcp_message)
-            print("")
-
         if tcp_message.isType('Check Focus Lock'):
             # This is supposed to ensure that everything else, like stage moves is complete.
             self.controlMessage.emit(halMessage.SyncMessage())
             
             action = TCPAction(tcp_message = tcp_message)
-            self.controlAction.emit(action)
+            self.emitAction(action)
 
         elif tcp_message.isType('Find Sum'):
             # This is supposed to ensure that everything else, like stage moves is complete.
             self.controlMessage.emit(halMessage.SyncMessage())
             
             action = TCPAction(tcp_message = tcp_message)
-            self.controlAction.emit(action)            
+            self.emitAction(action)            
                 
         elif tcp_message.isType("Set Directory"):
             print(">> Warning the 'Set Directory' message is deprecated.")
@@ -440,23 +461,23 @@ class Controller(QtCore.QObject):
                     #
                     self.controlMessage.emit(halMessage.HalMessage(m_type = "change directory",
                                                                    data = {"directory" : directory},
-                                                                   finalizer = lambda : self.server.sendMessage(tcp_message)))
+                                                                   finalizer = lambda : self.sendResponse(tcp_message)))
                     return
-            self.server.sendMessage(tcp_message)
+            self.sendResponse(tcp_message)
 
         elif tcp_message.isType("Set Parameters"):
             if tcp_message.isTest():
                 action = TCPActionGetParameters(tcp_message = tcp_message)
             else:
                 action = TCPActionSetParameters(tcp_message = tcp_message)
-            self.controlAction.emit(action)
+            self.emitAction(action)
                     
         elif tcp_message.isType("Take Movie"):
 
             # Check that movie length is valid.
             if (tcp_message.getData("length") is None) or (tcp_message.getData("length") < 1):
-                tcp_message.setError(True, str(message.getData("length")) + " is an invalid movie length.")
-                self.server.sendMessage(tcp_message)
+                tcp_message.setError(True, str(tcp_message.getData("length")) + " is an invalid movie length.")
+                self.sendResponse(tcp_message)
                 return
 
             # Some messy logic here to check if we will over-write a existing films? For now, just
@@ -469,7 +490,7 @@ class Controller(QtCore.QObject):
                 filename = os.path.join(directory, tcp_message.getData("name")) + ".xml"
                 if os.path.exists(filename):
                     tcp_message.setError(True, "The movie file '" + filename + "' already exists.")
-                    self.server.sendMessage(tcp_message)
+                    self.sendResponse(tcp_message)
                     return
 
             # More messy logic here to return film size, time, etc..
@@ -478,25 +499,58 @@ class Controller(QtCore.QObject):
                 # If the movie has parameters specified, we'll request them specially.
                 if tcp_message.getData("parameters") is not None:
                     action = TCPActionGetMovieStats(tcp_message = tcp_message)
-                    self.controlAction.emit(action)
+                    self.emitAction(action)
 
                 # Otherwise calculate based on the current parameters.
                 else:
                     calculateMovieStats(tcp_message, self.test_parameters)
-                    self.server.sendMessage(tcp_message)                    
+                    self.sendResponse(tcp_message)                    
             else:
                 action = TCPActionTakeMovie(tcp_message = tcp_message)
-                self.controlAction.emit(action)
+                self.emitAction(action)
 
         else:
             if tcp_message.isTest() or (not self.parallel_mode):
                 action = TCPAction(tcp_message = tcp_message)
-                self.controlAction.emit(action)
+                self.emitAction(action)
             else:
                 msg = halMessage.HalMessage(m_type = "tcp message",
                                             data = {"tcp message" : tcp_message})
                 self.controlMessage.emit(msg)
-                self.server.sendMessage(tcp_message)
+                self.sendResponse(tcp_message)
+
+    def handleMessageReceived(self, tcp_message):
+        """
+        Queue TCP messages, they are handled in the order that they were received.
+        """
+        if self.verbose:
+            print(">TCP message received:")
+            print(tcp_message)
+            print("")
+
+        self.pending.append(tcp_message)
+        self.handleNextMessage()
+
+    def handleNextMessage(self):
+        """
+        Handle queued TCP messages until we get to one that is handled
+        with an action, actions are handled one at a time.
+        """
+        while (len(self.pending) > 0) and (self.current_action is None):
+            tcp_message = self.pending.pop(0)
+
+            # Check that the messages this message depends on succeeded.
+            failed = [str(m_id) for m_id in tcp_message.getDependencies() if m_id in self.failed]
+            if (len(failed) > 0):
+                tcp_message.setError(True, "Not handled as message(s) " + ", ".join(failed) + " failed.")
+                self.sendResponse(tcp_message)
+                continue
+
+            # Wait for HAL to finish with the previous messages.
+            if tcp_message.isSync() or (len(tcp_message.getDependencies()) > 0):
+                self.controlMessage.emit(halMessage.SyncMessage())
+
+            self.handleMessage(tcp_message)
                 
     def handleNewConnection(self):
         self.gotConnection.emit(True)
@@ -504,6 +558,11 @@ class Controller(QtCore.QObject):
     def setDirectory(self, directory):
         self.test_directory = directory
 
+    def sendResponse(self, tcp_message):
+        if tcp_message.hasError():
+            self.failed.add(tcp_message.getID())
+        self.server.sendMessage(tcp_message)
+
     def setParameters(self, parameters):
         self.test_parameters = parameters
         
@@ -540,9 +599,14 @@ class TCPControl(halModule.HalModule):
         self.control.cleanUp()
 
     def finalizeControlAction(self):
-        self.control.actionDone(self.control_action)
-        self.control_action.actionMessage.disconnect(self.sendMessage)
+        #
+        # This has to be cleared first as the controller will start the
+        # next action (if any) when it is told that this one is done.
+        #
+        action = self.control_action
+        action.actionMessage.disconnect(self.sendMessage)
         self.control_action = None
+        self.control.actionDone(action)
         
     def handleControlAction(self, action):
         #
@@ -72,6 +72,14 @@ class Timing(halModule.HalModule):
     """
     def __init__(self, module_params = None, qt_settings = None, **kwds):
         super().__init__(**kwds)
+
+        # The messages that this module handles.
+        self.addHandledMessages(["configuration",
+                                 "configure1",
+                                 "new parameters",
+                                 "start film",
+                                 "stop film"])
+
         self.timing_functionality = None
 
         self.parameters = params.StormXMLObject()
@@ -100,6 +100,12 @@ class AmplitudeModule(hardwareModule.HardwareModule):
     """
     def __init__(self, **kwds):
         super().__init__(**kwds)
+
+        # The messages that this module handles.
+        self.addHandledMessages(["get functionality",
+                                 "start film",
+                                 "stop film"])
+
         self.device_mutex = QtCore.QMutex()
 
     def getFunctionality(self, message):
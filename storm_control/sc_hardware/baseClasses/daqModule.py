@@ -90,6 +90,15 @@ class DaqModule(hardwareModule.HardwareModule):
     
     def __init__(self, **kwds):
         super().__init__(**kwds)
+
+        # The messages that this module handles.
+        self.addHandledMessages(["configuration",
+                                 "configure1",
+                                 "daq waveforms",
+                                 "get functionality",
+                                 "start film",
+                                 "stop film"])
+
         self.run_shutters = False
 
         # These are the waveforms to output during a film.
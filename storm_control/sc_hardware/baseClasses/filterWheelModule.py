@@ -64,6 +64,9 @@ class FilterWheelModule(hardwareModule.HardwareModule):
     def __init__(self, **kwds):
         super().__init__(**kwds)
 
+        # The messages that this module handles.
+        self.addHandledMessages(["get functionality"])
+
     def getFunctionality(self, message):
         pass
 
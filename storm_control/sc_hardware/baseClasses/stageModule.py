@@ -200,6 +200,14 @@ class StageModule(hardwareModule.HardwareModule):
     """
     def __init__(self, **kwds):
         super().__init__(**kwds)
+
+        # The messages that this module handles.
+        self.addHandledMessages(["configuration",
+                                 "get functionality",
+                                 "start film",
+                                 "stop film",
+                                 "tcp message"])
+
         self.stage = None
         self.stage_functionality = None
 
@@ -80,6 +80,10 @@ class ZStage(hardwareModule.HardwareModule):
     """
     def __init__(self, module_params = None, qt_settings = None, **kwds):
         super().__init__(**kwds)
+
+        # The messages that this module handles.
+        self.addHandledMessages(["get functionality"])
+
         self.configuration = module_params.get("configuration")
         self.z_stage_functionality = None
         self.z_stage = None
@@ -92,6 +92,11 @@ class VoltageZ(hardwareModule.HardwareModule):
     """
     def __init__(self, module_params = None, qt_settings = None, **kwds):
         super().__init__(**kwds)
+
+        # The messages that this module handles.
+        self.addHandledMessages(["configure1",
+                                 "get functionality"])
+
         self.configuration = module_params.get("configuration")
         self.z_stage_functionality = None
 
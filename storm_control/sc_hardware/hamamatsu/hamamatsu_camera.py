@@ -275,6 +275,7 @@ class HamamatsuCamera(object):
         self.frame_bytes = 0
         self.frame_x = 0
         self.frame_y = 0
+        self.get_frame_slot = None
         self.last_frame_number = 0
         self.properties = None
         self.max_backlog = 0
@@ -409,8 +410,16 @@ class HamamatsuCamera(object):
                                                 ctypes.byref(paramlock)),
                              "dcambuf_lockframe")
 
-            # Create storage for the frame & copy into this storage.
-            hc_data = HCamData(self.frame_bytes)
+            # Copy the frame into a slot from HAL's frame pool if possible,
+            # otherwise create storage for the frame & copy into this storage.
+            hc_data = None
+            if self.get_frame_slot is not None:
+                hc_data = self.get_frame_slot()
+                if (hc_data is not None) and (hc_data.getData().nbytes != self.frame_bytes):
+                    hc_data.release()
+                    hc_data = None
+            if hc_data is None:
+                hc_data = HCamData(self.frame_bytes)
             hc_data.copyData(paramlock.buf)
 
             frames.append(hc_data)
@@ -418,6 +427,18 @@ class HamamatsuCamera(object):
 
         return [frames, [self.frame_x, self.frame_y]]
 
+    def setFrameSlotFunction(self, get_frame_slot):
+        """
+        get_frame_slot - A function that returns an object to copy the next
+                         frame into (i.e. a HAL frame pool slot) or None. The
+                         object must have the same methods as HCamData() and
+                         a release() method.
+
+        Note that HamamatsuCameraMR does not use this as the camera writes
+        directly into it's (recycled) buffers.
+        """
+        self.get_frame_slot = get_frame_slot
+
     def getModelInfo(self, camera_id):
         """
         Returns the model of the camera
@@ -92,6 +92,11 @@ class NoneQPDModule(hardwareModule.HardwareModule):
 
     def __init__(self, module_params = None, qt_settings = None, **kwds):
         super().__init__(**kwds)
+
+        # The messages that this module handles.
+        self.addHandledMessages(["configure2",
+                                 "get functionality"])
+
         self.qpd_functionality = None
 
         self.configuration = module_params.get("configuration")
@@ -39,6 +39,10 @@ class NoneZStageModule(hardwareModule.HardwareModule):
 
     def __init__(self, module_params = None, qt_settings = None, **kwds):
         super().__init__(**kwds)
+
+        # The messages that this module handles.
+        self.addHandledMessages(["get functionality"])
+
         self.z_stage_functionality = None
 
         configuration = module_params.get("configuration")
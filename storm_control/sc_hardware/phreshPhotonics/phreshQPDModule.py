@@ -42,6 +42,11 @@ class PhreshQPDModule(hardwareModule.HardwareModule):
 
     def __init__(self, module_params = None, qt_settings = None, **kwds):
         super().__init__(**kwds)
+
+        # The messages that this module handles.
+        self.addHandledMessages(["configure1",
+                                 "get functionality"])
+
         self.configuration = module_params.get("configuration")
         self.qpd_functionality = None
 
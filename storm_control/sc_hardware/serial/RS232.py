@@ -8,26 +8,53 @@ Hazen 3/09
 import serial
 import time
 
+import storm_control.sc_library.halExceptions as halExceptions
+
+import storm_control.sc_hardware.serial.serialTransport as serialTransport
+
+
+class RS232Exception(halExceptions.HardwareException):
+    pass
+
 
 class RS232(object):
     """
     The basic RS-232 communication object which is used by all the objects
     that communicate with their associated hardware using RS-232.
+
+    In event driven mode a separate thread reads everything that arrives on
+    the port, so the responses have to be read using commWithResp(),
+    commWithRespPipelined(), getResponse(), readline() or waitResponse().
+    Commands can be sent with sendCommand(), write() or writeline(). The
+    raw read() method can't be used in this mode, and neither can the tty
+    attribute (except for writing).
     """
 
     def __init__(self,
                  baudrate = None,
                  encoding = 'utf-8',
                  end_of_line = "\r",
+                 event_driven = False,
+                 pipelining = False,
                  port = None,
+                 response_timeout = None,
                  timeout = 1.0e-3,
                  wait_time = 1.0e-2,
                  **kwds):
         """
-        port - The port for RS-232 communication, e.g. "COM4".
+        port - The port for RS-232 communication, e.g. "COM4". This can also be
+               a pySerial URL such as "loop://".
         timeout - The RS-232 time out value.
         baudrate - The RS-232 communication speed, e.g. 9800.
         end_of_line - What character(s) are used to indicate the end of a line.
+        event_driven - Read the responses in a separate thread, commWithResp() then
+                       returns as soon as the response (a line) arrives instead of
+                       polling. Only use this for devices that respond to every
+                       command with a single line.
+        pipelining - The device handles commands in order, so commWithRespPipelined()
+                     can send several commands at once (event_driven only).
+        response_timeout - How long commWithResp() waits for a response (event_driven
+                           only), the default is 10 * wait_time.
         wait_time - How long to wait between polling events before it is decided 
                     that there is no new data available on the port. 
         """
@@ -35,19 +62,35 @@ class RS232(object):
         self.encoding = encoding
         self.end_of_line = end_of_line
         self.live = True
+        self.pipelining = pipelining
+        self.response_timeout = response_timeout
+        self.timeout = timeout
+        self.transport = None
         self.wait_time = wait_time
+
+        if self.response_timeout is None:
+            self.response_timeout = 10 * self.wait_time
+
         try:
-            self.tty = serial.Serial(port, baudrate, timeout = timeout)
+            self.tty = serial.serial_for_url(port, baudrate, timeout = timeout)
             self.tty.flush()
             time.sleep(self.wait_time)
         except serial.serialutil.SerialException as e:
             print("RS232 Error:", type(e), str(e))
             self.live = False
 
+        if self.live and event_driven:
+            self.transport = serialTransport.SerialTransport(encoding = self.encoding,
+                                                             end_of_line = self.end_of_line,
+                                                             tty = self.tty)
+
     def commWithResp(self, command):
         """
         Send a command and wait (a little) for a response.
         """
+        if self.transport is not None:
+            return self.transport.query(command, timeout = self.response_timeout)
+
         self.sendCommand(command)
         time.sleep(10 * self.wait_time)
         response = ""
@@ -59,10 +102,33 @@ class RS232(object):
         if len(response) > 0:
             return response
 
+    def commWithRespPipelined(self, commands):
+        """
+        Send several commands and return a list of their responses. The
+        commands are sent at once if the device supports pipelining.
+        """
+        if (self.transport is not None) and self.pipelining:
+            return self.transport.queryPipelined(commands, timeout = len(commands) * self.response_timeout)
+        return [self.commWithResp(command) for command in commands]
+
+    def getLatencyHistogram(self):
+        """
+        Return the latency histogram of commWithResp(), or None if this
+        is not event driven.
+        """
+        if self.transport is not None:
+            return self.transport.getLatencyHistogram()
+
     def getResponse(self):
         """
         Wait (a little) for a response.
         """
+        if self.transport is not None:
+            response = "".join(self.transport.getResponses())
+            if len(response) > 0:
+                return response
+            return None
+
         response = ""
         response_len = self.tty.inWaiting()
         while response_len:
@@ -79,14 +145,34 @@ class RS232(object):
         return self.live
 
     def read(self, response_len):
+        """
+        Read response_len bytes from the port, this is not available in
+        event driven mode as the reader thread reads from the port.
+        """
+        if self.transport is not None:
+            raise RS232Exception("read() can't be used in event driven mode, use getResponse() or readline().")
         response = self.tty.read(response_len)
         return response.decode(self.encoding)
 
     def readline(self):
+        if self.transport is not None:
+            response = self.transport.getResponse(timeout = self.timeout)
+            if response is None:
+                return ""
+            return response.strip()
+
         response = self.tty.readline()
         return response.decode(self.encoding).strip()
         
     def sendCommand(self, command):
+        """
+        Send a command. In event driven mode we don't wait for the output
+        to be flushed, as this can take much longer than the response.
+        """
+        if self.transport is not None:
+            self.transport.send(command)
+            return
+
         self.tty.flush()
         self.write(command + self.end_of_line)
 
@@ -95,6 +181,9 @@ class RS232(object):
         Closes the RS-232 port.
         """
         if self.live:
+            if self.transport is not None:
+                self.transport.close()
+                self.transport = None
             self.tty = None
 
     def waitResponse(self, end_of_response = False, max_attempts = 200):
@@ -107,6 +196,13 @@ class RS232(object):
         """
         if not end_of_response:
             end_of_response = str(self.end_of_line)
+        if self.transport is not None:
+            deadline = time.perf_counter() + max_attempts * self.wait_time
+            response = self.transport.waitResponse(deadline, end_of_response = end_of_response)[0]
+            if response is None:
+                return ""
+            return response
+
         attempts = 0
         response = ""
         index = -1
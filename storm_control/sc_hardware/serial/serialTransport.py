@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+"""
+Event driven serial port communication.
+
+A reader thread reads the data from the port as soon as it arrives and
+splits it into responses at the end of line character(s). Queries wait
+on the response queue until their response is complete, or a deadline
+passes, instead of sleeping for a fixed amount of time. For devices that
+handle commands in order, several commands can be sent at once and the
+responses collected afterwards (pipelining).
+
+The round trip time of each query is recorded in a (per device)
+latency histogram.
+"""
+
+import math
+import queue
+import threading
+import time
+
+import serial
+
+
+class LatencyHistogram(object):
+    """
+    A histogram of response latencies, the bins are logarithmically spaced.
+    """
+    def __init__(self, bins_per_decade = 10, max_latency = 10.0, min_latency = 1.0e-4, **kwds):
+        """
+        bins_per_decade - The number of bins per factor of 10.
+        max_latency - The upper edge of the last bin in seconds.
+        min_latency - The lower edge of the first bin in seconds.
+
+        Latencies outside of this range are counted in the first and the
+        last bin.
+        """
+        super().__init__(**kwds)
+        self.bins_per_decade = bins_per_decade
+        self.min_latency = min_latency
+        self.n_bins = int(math.ceil(bins_per_decade * math.log10(max_latency/min_latency)))
+        self.reset()
+
+    def addLatency(self, latency):
+        """
+        Add a latency (in seconds).
+        """
+        index = 0
+        if (latency > self.min_latency):
+            index = int(self.bins_per_decade * math.log10(latency/self.min_latency))
+        self.counts[min(index, self.n_bins - 1)] += 1
+        self.max_latency = max(self.max_latency, latency)
+        self.n_latencies += 1
+        self.total += latency
+
+    def getBinEdges(self):
+        """
+        Returns the n_bins + 1 edges of the bins in seconds.
+        """
+        return [self.min_latency * math.pow(10.0, i/self.bins_per_decade) for i in range(self.n_bins + 1)]
+
+    def getCounts(self):
+        return self.counts
+
+    def getPercentile(self, percentile):
+        """
+        Returns the upper edge of the bin that contains the percentile,
+        or None if there are no latencies.
+        """
+        if (self.n_latencies == 0):
+            return None
+        target = 0.01 * percentile * self.n_latencies
+        total = 0
+        for [i, count] in enumerate(self.counts):
+            total += count
+            if (total >= target) and (count > 0):
+                break
+
+        # The last bin also has the latencies that were larger than its upper edge.
+        if (i == (self.n_bins - 1)):
+            return self.max_latency
+        return min(self.min_latency * math.pow(10.0, (i + 1)/self.bins_per_decade), self.max_latency)
+
+    def getStatistics(self):
+        """
+        Returns a dictionary with the number of latencies, the mean and maximum
+        latency and the (approximate) median and 99th percentile latency.
+        """
+        mean = None
+        if (self.n_latencies > 0):
+            mean = self.total/self.n_latencies
+        return {"count" : self.n_latencies,
+                "max" : self.max_latency,
+                "mean" : mean,
+                "median" : self.getPercentile(50),
+                "p99" : self.getPercentile(99)}
+
+    def reset(self):
+        self.counts = [0] * self.n_bins
+        self.max_latency = 0.0
+        self.n_latencies = 0
+        self.total = 0.0
+
+
+class SerialTransport(object):
+    """
+    Reads the responses from a serial port in a separate thread.
+    """
+    def __init__(self, encoding = 'utf-8', end_of_line = "\r", read_timeout = 0.05, tty = None, **kwds):
+        """
+        encoding - The encoding of the commands and the responses.
+        end_of_line - What character(s) are used to indicate the end of a line.
+        read_timeout - How long the reader thread waits for data before checking
+                       if it should stop, this is also the time that close() can take.
+        tty - A (open) pySerial object, this can also be a loop:// port or a
+              fake device for testing.
+        """
+        super().__init__(**kwds)
+        self.buffer = bytearray()
+        self.encoding = encoding
+        self.end_of_line = end_of_line
+        self.eol_bytes = end_of_line.encode(encoding)
+        self.histogram = LatencyHistogram()
+        self.n_discarded = 0
+        self.n_timeouts = 0
+        self.responses = queue.Queue()
+        self.running = True
+        self.tty = tty
+
+        self.tty.timeout = read_timeout
+        self.reader_thread = threading.Thread(target = self.readerLoop, daemon = True)
+        self.reader_thread.start()
+
+    def addData(self, data, arrival_time):
+        """
+        Add data from the port, each complete line is added to the response queue.
+        """
+        self.buffer += data
+        end = self.buffer.rfind(self.eol_bytes)
+        if (end == -1):
+            return
+        end += len(self.eol_bytes)
+        lines = self.buffer[:end].split(self.eol_bytes)[:-1]
+        del self.buffer[:end]
+        for line in lines:
+            self.responses.put([arrival_time, (line + self.eol_bytes).decode(self.encoding, errors = "replace")])
+
+    def close(self):
+        """
+        Stop the reader thread, this does not close the port.
+        """
+        self.running = False
+        self.reader_thread.join()
+
+    def getLatencyHistogram(self):
+        return self.histogram
+
+    def getResponse(self, timeout = 0.0):
+        """
+        Returns the next line, or None if there is no line after timeout
+        seconds. A timeout of None waits forever.
+        """
+        try:
+            if (timeout == 0.0):
+                return self.responses.get_nowait()[1]
+            else:
+                return self.responses.get(timeout = timeout)[1]
+        except queue.Empty:
+            return None
+
+    def getResponses(self):
+        """
+        Returns all the lines that have been received (and not read).
+        """
+        lines = []
+        response = self.getResponse()
+        while response is not None:
+            lines.append(response)
+            response = self.getResponse()
+        return lines
+
+    def getStatistics(self):
+        """
+        Returns a dictionary with the latency statistics, the number of queries
+        that timed out and the number of (unexpected) lines that were discarded.
+        """
+        statistics = self.histogram.getStatistics()
+        statistics["discarded"] = self.n_discarded
+        statistics["timeouts"] = self.n_timeouts
+        return statistics
+
+    def query(self, command, end_of_response = None, timeout = 1.0):
+        """
+        Send a command and return the response, see waitResponse().
+        """
+        return self.queryPipelined([command], end_of_response = end_of_response, timeout = timeout)[0]
+
+    def queryPipelined(self, commands, end_of_response = None, timeout = 1.0):
+        """
+        Send several commands at once, then wait for their responses. This
+        only works for devices that handle commands in order and that respond
+        to every command.
+
+        Returns a list with the response to each command, see waitResponse().
+        All the responses have to arrive within timeout seconds.
+        """
+        # Anything that is already here is a late response to an earlier command.
+        self.n_discarded += len(self.getResponses())
+
+        start_time = time.perf_counter()
+        self.write("".join([command + self.end_of_line for command in commands]))
+        deadline = start_time + timeout
+
+        responses = []
+        for command in commands:
+            [response, arrival_time] = self.waitResponse(deadline, end_of_response = end_of_response)
+            if arrival_time is None:
+                self.n_timeouts += 1
+            else:
+                self.histogram.addLatency(arrival_time - start_time)
+            responses.append(response)
+        return responses
+
+    def readerLoop(self):
+        while self.running:
+            try:
+                data = self.tty.read(max(1, self.tty.in_waiting))
+            except (serial.SerialException, OSError) as e:
+                print("SerialTransport Error:", type(e), str(e))
+                self.running = False
+                break
+            if (len(data) > 0):
+                self.addData(data, time.perf_counter())
+
+    def send(self, command):
+        self.write(command + self.end_of_line)
+
+    def waitResponse(self, deadline, end_of_response = None):
+        """
+        Waits until the lines that have been received contain end_of_response
+        or the deadline (a time.perf_counter() time) passes. If you don't set
+        end_of_response then this will return the first line.
+
+        Returns [response, arrival time of the last line], the arrival time is
+        None if the response was not complete. The response is None if nothing
+        was received.
+        """
+        if end_of_response is None:
+            end_of_response = self.end_of_line
+        response = ""
+        while True:
+            remaining = deadline - time.perf_counter()
+            if (remaining <= 0.0):
+                break
+            try:
+                [arrival_time, line] = self.responses.get(timeout = remaining)
+            except queue.Empty:
+                break
+            response += line
+            if (response.find(end_of_response) != -1):
+                return [response, arrival_time]
+
+        if (len(response) > 0):
+            return [response, None]
+        return [None, None]
+
+    def write(self, string):
+        self.tty.write(string.encode(self.encoding))
+
+
+#
+# Testing / benchmarking.
+#
+if (__name__ == "__main__"):
+    import argparse
+
+    import storm_control.sc_hardware.serial.RS232 as RS232
+
+    parser = argparse.ArgumentParser(description = 'Serial round trip latency benchmark')
+
+    parser.add_argument('--baudrate', dest='baudrate', type=int, required=False, default=115200,
+                        help = "The port speed.")
+    parser.add_argument('--port', dest='port', type=str, required=False, default="loop://",
+                        help = "The port to use, the device has to respond to each command. The default is a loopback port that echoes the commands.")
+    parser.add_argument('--command', dest='command', type=str, required=False, default="?",
+                        help = "The command to send.")
+    parser.add_argument('--queries', dest='queries', type=int, required=False, default=20,
+                        help = "The number of queries.")
+
+    args = parser.parse_args()
+
+    def benchmark(name, query_fn, n_commands = 1):
+        start_time = time.perf_counter()
+        for i in range(args.queries):
+            query_fn()
+        elapsed = time.perf_counter() - start_time
+        n_queries = args.queries * n_commands
+        print("{0:s}, {1:.2f}ms per query, {2:.1f} queries per second".format(name, 1000.0 * elapsed/n_queries, n_queries/elapsed))
+
+    polling = RS232.RS232(baudrate = args.baudrate, port = args.port)
+    benchmark("polling (commWithResp)", lambda : polling.commWithResp(args.command))
+    polling.shutDown()
+
+    for pipelining in [False, True]:
+        event_driven = RS232.RS232(baudrate = args.baudrate,
+                                   event_driven = True,
+                                   pipelining = pipelining,
+                                   port = args.port)
+        if pipelining:
+            benchmark("event driven, pipelined", lambda : event_driven.commWithRespPipelined([args.command] * 10), n_commands = 10)
+        else:
+            benchmark("event driven", lambda : event_driven.commWithResp(args.command))
+        print(" ", event_driven.getLatencyHistogram().getStatistics())
+        event_driven.shutDown()
+
+
+#
+# The MIT License
+#
+# Copyright (c) 2018 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
@@ -36,6 +36,11 @@ class LDCIRLaserModule(hardwareModule.HardwareModule):
     """
     def __init__(self, module_params = None, qt_settings = None, **kwds):
         super().__init__(**kwds)
+
+        # The messages that this module handles.
+        self.addHandledMessages(["configure1",
+                                 "get functionality"])
+
         self.configuration = module_params.get("configuration")
         self.ir_laser_functionality = None
 
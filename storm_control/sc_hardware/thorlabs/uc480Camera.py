@@ -11,13 +11,16 @@ FIXME: This only works with the uc480 Version 4.20 (or earlier) software.
 Hazen 08/16
 """
 
+import collections
 import ctypes
 import ctypes.util
 import ctypes.wintypes
 import numpy
 import os
+import threading
 
 import time
+import zlib
 
 import storm_control.sc_library.hdebug as hdebug
 
@@ -304,6 +307,158 @@ class Camera(Handle):
         check(uc480.is_StopLiveVideo(self, IS_WAIT), "is_StopLiveVideo")
 
 
+class QPDPipeline(object):
+    """
+    Overlaps capturing images with analyzing them. One thread captures
+    images from the camera into a ring of reused buffers while a second
+    thread analyzes the newest image. Images that arrive faster than they
+    can be analyzed are dropped, so the update rate is set by the slower
+    of the camera frame rate and the analysis time, not by their sum.
+
+    Duplicate images are detected using a hash of the image.
+
+    camera_qpd is a CameraQPD, we use its capture(), analyzeImage() and
+    getImageInfo() methods.
+    """
+    def __init__(self, camera_qpd = None, n_buffers = 4, reps = 4, **kwds):
+        super().__init__(**kwds)
+        assert (n_buffers >= 3), "The pipeline needs at least 3 buffers."
+
+        self.analyzing = None
+        self.buffers = [None] * n_buffers
+        self.camera_qpd = camera_qpd
+        self.cond = threading.Condition()
+        self.image = None
+        self.last_result_id = 0
+        self.latest = None
+        self.n_analyzed = 0
+        self.n_captured = 0
+        self.n_dropped = 0
+        self.n_duplicates = 0
+        self.result = None
+        self.result_id = 0
+        self.results = collections.deque(maxlen = reps)
+        self.running = False
+        self.threads = []
+
+    def analysisLoop(self):
+        while True:
+            with self.cond:
+                while self.running and (self.latest is None):
+                    self.cond.wait()
+                if not self.running:
+                    break
+                self.analyzing = self.latest
+                self.latest = None
+
+            # The capture thread won't write into this buffer until
+            # we have our own copy of it.
+            data = self.buffers[self.analyzing].copy()
+            with self.cond:
+                self.analyzing = None
+
+            [power, n_good, offset] = self.camera_qpd.analyzeImage(data)
+            image = [data] + self.camera_qpd.getImageInfo()
+
+            with self.cond:
+                self.results.append([power, n_good, offset])
+                self.image = image
+                self.n_analyzed += 1
+                self.result = self.averageResults()
+                self.result_id += 1
+                self.cond.notify_all()
+
+    def averageResults(self):
+        """
+        Same as CameraQPD.qpdScan(), but over the most recent images.
+        """
+        power_total = 0.0
+        offset_total = 0.0
+        good_total = 0.0
+        for [power, n_good, offset] in self.results:
+            power_total += power
+            good_total += n_good
+            offset_total += offset
+
+        power_total = power_total/float(len(self.results))
+        if (good_total > 0):
+            return [power_total, offset_total/good_total, True]
+        else:
+            return [power_total, 0, False]
+
+    def captureLoop(self):
+        last_hash = None
+        while self.running:
+            data = self.camera_qpd.capture()
+
+            frame_hash = zlib.crc32(data)
+            if (frame_hash == last_hash):
+                with self.cond:
+                    self.n_duplicates += 1
+                continue
+            last_hash = frame_hash
+
+            # Pick a buffer that is not being analyzed and that does not
+            # have the newest image in it.
+            with self.cond:
+                self.n_captured += 1
+                index = 0
+                while index in [self.analyzing, self.latest]:
+                    index += 1
+
+            if (self.buffers[index] is None) or (self.buffers[index].shape != data.shape):
+                self.buffers[index] = numpy.empty_like(data)
+            numpy.copyto(self.buffers[index], data)
+
+            with self.cond:
+                if self.latest is not None:
+                    self.n_dropped += 1
+                self.latest = index
+                self.cond.notify_all()
+
+    def getImage(self):
+        """
+        Returns the image (and fit information) from the most recently analyzed image.
+        """
+        with self.cond:
+            if self.image is None:
+                return [None] + self.camera_qpd.getImageInfo()
+            return self.image
+
+    def getOffset(self, timeout = 1.0):
+        """
+        Wait (up to timeout seconds) for the next result, then return [power, offset, is_good].
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: (self.result_id != self.last_result_id) or not self.running, timeout)
+            self.last_result_id = self.result_id
+            if self.result is None:
+                return [0.0, 0, False]
+            return self.result
+
+    def getStatistics(self):
+        with self.cond:
+            return {"analyzed" : self.n_analyzed,
+                    "captured" : self.n_captured,
+                    "dropped" : self.n_dropped,
+                    "duplicates" : self.n_duplicates}
+
+    def start(self):
+        self.running = True
+        self.threads = [threading.Thread(target = self.captureLoop, daemon = True),
+                        threading.Thread(target = self.analysisLoop, daemon = True)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+
 class CameraQPD(object):
     """
     QPD emulation class. The default camera ROI of 200x200 pixels.
@@ -327,11 +482,14 @@ class CameraQPD(object):
 
         self.allow_single_fits = allow_single_fits
         self.background = background
+        self.cam_lock = threading.Lock()
         self.fit_mode = 1
         self.fit_size = int(1.5 * sigma)
         self.image = None
+        self.last_hash = None
         self.last_power = 0
         self.offset_file = offset_file
+        self.pipeline = None
         self.sigma = sigma
         self.x_off1 = 0.0
         self.y_off1 = 0.0
@@ -382,11 +540,53 @@ class CameraQPD(object):
     def adjustZeroDist(self, inc):
         self.zero_dist += inc
 
+    def analyzeImage(self, data):
+        """
+        Measure the focus lock offset and camera sum signal in a single image.
+
+        Returns [power, total_good, offset]
+        """
+        # The power number is the sum over the camera AOI minus the background.
+        power = numpy.sum(data.astype(numpy.int64)) - self.background
+        self.last_power = power
+
+        # Determine offset by fitting gaussians to the two beam spots.
+        # In the event that only beam spot can be fit then this will
+        # attempt to compensate. However this assumes that the two
+        # spots are centered across the mid-line of camera ROI.
+        #
+        if (self.fit_mode == 1):
+            [total_good, dist1, dist2] = self.doFit(data)
+
+        # Determine offset by moments calculation.
+        else:
+            [total_good, dist1, dist2] = self.doMoments(data)
+                        
+        # Calculate offset.
+        #
+
+        # No good fits.
+        if (total_good == 0):
+            return [power, 0.0, 0.0]
+
+        # One good fit.
+        elif (total_good == 1):
+            if self.allow_single_fits:
+                return [power, 1.0, ((dist1 + dist2) - 0.5*self.zero_dist)]
+            else:
+                return [power, 0.0, 0.0]
+
+        # Two good fits. This gets twice the weight of one good fit
+        # if we are averaging.
+        else:
+            return [power, 2.0, 2.0*((dist1 + dist2) - self.zero_dist)]
+
     def capture(self):
         """
         Get the next image from the camera.
         """
-        self.image = self.cam.captureImage()
+        with self.cam_lock:
+            self.image = self.cam.captureImage()
         return self.image
 
     def changeFitMode(self, mode):
@@ -429,13 +629,38 @@ class CameraQPD(object):
             dist2 = abs(self.y_off2)
 
         # The moment calculation is too fast. This is to slow things
-        # down so that (hopefully) the camera doesn't freeze up.
-        time.sleep(0.02)
+        # down so that (hopefully) the camera doesn't freeze up. This
+        # is not necessary with the pipeline as the capture thread
+        # only goes as fast as the camera.
+        if self.pipeline is None:
+            time.sleep(0.02)
         
         return [total_good, dist1, dist2]
 
     def getImage(self):
-        return [self.image, self.x_off1, self.y_off1, self.x_off2, self.y_off2, self.sigma]
+        if self.pipeline is not None:
+            return self.pipeline.getImage()
+        return [self.image] + self.getImageInfo()
+
+    def getImageInfo(self):
+        return [self.x_off1, self.y_off1, self.x_off2, self.y_off2, self.sigma]
+
+    def getStatistics(self):
+        """
+        Returns the pipeline statistics, or None if the pipeline is not running.
+        """
+        if self.pipeline is not None:
+            return self.pipeline.getStatistics()
+
+    def isDuplicate(self, data):
+        """
+        Returns True if data is the same as the previous image. The camera
+        will sometimes give us the same image twice.
+        """
+        frame_hash = zlib.crc32(data)
+        is_duplicate = (frame_hash == self.last_hash)
+        self.last_hash = frame_hash
+        return is_duplicate
 
     def getZeroDist(self):
         return self.zero_dist
@@ -443,7 +668,13 @@ class CameraQPD(object):
     def qpdScan(self, reps = 4):
         """
         Returns [power, offset, is_good]
+
+        If the pipeline is running this waits for the next result from the
+        pipeline, which is the average of the last reps images.
         """
+        if self.pipeline is not None:
+            return self.pipeline.getOffset()
+
         power_total = 0.0
         offset_total = 0.0
         good_total = 0.0
@@ -463,15 +694,17 @@ class CameraQPD(object):
         """
         Set the camera AOI to current AOI.
         """
-        self.cam.setAOI(self.x_start,
-                        self.y_start,
-                        self.x_width,
-                        self.y_width)
+        with self.cam_lock:
+            self.cam.setAOI(self.x_start,
+                            self.y_start,
+                            self.x_width,
+                            self.y_width)
 
     def shutDown(self):
         """
         Save the current camera AOI location and offset. Shutdown the camera.
         """
+        self.stopPipeline()
         if self.offset_file:
             with open(self.offset_file, "w") as fp:
                 fp.write(str(self.x_start) + "," + str(self.y_start))
@@ -485,47 +718,28 @@ class CameraQPD(object):
         """
         data = self.capture().copy()
 
-        # The power number is the sum over the camera AOI minus the background.
-        power = numpy.sum(data.astype(numpy.int64)) - self.background
-        
-        # (Simple) Check for duplicate frames.
-        if (power == self.last_power):
+        # Check for duplicate frames.
+        if self.isDuplicate(data):
             #print("> UC480-QPD: Duplicate image detected!")
             time.sleep(0.05)
             return [self.last_power, 0, 0]
 
-        self.last_power = power
-
-        # Determine offset by fitting gaussians to the two beam spots.
-        # In the event that only beam spot can be fit then this will
-        # attempt to compensate. However this assumes that the two
-        # spots are centered across the mid-line of camera ROI.
-        #
-        if (self.fit_mode == 1):
-            [total_good, dist1, dist2] = self.doFit(data)
+        return self.analyzeImage(data)
 
-        # Determine offset by moments calculation.
-        else:
-            [total_good, dist1, dist2] = self.doMoments(data)
-                        
-        # Calculate offset.
-        #
-
-        # No good fits.
-        if (total_good == 0):
-            return [power, 0.0, 0.0]
-
-        # One good fit.
-        elif (total_good == 1):
-            if self.allow_single_fits:
-                return [power, 1.0, ((dist1 + dist2) - 0.5*self.zero_dist)]
-            else:
-                return [power, 0.0, 0.0]
+    def startPipeline(self, n_buffers = 4, reps = 4):
+        """
+        Start capturing and analyzing images in separate threads.
+        """
+        if self.pipeline is None:
+            self.pipeline = QPDPipeline(camera_qpd = self,
+                                        n_buffers = n_buffers,
+                                        reps = reps)
+            self.pipeline.start()
 
-        # Two good fits. This gets twice the weight of one good fit
-        # if we are averaging.
-        else:
-            return [power, 2.0, 2.0*((dist1 + dist2) - self.zero_dist)]
+    def stopPipeline(self):
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.pipeline = None
 
 
 class CameraQPDCorrFit(CameraQPD):
@@ -638,12 +852,15 @@ class CameraQPDSAFit(CameraQPD):
             
 class CameraQPDScipyFit(CameraQPD):
     """
-    This version uses scipy to do the fitting.
+    This version uses numpy to do the fitting. Both spots are fit
+    at the same time with npLPF.GaussianFitter, starting from the
+    previous fit if both spots were found in the last image.
     """
     def __init__(self, fit_mutex = False, **kwds):
         super().__init__(**kwds)
 
         self.fit_mutex = fit_mutex
+        self.fitter = npLPF.GaussianFitter(elliptical = True, sigma = self.sigma)
 
     def doFit(self, data):
         dist1 = 0
@@ -655,51 +872,68 @@ class CameraQPDScipyFit(CameraQPD):
 
         # numpy finder/fitter.
         #
-        # Fit first gaussian to data in the left half of the picture.
-        total_good =0
-        [max_x, max_y, params, status] = self.fitGaussian(data[:,:self.half_x])
-        if status:
-            total_good += 1
-            self.x_off1 = float(max_x) + params[2] - self.half_y
-            self.y_off1 = float(max_y) + params[3] - self.half_x
-            dist1 = abs(self.y_off1)
+        # Find the gaussians in the left and the right half of the picture.
+        halves = [data[:,:self.half_x], data[:,-self.half_x:]]
+        spots = []
+        windows = []
+        for i, half in enumerate(halves):
+            spot = self.findSpot(half)
+            if spot is not None:
+                spots.append([i] + spot)
+                windows.append(half[spot[0]-self.fit_size:spot[0]+self.fit_size,spot[1]-self.fit_size:spot[1]+self.fit_size])
+        if (len(spots) == 0):
+            return [0, dist1, dist2]
+
+        # Only warm start if we are fitting the same spots as last time.
+        origins = None
+        if (len(spots) == 2):
+            origins = list(map(lambda x: [x[1] - self.fit_size, x[2] - self.fit_size], spots))
+        else:
+            self.fitter.reset()
 
-        # Fit second gaussian to data in the right half of the picture.
-        [max_x, max_y, params, status] = self.fitGaussian(data[:,-self.half_x:])
-        if status:
+        # Fit both gaussians in a single call.
+        if self.fit_mutex:
+            self.fit_mutex.lock()
+        [params, status] = self.fitter.fit(windows, origins = origins)
+        if self.fit_mutex:
+            self.fit_mutex.unlock()
+
+        total_good = 0
+        for i, [which, max_x, max_y] in enumerate(spots):
+            if not status[i]:
+                continue
             total_good += 1
-            self.x_off2 = float(max_x) + params[2] - self.half_y
-            self.y_off2 = float(max_y) + params[3]
-            dist2 = abs(self.y_off2)
+            x_off = float(max_x) + params[i,2] - self.fit_size - self.half_y
+            y_off = float(max_y) + params[i,3] - self.fit_size
+            if (which == 0):
+                self.x_off1 = x_off
+                self.y_off1 = y_off - self.half_x
+                dist1 = abs(self.y_off1)
+            else:
+                self.x_off2 = x_off
+                self.y_off2 = y_off
+                dist2 = abs(self.y_off2)
 
         return [total_good, dist1, dist2]
         
-    def fitGaussian(self, data):
+    def findSpot(self, data):
+        """
+        Returns the [x, y] location of the maximum in data, or None if the
+        maximum is too dim or too close to the edge to fit.
+        """
         if (numpy.max(data) < 25):
-            return [False, False, False, False]
+            return None
         x_width = data.shape[0]
         y_width = data.shape[1]
         max_i = data.argmax()
         max_x = int(max_i/y_width)
         max_y = int(max_i%y_width)
         if (max_x > (self.fit_size-1)) and (max_x < (x_width - self.fit_size)) and (max_y > (self.fit_size-1)) and (max_y < (y_width - self.fit_size)):
-            if self.fit_mutex:
-                self.fit_mutex.lock()
-            #[params, status] = npLPF.fitSymmetricGaussian(data[max_x-self.fit_size:max_x+self.fit_size,max_y-self.fit_size:max_y+self.fit_size], 8.0)
-            #[params, status] = npLPF.fitFixedEllipticalGaussian(data[max_x-self.fit_size:max_x+self.fit_size,max_y-self.fit_size:max_y+self.fit_size], 8.0)
-            [params, status] = npLPF.fitFixedEllipticalGaussian(data[max_x-self.fit_size:max_x+self.fit_size,max_y-self.fit_size:max_y+self.fit_size], self.sigma)
-            if self.fit_mutex:
-                self.fit_mutex.unlock()
-            params[2] -= self.fit_size
-            params[3] -= self.fit_size
-            return [max_x, max_y, params, status]
+            return [max_x, max_y]
         else:
-            return [False, False, False, False]
-
+            return None
 
 
-
-        
 # Testing
 if (__name__ == "__main__"):
 
@@ -18,11 +18,12 @@ class UC480QPDCameraFunctionality(hardwareModule.BufferedFunctionality, lockModu
     qpdUpdate = QtCore.pyqtSignal(dict)
     threadUpdate = QtCore.pyqtSignal(dict)
 
-    def __init__(self, camera = None, reps = None, **kwds):
+    def __init__(self, camera = None, pipeline = False, reps = None, **kwds):
         super().__init__(**kwds)
         self.camera = camera
         self.scan_thread = UC480ScanThread(camera = self.camera,
                                            device_mutex = self.device_mutex,
+                                           pipeline = pipeline,
                                            qpd_update_signal = self.threadUpdate,
                                            reps = reps,
                                            units_to_microns = self.units_to_microns)
@@ -69,10 +70,15 @@ class UC480ScanThread(QtCore.QThread):
     Handles periodic polling of the camera to determine the current offset. 
     In testing this approach appeared more performant than starting a new
     QRunnable for each scan.
+
+    If pipeline is True the camera captures and analyzes images in their
+    own threads (see uc480Camera.QPDPipeline), and this thread just sends
+    each new (averaged) result.
     """
     def __init__(self,
                  camera = None,
                  device_mutex = None,
+                 pipeline = False,
                  qpd_update_signal = None,
                  reps = None,
                  units_to_microns = None,
@@ -80,6 +86,7 @@ class UC480ScanThread(QtCore.QThread):
         super().__init__(**kwds)
         self.camera = camera
         self.device_mutex = device_mutex
+        self.pipeline = pipeline
         self.qpd_update_signal = qpd_update_signal
         self.reps = reps
         self.running = False
@@ -90,6 +97,8 @@ class UC480ScanThread(QtCore.QThread):
         
     def run(self):
         self.running = True
+        if self.pipeline:
+            self.camera.startPipeline(reps = self.reps)
         while(self.running):
             [power, offset, is_good] = self.camera.qpdScan(reps = self.reps)
             [image, x_off1, y_off1, x_off2, y_off2, sigma] = self.camera.getImage()
@@ -102,6 +111,8 @@ class UC480ScanThread(QtCore.QThread):
                                          "y_off1" : y_off1,
                                          "x_off2" : x_off2,
                                          "y_off2" : y_off2})
+        if self.pipeline:
+            self.camera.stopPipeline()
 
     def startScan(self):
         self.start(QtCore.QThread.NormalPriority)
@@ -117,6 +128,10 @@ class UC480Camera(hardwareModule.HardwareModule):
     """
     def __init__(self, module_params = None, qt_settings = None, **kwds):
         super().__init__(**kwds)
+
+        # The messages that this module handles.
+        self.addHandledMessages(["get functionality"])
+
         self.camera = None
         self.camera_functionality = None
 
@@ -170,6 +185,7 @@ class UC480Camera(hardwareModule.HardwareModule):
         self.camera_functionality = UC480QPDCameraFunctionality(camera = self.camera,
                                                                 device_mutex = QtCore.QMutex(),
                                                                 parameters = configuration.get("parameters"),
+                                                                pipeline = configuration.get("pipeline", False),
                                                                 reps = configuration.get("reps", 1),
                                                                 units_to_microns = configuration.get("units_to_microns"))
 
@@ -3,6 +3,11 @@
 Peak finder for use by the camera based focus locks. This 
 version uses numpy/scipy only.
 
+GaussianFitter is a faster alternative to fitAFunctionLS() for the
+gaussians in this module. It uses Levenberg-Marquardt with an analytic
+Jacobian, it can fit several images (i.e. both of the focus lock beam
+spots) in one call and it can start from the previous fit.
+
 Hazen 11/17
 """
 import numpy
@@ -79,3 +84,223 @@ def fitFixedEllipticalGaussian(data, sigma):
     return fitAFunctionLS(data, params, fixedEllipticalGaussian)
 
 
+class GaussianFitter(object):
+    """
+    Least squares fitting of fixedEllipticalGaussian() or symmetricGaussian()
+    to one or more images of the same size.
+
+    Parameters are in the same order (and the same coordinate system) as
+    those for fitFixedEllipticalGaussian() and fitSymmetricGaussian(), i.e.
+    center_x is the position along the first axis of the image.
+    """
+    def __init__(self, elliptical = True, max_iterations = 50, sigma = None, tolerance = 1.0e-6, **kwds):
+        """
+        elliptical - Fit a fixed elliptical gaussian, otherwise a symmetric gaussian.
+        max_iterations - The maximum number of Levenberg-Marquardt iterations.
+        sigma - The (approximate) sigma of the gaussian, used for the starting width.
+        tolerance - Fitting stops when the fractional change in the error is less than this.
+        """
+        super().__init__(**kwds)
+        self.elliptical = elliptical
+        self.grids = {}
+        self.last_good = None
+        self.last_origins = None
+        self.last_params = None
+        self.max_iterations = max_iterations
+        self.sigma = sigma
+        self.tolerance = tolerance
+
+        if self.elliptical:
+            self.n_params = 6
+        else:
+            self.n_params = 5
+
+    def fit(self, images, origins = None):
+        """
+        images - A list of 2D arrays, all of the same shape.
+        origins - The [x, y] position of each image in a larger image. If this
+                  is specified then we start from the previous solution (if it
+                  was good) shifted to the new origin.
+
+        Returns [params, good], params is a (n_images, n_params) array.
+        """
+        data = numpy.array([numpy.ravel(image) for image in images], dtype = numpy.float64)
+        [x, y] = self.getGrid(images[0].shape)
+
+        params = self.initialParams(data, images[0].shape)
+        warm = numpy.zeros(len(images), dtype = numpy.bool_)
+        if (origins is not None) and (self.last_origins is not None) and (self.last_params.shape == params.shape):
+            for i in range(len(images)):
+                if self.last_good[i]:
+                    params[i,:] = self.last_params[i,:]
+                    params[i,2] += self.last_origins[i][0] - origins[i][0]
+                    params[i,3] += self.last_origins[i][1] - origins[i][1]
+                    warm[i] = True
+
+        [params, good] = self.levenbergMarquardt(data, x, y, params)
+
+        # If a warm start fit failed try again from the default starting point.
+        retry = warm & ~good
+        if retry.any():
+            [params[retry], good[retry]] = self.levenbergMarquardt(data[retry], x, y, self.initialParams(data[retry], images[0].shape))
+
+        self.last_good = good
+        self.last_origins = origins
+        self.last_params = params.copy()
+        return [params, good]
+
+    def getGrid(self, shape):
+        """
+        Coordinate grids are cached as the image size rarely changes.
+        """
+        if not shape in self.grids:
+            [x, y] = numpy.indices(shape)
+            self.grids[shape] = [numpy.ravel(x).astype(numpy.float64), numpy.ravel(y).astype(numpy.float64)]
+        return self.grids[shape]
+
+    def initialParams(self, data, shape):
+        params = numpy.zeros((data.shape[0], self.n_params))
+        params[:,0] = numpy.min(data, axis = 1)
+        params[:,1] = numpy.max(data, axis = 1)
+        params[:,2] = 0.5 * shape[0]
+        params[:,3] = 0.5 * shape[1]
+        params[:,4:] = 2.0 * self.sigma
+        return params
+
+    def levenbergMarquardt(self, data, x, y, params):
+        """
+        Fit all the images at the same time, each with its own damping.
+        """
+        n_fits = data.shape[0]
+        params = params.copy()
+        converged = numpy.zeros(n_fits, dtype = numpy.bool_)
+        failed = numpy.zeros(n_fits, dtype = numpy.bool_)
+        diagonal = numpy.arange(self.n_params)
+        lambdas = numpy.full(n_fits, 1.0e-3)
+
+        [model, gauss] = self.model(params, x, y)
+        error = numpy.sum((model - data)**2, axis = 1)
+        for i in range(self.max_iterations):
+            jacobian = self.jacobian(params, gauss, x, y)
+            jt = jacobian.transpose(0, 2, 1)
+            jtj = numpy.matmul(jt, jacobian)
+            jtr = numpy.matmul(jt, (data - model)[:,:,None])
+
+            # Marquardt scaling of the damping term.
+            jtj[:, diagonal, diagonal] *= 1.0 + lambdas[:,None]
+            try:
+                delta = numpy.linalg.solve(jtj, jtr)[:,:,0]
+            except numpy.linalg.LinAlgError:
+                break
+
+            new_params = params + delta
+            [new_model, new_gauss] = self.model(new_params, x, y)
+            new_error = numpy.sum((new_model - data)**2, axis = 1)
+
+            # Accept the steps that reduced the error, fits that have
+            # already stopped are left alone.
+            active = ~(converged | failed)
+            better = (new_error < error) & active
+
+            # Converged when an accepted step barely changes the error or the
+            # parameters. Failed if a small step doesn't reduce the error, or
+            # if the damping gets so large that we're not going anywhere.
+            small_step = numpy.all(numpy.abs(delta) <= self.tolerance * (numpy.abs(params) + 1.0), axis = 1)
+            converged |= better & (small_step | ((error - new_error) <= self.tolerance * error))
+            failed |= active & ~better & (small_step | (lambdas > 1.0e8))
+
+            params[better] = new_params[better]
+            model[better] = new_model[better]
+            gauss[better] = new_gauss[better]
+            error[better] = new_error[better]
+            lambdas = numpy.where(better, 0.1 * lambdas, 10.0 * lambdas)
+
+            if (converged | failed).all():
+                break
+
+        # The model only depends on the square of the widths.
+        params[:,4:] = numpy.abs(params[:,4:])
+        good = converged & numpy.all(numpy.isfinite(params), axis = 1)
+        if not good.all():
+            hdebug.logText("Fitting problem: " + str(numpy.count_nonzero(~good)) + " fits did not converge")
+        return [params, good]
+
+    def jacobian(self, params, gauss, x, y):
+        """
+        Returns the (n_fits, n_pixels, n_params) Jacobian of the model.
+        """
+        height = params[:,1,None]
+        dx = params[:,2,None] - x
+        dy = params[:,3,None] - y
+        if self.elliptical:
+            wx = params[:,4,None]
+            wy = params[:,5,None]
+        else:
+            wx = params[:,4,None]
+            wy = wx
+        hg = height * gauss
+
+        jacobian = numpy.empty((params.shape[0], x.size, self.n_params))
+        jacobian[:,:,0] = 1.0
+        jacobian[:,:,1] = gauss
+        jacobian[:,:,2] = -4.0 * hg * dx/(wx*wx)
+        jacobian[:,:,3] = -4.0 * hg * dy/(wy*wy)
+        if self.elliptical:
+            jacobian[:,:,4] = 4.0 * hg * dx*dx/(wx*wx*wx)
+            jacobian[:,:,5] = 4.0 * hg * dy*dy/(wy*wy*wy)
+        else:
+            jacobian[:,:,4] = 4.0 * hg * (dx*dx + dy*dy)/(wx*wx*wx)
+        return jacobian
+
+    def model(self, params, x, y):
+        """
+        Returns the model and the gaussian part of the model (which we
+        re-use for the Jacobian).
+        """
+        dx = (params[:,2,None] - x)/params[:,4,None]
+        if self.elliptical:
+            dy = (params[:,3,None] - y)/params[:,5,None]
+        else:
+            dy = (params[:,3,None] - y)/params[:,4,None]
+        gauss = numpy.exp(-2.0 * (dx*dx + dy*dy))
+        return [params[:,0,None] + params[:,1,None] * gauss, gauss]
+
+    def reset(self):
+        """
+        Don't use the previous solution as the starting point for the next fit.
+        """
+        self.last_good = None
+        self.last_origins = None
+        self.last_params = None
+
+
+#
+# Benchmark against fitFixedEllipticalGaussian().
+#
+if (__name__ == "__main__"):
+
+    def drawGaussian(size, cx, cy, wx, wy):
+        [x, y] = numpy.indices((size, size))
+        return numpy.random.poisson(10.0 + 300.0 * numpy.exp(-2.0 * (((cx-x)/wx)**2 + ((cy-y)/wy)**2))).astype(numpy.float64)
+
+    sigma = 4.0
+    size = 2 * int(1.5 * sigma)
+    images = [[drawGaussian(size, 0.5*size + numpy.random.uniform(-0.5, 0.5), 0.5*size, 1.1*sigma, sigma),
+               drawGaussian(size, 0.5*size, 0.5*size + numpy.random.uniform(-0.5, 0.5), sigma, 0.9*sigma)] for i in range(100)]
+
+    start_time = time.perf_counter()
+    for pair in images:
+        for image in pair:
+            fitFixedEllipticalGaussian(image, sigma)
+    print("leastsq, {0:.3f}ms per pair".format(1000.0 * (time.perf_counter() - start_time)/len(images)))
+
+    fitter = GaussianFitter(sigma = sigma)
+    start_time = time.perf_counter()
+    for pair in images:
+        fitter.fit(pair)
+    print("GaussianFitter, {0:.3f}ms per pair".format(1000.0 * (time.perf_counter() - start_time)/len(images)))
+
+    start_time = time.perf_counter()
+    for pair in images:
+        fitter.fit(pair, origins = [[0, 0], [0, 0]])
+    print("GaussianFitter (warm start), {0:.3f}ms per pair".format(1000.0 * (time.perf_counter() - start_time)/len(images)))
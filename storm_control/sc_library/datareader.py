@@ -16,8 +16,8 @@ Hazen 07/15
 
 import numpy
 import os
-from PIL import Image
 import re
+import tifffile
 
 import storm_control.sc_library.parameters as parameters
 
@@ -112,10 +112,12 @@ def infToXmlObject(filename):
     return xml
 
 
-def reader(filename):
+def reader(filename, memmap = False):
     """
     Returns the appropriate object based on the file type as
     saved in the corresponding XML file.
+
+    memmap - Use a memory mapped file (if supported by the reader).
     """
     no_ext_name = os.path.splitext(filename)[0]
 
@@ -140,12 +142,14 @@ def reader(filename):
 
     if (file_type == ".dax"):
         return DaxReader(filename = filename,
+                         memmap = memmap,
                          xml = xml)
     elif (file_type == ".spe"):
         return SpeReader(filename = filename,
                          xml = xml)
-    elif (file_type == ".tif"): 
+    elif (file_type == ".tif") or (file_type == ".big.tif"):
         return TifReader(filename = filename,
+                         memmap = memmap,
                          xml = xml)
     else:
         print(file_type, "is not a recognized file type")
@@ -165,6 +169,10 @@ class DataReader(object):
 
      2. loadAFrame(self, frame_number)
         Load the requested frame and return it as numpy array.
+
+    Subclasses can also implement loadFrames() if they can do
+    something more efficient than loading the frames one at a
+    time.
     """
     def __init__(self, filename = None, xml = None, **kwds):
         super().__init__(**kwds)
@@ -196,6 +204,16 @@ class DataReader(object):
         if (frame_number >= self.number_frames):
             raise IOError("frame number must be less than " + str(self.number_frames))
             
+    # Check the requested frame range and return it as a range object.
+    def checkFrameRange(self, start, stop, step):
+        if stop is None:
+            stop = self.number_frames
+        frames = range(start, stop, step)
+        if (len(frames) > 0):
+            self.checkFrameNumber(frames[0])
+            self.checkFrameNumber(frames[-1])
+        return frames
+
     # Close the file.
     def closeFilePtr(self):
         if self.fileptr:
@@ -213,12 +231,38 @@ class DataReader(object):
     def filmSize(self):
         return [self.image_width, self.image_height, self.number_frames]
 
+    def iterFrames(self, chunk = 100, start = 0, stop = None, **kwds):
+        """
+        Iterate over the frames in the movie in chunks of (up to)
+        chunk frames. Each chunk is a 3D numpy array, the first
+        index is the frame number.
+        """
+        frames = self.checkFrameRange(start, stop, 1)
+        for i in range(frames.start, frames.stop, chunk):
+            yield self.loadFrames(i, min(i + chunk, frames.stop), **kwds)
+
+    def loadFrames(self, start = 0, stop = None, step = 1, **kwds):
+        """
+        Load the frames in range(start, stop, step) and return them as
+        a 3D numpy array, the first index is the frame number.
+        """
+        frames = self.checkFrameRange(start, stop, step)
+        return numpy.array([self.loadAFrame(i, **kwds) for i in frames])
+
 
 class DaxReader(DataReader):
     """
     Dax reader class. This is a Zhuang lab custom format.
+
+    If memmap is True the file is memory mapped and the frames
+    that are returned are views of the memory mapped file (unless
+    the file is big endian). These are read only.
+
+    The frames are stored as the transpose of what we return, so
+    callers that don't need this can use transpose = False. With
+    memory mapping this will then also be C contiguous.
     """
-    def __init__(self, **kwds):
+    def __init__(self, memmap = False, **kwds):
         super().__init__(**kwds)
 
         self.bigendian = self.xml.get("film.want_big_endian", False)
@@ -234,17 +278,71 @@ class DaxReader(DataReader):
         # open the dax file
         self.fileptr = open(self.filename, "rb")
 
+        self.mmap = None
+        if memmap:
+            dtype = numpy.dtype(">u2") if self.bigendian else numpy.dtype("<u2")
+            try:
+                self.mmap = numpy.memmap(self.fileptr,
+                                         dtype = dtype,
+                                         mode = "r",
+                                         shape = (self.number_frames, self.image_width, self.image_height))
+            except ValueError as exception:
+                raise IOError("Could not memory map " + self.filename + ", " + str(exception))
+
+    def closeFilePtr(self):
+        # Any views of the memory map that are still in use will
+        # keep the file mapped until they are garbage collected.
+        self.mmap = None
+        super().closeFilePtr()
+
+    def convertFrames(self, image_data, transpose):
+        """
+        Convert raw (the last two axises) frame data to the
+        expected byte order and orientation.
+        """
+        if not image_data.dtype.isnative:
+            image_data = image_data.astype(numpy.uint16)
+        if transpose:
+            image_data = numpy.swapaxes(image_data, -1, -2)
+        return image_data
+
     # load a frame & return it as a numpy array
-    def loadAFrame(self, frame_number):
+    def loadAFrame(self, frame_number, transpose = True):
         if self.fileptr:
             self.checkFrameNumber(frame_number)
+            if self.mmap is not None:
+                return self.convertFrames(self.mmap[frame_number], transpose)
             self.fileptr.seek(frame_number * self.image_height * self.image_width * 2)
             image_data = numpy.fromfile(self.fileptr, dtype=numpy.uint16, count = self.image_height * self.image_width)
-            image_data = numpy.transpose(numpy.reshape(image_data, [self.image_width, self.image_height]))
+            image_data = numpy.reshape(image_data, [self.image_width, self.image_height])
             if self.bigendian:
                 image_data.byteswap(True)
+            if transpose:
+                image_data = numpy.transpose(image_data)
             return image_data
 
+    def loadFrames(self, start = 0, stop = None, step = 1, transpose = True):
+        """
+        With memory mapping this is a view of the file (for little endian
+        files), otherwise consecutive frames are read with a single read
+        call.
+        """
+        if self.fileptr:
+            frames = self.checkFrameRange(start, stop, step)
+            if self.mmap is not None:
+                return self.convertFrames(self.mmap[frames.start:frames.stop:frames.step], transpose)
+
+            if (step != 1):
+                return super().loadFrames(start, stop, step, transpose = transpose)
+
+            frame_size = self.image_height * self.image_width
+            self.fileptr.seek(frames.start * frame_size * 2)
+            image_data = numpy.fromfile(self.fileptr, dtype=numpy.uint16, count = len(frames) * frame_size)
+            image_data = numpy.reshape(image_data, [len(frames), self.image_width, self.image_height])
+            if self.bigendian:
+                image_data.byteswap(True)
+            return self.convertFrames(image_data, transpose)
+
 
 class SpeReader(DataReader):
     """
@@ -297,30 +395,130 @@ class SpeReader(DataReader):
 
 class TifReader(DataReader):
     """
-    TIF reader class.
+    TIF reader class. This handles both the ImageJ and the BigTIFF
+    files that HAL writes.
+
+    The location of the image data for every page is found when the
+    file is opened. If the pages are not compressed (HAL does not
+    compress) then frames are read directly from the file, or are
+    views of the file if memmap is True, rather than going through
+    tifffile for every frame.
     """
-    def __init__(self, **kwds):
+    def __init__(self, memmap = False, **kwds):
+
+        # closeFilePtr() is called by __del__() even if this fails.
+        self.tif = None
         super().__init__(**kwds)
-                
-        self.fileptr = False
-        self.im = Image.open(filename)
-        self.isize = self.im.size
+
+        self.mmap = None
+        self.page_stride = None
+        self.tif = tifffile.TiffFile(self.filename)
+
+        # Only index the IFDs, this is a lot faster than loading every page.
+        pages = self.tif.pages
+        pages.useframes = True
+        keyframe = pages[0]
+        if (len(keyframe.shape) != 2):
+            self.tif.close()
+            raise IOError("not a monochrome tif image.")
+        
+        # The dtype from tifffile is native, the data in the file might not be.
+        self.page_dtype = numpy.dtype(self.tif.byteorder + keyframe.dtype.char)
+        self.page_shape = keyframe.shape
 
         # FIXME: Should check that these match the XML file.
-        self.image_width = self.isize[1]
-        self.image_height = self.isize[0]
+        self.image_width = self.page_shape[0]
+        self.image_height = self.page_shape[1]
 
-        self.number_frames = self.xml.get("acquisition.number_frames")
+        #
+        # ImageJ files with more than 4GB of data only have a single
+        # IFD, but the data is contiguous so we can just find the
+        # start of the data.
+        #
+        series = self.tif.series[0]
+        if self.tif.is_imagej and (series.dataoffset is not None) and (len(series.shape) > 2):
+            self.number_frames = int(numpy.prod(series.shape[:-2]))
+            self.page_offsets = series.dataoffset + numpy.arange(self.number_frames) * keyframe.nbytes
+        else:
+            self.number_frames = len(pages)
+            self.page_offsets = None
+            if keyframe.is_memmappable:
+                self.page_offsets = numpy.zeros(self.number_frames, dtype = numpy.int64)
+                for i in range(self.number_frames):
+                    page = pages[i]
+                    offsets = page.dataoffsets
+                    counts = page.databytecounts
+                    if (sum(counts) != keyframe.nbytes) or \
+                       any((offsets[j] + counts[j]) != offsets[j+1] for j in range(len(offsets) - 1)):
+                        self.page_offsets = None
+                        break
+                    self.page_offsets[i] = offsets[0]
+
+        if self.page_offsets is not None:
+            self.fileptr = open(self.filename, "rb")
+
+            # Check if the pages are evenly spaced in the file.
+            if (self.number_frames > 1):
+                diffs = numpy.diff(self.page_offsets)
+                if numpy.all(diffs == diffs[0]) and (diffs[0] >= keyframe.nbytes):
+                    self.page_stride = int(diffs[0])
+            else:
+                self.page_stride = keyframe.nbytes
+
+            if memmap:
+                self.mmap = numpy.memmap(self.fileptr, dtype = numpy.uint8, mode = "r")
 
-    def loadAFrame(self, frame_number, cast_to_int16 = True):
-        self.checkFrameNumber(frame_number)
-        self.im.seek(frame_number)
-        image_data = numpy.array(list(self.im.getdata()))
-        assert len(image_data.shape) == 1, "not a monochrome tif image."
+    def closeFilePtr(self):
+        self.mmap = None
+        if self.tif is not None:
+            self.tif.close()
+        super().closeFilePtr()
+
+    def convertFrames(self, image_data, cast_to_int16, transpose):
         if cast_to_int16:
             image_data = image_data.astype(numpy.int16)
-        image_data = numpy.transpose(numpy.reshape(image_data, (self.image_width, self.image_height)))
+        elif not image_data.dtype.isnative:
+            image_data = image_data.astype(image_data.dtype.newbyteorder("="))
+        if transpose:
+            image_data = numpy.swapaxes(image_data, -1, -2)
         return image_data
+        
+    def loadAFrame(self, frame_number, cast_to_int16 = True, transpose = True):
+        self.checkFrameNumber(frame_number)
+        if self.page_offsets is None:
+            image_data = self.tif.pages[frame_number].asarray()
+            
+        elif self.mmap is not None:
+            image_data = numpy.ndarray(self.page_shape,
+                                       dtype = self.page_dtype,
+                                       buffer = self.mmap,
+                                       offset = self.page_offsets[frame_number])
+        else:
+            self.fileptr.seek(self.page_offsets[frame_number])
+            image_data = numpy.fromfile(self.fileptr,
+                                        dtype = self.page_dtype,
+                                        count = self.page_shape[0] * self.page_shape[1])
+            image_data = numpy.reshape(image_data, self.page_shape)
+
+        return self.convertFrames(image_data, cast_to_int16, transpose)
+
+    def loadFrames(self, start = 0, stop = None, step = 1, cast_to_int16 = True, transpose = True):
+        """
+        If the file is memory mapped and the pages are evenly spaced
+        this is done with a (strided) view of the file.
+        """
+        if (self.mmap is None) or (self.page_stride is None):
+            return super().loadFrames(start, stop, step, cast_to_int16 = cast_to_int16, transpose = transpose)
+
+        frames = self.checkFrameRange(start, stop, step)
+        image_data = numpy.ndarray((self.number_frames,) + self.page_shape,
+                                   dtype = self.page_dtype,
+                                   buffer = self.mmap,
+                                   offset = self.page_offsets[0],
+                                   strides = (self.page_stride,
+                                              self.page_shape[1] * self.page_dtype.itemsize,
+                                              self.page_dtype.itemsize))
+        return self.convertFrames(image_data[frames.start:frames.stop:frames.step], cast_to_int16, transpose)
 
 
 #
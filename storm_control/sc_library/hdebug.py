@@ -12,6 +12,7 @@ import logging.handlers
 from PyQt5 import QtCore
 
 a_logger = False
+log_basename = None
 logging_mutex = QtCore.QMutex()
 
 def objectToString(a_object, a_name, a_attrs):
@@ -80,6 +81,13 @@ def logText(a_string, to_console = False):
     else:
         print(a_string)
 
+def getLogBasename():
+    """
+    Return the name of the current log file without the extension, or
+    None if logging has not been started.
+    """
+    return log_basename
+
 def startLogging(directory, program_name):
     """
     This should only be called once in "main". It uses QSettings() to generate
@@ -89,7 +97,7 @@ def startLogging(directory, program_name):
     FIXME? As this seems to just append to existing log files, it would probably
            be better to delete the existing files first.
     """
-    global a_logger
+    global a_logger, log_basename
 
     # Get logger index (to allow logging from several programs with the same name).
     settings = QtCore.QSettings("Zhuang Lab", "hdebug logger")
@@ -120,6 +128,7 @@ def startLogging(directory, program_name):
     if a_logger:
         rf_handler.setFormatter(rt_formatter)
         a_logger.addHandler(rf_handler)
+        log_basename = directory + program_name + "_" + str(index)
         
 
 #
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+"""
+Low overhead binary tracing of HAL message events.
+
+This is an alternative to logging message events as text with
+hdebug.logText(). Each event is a fixed size record with the
+following fields:
+
+   time   - perf_counter_ns() time stamp (uint64).
+   m_id   - The message ID (uint32), or the number of messages for
+            'drained' events.
+   name   - Index of the module name (uint16).
+   m_type - Index of the message type (uint16).
+   event  - The event type (uint8).
+
+Events are packed into a pre-allocated ring buffer. A separate
+thread periodically writes the buffer to the trace file, so the
+thread that records an event never does any file IO. Module names
+and message types are stored in the trace file as small integers.
+The strings are saved in a separate '.names' file, one per line.
+
+If the flush thread falls behind and the ring buffer fills up then
+new events are dropped (and counted) rather than blocking.
+
+The trace file for 'basename' is 'basename.trace'. Use loadTrace()
+to read it back, log_timing.py knows how to use these files.
+"""
+
+import numpy
+import struct
+import threading
+import time
+
+
+# Event types.
+QUEUED = 1
+SENT = 2
+HANDLED = 3
+PROCESSED = 4
+WORKER_STARTED = 5
+WORKER_DONE = 6
+WORKER_FAILED = 7
+DRAINED = 8
+
+event_codes = {"queued" : QUEUED,
+               "sent" : SENT,
+               "handled by" : HANDLED,
+               "processed" : PROCESSED,
+               "worker started" : WORKER_STARTED,
+               "worker done" : WORKER_DONE,
+               "worker failed" : WORKER_FAILED,
+               "drained" : DRAINED}
+
+#
+# The tracing level that an event type is recorded at, levels are:
+#
+# 0 - No tracing.
+# 1 - Message life cycle (queued, sent, handled by, processed), worker and dispatch events.
+#
+# Events that are not traced at the current level are not logged as text
+# either, so the events that log_timing.py needs are all level 1.
+#
+event_levels = {QUEUED : 1,
+                SENT : 1,
+                HANDLED : 1,
+                PROCESSED : 1,
+                WORKER_STARTED : 1,
+                WORKER_DONE : 1,
+                WORKER_FAILED : 1,
+                DRAINED : 1}
+
+# File header, the last byte is the file format version.
+header = b"HALTRC\x00\x01"
+
+record = struct.Struct("<QIHHBx")
+record_dtype = numpy.dtype([("time", "<u8"),
+                            ("m_id", "<u4"),
+                            ("name", "<u2"),
+                            ("m_type", "<u2"),
+                            ("event", "u1"),
+                            ("pad", "u1")])
+
+tracer = None
+
+
+class Tracer(threading.Thread):
+    """
+    The ring buffer and the thread that writes it to disk.
+    """
+    def __init__(self, basename = None, flush_interval = 0.5, level = 1, n_events = 65536, sample_every = 1, **kwds):
+        """
+        basename - The trace file name without the extension.
+        flush_interval - How often (in seconds) to write the buffer to disk.
+        level - The tracing level, see event_levels.
+        n_events - The size of the ring buffer.
+        sample_every - Only trace messages whose ID is a multiple of this.
+        """
+        super().__init__(**kwds)
+        self.daemon = True
+
+        self.buffer = bytearray(n_events * record.size)
+        self.buffer_lock = threading.Lock()
+        self.dropped = 0
+        self.flush_interval = flush_interval
+        self.level = level
+        self.n_events = n_events
+        self.n_names_written = 0
+        self.name_index = {}
+        self.name_lock = threading.Lock()
+        self.names = []
+        self.read_count = 0
+        self.running = True
+        self.sample_every = sample_every
+        self.wake = threading.Event()
+        self.write_count = 0
+
+        self.fp = open(basename + ".trace", "wb")
+        self.fp.write(header)
+        self.names_fp = open(basename + ".trace.names", "w")
+
+    def flush(self):
+        """
+        Write any new events and names to disk.
+        """
+        with self.buffer_lock:
+            start = self.read_count
+            stop = self.write_count
+
+        # Names first, so that every name index in the trace file is
+        # always defined.
+        n_names = len(self.names)
+        for i in range(self.n_names_written, n_names):
+            self.names_fp.write(self.names[i] + "\n")
+        self.n_names_written = n_names
+        self.names_fp.flush()
+
+        if (stop > start):
+            i_start = (start % self.n_events) * record.size
+            i_stop = (stop % self.n_events) * record.size
+            view = memoryview(self.buffer)
+            if (i_stop > i_start):
+                self.fp.write(view[i_start:i_stop])
+            else:
+                self.fp.write(view[i_start:])
+                self.fp.write(view[:i_stop])
+            with self.buffer_lock:
+                self.read_count = stop
+            self.fp.flush()
+
+    def getStatistics(self):
+        with self.buffer_lock:
+            return {"dropped" : self.dropped,
+                    "events" : self.write_count}
+
+    def nameIndex(self, name):
+        try:
+            return self.name_index[name]
+        except KeyError:
+            with self.name_lock:
+                if not name in self.name_index:
+                    self.names.append(name)
+                    self.name_index[name] = len(self.names) - 1
+            return self.name_index[name]
+
+    def record(self, event, m_id, name, m_type):
+        t_ns = time.perf_counter_ns()
+        i_name = self.nameIndex(str(name))
+        i_type = self.nameIndex(m_type)
+        with self.buffer_lock:
+            n_pending = self.write_count - self.read_count
+            if (n_pending >= self.n_events):
+                self.dropped += 1
+                return
+            record.pack_into(self.buffer,
+                             (self.write_count % self.n_events) * record.size,
+                             t_ns,
+                             m_id & 0xffffffff,
+                             i_name,
+                             i_type,
+                             event)
+            self.write_count += 1
+
+        # Wake up the flush thread if the buffer is getting full.
+        if (n_pending == self.n_events//2):
+            self.wake.set()
+
+    def run(self):
+        while self.running:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self.flush()
+        self.flush()
+        self.fp.close()
+        self.names_fp.close()
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
+        self.join()
+
+
+def getStatistics():
+    """
+    Returns the number of events recorded and dropped, or None if we
+    are not tracing.
+    """
+    if tracer is not None:
+        return tracer.getStatistics()
+
+def isTracing():
+    return (tracer is not None)
+
+def loadTrace(basename):
+    """
+    Returns the events in a trace file as a numpy structured array
+    and the list of names.
+    """
+    with open(basename + ".trace", "rb") as fp:
+        if (fp.read(len(header)) != header):
+            raise IOError(basename + ".trace is not a HAL trace file.")
+
+    events = numpy.fromfile(basename + ".trace", dtype = record_dtype, offset = len(header))
+    with open(basename + ".trace.names") as fp:
+        names = fp.read().splitlines()
+    return [events, names]
+
+def startTracing(basename, level = 1, sample_every = 1, n_events = 65536):
+    """
+    Start tracing to the file basename.trace. If level is 0 this does
+    nothing.
+    """
+    global tracer
+    stopTracing()
+    if (level > 0):
+        tracer = Tracer(basename = basename,
+                        level = level,
+                        n_events = n_events,
+                        sample_every = sample_every)
+        tracer.start()
+
+def stopTracing():
+    """
+    Stop tracing and write any remaining events to disk.
+    """
+    global tracer
+    if tracer is not None:
+        a_tracer = tracer
+        tracer = None
+        a_tracer.stop()
+
+def traceEvent(event_name, m_id, name, m_type = ""):
+    """
+    Record an event, event_name is one of the keys in event_codes. Returns
+    False if we are not tracing so the caller can fall back to text logging.
+
+    Note that the sampling is done by message ID so that we get either
+    all or none of the events for a message.
+    """
+    a_tracer = tracer
+    if a_tracer is None:
+        return False
+
+    # Some events, like 'worker started 1000', include extra information
+    # that we don't record.
+    if event_name in event_codes:
+        event = event_codes[event_name]
+    else:
+        event = event_codes[" ".join(event_name.split(" ")[:2])]
+    if (event_levels[event] > a_tracer.level):
+        return True
+
+    if (event != DRAINED) and ((m_id % a_tracer.sample_every) != 0):
+        return True
+
+    a_tracer.record(event, m_id, name, m_type)
+    return True
+
+
+#
+# The MIT License
+#
+# Copyright (c) 2018 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
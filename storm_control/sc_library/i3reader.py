@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+"""
+Memory mapped reader for Insight3 (.bin) format localization files.
+
+The file is a 16 byte header (version, frames, status, molecules)
+followed by a fixed size record for each localization. The records
+are memory mapped rather than read into memory, so only the parts of
+the file that are actually used are loaded (by the OS, as needed).
+
+Typical usage is to select just the fields (columns) that you need,
+either as lazy views of the whole file:
+
+   reader = I3Reader("movie_mlist.bin")
+   fr = reader.getField("fr")
+
+Or as (compact) in memory copies, a chunk of frames at a time:
+
+   for chunk in reader.chunks(["x", "y", "fr"], frames_per_chunk = 500):
+       ...
+
+Note that localizations are usually, but not always, stored in frame
+order. Chunking by frame is faster if they are as the chunk boundaries
+can then be found with a binary search.
+"""
+
+import numpy
+import os
+import struct
+
+
+header_size = 16
+
+
+def i3DataType():
+    """
+    Returns the numpy data type of a Insight3 localization record.
+    """
+    return numpy.dtype([('x', numpy.float32),   # original x location
+                        ('y', numpy.float32),   # original y location
+                        ('xc', numpy.float32),  # drift corrected x location
+                        ('yc', numpy.float32),  # drift corrected y location
+                        ('h', numpy.float32),   # fit height
+                        ('a', numpy.float32),   # fit area
+                        ('w', numpy.float32),   # fit width
+                        ('phi', numpy.float32), # fit angle (for unconstrained elliptical gaussian)
+                        ('ax', numpy.float32),  # peak aspect ratio
+                        ('bg', numpy.float32),  # fit background
+                        ('i', numpy.float32),   # sum - baseline for pixels included in the peak
+                        ('c', numpy.int32),     # peak category ([0..9] for STORM images)
+                        ('fi', numpy.int32),    # fit iterations
+                        ('fr', numpy.int32),    # frame
+                        ('tl', numpy.int32),    # track length
+                        ('lk', numpy.int32),    # link (id of the next molecule in the trace)
+                        ('z', numpy.float32),   # original z coordinate
+                        ('zc', numpy.float32)]) # drift corrected z coordinate
+
+def readHeader(fp):
+    """
+    Returns [# frames, # localizations, file version, file status].
+    """
+    [version, frames, status, molecules] = struct.unpack("4siii", fp.read(header_size))
+    return [frames, molecules, version, status]
+
+
+def searchFrame(fr, frame):
+    """
+    Returns the index of the first localization in frame or later,
+    fr must be sorted. numpy.searchsorted() would make a copy of fr,
+    which is the whole column if fr is a memory mapped field.
+    """
+    lo = 0
+    hi = fr.size
+    while (lo < hi):
+        mid = (lo + hi)//2
+        if (fr[mid] < frame):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+class I3Reader(object):
+    """
+    Memory mapped Insight3 file reader.
+    """
+    def __init__(self, filename = None, chunk_size = 1000000, **kwds):
+        """
+        filename - The name of the Insight3 file.
+        chunk_size - The (maximum) number of localizations to process
+                     at once when scanning the file.
+        """
+        super().__init__(**kwds)
+        self.chunk_size = chunk_size
+        self.data = None
+        self.filename = filename
+        self.frames_sorted = None
+
+        with open(filename, "rb") as fp:
+            [self.frames, self.molecules, self.version, self.status] = readHeader(fp)
+
+        # The file can be longer than the localizations (Insight3 saves
+        # some meta-data at the end), or shorter if it is not finished.
+        available = max(0, (os.path.getsize(filename) - header_size)//i3DataType().itemsize)
+        if (self.molecules > available):
+            print("Warning", filename, "is truncated, expected", self.molecules, "localizations, found", available)
+            self.molecules = available
+
+        if (self.molecules > 0):
+            self.data = numpy.memmap(filename,
+                                     dtype = i3DataType(),
+                                     mode = "r",
+                                     offset = header_size,
+                                     shape = (self.molecules,))
+
+    def chunks(self, fields, frames_per_chunk = 1000, start = None, stop = None):
+        """
+        A generator of compact structured arrays containing only
+        fields, each covering (up to) frames_per_chunk frames. Only
+        localizations with start <= frame < stop are returned.
+        """
+        if (self.molecules == 0):
+            return
+
+        fr = self.getField("fr")
+        if start is None:
+            start = int(self.getFrameRange()[0])
+        if stop is None:
+            stop = int(self.getFrameRange()[1]) + 1
+
+        if self.isFrameSorted():
+            for first in range(start, stop, frames_per_chunk):
+                last = min(first + frames_per_chunk, stop)
+                i = searchFrame(fr, first)
+                j = searchFrame(fr, last)
+                if (j > i):
+                    yield self.project(fields, slice(i, j))
+
+        # Unsorted files have to be scanned once for each chunk.
+        else:
+            for first in range(start, stop, frames_per_chunk):
+                last = min(first + frames_per_chunk, stop)
+                index = []
+                for i in range(0, self.molecules, self.chunk_size):
+                    c_fr = fr[i:i+self.chunk_size]
+                    index.append(i + numpy.nonzero((c_fr >= first) & (c_fr < last))[0])
+                index = numpy.concatenate(index)
+                if (index.size > 0):
+                    yield self.project(fields, index)
+
+    def getField(self, field):
+        """
+        Returns a lazy (memory mapped) view of a single field.
+        """
+        if self.data is None:
+            return numpy.zeros(0, dtype = i3DataType()[field])
+        return self.data[field]
+
+    def getFrameRange(self):
+        """
+        Returns [first frame, last frame].
+        """
+        if self.isFrameSorted():
+            fr = self.getField("fr")
+            return [fr[0], fr[-1]]
+        else:
+            return self.reduceField("fr", [numpy.min, numpy.max])
+
+    def getNumberMolecules(self):
+        return self.molecules
+
+    def isFrameSorted(self):
+        """
+        Returns True if the localizations are in frame order.
+        """
+        if self.frames_sorted is None:
+            self.frames_sorted = True
+            fr = self.getField("fr")
+            for i in range(0, self.molecules, self.chunk_size):
+                # Include the last element of the previous chunk.
+                c_fr = fr[max(0, i-1):i+self.chunk_size]
+                if (numpy.diff(c_fr) < 0).any():
+                    self.frames_sorted = False
+                    break
+        return self.frames_sorted
+
+    def load(self, fields, mask_fn = None):
+        """
+        Returns a compact structured array containing only fields,
+        reading the file a chunk at a time. mask_fn is an optional
+        function that takes a chunk and returns a mask of the
+        localizations to keep.
+        """
+        chunks = []
+        for i in range(0, self.molecules, self.chunk_size):
+            chunk = self.project(fields, slice(i, i + self.chunk_size))
+            if mask_fn is not None:
+                chunk = chunk[mask_fn(chunk)]
+            chunks.append(chunk)
+        if (len(chunks) == 0):
+            return numpy.zeros(0, dtype = self.projectedDataType(fields))
+        return numpy.concatenate(chunks)
+
+    def project(self, fields, index):
+        """
+        Returns a compact (in memory) structured array containing only
+        fields for the localizations in index (a slice or an array).
+        """
+        if self.data is None:
+            return numpy.zeros(0, dtype = self.projectedDataType(fields))
+
+        c_data = None
+        for field in fields:
+            values = self.data[field][index]
+            if c_data is None:
+                c_data = numpy.empty(values.size, dtype = self.projectedDataType(fields))
+            c_data[field] = values
+        return c_data
+
+    def projectedDataType(self, fields):
+        i3_type = i3DataType()
+        return numpy.dtype([(field, i3_type[field]) for field in fields])
+
+    def reduceField(self, field, functions):
+        """
+        Apply each of functions (i.e. numpy.min) to field a chunk at a
+        time, returns a list with the result of each function.
+        """
+        results = []
+        values = self.getField(field)
+        for fn in functions:
+            partial = [fn(values[i:i+self.chunk_size]) for i in range(0, self.molecules, self.chunk_size)]
+            results.append(fn(numpy.array(partial)))
+        return results
+
+
+#
+# The MIT License
+#
+# Copyright (c) 2018 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
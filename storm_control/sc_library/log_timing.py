@@ -1,14 +1,22 @@
 #!/usr/bin/env python
 """
 This parses a log file series (i.e. log, log.1, log.2, etc..) and
-outputs timing and call frequency information for HAL messages.
+outputs timing and call frequency information for HAL messages, as 
+well as how many messages HAL core and the modules processed per timer
+event.
+
+If there is a binary trace file (see sc_library/htrace.py) then
+this is used instead of the text log files.
 
 Hazen 5/18
 """
 from datetime import datetime
 import os
 
+import storm_control.sc_library.htrace as htrace
+
 
+epoch = datetime(1970, 1, 1)
 pattern = '%Y-%m-%d %H:%M:%S,%f'
 
 
@@ -31,7 +39,7 @@ class Message(object):
 
     def created(self, time):
         t_time = self.parseTime(time)
-        self.created_time = (self.temp - t_time).total_seconds()
+        self.created_time = self.temp - t_time
 
     def handledBy(self, module_name):
         if module_name in self.handled_by:
@@ -93,18 +101,52 @@ class Message(object):
         return (self.processing_time != None)
 
     def parseTime(self, time):
-        return datetime.strptime(time, pattern)
+        """
+        Returns the time in seconds. This is either a time stamp string
+        from a log file, or a time in seconds from a trace file.
+        """
+        if isinstance(time, str):
+            return (datetime.strptime(time, pattern) - epoch).total_seconds()
+        else:
+            return time
 
     def processed(self, time):
         t_time = self.parseTime(time)
-        self.processing_time = (t_time - self.temp).total_seconds()
+        self.processing_time = t_time - self.temp
         
     def sent(self, time):
         t_time = self.parseTime(time)
-        self.queued_time = (t_time - self.temp).total_seconds()
+        self.queued_time = t_time - self.temp
         self.temp = t_time
 
 
+def drainCounts(basename):
+    """
+    Returns a dictionary keyed by module name (or 'core') with a list
+    of the number of messages processed each time that the module's
+    message timer fired.
+    """
+    drains = {}
+    if os.path.exists(basename + ".trace"):
+        [events, names] = htrace.loadTrace(basename)
+        events = events[(events["event"] == htrace.DRAINED)]
+        for [name, n_messages] in zip(events["name"].tolist(), events["m_id"].tolist()):
+            if names[name] in drains:
+                drains[names[name]].append(n_messages)
+            else:
+                drains[names[name]] = [n_messages]
+        return drains
+    
+    for [time, command] in logLines(basename):
+        if (command.startswith("drained,")):
+            [name, n_messages] = command.split(",")[1:]
+            if name in drains:
+                drains[name].append(int(n_messages))
+            else:
+                drains[name] = [int(n_messages)]
+    return drains
+
+
 def getIterable(dict_or_list):
     """
     Returns an iterable given a dictionary of a list.
@@ -157,9 +199,60 @@ def logTiming(basename, ignore_incomplete = True):
     """
     Returns a dictionary of Message objects keyed by their ID number.
     """
+    if os.path.exists(basename + ".trace"):
+        return traceTiming(basename, ignore_incomplete = ignore_incomplete)
+    
     zero_time = None
     messages = {}
 
+    for [time, command] in logLines(basename):
+
+        if zero_time is None:
+            zero_time = time
+
+        # Message handled by.
+        if (command.startswith("handled by,")):
+            [m_id, module_name, m_type] = command.split(",")[1:]
+            if m_id in messages:
+                messages[m_id].handledBy(module_name)
+
+        # Message queued.
+        elif (command.startswith("queued,")):
+            [m_id, source, m_type] = command.split(",")[1:]
+            messages[m_id] = Message(m_type = m_type,
+                                     source = source,
+                                     time = time,
+                                     zero_time = zero_time)
+                      
+        # Message sent.
+        elif (command.startswith("sent,")):
+            m_id = command.split(",")[1]
+            if m_id in messages:
+                messages[m_id].sent(time)
+
+        # Message processed.
+        elif (command.startswith("processed,")):
+            m_id = command.split(",")[1]
+            if m_id in messages:
+                messages[m_id].processed(time)
+
+        elif (command.startswith("worker done,")):
+            m_id = command.split(",")[1]
+            if m_id in messages:
+                messages[m_id].incNWorkers()
+
+    # Ignore messages that we don't have all the timing for.
+    if ignore_incomplete:
+        return onlyComplete(messages)
+    else:
+        return messages
+
+
+def logLines(basename):
+    """
+    Iterates over the lines in a log file series returning the time and 
+    the command for each line.
+    """
     for ext in [".5", ".4", ".3", ".2", ".1", ""]:
 
         fname = basename + ".out" + ext
@@ -175,50 +268,19 @@ def logTiming(basename, ignore_incomplete = True):
                 except ValueError:
                     continue
 
-                if zero_time is None:
-                    zero_time = time
-
-                # Message handled by.
-                if (command.startswith("handled by,")):
-                    [m_id, module_name, m_type] = command.split(",")[1:]
-                    if m_id in messages:
-                        messages[m_id].handledBy(module_name)
-
-                # Message queued.
-                elif (command.startswith("queued,")):
-                    [m_id, source, m_type] = command.split(",")[1:]
-                    messages[m_id] = Message(m_type = m_type,
-                                             source = source,
-                                             time = time,
-                                             zero_time = zero_time)
-                              
-                # Message sent.
-                elif (command.startswith("sent,")):
-                    m_id = command.split(",")[1]
-                    if m_id in messages:
-                        messages[m_id].sent(time)
-
-                # Message processed.
-                elif (command.startswith("processed,")):
-                    m_id = command.split(",")[1]
-                    if m_id in messages:
-                        messages[m_id].processed(time)
-
-                elif (command.startswith("worker done,")):
-                    m_id = command.split(",")[1]
-                    if m_id in messages:
-                        messages[m_id].incNWorkers()
+                yield [time, command]
 
-    # Ignore messages that we don't have all the timing for.
-    if ignore_incomplete:
-        temp = {}
-        for m_id in messages:
-            msg = messages[m_id]
-            if msg.isComplete():
-                temp[m_id] = msg
-        return temp
-    else:
-        return messages
+
+def onlyComplete(messages):
+    """
+    Returns only those messages that we have all the timing for.
+    """
+    temp = {}
+    for m_id in messages:
+        msg = messages[m_id]
+        if msg.isComplete():
+            temp[m_id] = msg
+    return temp
 
 
 def processingTime(messages):
@@ -249,6 +311,53 @@ def queuedTime(messages):
     return accum_time
 
 
+def traceTiming(basename, ignore_incomplete = True):
+    """
+    Version of logTiming() for trace files. This is a lot faster as
+    we don't have to parse any text.
+    """
+    [events, names] = htrace.loadTrace(basename)
+    messages = {}
+    if (events.size == 0):
+        return messages
+    
+    times = 1.0e-9 * (events["time"] - events["time"][0])
+
+    for [event, m_id, name, m_type, time] in zip(events["event"].tolist(),
+                                                 events["m_id"].tolist(),
+                                                 events["name"].tolist(),
+                                                 events["m_type"].tolist(),
+                                                 times.tolist()):
+        # Use strings for the message IDs, same as logTiming().
+        m_id = str(m_id)
+        
+        if (event == htrace.QUEUED):
+            messages[m_id] = Message(m_type = names[m_type],
+                                     source = names[name],
+                                     time = time,
+                                     zero_time = 0.0)
+
+        elif not m_id in messages:
+            continue
+
+        elif (event == htrace.HANDLED):
+            messages[m_id].handledBy(names[name])
+
+        elif (event == htrace.SENT):
+            messages[m_id].sent(time)
+
+        elif (event == htrace.PROCESSED):
+            messages[m_id].processed(time)
+
+        elif (event == htrace.WORKER_DONE):
+            messages[m_id].incNWorkers()
+
+    if ignore_incomplete:
+        return onlyComplete(messages)
+    else:
+        return messages
+    
+
 if (__name__ == "__main__"):
 
     import sys
@@ -276,5 +385,11 @@ if (__name__ == "__main__"):
         print(key + ", {0:0d} counts, {1:.3f} seconds".format(len(grp), processingTime(grp)))
     print("Total processing time {0:.3f} seconds".format(processingTime(groups)))
 
+    print()
+    print("Messages per timer event:")
+    drains = drainCounts(sys.argv[1])
+    for key in sorted(drains):
+        counts = drains[key]
+        print(key + ", {0:0d} events, {1:.2f} average, {2:0d} maximum".format(len(counts), sum(counts)/len(counts), max(counts)))
 
 
@@ -3,6 +3,9 @@
 A TCP communication class that acts as the client side for generic communications
 between programs in the storm-control project
 
+The client keeps track of the messages that are waiting for a response, so it can
+be used either one message at a time or with several messages outstanding.
+
 Jeffrey Moffitt
 3/8/14
 jeffmoffitt@gmail.com
@@ -11,6 +14,7 @@ jeffmoffitt@gmail.com
 # 
 # Import
 # 
+import collections
 import sys
 import time
 from PyQt5 import QtCore, QtGui, QtNetwork, QtWidgets
@@ -23,11 +27,13 @@ class TCPClient(QtCore.QObject, tcpCommunications.TCPCommunicationsMixin):
     """
     A TCP client class used to transfer TCP messages from one program to another
     """
+    allReceived = QtCore.pyqtSignal()
     comLostConnection = QtCore.pyqtSignal()
     messageReceived = QtCore.pyqtSignal(object)
 
     def __init__(self, **kwds):
         super().__init__(**kwds)
+        self.outstanding = collections.OrderedDict()
         
         # Create instance of TCP socket
         self.socket = QtNetwork.QTcpSocket()
@@ -46,17 +52,43 @@ class TCPClient(QtCore.QObject, tcpCommunications.TCPCommunicationsMixin):
             print(string)
 
         # Attempt to connect to host.
+        self.decoder.reset()
         self.socket.connectToHost(self.address, self.port)
 
         if not self.socket.waitForConnected(1000):
             print(self.server_name + " server not found")
 
+    def getOutstanding(self):
+        """
+        Return the messages that are waiting for a response, oldest first.
+        """
+        return list(self.outstanding.values())
+
     def handleDisconnect(self):
         """
         Handles the disconnect from the socket.
         """
+        self.outstanding.clear()
         self.comLostConnection.emit()
 
+    def handleMessage(self, message):
+        """
+        Forward a response, allReceived is emitted after the response to
+        the last outstanding message.
+        """
+        was_outstanding = (self.outstanding.pop(message.getID(), None) is not None)
+        super().handleMessage(message)
+        if was_outstanding and (len(self.outstanding) == 0):
+            self.allReceived.emit()
+
+    def sendMessage(self, message):
+        """
+        Send a message, the message is outstanding until we get a response.
+        """
+        if self.isConnected():
+            self.outstanding[message.getID()] = message
+        super().sendMessage(message)
+
     def startCommunication(self):
         """
         Start communications with server
@@ -11,7 +11,7 @@ Hazen 05/14
 
 from PyQt5 import QtCore, QtNetwork
 
-from storm_control.sc_library.tcpMessage import TCPMessage
+import storm_control.sc_library.tcpFraming as tcpFraming
 
 
 class TCPCommunicationsMixin(object):
@@ -21,9 +21,14 @@ class TCPCommunicationsMixin(object):
 
     They will should also include the following signal:
     messageReceived = QtCore.pyqtSignal(object)
+
+    Messages are sent as JSON, one per line. Messages whose JSON is at
+    least binary_threshold bytes are sent as compressed binary frames
+    instead, if this is allowed (see tcpFraming).
     """
     def __init__(self,
                  address = QtNetwork.QHostAddress(QtNetwork.QHostAddress.LocalHost),
+                 binary_threshold = None,
                  encoding = 'utf-8',
                  port = 9500,
                  server_name = "default",
@@ -33,12 +38,20 @@ class TCPCommunicationsMixin(object):
 
         # Initialize internal attributes
         self.address = address
+        self.binary_threshold = binary_threshold
+        self.decoder = tcpFraming.FrameDecoder(encoding = encoding)
         self.encoding = encoding
         self.port = port 
         self.server_name = server_name
         self.socket = None
         self.verbose = verbose
     
+    def canSendBinary(self):
+        """
+        Return True if the other side can handle binary frames.
+        """
+        return (self.binary_threshold is not None)
+
     def close(self):
         """
         Close the socket.
@@ -54,24 +67,26 @@ class TCPCommunicationsMixin(object):
         """
         pass
 
-    def handleReadyRead(self):
+    def handleMessage(self, message):
         """
-        Create TCP message class from JSON message and forward as appropriate
+        Forward a message as appropriate.
         """
-        message_str = ""
-        while self.socket.canReadLine():
-            # Read data line
-            message_str += str(self.socket.readLine(), self.encoding)
-
-        # Create message.
-        message = TCPMessage.fromJSON(message_str)
-        if self.verbose:
-            print("Received: \n" + str(message))
-
         if (message.getType() == "Busy"):
             self.handleBusy()
         else:
             self.messageReceived.emit(message)
+
+    def handleReadyRead(self):
+        """
+        Create TCP message classes from the frames that have been received.
+        There can be more than one message if the other side has several
+        messages in flight, and a message can arrive in several pieces.
+        """
+        for message in self.decoder.addData(bytes(self.socket.readAll())):
+            if self.verbose:
+                print("Received: \n" + str(message))
+
+            self.handleMessage(message)
     
     def isConnected(self):
         """
@@ -84,11 +99,14 @@ class TCPCommunicationsMixin(object):
 
     def sendMessage(self, message):
         """
-        Send TCP message as JSON string if the socket is connected.
+        Send TCP message as JSON string (or binary frame) if the socket
+        is connected.
         """
         if self.isConnected():
-            message_str = message.toJSON() + "\n"
-            self.socket.write(message_str.encode(self.encoding))
+            frame = tcpFraming.encodeFrame(message, encoding = self.encoding)
+            if self.canSendBinary() and (len(frame) >= self.binary_threshold):
+                frame = tcpFraming.encodeFrame(message, binary = True, encoding = self.encoding)
+            self.socket.write(frame)
             self.socket.flush()
             if self.verbose:
                 print("Sent: \n" + str(message))
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+"""
+Framing of TCP messages.
+
+There are two kinds of frames:
+
+1. JSON frames, a JSON string followed by a newline. This is the
+   default and is compatible with older versions.
+
+2. Binary frames, these start with a 0 byte (which can't be the first
+   byte of a JSON frame), followed by the payload size as a 4 byte
+   (big endian) unsigned integer, followed by the payload, which is the
+   zlib compressed JSON string. These are a lot smaller for messages
+   with large payloads, such as parameters XML.
+
+FrameDecoder keeps the data that has been received so far and returns
+the messages as each frame is completed, so it does not matter how the
+frames are split up (or joined together) by the network.
+"""
+
+import struct
+import zlib
+
+from storm_control.sc_library.tcpMessage import TCPMessage
+
+
+binary_marker = 0
+binary_header = struct.Struct(">BI")
+
+
+def encodeFrame(message, binary = False, encoding = "utf-8"):
+    """
+    Returns a message as a (JSON or binary) frame.
+    """
+    message_bytes = message.toJSON().encode(encoding)
+    if binary:
+        payload = zlib.compress(message_bytes, 1)
+        return binary_header.pack(binary_marker, len(payload)) + payload
+    else:
+        return message_bytes + b"\n"
+
+
+class FrameDecoder(object):
+    """
+    Converts the data received from a socket into messages.
+    """
+    def __init__(self, encoding = "utf-8", max_frame_size = 256 * 1024 * 1024, **kwds):
+        """
+        max_frame_size - Binary frames larger than this are assumed to
+                         be corrupt.
+        """
+        super().__init__(**kwds)
+        self.buffer = bytearray()
+        self.encoding = encoding
+        self.got_binary = False
+        self.max_frame_size = max_frame_size
+        self.n_binary = 0
+        self.n_json = 0
+        self.scan_start = 0
+
+    def addData(self, data):
+        """
+        Add data from the socket, returns a list of the messages in the
+        frames that were completed.
+        """
+        self.buffer += data
+
+        messages = []
+        pos = 0
+        while (pos < len(self.buffer)):
+
+            # Binary frame.
+            if (self.buffer[pos] == binary_marker):
+                if ((len(self.buffer) - pos) < binary_header.size):
+                    break
+                [marker, size] = binary_header.unpack_from(self.buffer, pos)
+                if (size > self.max_frame_size):
+                    print("Binary frame of", size, "bytes is too large, discarding received data.")
+                    self.reset()
+                    return messages
+                end = pos + binary_header.size + size
+                if (len(self.buffer) < end):
+                    break
+                start = pos + binary_header.size
+                pos = end
+                try:
+                    payload = zlib.decompress(self.buffer[start:end])
+                except zlib.error as error:
+                    print("Discarding corrupt binary frame:", error)
+                    continue
+                self.got_binary = True
+                self.n_binary += 1
+
+                self.decodeFrame(payload, messages)
+
+            # JSON frames, these are decoded up to the next binary frame, if any.
+            # JSON can't contain 0 bytes, so these always start a binary frame.
+            else:
+                start = max(pos, self.scan_start)
+                next_binary = self.buffer.find(b"\x00", start)
+                if (next_binary == -1):
+                    next_binary = len(self.buffer)
+                end = self.buffer.rfind(b"\n", start, next_binary)
+                if (end == -1):
+                    if (next_binary == len(self.buffer)):
+                        # Don't search the same data again next time.
+                        self.scan_start = len(self.buffer)
+                        break
+                    print("Discarding unterminated frame.")
+                    pos = next_binary
+                    continue
+
+                for payload in self.buffer[pos:end].split(b"\n"):
+
+                    # Skip empty lines.
+                    if (len(payload.strip()) > 0):
+                        self.n_json += 1
+                        self.decodeFrame(payload, messages)
+                pos = end + 1
+
+        # Remove the frames that we have decoded.
+        if (pos > 0):
+            del self.buffer[:pos]
+            self.scan_start = max(0, self.scan_start - pos)
+        return messages
+
+    def decodeFrame(self, payload, messages):
+        """
+        Add the message in payload to messages.
+        """
+        try:
+            messages.append(TCPMessage.fromJSON(str(payload, self.encoding)))
+        except ValueError as error:
+            print("Discarding corrupt frame:", error)
+
+    def getBuffered(self):
+        """
+        Returns the number of bytes waiting for the rest of their frame.
+        """
+        return len(self.buffer)
+
+    def getStatistics(self):
+        return {"binary" : self.n_binary,
+                "buffered" : len(self.buffer),
+                "json" : self.n_json}
+
+    def gotBinary(self):
+        """
+        Returns True if the other side has sent us a binary frame, i.e. it
+        understands them.
+        """
+        return self.got_binary
+
+    def reset(self):
+        self.buffer = bytearray()
+        self.got_binary = False
+        self.scan_start = 0
+
+
+#
+# Testing / benchmarking.
+#
+if (__name__ == "__main__"):
+    import argparse
+    import time
+
+    from PyQt5 import QtCore, QtWidgets
+
+    import storm_control.sc_library.tcpClient as tcpClient
+    import storm_control.sc_library.tcpServer as tcpServer
+
+    parser = argparse.ArgumentParser(description = 'TCP framing benchmark')
+
+    parser.add_argument('--messages', dest='messages', type=int, required=False, default=5000,
+                        help = "The number of small messages.")
+    parser.add_argument('--parameters', dest='parameters', type=str, required=True,
+                        help = "A parameters XML file to use as the large payload.")
+    parser.add_argument('--port', dest='port', type=int, required=False, default=9620,
+                        help = "The (loopback) port to use.")
+
+    args = parser.parse_args()
+
+    with open(args.parameters) as fp:
+        parameters_xml = fp.read()
+
+    def smallMessage(i):
+        return TCPMessage(message_type = "Move Stage",
+                          message_data = {"stage_x" : float(i), "stage_y" : 0.0})
+
+    def largeMessage(i):
+        return TCPMessage(message_type = "Set Parameters",
+                          message_data = {"parameters" : parameters_xml})
+
+    # Frame sizes and decoding speed, the frames arrive in packet sized pieces.
+    for [name, message_fn, binary] in [["small, json", smallMessage, False],
+                                       ["large, json", largeMessage, False],
+                                       ["large, binary", largeMessage, True]]:
+        data = b"".join([encodeFrame(message_fn(i), binary = binary) for i in range(args.messages)])
+        decoder = FrameDecoder()
+        start_time = time.perf_counter()
+        for i in range(0, len(data), 1400):
+            decoder.addData(data[i:i+1400])
+        elapsed = time.perf_counter() - start_time
+        print("{0:s}, {1:d} bytes per message, decoded {2:.0f} messages per second".format(name, len(data)//args.messages, args.messages/elapsed))
+    print()
+
+    # Loopback, the server echoes each message back to the client.
+    app = QtWidgets.QApplication([])
+    server = tcpServer.TCPServer(binary_threshold = 4096, port = args.port)
+    server.messageReceived.connect(server.sendMessage)
+
+    def loopback(name, n_messages, message_fn, binary_threshold):
+        client = tcpClient.TCPClient(binary_threshold = binary_threshold, port = args.port)
+        client.startCommunication()
+        loop = QtCore.QEventLoop()
+        client.allReceived.connect(loop.quit)
+
+        messages = [message_fn(i) for i in range(n_messages)]
+        start_time = time.perf_counter()
+        for message in messages:
+            client.sendMessage(message)
+        loop.exec_()
+        elapsed = time.perf_counter() - start_time
+
+        print("{0:s}, {1:d} messages in {2:.3f}s, {3:.0f} messages per second".format(name, n_messages, elapsed, n_messages/elapsed))
+        client.stopCommunication()
+        client.close()
+
+        # Wait for the server to notice.
+        while server.isConnected():
+            app.processEvents()
+
+    loopback("small, json", args.messages, smallMessage, None)
+    loopback("large, json", args.messages//10, largeMessage, None)
+    loopback("large, binary", args.messages//10, largeMessage, 4096)
+    server.close()
+
+
+#
+# The MIT License
+#
+# Copyright (c) 2018 Zhuang Lab, Harvard University
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
@@ -2,6 +2,15 @@
 """
 Handles remote control (via TCP/IP of the data collection program) 
 
+The message ID is also the request ID. Responses are the original message
+(with the same ID) so clients can have several messages outstanding and
+match the responses to them even if they arrive out of order.
+
+Messages can also specify the messages (IDs) that they depend on, if any
+of these fail then the message is not handled and an error is returned
+instead. Sync messages are not handled until the previous messages have
+been completely processed by the server.
+
 Jeffrey Moffitt
 3/8/14
 jeffmoffitt@gmail.com
@@ -29,16 +38,24 @@ class TCPMessage(object):
         assert message_type is not None
         
         #self.complete = False
+        self.depends_on = []
         self.error = False
         self.error_message = None
         self.message_data = copy.copy(message_data)
         self.message_type = message_type
         self.response = {}
+        self.sync = False
         self.test_mode = test_mode
 
         self.message_id = TCPMessage._COUNTER # Record instance number.
         TCPMessage._COUNTER += 1 # Increment the instance counter.
 
+    def addDependency(self, message):
+        """
+        This message will not be handled if message fails.
+        """
+        self.depends_on.append(message.getID())
+
     def addData(self, key_name, value):
         """
         Add or change the contents of fields in the message data dictionary.
@@ -66,6 +83,12 @@ class TCPMessage(object):
         """
         return self.message_data.get(key_name, default)
 
+    def getDependencies(self):
+        """
+        Return the IDs of the messages that this message depends on.
+        """
+        return self.depends_on
+
     def getErrorMessage(self):
         """
         Return the error message string, which is empty if no error occurred. 
@@ -109,6 +132,13 @@ class TCPMessage(object):
         """
         return self.error
 
+    def isSync(self):
+        """
+        Return True if the previous messages need to be completely
+        processed before this message is handled.
+        """
+        return self.sync
+
     def isTest(self):
         """
         Return the test status of the message. If the message is in test 
@@ -130,6 +160,12 @@ class TCPMessage(object):
         self.error = error_boolean
         self.error_message = error_message
 
+    def setSync(self, sync_boolean):
+        """
+        Set the sync status of the message.
+        """
+        self.sync = sync_boolean
+
     def setTestMode(self, test_boolean):
         """
         Set the test status of the message.
@@ -20,13 +20,16 @@ import storm_control.sc_library.tcpCommunications as tcpCommunications
 class TCPServer(QtNetwork.QTcpServer, tcpCommunications.TCPCommunicationsMixin):
     """
     A TCP server for passing TCP messages between programs.
+
+    The server only sends binary frames to clients that have sent it
+    a binary frame, so older clients continue to work.
     """
     comGotConnection = QtCore.pyqtSignal()
     comLostConnection = QtCore.pyqtSignal()
     messageReceived = QtCore.pyqtSignal(object)
     
-    def __init__(self, **kwds):
-        super().__init__(**kwds)
+    def __init__(self, binary_threshold = 16384, **kwds):
+        super().__init__(binary_threshold = binary_threshold, **kwds)
 
         # Connect new connection signal
         self.newConnection.connect(self.handleClientConnection)
@@ -34,6 +37,12 @@ class TCPServer(QtNetwork.QTcpServer, tcpCommunications.TCPCommunicationsMixin):
         # Listen for new connections
         self.connectToNewClients()
 
+    def canSendBinary(self):
+        """
+        Return True if the client can handle binary frames.
+        """
+        return super().canSendBinary() and self.decoder.gotBinary()
+
     def connectToNewClients(self):
         """
         Listen for new clients.
@@ -67,6 +76,7 @@ class TCPServer(QtNetwork.QTcpServer, tcpCommunications.TCPCommunicationsMixin):
         socket = self.nextPendingConnection()
 
         if not self.isConnected():
+            self.decoder.reset()
             self.socket = socket
             self.socket.readyRead.connect(self.handleReadyRead)
             self.socket.disconnected.connect(self.handleClientDisconnect)
@@ -5,9 +5,23 @@
 # Class for rendering multiple images in taken at different magnifications.
 # This is used by the steve software and others for image display.
 #
+# Each image is rendered at full resolution, or downsampled by 2, 4 or 8
+# (the image pyramid levels) depending on how large it is on the screen.
+# The pixmaps for each level are created on demand in a worker thread and
+# stored in a shared cache with a fixed memory budget. The least recently
+# used pixmaps are dropped when the cache is full, as are the pixmaps of
+# images that are not visible.
+#
+# Contrast changes are done with a look up table (shared by all the images
+# with the same contrast). The current pixmaps are kept, and drawn, until
+# the images are re-mapped with the new contrast.
+#
 # Hazen 07/13
 #
 
+import collections
+import functools
+import math
 import pickle
 import numpy
 import os
@@ -15,6 +29,302 @@ import os
 from PyQt5 import QtCore, QtGui, QtWidgets
 
 
+## The number of image pyramid levels, level N is downsampled by 2^N.
+n_levels = 4
+
+## Gray scale color table for 8 bit images.
+gray_table = [QtGui.qRgb(i, i, i) for i in range(256)]
+
+## createImage
+#
+# Converts the numpy image from HAL to a QtGui.QImage at the requested pyramid level.
+#
+# @param data The image data (a numpy array).
+# @param level The pyramid level.
+# @param pixmap_min The pixel value that maps to 0.
+# @param pixmap_max The pixel value that maps to 255.
+# @param lut (Optional) The look up table from getLUT(pixmap_min, pixmap_max).
+#
+# @return A QtGui.QImage.
+#
+def createImage(data, level, pixmap_min, pixmap_max, lut = None):
+
+    # This just undoes the transpose that we applied when the image was loaded. It might
+    # make more sense not to transpose the image in the first place, but this is the standard
+    # for the storm-analysis project so we maintain that here.
+    frame = numpy.transpose(data)
+
+    # Downsample by averaging binning x binning blocks.
+    binning = 2**level
+    if (binning > 1):
+        h = frame.shape[0]//binning
+        w = frame.shape[1]//binning
+        frame = frame[:h*binning,:w*binning].reshape(h, binning, w, binning)
+        if useLUT(data):
+            n = binning * binning
+            frame = ((frame.sum(axis = (1,3), dtype = numpy.uint32) + n//2)//n).astype(numpy.uint16)
+        else:
+            frame = frame.mean(axis = (1,3), dtype = numpy.float32)
+
+    # Rescale & convert to 8bit
+    if useLUT(data):
+        if lut is None:
+            lut = getLUT(pixmap_min, pixmap_max)
+        frame = lut[frame]
+    else:
+        frame = 255.0 * (frame.astype(numpy.float32) - float(pixmap_min))/float(pixmap_max - pixmap_min)
+        frame = numpy.clip(frame, 0.0, 255.0).astype(numpy.uint8)
+    frame = numpy.ascontiguousarray(frame)
+
+    # Create the image
+    w, h = frame.shape
+    image = QtGui.QImage(frame.data, h, w, h, QtGui.QImage.Format_Indexed8)
+    image.ndarray = frame
+    image.setColorTable(gray_table)
+    return image
+
+## getLUT
+#
+# Returns the (read only) look up table that converts 16 bit pixel values to 8 bit,
+# this is shared by all the images with the same contrast.
+#
+# @param pixmap_min The pixel value that maps to 0.
+# @param pixmap_max The pixel value that maps to 255.
+#
+# @return A numpy uint8 array with 65536 elements.
+#
+@functools.lru_cache(maxsize = 8)
+def getLUT(pixmap_min, pixmap_max):
+    lut = numpy.arange(65536, dtype = numpy.float32)
+    lut = 255.0 * (lut - float(pixmap_min))/float(pixmap_max - pixmap_min)
+    lut = numpy.clip(lut, 0.0, 255.0).astype(numpy.uint8)
+    lut.flags.writeable = False
+    return lut
+
+## useLUT
+#
+# @param data The image data (a numpy array).
+#
+# @return True if the image can be converted with a look up table. Only
+#         unsigned images can be, negative values can't be used as indices.
+#
+def useLUT(data):
+    return (data.dtype.kind == "u") and (data.dtype.itemsize <= 2)
+
+
+## PyramidTaskSignaler
+#
+# A signaler class for PyramidTask.
+#
+class PyramidTaskSignaler(QtCore.QObject):
+    levelDone = QtCore.pyqtSignal(object)
+
+
+## PyramidTask
+#
+# Creates the image for a single pyramid level in a worker thread.
+#
+class PyramidTask(QtCore.QRunnable):
+
+    ## __init__
+    #
+    # @param item The viewImageItem.
+    # @param level The pyramid level.
+    #
+    def __init__(self, item, level, **kwds):
+        super().__init__(**kwds)
+        self.data = item.data
+        self.generation = item.generation
+        self.image = None
+        self.item = item
+        self.level = level
+        self.lut = None
+        self.pixmap_max = item.pixmap_max
+        self.pixmap_min = item.pixmap_min
+
+        if useLUT(self.data):
+            self.lut = getLUT(self.pixmap_min, self.pixmap_max)
+
+        self.ptsignaler = PyramidTaskSignaler()
+
+    ## run
+    #
+    # This is called in the worker thread. QImages (unlike QPixmaps) can be
+    # created outside of the GUI thread.
+    #
+    def run(self):
+        try:
+            self.image = createImage(self.data, self.level, self.pixmap_min, self.pixmap_max, lut = self.lut)
+        finally:
+            self.ptsignaler.levelDone.emit(self)
+
+
+## PixmapCache
+#
+# Least recently used cache of image pyramid pixmaps, this is shared by
+# all the viewImageItems.
+#
+class PixmapCache(QtCore.QObject):
+
+    ## __init__
+    #
+    # @param budget (Optional) The maximum size of the cache in bytes.
+    #
+    def __init__(self, budget = 512 * 1024 * 1024, **kwds):
+        super().__init__(**kwds)
+        self.budget = budget
+        self.n_evicted = 0
+        self.n_generated = 0
+        self.pixmaps = collections.OrderedDict()
+        self.size = 0
+        self.tasks = {}
+        self.thread_pool = QtCore.QThreadPool()
+
+    ## addPixmap
+    #
+    # @param item The viewImageItem.
+    # @param level The pyramid level.
+    # @param pixmap The QtGui.QPixmap for this level.
+    #
+    def addPixmap(self, item, level, pixmap):
+        self.removePixmap(item, level)
+        item.pyramid[level] = pixmap
+        item.stale.discard(level)
+        cost = pixmapCost(pixmap)
+        self.pixmaps[(item, level)] = cost
+        self.size += cost
+        self.n_generated += 1
+
+        # Drop the least recently used pixmaps, but not the one we just added.
+        while (self.size > self.budget) and (len(self.pixmaps) > 1):
+            [[old_item, old_level], old_cost] = self.pixmaps.popitem(last = False)
+            del old_item.pyramid[old_level]
+            old_item.stale.discard(old_level)
+            self.size -= old_cost
+            self.n_evicted += 1
+
+    ## getStatistics
+    #
+    # @return A dictionary with the cache statistics.
+    #
+    def getStatistics(self):
+        return {"budget" : self.budget,
+                "evicted" : self.n_evicted,
+                "generated" : self.n_generated,
+                "pending" : len(self.tasks),
+                "pixmaps" : len(self.pixmaps),
+                "size" : self.size}
+
+    ## getPixmap
+    #
+    # @param item The viewImageItem.
+    # @param level The pyramid level.
+    #
+    # @return The pixmap for this level (or None), marking it as recently used.
+    #
+    def getPixmap(self, item, level):
+        pixmap = item.pyramid.get(level)
+        if pixmap is not None:
+            self.pixmaps.move_to_end((item, level))
+        return pixmap
+
+    ## handleLevelDone
+    #
+    # Called (in the GUI thread) when a PyramidTask finishes. The result is
+    # ignored if the image contrast changed while it was being created, the
+    # item will request it again the next time that it is drawn.
+    #
+    # @param task The PyramidTask.
+    #
+    def handleLevelDone(self, task):
+        item = task.item
+        del self.tasks[(item, task.level)]
+        if (task.generation == item.generation) and task.image is not None:
+            self.addPixmap(item, task.level, QtGui.QPixmap.fromImage(task.image))
+        item.update()
+
+    ## removeItem
+    #
+    # Drops all the pixmaps of an item. This also changes the generation of
+    # the item, so that the results of any PyramidTasks that are still
+    # running for the item are ignored instead of being added to the cache.
+    #
+    # @param item The viewImageItem.
+    #
+    def removeItem(self, item):
+        item.generation += 1
+        for level in list(item.pyramid):
+            self.removePixmap(item, level)
+
+    ## removePixmap
+    #
+    # @param item The viewImageItem.
+    # @param level The pyramid level.
+    #
+    def removePixmap(self, item, level):
+        if level in item.pyramid:
+            del item.pyramid[level]
+            item.stale.discard(level)
+            self.size -= self.pixmaps.pop((item, level))
+
+    ## requestPixmap
+    #
+    # Start creating the pixmap for a pyramid level in a worker thread, if
+    # this is not already in progress.
+    #
+    # @param item The viewImageItem.
+    # @param level The pyramid level.
+    #
+    def requestPixmap(self, item, level):
+        key = (item, level)
+        if key in self.tasks:
+            return
+        task = PyramidTask(item, level)
+        task.ptsignaler.levelDone.connect(self.handleLevelDone)
+        task.setAutoDelete(False)
+        self.tasks[key] = task
+        self.thread_pool.start(task)
+
+    ## setBudget
+    #
+    # @param budget The maximum size of the cache in bytes.
+    #
+    def setBudget(self, budget):
+        self.budget = budget
+
+    ## waitForDone
+    #
+    # Wait for all the pixmaps that are being created.
+    #
+    def waitForDone(self):
+        self.thread_pool.waitForDone()
+        QtCore.QCoreApplication.processEvents()
+
+
+## pixmapCost
+#
+# @param pixmap A QtGui.QPixmap.
+#
+# @return The (approximate) size of the pixmap in bytes.
+#
+def pixmapCost(pixmap):
+    return pixmap.width() * pixmap.height() * max(1, pixmap.depth()//8)
+
+
+## The cache that all the images use.
+pixmap_cache = None
+
+## getPixmapCache
+#
+# @return The PixmapCache, this is created the first time it is needed.
+#
+def getPixmapCache():
+    global pixmap_cache
+    if pixmap_cache is None:
+        pixmap_cache = PixmapCache()
+    return pixmap_cache
+
+
 ## MultifieldView
 #
 # Handles user interaction with the microscope images.
@@ -38,6 +348,7 @@ class MultifieldView(QtWidgets.QGraphicsView):
         self.bg_brush = QtGui.QBrush(QtGui.QColor(255, 255, 255))
         self.currentz = 0.0
         self.directory = ""
+        self.drop_timer = QtCore.QTimer(self)
         self.image_items = []
         self.margin = 8000.0
         self.scene_rect = [-self.margin, -self.margin, self.margin, self.margin]
@@ -58,6 +369,12 @@ class MultifieldView(QtWidgets.QGraphicsView):
         self.setMouseTracking(True)
         self.setRenderHint(QtGui.QPainter.SmoothPixmapTransform)
 
+        # Drop the pixmaps of images that are no longer visible once
+        # the user has stopped panning / zooming.
+        self.drop_timer.setInterval(500)
+        self.drop_timer.setSingleShot(True)
+        self.drop_timer.timeout.connect(self.dropHiddenPixmaps)
+
     ## addViewImageItem
     #
     # Adds a ViewImageItem to the QGraphicsScene.
@@ -86,7 +403,8 @@ class MultifieldView(QtWidgets.QGraphicsView):
 
     ## changeContrast
     #
-    # Change the contrast of all image items
+    # Change the contrast of all image items. The images are re-mapped
+    # in worker threads when they are next drawn.
     #
     # @param contrast_range The new minimum and maximum contrast values (which will control what is set to 0 and to 255)
     #
@@ -139,10 +457,21 @@ class MultifieldView(QtWidgets.QGraphicsView):
     def clearMosaic(self):
         for image_item in self.image_items:
             self.scene.removeItem(image_item)
+            getPixmapCache().removeItem(image_item)
         #self.initSceneRect()
         self.currentz = 0.0
         self.image_items = []
 
+    ## dropHiddenPixmaps
+    #
+    # Drops the pixmaps of all the images that are not in the viewport.
+    #
+    def dropHiddenPixmaps(self):
+        visible = self.mapToScene(self.viewport().rect()).boundingRect()
+        for item in self.image_items:
+            if not item.sceneBoundingRect().intersects(visible):
+                getPixmapCache().removeItem(item)
+
     ## getContrast
     #
     # @return The minimum and maximum pixmap values from all image items.
@@ -172,6 +501,7 @@ class MultifieldView(QtWidgets.QGraphicsView):
         if(len(self.image_items) > 0):
             item = self.image_items.pop()
             self.scene.removeItem(item)
+            getPixmapCache().removeItem(item)
 
 #    def initSceneRect(self):
 #        self.scene_rect = [-self.margin, -self.margin, self.margin, self.margin]
@@ -257,15 +587,26 @@ class MultifieldView(QtWidgets.QGraphicsView):
 
         progress_bar.close()
 
+    ## scrollContentsBy
+    #
+    # @param dx The horizontal scroll in pixels.
+    # @param dy The vertical scroll in pixels.
+    #
+    def scrollContentsBy(self, dx, dy):
+        QtWidgets.QGraphicsView.scrollContentsBy(self, dx, dy)
+        self.drop_timer.start()
+
     ## setScale
     #
-    # Sets the current scale of the view.
+    # Sets the current scale of the view. The images pick the pyramid level
+    # to draw based on this scale (and their magnification).
     #
     def setScale(self, scale):
         self.view_scale = scale
         transform = QtGui.QTransform()
         transform.scale(scale, scale)
         self.setTransform(transform)
+        self.drop_timer.start()
 
     ## updateSceneRect
     #
@@ -343,13 +684,15 @@ class viewImageItem(QtWidgets.QGraphicsItem):
         QtWidgets.QGraphicsItem.__init__(self, None)
 
         self.data = False
+        self.generation = 0
         self.height = 0
         self.magnification = magnification
         self.objective_name = str(objective_name)
         self.parameters_file = ""
-        self.pixmap = False
         self.pixmap_min = 0
         self.pixmap_max = 0
+        self.pyramid = {}
+        self.stale = set()
         self.version = "0.0"
         self.width = 0
         self.x_offset_pix = x_offset_pix
@@ -365,33 +708,48 @@ class viewImageItem(QtWidgets.QGraphicsItem):
     # @return QtCore.QRectF containing the size of the image.
     #
     def boundingRect(self):
-        return QtCore.QRectF(0, 0, self.pixmap.width(), self.pixmap.height())
+        # The image is transposed when it is drawn.
+        return QtCore.QRectF(0, 0, self.data.shape[0], self.data.shape[1])
+
+    ## createLevel
+    #
+    # Creates the pixmap for a pyramid level (in the GUI thread).
+    #
+    # @param level The pyramid level.
+    #
+    # @return The pixmap for this level.
+    #
+    def createLevel(self, level):
+        pixmap = QtGui.QPixmap.fromImage(createImage(self.data, level, self.pixmap_min, self.pixmap_max))
+        getPixmapCache().addPixmap(self, level, pixmap)
+        return pixmap
 
     ## createPixmap
     #
-    # Converts the numpy image from HAL to a QtGui.QPixmap.
+    # Called when the image contrast changes. The current pixmaps are
+    # marked as stale, they are drawn until they are re-created (when
+    # the image is drawn).
     #
     def createPixmap(self):
-        
-        # This just undoes the transpose that we applied when the image was loaded. It might
-        # make more sense not to transpose the image in the first place, but this is the standard
-        # for the storm-analysis project so we maintain that here.
-        frame = numpy.transpose(self.data.copy())
-
-        # Rescale & convert to 8bit
-        frame = numpy.ascontiguousarray(frame, dtype = numpy.float32)
-        frame = 255.0 * (frame - float(self.pixmap_min))/float(self.pixmap_max - self.pixmap_min)
-        frame[(frame > 255.0)] = 255.0
-        frame[(frame < 0.0)] = 0.0
-        frame = frame.astype(numpy.uint8)
-
-        # Create the pixmap
-        w, h = frame.shape
-        image = QtGui.QImage(frame.data, h, w, QtGui.QImage.Format_Indexed8)
-        image.ndarray = frame
-        for i in range(256):
-            image.setColor(i, QtGui.QColor(i,i,i).rgb())
-        self.pixmap = QtGui.QPixmap.fromImage(image)
+        self.generation += 1
+        self.stale = set(self.pyramid)
+        self.update()
+
+    ## getLevel
+    #
+    # @param lod The level of detail, i.e. screen pixels per image pixel.
+    #
+    # @return The pyramid level to use at this level of detail.
+    #
+    def getLevel(self, lod):
+        if (lod >= 1.0) or (lod <= 0.0):
+            return 0
+        level = min(int(math.floor(-math.log2(lod))), n_levels - 1)
+
+        # Don't downsample the image to nothing.
+        while (level > 0) and ((min(self.data.shape) >> level) == 0):
+            level -= 1
+        return level
 
     ## getMagnification
     #
@@ -418,10 +776,13 @@ class viewImageItem(QtWidgets.QGraphicsItem):
 
     ## getPixmap
     #
-    # @return The image as a QtGui.QPixmap.
+    # @return The (full resolution) image as a QtGui.QPixmap.
     #
     def getPixmap(self):
-        return self.pixmap
+        pixmap = getPixmapCache().getPixmap(self, 0)
+        if (pixmap is None) or (0 in self.stale):
+            pixmap = self.createLevel(0)
+        return pixmap
 
     ## getPositionUm
     #
@@ -434,11 +795,12 @@ class viewImageItem(QtWidgets.QGraphicsItem):
     #
     # This is used to pickle objects of this class.
     #
-    # @return The dictionary for this object, with 'pixmap' element removed.
+    # @return The dictionary for this object, with 'pyramid' and 'stale' elements removed.
     #
     def getState(self):
         odict = self.__dict__.copy()
-        del odict['pixmap']
+        del odict['pyramid']
+        del odict['stale']
         return odict
 
     ## initializeWithImageObject
@@ -471,14 +833,31 @@ class viewImageItem(QtWidgets.QGraphicsItem):
 
     ## paint
     #
-    # Called by PyQt to render the image.
+    # Called by PyQt to render the image. If the pixmap for the right pyramid
+    # level is not available (or has the wrong contrast) then the closest
+    # level that is available is drawn while the right level is created. The
+    # pixmap is only created here (in the GUI thread) if there are no levels
+    # available.
     #
     # @param painter A QPainter object.
     # @param option A QStyleOptionGraphicsItem object.
     # @param widget A QWidget object.
     #
     def paint(self, painter, option, widget):
-        painter.drawPixmap(0, 0, self.pixmap)
+        cache = getPixmapCache()
+        level = self.getLevel(option.levelOfDetailFromTransform(painter.worldTransform()))
+        pixmap = cache.getPixmap(self, level)
+        if pixmap is not None:
+            if level in self.stale:
+                cache.requestPixmap(self, level)
+        else:
+            if (len(self.pyramid) > 0):
+                closest = min(self.pyramid, key = lambda x: abs(x - level))
+                pixmap = cache.getPixmap(self, closest)
+                cache.requestPixmap(self, level)
+            else:
+                pixmap = self.createLevel(level)
+        painter.drawPixmap(self.boundingRect(), pixmap, QtCore.QRectF(pixmap.rect()))
 
     ## setPixmapGeometry
     #
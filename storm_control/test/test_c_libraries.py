@@ -38,6 +38,48 @@ def testCImageManipulation():
 
 
 
+def testNumpyRescale():
+    """
+    Compare the numpy rescaler to a simple floating point version.
+    """
+    import storm_control.hal4000.halLib.c_image_manipulation_c as cIM
+
+    rescaler = cIM.NumpyRescaler(block_rows = 7)
+    nim = numpy.random.randint(300, size = (50,40)).astype(numpy.uint16)
+
+    for op_code in range(8):
+        [flip_h, flip_v, transpose] = map(lambda x: bool(op_code & x), [4, 2, 1])
+
+        for [saturated_value, max_range] in [[65536, 255.0], [250, 254.0]]:
+            out = None
+            for i in range(2):
+                [np_nim, image_min, image_max] = rescaler.rescale(nim, flip_h, flip_v, transpose, [10, 200], saturated_value, max_range, out = out)
+
+                # The output buffer should get re-used.
+                if out is not None:
+                    assert(np_nim is out)
+                out = np_nim
+
+            im = nim
+            if flip_h:
+                im = numpy.fliplr(im)
+            if flip_v:
+                im = numpy.flipud(im)
+            if transpose:
+                im = numpy.transpose(im)
+            expected = numpy.clip(max_range * (im.astype(numpy.float64) - 10.0)/190.0, 0.0, max_range)
+            expected[(im >= saturated_value)] = 255.0
+            expected = (expected + 0.5).astype(numpy.uint8)
+
+            assert(image_min == numpy.min(nim))
+            assert(image_max == numpy.max(nim))
+            assert(np_nim.flags['C_CONTIGUOUS'])
+            assert(numpy.array_equal(np_nim, expected))
+
+    # Look up tables are cached.
+    assert(len(rescaler.luts) == 2)
+
+
 def testFocusQuality():
     import storm_control.hal4000.camera.frame as frame
     import storm_control.hal4000.focusLock.focusQuality as fq
@@ -85,10 +127,43 @@ def testLMMoment():
 
     lof.cleanUp()
 
+def testLMMomentTiles():
+    import storm_control.hal4000.camera.frame as frame
+    import storm_control.hal4000.spotCounter.lmmObjectFinder as lof
+
+    image_x = 200
+    image_y = 100
+
+    image = numpy.ones((image_y, image_x), dtype = numpy.uint16)
+    for i in range(10):
+        image[10 + 8*i, 20 + 15*i] = 200
+    image[40, 21] = 200
+    image[41, 21] = 100
+    
+    a_frame = frame.Frame(image, 0, image_x, image_y, "na")
+
+    # Tiles should find the same objects as the whole frame.
+    finder = lof.LMMomentFinder()
+    [x, y, n] = finder.findObjects(a_frame, 100)
+    assert(n == 11)
+    assert(abs(y[4] - (40.0 + 99.0/298.0)) < 1.0e-5)
+
+    tiles = [finder.findObjects(a_frame, 100, start, stop) for [start, stop] in lof.tileRows(image_y, 3)]
+    assert(numpy.allclose(numpy.concatenate([tile[0] for tile in tiles]), x))
+    assert(numpy.allclose(numpy.concatenate([tile[1] for tile in tiles]), y))
+
+    # Maximum number of objects.
+    finder = lof.LMMomentFinder(max_locs = 5)
+    [x, y, n] = finder.findObjects(a_frame, 100)
+    assert(n == 5)
+    assert(finder.getOverflowCount() == 1)
+
 
 if (__name__ == "__main__"):
     testCImageManipulation()
+    testNumpyRescale()
     testFocusQuality()
     testLMMoment()
+    testLMMomentTiles()
     
     
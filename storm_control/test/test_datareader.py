@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+"""
+Tests of the movie readers.
+"""
+import numpy
+import os
+import pytest
+import tempfile
+import tifffile
+
+import storm_control.sc_library.datareader as datareader
+import storm_control.sc_library.parameters as params
+
+
+def openDax(dirname, x_pixels, y_pixels, n_frames, memmap = False):
+    """
+    Write a .dax file in the same way as HAL does and open it.
+    """
+    filename = os.path.join(dirname, "movie.dax")
+    if not os.path.exists(filename):
+        data = numpy.random.randint(0, 1000, size = (n_frames, y_pixels * x_pixels)).astype(numpy.uint16)
+        data.tofile(filename)
+
+    xml = params.StormXMLObject()
+    xml.add("acquisition.number_frames", n_frames)
+    xml.add("camera1.x_pixels", x_pixels)
+    xml.add("camera1.y_pixels", y_pixels)
+    xml.add("film.filetype", ".dax")
+    return datareader.DaxReader(filename = filename,
+                                memmap = memmap,
+                                xml = xml)
+
+def test_dax_reader_1():
+    """
+    The memory mapped and standard readers return the same frames.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        movie = openDax(tmp_dir, 12, 8, 20)
+        mm_movie = openDax(tmp_dir, 12, 8, 20, memmap = True)
+        assert(movie.filmSize() == mm_movie.filmSize())
+
+        # Memory mapped frames are views, not copies.
+        assert not mm_movie.loadAFrame(0).flags.owndata
+        assert mm_movie.loadAFrame(0, transpose = False).flags.c_contiguous
+
+        for i in [0, 7, 19]:
+            assert numpy.array_equal(movie.loadAFrame(i), mm_movie.loadAFrame(i))
+            assert numpy.array_equal(movie.loadAFrame(i, transpose = False),
+                                     numpy.transpose(mm_movie.loadAFrame(i)))
+
+        for [start, stop, step] in [[0, None, 1], [3, 11, 1], [2, 19, 4]]:
+            frames = movie.loadFrames(start, stop, step)
+            mm_frames = mm_movie.loadFrames(start, stop, step)
+            assert(frames.shape[0] == len(range(start, 20 if stop is None else stop, step)))
+            assert numpy.array_equal(frames, mm_frames)
+            for j, k in enumerate(range(start, 20 if stop is None else stop, step)):
+                assert numpy.array_equal(frames[j], movie.loadAFrame(k))
+
+        chunks = list(mm_movie.iterFrames(chunk = 6))
+        assert([x.shape[0] for x in chunks] == [6, 6, 6, 2])
+        assert numpy.array_equal(numpy.concatenate(chunks), movie.loadFrames())
+
+        movie.closeFilePtr()
+        mm_movie.closeFilePtr()
+
+def test_dax_reader_2():
+    """
+    Out of range frames raise an IOError.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        movie = openDax(tmp_dir, 8, 8, 5, memmap = True)
+        for [start, stop] in [[-1, 2], [0, 6]]:
+            try:
+                movie.loadFrames(start, stop)
+            except IOError:
+                pass
+            else:
+                assert False
+        movie.closeFilePtr()
+
+def openTif(dirname, images, memmap = False, **kwds):
+    """
+    Write a .tif file and open it.
+    """
+    filename = os.path.join(dirname, "movie.tif")
+    if not os.path.exists(filename):
+        with tifffile.TiffWriter(filename, **kwds) as tif:
+            if "imagej" in kwds:
+                tif.write(images, metadata = {"unit" : "um"}, resolution = (1.0, 1.0))
+            else:
+                for image in images:
+                    tif.write(image, metadata = {"unit" : "um"}, resolution = (1.0, 1.0))
+
+    xml = params.StormXMLObject()
+    xml.add("acquisition.number_frames", images.shape[0])
+    xml.add("film.filetype", ".tif")
+    return datareader.TifReader(filename = filename,
+                                memmap = memmap,
+                                xml = xml)
+
+def test_tif_reader_1():
+    """
+    ImageJ and BigTIFF files, with and without memory mapping.
+    """
+    images = numpy.random.randint(0, 1000, size = (10, 8, 12)).astype(numpy.uint16)
+    for kwds in [{"imagej" : True}, {"bigtiff" : True}, {"bigtiff" : True, "byteorder" : ">"}]:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for memmap in [False, True]:
+                movie = openTif(tmp_dir, images, memmap = memmap, **kwds)
+                assert(movie.filmSize() == [8, 12, 10])
+
+                for i in [0, 5, 9]:
+                    assert numpy.array_equal(movie.loadAFrame(i), numpy.transpose(images[i]))
+                    assert numpy.array_equal(movie.loadAFrame(i, cast_to_int16 = False, transpose = False), images[i])
+
+                frames = movie.loadFrames(1, 9, 3, cast_to_int16 = False, transpose = False)
+                assert numpy.array_equal(frames, images[1:9:3])
+                assert frames.dtype.isnative
+
+                chunks = list(movie.iterFrames(chunk = 4))
+                assert numpy.array_equal(numpy.concatenate(chunks), numpy.transpose(images, (0, 2, 1)))
+                movie.closeFilePtr()
+
+def test_tif_reader_2():
+    """
+    Color images raise an IOError, and the file is closed.
+    """
+    tifs = []
+    tif_init = tifffile.TiffFile.__init__
+    def init(tif, *args, **kwds):
+        tif_init(tif, *args, **kwds)
+        tifs.append(tif)
+
+    with pytest.MonkeyPatch.context() as mp, tempfile.TemporaryDirectory() as tmp_dir:
+        mp.setattr(tifffile.TiffFile, "__init__", init)
+        filename = os.path.join(tmp_dir, "movie.tif")
+        tifffile.imwrite(filename, numpy.zeros((8, 12, 3), dtype = numpy.uint8), photometric = "rgb")
+        xml = params.StormXMLObject()
+        xml.add("film.filetype", ".tif")
+        # excinfo keeps the reader alive, so the file is not closed by __del__().
+        with pytest.raises(IOError) as excinfo:
+            datareader.TifReader(filename = filename, xml = xml)
+        assert(len(tifs) == 1)
+        assert tifs[0].filehandle.closed
+
+if (__name__ == "__main__"):
+    test_dax_reader_1()
+    test_dax_reader_2()
+    test_tif_reader_1()
+    test_tif_reader_2()
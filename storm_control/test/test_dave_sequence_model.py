@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""
+Tests of Dave's (lazy) sequence model.
+"""
+import os
+import tempfile
+
+from xml.etree import ElementTree
+from PyQt5 import QtCore, QtTest, QtWidgets
+
+import storm_control.dave.sequenceViewer as sequenceViewer
+
+
+app = None
+
+def getApp():
+    global app
+    app = QtWidgets.QApplication.instance()
+    if app is None:
+        app = QtWidgets.QApplication([])
+    return app
+
+def addAction(parent, name, fields):
+    block = ElementTree.SubElement(parent, name)
+    for [f_name, f_value] in fields.items():
+        field = ElementTree.SubElement(block, f_name)
+        field.set("type", type(f_value).__name__)
+        field.text = str(f_value)
+
+def makeSequence(tmp_dir, n_positions, n_movies):
+    """
+    A loop over positions, with a branch for each movie.
+    """
+    root = ElementTree.Element("sequence")
+    addAction(root, "DASetDirectory", {"directory" : tmp_dir})
+    loop = ElementTree.SubElement(root, "branch", {"name" : "positions"})
+    for i in range(n_positions):
+        for j in range(n_movies):
+            movie = ElementTree.SubElement(loop, "branch", {"name" : "movie_" + str(i) + "_" + str(j)})
+            addAction(movie, "DAMoveStage", {"stage_x" : float(i), "stage_y" : 0.0})
+            addAction(movie, "DASetParameters", {"parameters" : "p" + str(j)})
+            addAction(movie, "DATakeMovie", {"name" : "movie_" + str(i) + "_" + str(j), "length" : 10, "overwrite" : True})
+    filename = os.path.join(tmp_dir, "sequence.xml")
+    ElementTree.ElementTree(root).write(filename)
+    return sequenceViewer.parseSequenceFile(filename)
+
+def created(model):
+    return [item.index for item in model.dave_actions_all if (item.dave_action is not None)]
+
+def test_dave_sequence_model_1():
+    """
+    DaveActions are only created when they are needed, and released when they
+    are far from the current action.
+    """
+    getApp()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model = makeSequence(tmp_dir, 100, 2)
+        model.window_size = 10
+        assert(model.getNumberItems() == 601)
+        assert(created(model) == [])
+
+        # The same DaveAction is used while it is close to the current action.
+        first = model.getCurrentItem().getDaveAction()
+        assert(first.getDescriptor() == "change directory to " + tmp_dir)
+        for i in range(5):
+            model.getNextItem(True).getDaveAction()
+        model.resetItemIndex()
+        assert(model.getCurrentItem().getDaveAction() is first)
+
+        # Walking through the sequence only keeps a few DaveActions.
+        while model.haveNextItem():
+            model.getNextItem(True).getDaveAction()
+            assert(len(created(model)) <= 4 * model.window_size)
+        assert(max(created(model)) == 600)
+        assert(min(created(model)) >= 600 - 4 * model.window_size)
+
+        # Estimates are kept when the DaveActions are released.
+        item = model.dave_actions_all[3]
+        item.setUsageEstimates(10.0, 1.0)
+        item.releaseDaveAction()
+        assert(item.getDaveAction().getDuration() == 1.0)
+        assert(item.getDaveAction().getUsage() == 10.0)
+
+def test_dave_sequence_model_2():
+    """
+    The validation keys are found when they are first needed.
+    """
+    getApp()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model = makeSequence(tmp_dir, 20, 2)
+        assert(model.dave_actions_all[-1].getValidationKey() is None)
+
+        # One for the directory, one for each position, one for each parameters and one for each movie.
+        items = model.getValidationItems()
+        assert(len(items) == 1 + 20 + 2 + 2)
+        assert(created(model) == [])
+
+        movie = model.dave_actions_all[3]
+        assert(movie.getValidationContext() == {"directory" : tmp_dir, "parameters" : "p0"})
+        assert(model.getContextSetter("parameters", "p0") is model.dave_actions_all[2])
+
+        model.setGroupEstimates(movie.getValidationKey(), 10.0, 1.0)
+        assert(model.getRemainingTime() == 20.0)
+        assert(model.getRunSize() == 200.0)
+
+def test_dave_sequence_model_3():
+    """
+    The model works with a tree view.
+    """
+    getApp()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model = makeSequence(tmp_dir, 50, 2)
+
+        # This checks the model every time that it changes, so it needs to
+        # exist for the whole test.
+        tester = QtTest.QAbstractItemModelTester(model, QtTest.QAbstractItemModelTester.FailureReportingMode.Fatal)
+
+        viewer = sequenceViewer.DaveCommandTreeViewer()
+        viewer.setModel(model)
+        viewer.expandAll()
+        viewer.resize(300, 200)
+        viewer.show()
+        app.processEvents()
+
+        # Branches and actions.
+        assert(model.rowCount() == 2)
+        loop = model.index(1, 0)
+        assert(model.data(loop) == "positions")
+        assert(model.rowCount(loop) == 100)
+        movie = model.index(99, 0, loop)
+        assert(model.data(movie) == "movie_49_1")
+        take_movie = model.index(2, 0, movie)
+        assert(model.itemFromIndex(take_movie) is model.dave_actions_all[-1])
+        assert(model.itemFromIndex(take_movie).getParentName() == "movie_49_1")
+        assert(model.parent(take_movie) == movie)
+        assert not (model.flags(movie) & QtCore.Qt.ItemIsSelectable)
+        assert (model.flags(take_movie) & QtCore.Qt.ItemIsSelectable)
+
+        # Invalid actions are highlighted.
+        assert(model.data(take_movie, QtCore.Qt.BackgroundRole) is None)
+        changed = []
+        model.dataChanged.connect(lambda first, last : changed.append(first))
+        model.itemFromIndex(take_movie).setValid(False)
+        assert(changed == [take_movie])
+        assert(model.data(take_movie, QtCore.Qt.BackgroundRole) is not None)
+
+        # Only the visible actions (and the current action) were created.
+        assert(len(created(model)) < 50)
+
+        viewer.setCurrentAction(model.dave_actions_all[-2])
+        assert(model.getCurrentIndex() == 299)
+        assert(tester.model() is model)
+        viewer.close()
+
+
+if (__name__ == "__main__"):
+    test_dave_sequence_model_1()
+    test_dave_sequence_model_2()
+    test_dave_sequence_model_3()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+"""
+Tests of Dave's sequence validation.
+"""
+import os
+import tempfile
+
+from xml.etree import ElementTree
+from PyQt5 import QtCore, QtWidgets
+
+import storm_control.sc_library.tcpClient as tcpClient
+import storm_control.sc_library.tcpMessage as tcpMessage
+import storm_control.sc_library.tcpServer as tcpServer
+
+import storm_control.dave.dave as dave
+import storm_control.dave.sequenceViewer as sequenceViewer
+
+
+# [frames per second, MB per frame]
+parameters_table = {"fast" : [100.0, 1.0],
+                    "slow" : [10.0, 2.0]}
+
+app = None
+
+def getApp():
+    global app
+    app = QtWidgets.QApplication.instance()
+    if app is None:
+        app = QtWidgets.QApplication([])
+    return app
+
+def waitFor(condition, timeout = 5.0):
+    timer = QtCore.QElapsedTimer()
+    timer.start()
+    while not condition() and (timer.elapsed() < 1000.0 * timeout):
+        app.processEvents(QtCore.QEventLoop.AllEvents, 10)
+    return condition()
+
+
+class FakeHal(QtCore.QObject):
+    """
+    Responds to test messages like HAL's tcpControl module.
+    """
+    def __init__(self, port = None, **kwds):
+        super().__init__(**kwds)
+        self.received = []
+        self.server = tcpServer.TCPServer(port = port)
+        self.test_parameters = "fast"
+
+        self.server.messageReceived.connect(self.handleMessageReceived)
+
+    def handleMessageReceived(self, message):
+        self.received.append(message.getType())
+        respond(message, self)
+        self.server.sendMessage(message)
+
+
+def respond(message, state):
+    """
+    The response of HAL to a test message, state is the test state.
+    """
+    if message.isType("Set Parameters"):
+        if message.getData("parameters") in parameters_table:
+            state.test_parameters = message.getData("parameters")
+        else:
+            message.setError(True, "Parameters not found")
+
+    elif message.isType("Take Movie"):
+        parameters = message.getData("parameters")
+        if parameters is None:
+            parameters = state.test_parameters
+        [fps, mb_per_frame] = parameters_table[parameters]
+        message.addResponse("duration", message.getData("length")/fps)
+        message.addResponse("disk_usage", message.getData("length") * mb_per_frame)
+
+def referenceEstimates(model):
+    """
+    The estimates if every action was validated.
+    """
+    class State(object):
+        test_parameters = "fast"
+
+    state = State()
+    [est_time, est_space] = [0, 0]
+    for item in model.dave_actions_all:
+        message = item.getDaveAction().getMessage()
+        message = tcpMessage.TCPMessage(message_type = message.getType(),
+                                        message_data = message.getMessageData())
+        respond(message, state)
+        if not message.hasError() and message.isType("Take Movie"):
+            est_time += message.getResponse("duration")
+            est_space += message.getResponse("disk_usage")
+    return [est_time, est_space]
+
+def makeSequence(tmp_dir, actions):
+    """
+    actions is a list of [action name, {field : value}].
+    """
+    root = ElementTree.Element("sequence")
+    for [name, fields] in actions:
+        block = ElementTree.SubElement(root, name)
+        for [f_name, f_value] in fields.items():
+            field = ElementTree.SubElement(block, f_name)
+            field.set("type", type(f_value).__name__)
+            field.text = str(f_value)
+    filename = os.path.join(tmp_dir, "sequence.xml")
+    ElementTree.ElementTree(root).write(filename)
+    return sequenceViewer.parseSequenceFile(filename)
+
+def movie(name, length):
+    return ["DATakeMovie", {"name" : name, "length" : length, "overwrite" : True}]
+
+def cycles(n_cycles, lengths = None):
+    actions = []
+    for i in range(n_cycles):
+        length = 100
+        if lengths is not None:
+            length = lengths.get(i, 100)
+        actions += [["DAMoveStage", {"stage_x" : float(i), "stage_y" : 0.0}],
+                    ["DASetParameters", {"parameters" : "fast"}],
+                    movie("fast_" + str(i), length),
+                    ["DASetParameters", {"parameters" : "slow"}],
+                    movie("slow_" + str(i), 50)]
+    return actions
+
+def validate(engine, viewer, model):
+    done = []
+    engine.done.connect(lambda : done.append(True))
+    viewer.setModel(model)
+    engine.start(model)
+    assert waitFor(lambda : (len(done) == 1))
+    engine.done.disconnect()
+
+def test_dave_validation_1():
+    """
+    Each action is validated once, and again only if it changes.
+    """
+    getApp()
+    hal = FakeHal(port = 9620)
+    client = tcpClient.TCPClient(port = 9620)
+    assert client.startCommunication()
+    engine = dave.ValidationEngine({"hal" : client})
+    viewer = sequenceViewer.DaveCommandTreeViewer()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model = makeSequence(tmp_dir, cycles(50))
+        assert(model.getNumberItems() == 250)
+        validate(engine, viewer, model)
+        assert(len(hal.received) == 54)
+        assert model.isAllValid()
+        assert(viewer.getEstimates() == referenceEstimates(model))
+
+        # Nothing changed.
+        hal.received = []
+        model = makeSequence(tmp_dir, cycles(50))
+        validate(engine, viewer, model)
+        assert(len(hal.received) == 0)
+        assert(viewer.getEstimates() == referenceEstimates(model))
+
+        # One movie changed, it is validated with the right parameters.
+        model = makeSequence(tmp_dir, cycles(50, lengths = {10 : 75}))
+        validate(engine, viewer, model)
+        assert(hal.received == ["Set Parameters", "Take Movie"])
+        assert(viewer.getEstimates() == referenceEstimates(model))
+
+    client.close()
+    hal.server.close()
+
+def test_dave_validation_2():
+    """
+    The test state is restored, and invalid actions are always validated.
+    """
+    getApp()
+    hal = FakeHal(port = 9621)
+    client = tcpClient.TCPClient(port = 9621)
+    assert client.startCommunication()
+    engine = dave.ValidationEngine({"hal" : client}, batch_size = 2)
+    viewer = sequenceViewer.DaveCommandTreeViewer()
+    problems = []
+    def handleProblem(item, message):
+        assert not engine.lost_message_timer.isActive()
+        problems.append(item.getDaveAction().getDescriptor())
+    engine.problem.connect(handleProblem)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        actions = [["DASetParameters", {"parameters" : "slow"}],
+                   movie("m1", 100),
+                   ["DASetParameters", {"parameters" : "fast"}],
+                   movie("m2", 100),
+                   ["DASetParameters", {"parameters" : "slow"}],
+                   movie("m3", 200),
+                   ["DASetParameters", {"parameters" : "bad"}]]
+        for i in range(2):
+            hal.received = []
+            problems = []
+            model = makeSequence(tmp_dir, actions)
+            validate(engine, viewer, model)
+            assert(problems == ["set parameters to bad"])
+            assert not model.dave_actions_all[-1].isValid()
+            assert(viewer.getEstimates() == referenceEstimates(model))
+
+        # 'slow' was re-sent before m3, then only the invalid action is sent again.
+        assert(viewer.getEstimates()[0] == 10.0 + 1.0 + 20.0)
+        assert(hal.received == ["Set Parameters"])
+
+    client.close()
+    hal.server.close()
+
+
+if (__name__ == "__main__"):
+    test_dave_validation_1()
+    test_dave_validation_2()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Tests of the camera frame pool.
+"""
+import numpy
+import pytest
+
+import storm_control.sc_library.parameters as params
+
+import storm_control.hal4000.camera.cameraControl as cameraControl
+import storm_control.hal4000.camera.frame as frame
+import storm_control.hal4000.camera.framePool as framePool
+
+
+def test_frame_pool_1():
+    """
+    Slots are recycled once all references are released.
+    """
+    pool = framePool.FramePool(max_bytes = 4 * 2 * 16, min_slots = 1)
+    pool.resize(16)
+    assert(pool.getStatistics()["slots"] == 4)
+
+    slots = []
+    for i in range(4):
+        slots.append(pool.acquireSlot())
+    assert(pool.acquireSlot() is None)
+
+    stats = pool.getStatistics()
+    assert(stats["high_water"] == 4)
+    assert(stats["in_use"] == 4)
+
+    a_frame = frame.Frame(slots[0].getData(16), 0, 4, 4, "camera1", pool_slot = slots[0])
+    a_frame.hold()
+    a_frame.release()
+    assert(pool.acquireSlot() is None)
+    a_frame.release()
+    assert(pool.getStatistics()["in_use"] == 3)
+    assert(pool.acquireSlot() is slots[0])
+
+    with pytest.raises(framePool.FramePoolException):
+        slots[1].release()
+        slots[1].release()
+
+def test_frame_pool_2():
+    """
+    Slots from before a resize are not returned to the pool.
+    """
+    pool = framePool.FramePool(max_bytes = 2 * 2 * 16, min_slots = 1)
+    pool.resize(16)
+    slot = pool.acquireSlot()
+    assert(slot.getData(16).size == 16)
+
+    pool.resize(32)
+    assert(pool.getStatistics()["slots"] == 1)
+    slot.release()
+    assert(pool.getStatistics()["in_use"] == 0)
+    assert(pool.acquireSlot().getData(32).size == 32)
+    assert(pool.acquireSlot() is None)
+
+def test_frame_pool_3():
+    """
+    A pool with no memory is disabled, frames without a pool
+    slot ignore hold() and release().
+    """
+    pool = framePool.FramePool(max_bytes = 0)
+    pool.resize(16)
+    assert not pool.isEnabled()
+
+    a_frame = frame.Frame(numpy.zeros(16, dtype = numpy.uint16), 0, 4, 4, "camera1")
+    assert not a_frame.isPooled()
+    a_frame.hold()
+    a_frame.release()
+
+def test_frame_pool_4():
+    """
+    Slots are only allocated when they are needed.
+    """
+    pool = framePool.FramePool(max_bytes = 10 * 2 * 16, min_slots = 2)
+    pool.resize(16)
+    assert(pool.getStatistics()["allocated"] == 2)
+
+    slots = [pool.acquireSlot() for i in range(3)]
+    assert(pool.getStatistics()["allocated"] == 3)
+    for slot in slots:
+        slot.release()
+    slots = [pool.acquireSlot() for i in range(3)]
+    stats = pool.getStatistics()
+    assert(stats["allocated"] == 3)
+    assert(stats["high_water"] == 3)
+    assert(stats["slots"] == 10)
+
+def test_frame_pool_5():
+    """
+    Camera drivers can copy frames directly into a frame pool slot.
+    """
+    config = params.StormXMLObject()
+    config.set("frame_pool_mb", 1)
+    camera_control = cameraControl.CameraControl(camera_name = "camera1", config = config)
+    camera_control.frame_pool.resize(16)
+
+    data = numpy.arange(16, dtype = numpy.uint16)
+    slot = camera_control.getFrameSlot()
+    slot.copyData(data.ctypes.data)
+    a_frame = camera_control.createFrame(slot.getData(), 4, 4, pool_slot = slot)
+    assert a_frame.isPooled()
+    assert (a_frame.getData() is slot.getData())
+    assert numpy.array_equal(a_frame.getData(), data)
+    a_frame.release()
+    assert(camera_control.getFramePoolStatistics()["in_use"] == 0)
+
+
+if (__name__ == "__main__"):
+    test_frame_pool_1()
+    test_frame_pool_2()
+    test_frame_pool_3()
+    test_frame_pool_4()
+    test_frame_pool_5()
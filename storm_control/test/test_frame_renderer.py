@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Tests of rendering camera frames in a worker thread.
+"""
+import numpy
+import threading
+
+from PyQt5 import QtWidgets
+
+import storm_control.hal4000.camera.frame as frame
+import storm_control.hal4000.display.frameRenderer as frameRenderer
+import storm_control.hal4000.qtWidgets.qtCameraGraphicsScene as qtCameraGraphicsScene
+
+
+app = None
+
+def getApp():
+    global app
+    app = QtWidgets.QApplication.instance()
+    if app is None:
+        app = QtWidgets.QApplication([])
+    return app
+
+def makeFrame(frame_number):
+    return frame.Frame(numpy.full(64, frame_number, dtype = numpy.uint16), frame_number, 8, 8, "camera1")
+
+def renderFrames(n_frames, reset_after = None):
+    getApp()
+    frameRenderer.setRenderThreads(1)
+    camera_item = qtCameraGraphicsScene.QtCameraGraphicsItem()
+    camera_item.newRange(0, 10)
+
+    images = []
+    frame_renderer = frameRenderer.FrameRenderer()
+    frame_renderer.newImage.connect(images.append)
+    for i in range(n_frames):
+        a_frame = makeFrame(i)
+        frame_renderer.render(a_frame, camera_item.startRender(a_frame))
+        if (i == reset_after):
+            frame_renderer.reset()
+
+    while frame_renderer.isBusy():
+        app.processEvents()
+
+    return [frame_renderer.getStatistics(), images]
+
+def test_frame_renderer_1():
+    """
+    Only the newest frame is rendered if frames arrive faster than
+    they can be rendered.
+    """
+    [stats, images] = renderFrames(5)
+    assert(stats["dropped"] == 3)
+    assert(stats["rendered"] == 2)
+    assert([image.frame.frame_number for image in images] == [0, 4])
+    assert(images[1].q_image.pixelIndex(0, 0) == 102)
+
+def test_frame_renderer_2():
+    """
+    Frames from before a reset are not displayed.
+    """
+    [stats, images] = renderFrames(3, reset_after = 1)
+    assert(stats["dropped"] == 2)
+    assert([image.frame.frame_number for image in images] == [2])
+
+def test_frame_renderer_3():
+    """
+    Image buffers can be used in different threads at the same time.
+    """
+    getApp()
+    a_frame = frame.Frame(numpy.arange(256 * 256, dtype = numpy.uint16), 0, 256, 256, "camera1")
+    camera_item = qtCameraGraphicsScene.QtCameraGraphicsItem()
+
+    # Each buffer uses a different display range, so a different look up table.
+    settings = []
+    for i in range(4):
+        camera_item.newRange(0, 1000 * (i + 1))
+        settings.append(camera_item.startRender(a_frame))
+    buffers = [qtCameraGraphicsScene.ImageBuffer() for i in range(4)]
+    assert(buffers[0].rescaler is not buffers[1].rescaler)
+
+    expected = [buffers[i].render(a_frame, settings[i]).q_image.pixelIndex(100, 2) for i in range(4)]
+    errors = []
+    def renderMany(i):
+        for j in range(20):
+            if (buffers[i].render(a_frame, settings[i]).q_image.pixelIndex(100, 2) != expected[i]):
+                errors.append(i)
+
+    threads = [threading.Thread(target = renderMany, args = (i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert(len(set(expected)) == 4)
+    assert(errors == [])
+
+
+if (__name__ == "__main__"):
+    test_frame_renderer_1()
+    test_frame_renderer_2()
+    test_frame_renderer_3()
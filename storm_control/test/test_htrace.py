@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Tests of HAL message tracing.
+"""
+import os
+import tempfile
+
+import storm_control.sc_library.htrace as htrace
+import storm_control.sc_library.log_timing as logTiming
+
+
+def traceMessage(m_id, source, m_type, handled_by):
+    htrace.traceEvent("queued", m_id, source, m_type)
+    htrace.traceEvent("sent", m_id, source, m_type)
+    for name in handled_by:
+        htrace.traceEvent("handled by", m_id, name, m_type)
+    htrace.traceEvent("processed", m_id, source, m_type)
+
+def test_htrace_1():
+    """
+    Trace some messages and check that log_timing can read them.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        basename = os.path.join(tmp_dir, "hal4000_1")
+        htrace.startTracing(basename, level = 2)
+        assert htrace.isTracing()
+
+        for i in range(10):
+            traceMessage(i, "film", "start film", ["camera1", "display"])
+        htrace.traceEvent("drained", 5, "core")
+        htrace.traceEvent("worker started 1000", 3, "camera1", "start film")
+        htrace.traceEvent("worker done", 3, "camera1", "start film")
+        htrace.stopTracing()
+        assert not htrace.isTracing()
+        assert not htrace.traceEvent("queued", 11, "film", "stop film")
+
+        messages = logTiming.logTiming(basename)
+        assert(len(messages) == 10)
+        assert(messages["3"].getNWorkers() == 1)
+        assert(messages["0"].getHandledBy() == {"camera1" : 1, "display" : 1})
+        assert(messages["0"].getSource() == "film")
+        assert(messages["0"].getType() == "start film")
+        assert(messages["9"].getProcessingTime() >= 0.0)
+        assert(logTiming.drainCounts(basename) == {"core" : [5]})
+
+def test_htrace_2():
+    """
+    Test tracing levels and sampling.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        basename = os.path.join(tmp_dir, "hal4000_1")
+        htrace.startTracing(basename, level = 0)
+        assert not htrace.isTracing()
+
+        htrace.startTracing(basename, level = 1, sample_every = 2)
+        for i in range(10):
+            traceMessage(i, "film", "start film", ["camera1"])
+            htrace.traceEvent("worker done", i, "camera1", "start film")
+        htrace.stopTracing()
+
+        [events, names] = htrace.loadTrace(basename)
+        assert(events.size == 25)
+        assert(set(events["m_id"].tolist()) == set([0, 2, 4, 6, 8]))
+        assert((events["event"] == htrace.HANDLED).sum() == 5)
+        assert((events["event"] == htrace.WORKER_DONE).sum() == 5)
+
+        messages = logTiming.traceTiming(basename)
+        assert(messages["4"].getNWorkers() == 1)
+
+def test_htrace_3():
+    """
+    Test that events are dropped, not blocked, when the buffer is full,
+    and that the buffer wraps correctly.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        basename = os.path.join(tmp_dir, "hal4000_1")
+
+        # Don't start the flush thread so that nothing empties the buffer.
+        a_tracer = htrace.Tracer(basename = basename, level = 2, n_events = 8)
+        a_tracer.read_count = 5
+        a_tracer.write_count = 5
+
+        for i in range(10):
+            a_tracer.record(htrace.SENT, i, "core", "test")
+        stats = a_tracer.getStatistics()
+        a_tracer.flush()
+        a_tracer.fp.close()
+        a_tracer.names_fp.close()
+
+        assert(stats["dropped"] == 2)
+        [events, names] = htrace.loadTrace(basename)
+        assert(events["m_id"].tolist() == list(range(8)))
+
+
+if (__name__ == "__main__"):
+    test_htrace_1()
+    test_htrace_2()
+    test_htrace_3()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Tests of the memory mapped Insight3 file reader.
+"""
+import numpy
+import os
+import struct
+import tempfile
+
+import storm_control.sc_library.i3reader as i3reader
+import storm_control.zee_calibrator.zcal as zcal
+
+
+def writeI3File(filename, fr):
+    data = numpy.zeros(fr.size, dtype = i3reader.i3DataType())
+    data["fr"] = fr
+    data["x"] = numpy.arange(fr.size)
+    data["i"] = numpy.arange(fr.size) % 10
+    data["w"] = 300.0
+    data["ax"] = 1.0
+    with open(filename, "wb") as fp:
+        fp.write(struct.pack("4siii", b"M425", int(fr.max()), 6, fr.size))
+        data.tofile(fp)
+
+        # Insight3 meta-data.
+        fp.write(b"<xml></xml>")
+    return data
+
+def test_i3reader_1():
+    """
+    Read a file with localizations in frame order.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = os.path.join(tmp_dir, "test_mlist.bin")
+        data = writeI3File(filename, numpy.repeat(numpy.arange(1, 101), 5))
+
+        reader = i3reader.I3Reader(filename, chunk_size = 64)
+        assert(reader.getNumberMolecules() == 500)
+        assert reader.isFrameSorted()
+        assert(list(reader.getFrameRange()) == [1, 100])
+        assert numpy.array_equal(reader.getField("x"), data["x"])
+
+        chunks = list(reader.chunks(["x", "fr"], frames_per_chunk = 30))
+        assert([chunk.size for chunk in chunks] == [150, 150, 150, 50])
+        assert(chunks[0].dtype.names == ("x", "fr"))
+        assert numpy.array_equal(numpy.concatenate(chunks)["x"], data["x"])
+
+        chunks = list(reader.chunks(["fr"], start = 10, stop = 20))
+        assert(len(chunks) == 1)
+        assert numpy.array_equal(numpy.unique(chunks[0]["fr"]), numpy.arange(10, 20))
+
+        loaded = reader.load(["x", "i"], mask_fn = lambda chunk: (chunk["i"] > 4))
+        assert numpy.array_equal(loaded["x"], data["x"][data["i"] > 4])
+
+        # The z calibration loads the same localizations.
+        zc = zcal.ZCalibration(None, 2, None, 160.0)
+        zc.loadMolecules(filename, 4)
+        assert numpy.array_equal(zc.i3_data["fr"], data["fr"][data["i"] > 4] - 1)
+        assert numpy.array_equal(zcal.readI3File(filename, 160.0), data)
+
+        del reader
+        del loaded
+
+def test_i3reader_2():
+    """
+    Read a file with localizations that are not in frame order.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = os.path.join(tmp_dir, "test_mlist.bin")
+        numpy.random.seed(0)
+        data = writeI3File(filename, numpy.random.randint(0, 50, 1000))
+
+        reader = i3reader.I3Reader(filename, chunk_size = 64)
+        assert not reader.isFrameSorted()
+        assert(list(reader.getFrameRange()) == [data["fr"].min(), data["fr"].max()])
+
+        chunks = list(reader.chunks(["x", "fr"], frames_per_chunk = 7))
+        assert(sum([chunk.size for chunk in chunks]) == 1000)
+        for i, first in enumerate(range(data["fr"].min(), data["fr"].max() + 1, 7)):
+            expected = data["x"][(data["fr"] >= first) & (data["fr"] < (first + 7))]
+            assert numpy.array_equal(chunks[i]["x"], expected)
+
+        del reader
+
+
+if (__name__ == "__main__"):
+    test_i3reader_1()
+    test_i3reader_2()
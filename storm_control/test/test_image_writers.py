@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Tests of the image writers.
+"""
+import numpy
+import os
+import pytest
+import tempfile
+
+import storm_control.sc_library.parameters as params
+
+import storm_control.hal4000.camera.cameraFunctionality as cameraFunctionality
+import storm_control.hal4000.camera.frame as frame
+import storm_control.hal4000.film.filmSettings as filmSettings
+import storm_control.hal4000.halLib.imagewriters as imagewriters
+
+
+def makeCameraFunctionality(x_pixels, y_pixels):
+    p = params.StormXMLObject()
+    p.add(params.ParameterInt(name = "bytes_per_frame", value = 2 * x_pixels * y_pixels))
+    p.add(params.ParameterString(name = "extension", value = ""))
+    p.add(params.ParameterInt(name = "x_pixels", value = x_pixels))
+    p.add(params.ParameterInt(name = "y_pixels", value = y_pixels))
+    return cameraFunctionality.CameraFunctionality(camera_name = "camera1",
+                                                   parameters = p)
+
+def writeDax(writer_queue):
+    """
+    Write a .dax file and check that we can read it back.
+    """
+    [x_pixels, y_pixels, n_frames] = [16, 8, 50]
+    cam_fn = makeCameraFunctionality(x_pixels, y_pixels)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        film_settings = filmSettings.FilmSettings(basename = os.path.join(tmp_dir, "movie"),
+                                                  filetype = ".dax",
+                                                  writer_queue = writer_queue)
+        writer = imagewriters.createFileWriter(cam_fn, film_settings)
+
+        images = []
+        for i in range(n_frames):
+            image = numpy.random.randint(0, 1000, size = x_pixels * y_pixels).astype(numpy.uint16)
+            images.append(image)
+            cam_fn.newFrame.emit(frame.Frame(image, i, x_pixels, y_pixels, "camera1"))
+        cam_fn.stopped.emit()
+        writer.closeWriter()
+
+        data = numpy.fromfile(os.path.join(tmp_dir, "movie.dax"), dtype = numpy.uint16)
+        assert numpy.array_equal(data, numpy.concatenate(images))
+        with open(os.path.join(tmp_dir, "movie.inf")) as fp:
+            assert("number of frames = " + str(n_frames) in fp.read())
+
+def test_image_writers_1():
+    writeDax(0)
+
+def test_image_writers_2():
+    writeDax(4)
+
+def test_image_writers_3():
+    """
+    The file is closed even if the background writer failed.
+    """
+    cam_fn = makeCameraFunctionality(16, 8)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        film_settings = filmSettings.FilmSettings(basename = os.path.join(tmp_dir, "movie"),
+                                                  filetype = ".dax",
+                                                  writer_queue = 4)
+        writer = imagewriters.createFileWriter(cam_fn, film_settings)
+        def writeFrames(frames):
+            raise IOError("disk full")
+        writer.writeFrames = writeFrames
+
+        cam_fn.newFrame.emit(frame.Frame(numpy.zeros(16 * 8, dtype = numpy.uint16), 0, 16, 8, "camera1"))
+        cam_fn.stopped.emit()
+        with pytest.raises(imagewriters.ImageWriterException):
+            writer.closeWriter()
+        assert writer.fp.closed
+
+
+if (__name__ == "__main__"):
+    test_image_writers_1()
+    test_image_writers_2()
+    test_image_writers_3()
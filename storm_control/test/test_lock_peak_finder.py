@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Test the numpy focus lock gaussian fitter.
+"""
+import numpy
+
+import storm_control.sc_hardware.utility.np_lock_peak_finder as npLPF
+
+
+def drawGaussian(size, params):
+    [background, height, cx, cy, wx, wy] = params
+    [x, y] = numpy.indices((size, size))
+    return background + height * numpy.exp(-2.0 * (((cx-x)/wx)**2 + ((cy-y)/wy)**2))
+
+def test_gaussian_fitter_1():
+    """
+    Batched fits agree with leastsq fits.
+    """
+    numpy.random.seed(0)
+    sigma = 4.0
+    truth = [[10.0, 300.0, 6.3, 5.8, 4.4, 3.9],
+             [12.0, 250.0, 5.6, 6.4, 3.8, 4.2]]
+    images = [numpy.random.poisson(drawGaussian(12, p)).astype(numpy.float64) for p in truth]
+
+    fitter = npLPF.GaussianFitter(sigma = sigma)
+    [params, good] = fitter.fit(images)
+    assert good.all()
+    for i, image in enumerate(images):
+        [ls_params, ls_good] = npLPF.fitFixedEllipticalGaussian(image, sigma)
+        assert ls_good
+        assert numpy.allclose(params[i], ls_params, atol = 1.0e-3)
+
+    [params, good] = npLPF.GaussianFitter(elliptical = False, sigma = sigma).fit(images)
+    assert good.all()
+    for i, image in enumerate(images):
+        [ls_params, ls_good] = npLPF.fitSymmetricGaussian(image, sigma)
+        assert numpy.allclose(params[i], ls_params, atol = 1.0e-3)
+
+def test_gaussian_fitter_2():
+    """
+    Warm starts when the fitting windows move.
+    """
+    sigma = 4.0
+    fitter = npLPF.GaussianFitter(sigma = sigma)
+    for i in range(5):
+        truth = [10.0, 300.0, 6.0 + 0.2 * i, 6.0 - 0.1 * i, 4.0, 4.0]
+        origin = [i % 2, 0]
+        image = drawGaussian(12 + 1, truth)[origin[0]:origin[0]+12, origin[1]:origin[1]+12]
+        [params, good] = fitter.fit([image], origins = [origin])
+        assert good[0]
+        assert (abs(params[0,2] + origin[0] - truth[2]) < 1.0e-3)
+        assert (abs(params[0,3] + origin[1] - truth[3]) < 1.0e-3)
+
+def test_gaussian_fitter_3():
+    """
+    Fitting after a reset.
+    """
+    sigma = 4.0
+    truth = [10.0, 300.0, 6.0, 6.0, 4.0, 4.0]
+    image = drawGaussian(12, truth)
+    fitter = npLPF.GaussianFitter(sigma = sigma)
+    [params, good] = fitter.fit([image], origins = [[0, 0]])
+    fitter.reset()
+    [reset_params, reset_good] = fitter.fit([image], origins = [[0, 0]])
+    assert reset_good[0]
+    assert numpy.allclose(params, reset_params, atol = 1.0e-3)
+
+def test_gaussian_fitter_4():
+    """
+    Fits that stop without converging are not good.
+    """
+    sigma = 4.0
+    images = [drawGaussian(12, [10.0, 300.0, 6.0, 6.0, 4.0, 4.0]),
+              numpy.full((12, 12), 10.0)]
+    [params, good] = npLPF.GaussianFitter(sigma = sigma).fit(images)
+    assert good[0]
+    assert not good[1]
+
+
+if (__name__ == "__main__"):
+    test_gaussian_fitter_1()
+    test_gaussian_fitter_2()
+    test_gaussian_fitter_3()
+    test_gaussian_fitter_4()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Test replaying QPD traces through the focus lock modes.
+"""
+import numpy
+import os
+import tempfile
+
+from PyQt5 import QtCore
+
+import storm_control.hal4000.focusLock.lockReplay as lockReplay
+
+
+def getApp():
+    app = QtCore.QCoreApplication.instance()
+    if app is None:
+        app = QtCore.QCoreApplication([])
+    return app
+
+def test_lock_replay_1():
+    """
+    The lock follows a step in the focus.
+    """
+    app = getApp()
+    trace = lockReplay.syntheticTrace(1000, steps = [[500, 0.5]])
+    replay = lockReplay.LockReplay(lock_mode = "AlwaysOnLockMode", trace = trace)
+    results = replay.run(target = 0.0)
+
+    stats = results.getStatistics()
+    assert (stats["settle_time"] is not None)
+    assert (stats["rms_error"] < 0.02)
+    assert (stats["realtime_factor"] > 1.0)
+
+    # The lock should have lost lock after the step, then recovered.
+    assert not results.good_lock[505]
+    assert results.good_lock[-1]
+    assert (abs(results.stage_z[-1] - results.stage_z[0] - 0.5) < 0.02)
+
+def test_lock_replay_2():
+    """
+    Replaying a recorded trace without locking gives the recorded offsets.
+    """
+    app = getApp()
+    offsets = numpy.random.normal(scale = 0.1, size = 100)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = os.path.join(tmp_dir, "movie_01.off")
+        with open(filename, "w") as fp:
+            fp.write("frame offset power stage-z good-offset\n")
+            for i, offset in enumerate(offsets):
+                fp.write("{0:d} {1:.6f} {2:.6f} {3:.6f} {4:0d}\n".format(i + 1, offset, 1000.0, 50.0, 1))
+        trace = lockReplay.loadTrace(filename)
+
+    replay = lockReplay.LockReplay(lock_mode = "NoLockMode", trace = trace)
+    results = replay.run(lock = False)
+    assert numpy.allclose(results.offset, offsets, atol = 1.0e-5)
+    assert numpy.allclose(results.stage_z, 50.0)
+
+def test_lock_replay_3():
+    """
+    The optimal lock mode finds the offset with the best focus.
+    """
+    app = getApp()
+    camera = lockReplay.SyntheticCamera(best_offset = 0.3)
+    trace = lockReplay.syntheticTrace(2000)
+    replay = lockReplay.LockReplay(camera = camera,
+                                   lock_mode = "OptimalLockMode",
+                                   trace = trace)
+    results = replay.run(film = True, target = 0.0)
+    assert (abs(results.target[-1] - 0.3) < 0.05)
+
+
+if (__name__ == "__main__"):
+    test_lock_replay_1()
+    test_lock_replay_2()
+    test_lock_replay_3()
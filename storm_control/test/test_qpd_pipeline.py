@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Test the uc480 camera QPD capture / analysis pipeline.
+"""
+import numpy
+import time
+
+import storm_control.sc_hardware.thorlabs.uc480Camera as uc480Camera
+
+
+class FakeCameraQPD(object):
+    """
+    Provides the CameraQPD methods that QPDPipeline uses. Every
+    other image is a duplicate of the previous image.
+    """
+    def __init__(self, n_images = 20):
+        self.data = numpy.zeros((10, 10), dtype = numpy.uint8)
+        self.n_captured = 0
+        self.n_images = n_images
+
+    def analyzeImage(self, data):
+        time.sleep(0.002)
+        return [float(data[0,0]), 2.0, 2.0 * float(data[0,0])]
+
+    def capture(self):
+        time.sleep(0.001)
+        if (self.n_captured < self.n_images):
+            self.data[0,0] = self.n_captured//2
+            self.n_captured += 1
+        return self.data
+
+    def getImageInfo(self):
+        return [0.0, 0.0, 0.0, 0.0, 1.0]
+
+def test_qpd_pipeline_1():
+    camera_qpd = FakeCameraQPD()
+    pipeline = uc480Camera.QPDPipeline(camera_qpd = camera_qpd, reps = 2)
+    pipeline.start()
+    while (camera_qpd.n_captured < camera_qpd.n_images):
+        [power, offset, is_good] = pipeline.getOffset()
+        assert is_good
+        assert (offset == power)
+    time.sleep(0.05)
+    pipeline.stop()
+
+    # The last image should have been analyzed.
+    [image, x_off1, y_off1, x_off2, y_off2, sigma] = pipeline.getImage()
+    assert (image[0,0] == 9)
+    
+    stats = pipeline.getStatistics()
+    assert (stats["captured"] == 10)
+    assert (stats["analyzed"] + stats["dropped"] == stats["captured"])
+    assert (stats["duplicates"] > 10)
+
+
+if (__name__ == "__main__"):
+    test_qpd_pipeline_1()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""
+Tests of event driven RS232 communication.
+"""
+import pytest
+import threading
+import time
+
+import storm_control.sc_hardware.serial.RS232 as RS232
+import storm_control.sc_hardware.serial.serialTransport as serialTransport
+
+
+class FakeDevice(object):
+    """
+    A scripted device with the parts of the pySerial interface that
+    SerialTransport uses. Commands are handled in order and each one
+    takes delay seconds.
+    """
+    def __init__(self, delay = 0.002, script = None, **kwds):
+        super().__init__(**kwds)
+        self.condition = threading.Condition()
+        self.delay = delay
+        self.incoming = b""
+        self.last_ready = 0.0
+        self.output = b""
+        self.pending = []
+        self.script = script
+        self.timeout = None
+
+    @property
+    def in_waiting(self):
+        with self.condition:
+            self.update()
+            return len(self.output)
+
+    def read(self, size = 1):
+        with self.condition:
+            end_time = time.perf_counter() + self.timeout
+            self.update()
+            while (len(self.output) == 0) and (time.perf_counter() < end_time):
+                wait = end_time - time.perf_counter()
+                if (len(self.pending) > 0):
+                    wait = min(wait, self.pending[0][0] - time.perf_counter())
+                self.condition.wait(max(wait, 0.0))
+                self.update()
+            data = self.output[:size]
+            self.output = self.output[size:]
+            return data
+
+    def update(self):
+        while (len(self.pending) > 0) and (self.pending[0][0] <= time.perf_counter()):
+            self.output += self.pending.pop(0)[1]
+
+    def write(self, data):
+        with self.condition:
+            self.incoming += data
+            while (b"\r" in self.incoming):
+                [command, self.incoming] = self.incoming.split(b"\r", 1)
+                self.last_ready = max(self.last_ready, time.perf_counter()) + self.delay
+                response = self.script.get(command.decode())
+                if response is not None:
+                    self.pending.append([self.last_ready, response.encode()])
+            self.condition.notify_all()
+
+
+def test_rs232_transport_1():
+    """
+    Event driven queries return the same response as polling, but a lot faster.
+    """
+    timing = {}
+    for event_driven in [False, True]:
+        rs232 = RS232.RS232(baudrate = 9600, event_driven = event_driven, port = "loop://")
+        assert rs232.getStatus()
+        start_time = time.perf_counter()
+        for i in range(3):
+            assert(rs232.commWithResp("pos " + str(i)) == "pos " + str(i) + "\r")
+        timing[event_driven] = time.perf_counter() - start_time
+
+        rs232.sendCommand("ver")
+        assert(rs232.waitResponse() == "ver\r")
+        rs232.writeline("ver")
+        time.sleep(0.05)
+        assert(rs232.getResponse() == "ver\r")
+        assert(rs232.getResponse() is None)
+
+        if event_driven:
+            assert(rs232.getLatencyHistogram().getStatistics()["count"] == 3)
+            with pytest.raises(RS232.RS232Exception):
+                rs232.read(1)
+        else:
+            assert(rs232.getLatencyHistogram() is None)
+        rs232.shutDown()
+
+    assert(timing[False] > 0.3)
+    assert(timing[True] < 0.1)
+
+def test_rs232_transport_2():
+    """
+    Pipelined queries, multi-line responses and commands without a response.
+    """
+    script = {"P" : "100,200,0\r",
+              "?" : "STAGE = H101\rFOCUS = NONE\rEND\r",
+              "$" : "0\r"}
+    device = FakeDevice(delay = 0.01, script = script)
+    transport = serialTransport.SerialTransport(tty = device)
+
+    # One at a time.
+    start_time = time.perf_counter()
+    responses = [transport.query(command) for command in ["P", "$", "P", "$"]]
+    sequential = time.perf_counter() - start_time
+    assert(responses == ["100,200,0\r", "0\r", "100,200,0\r", "0\r"])
+
+    # All at once.
+    start_time = time.perf_counter()
+    assert(transport.queryPipelined(["P", "$", "P", "$"]) == responses)
+    pipelined = time.perf_counter() - start_time
+    assert(pipelined < sequential)
+
+    assert(transport.query("?", end_of_response = "END\r") == script["?"])
+
+    # No response, the late response to the first query is discarded.
+    assert(transport.query("J", timeout = 0.05) is None)
+    assert(transport.query("P", timeout = 0.005) is None)
+    time.sleep(0.02)
+    assert(transport.query("$") == "0\r")
+
+    statistics = transport.getStatistics()
+    assert(statistics["count"] == 10)
+    assert(statistics["discarded"] == 1)
+    assert(statistics["timeouts"] == 2)
+    assert(0.01 <= statistics["median"] < 0.1)
+    transport.close()
+
+def test_rs232_transport_3():
+    """
+    Latency histogram.
+    """
+    histogram = serialTransport.LatencyHistogram(bins_per_decade = 1, max_latency = 1.0, min_latency = 1.0e-3)
+    assert(histogram.getBinEdges() == [1.0e-3, 1.0e-2, 1.0e-1, 1.0])
+    assert(histogram.getStatistics()["median"] is None)
+    for latency in [1.0e-4, 2.0e-3, 3.0e-3, 4.0e-2, 5.0]:
+        histogram.addLatency(latency)
+    assert(histogram.getCounts() == [3, 1, 1])
+    assert(histogram.getPercentile(50) == 1.0e-2)
+    assert(histogram.getPercentile(99) == 5.0)
+    assert(histogram.getStatistics()["count"] == 5)
+
+
+if (__name__ == "__main__"):
+    test_rs232_transport_1()
+    test_rs232_transport_2()
+    test_rs232_transport_3()
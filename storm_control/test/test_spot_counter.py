@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Tests of the spot counter frame scheduling.
+"""
+import numpy
+
+from PyQt5 import QtWidgets
+
+import storm_control.hal4000.camera.frame as frame
+import storm_control.hal4000.spotCounter.findSpots as findSpots
+
+
+app = None
+
+def getApp():
+    global app
+    app = QtWidgets.QApplication.instance()
+    if app is None:
+        app = QtWidgets.QApplication([])
+    return app
+
+def makeFrame(frame_number):
+    image = numpy.ones((64, 64), dtype = numpy.uint16)
+    image[20, 30] = 500
+    return frame.Frame(image.flatten(), frame_number, 64, 64, "camera1")
+
+def test_spot_counter_1():
+    """
+    Test the frame queue policies.
+    """
+    queue = findSpots.CameraQueue(policy = "drop_oldest", queue_size = 3)
+    for i in range(5):
+        queue.addFrame(makeFrame(i), 100)
+    assert(queue.getStatistics()["dropped"] == 2)
+    assert(queue.nextFrame()[0].frame_number == 2)
+
+    queue = findSpots.CameraQueue(policy = "latest", queue_size = 3)
+    for i in range(5):
+        queue.addFrame(makeFrame(i), 100)
+    assert(queue.getStatistics()["dropped"] == 4)
+    assert(queue.nextFrame()[0].frame_number == 4)
+
+    queue = findSpots.CameraQueue(decimation = 3, policy = "every_nth", queue_size = 10)
+    for i in range(10):
+        queue.addFrame(makeFrame(i), 100)
+    stats = queue.getStatistics()
+    assert(stats["dropped"] == 0)
+    assert(stats["queued"] == 4)
+    assert(stats["skipped"] == 6)
+
+def test_spot_counter_2():
+    """
+    Test that every Nth frame is analyzed.
+    """
+    getApp()
+    spot_counter = findSpots.SpotCounter(decimation = 2,
+                                         max_threads = 2,
+                                         max_size = 64 * 64,
+                                         policy = "every_nth",
+                                         queue_size = 20)
+    analyzed = []
+    spot_counter.imageProcessed.connect(lambda fa: analyzed.append([fa.getFrameNumber(), fa.getCounts()]))
+    for i in range(20):
+        spot_counter.newFrameToAnalyze("camera1", makeFrame(i), 100)
+
+    while (len(analyzed) < 10):
+        app.processEvents()
+    spot_counter.cleanUp()
+
+    assert(sorted(analyzed) == [[i, 1] for i in range(0, 20, 2)])
+    stats = spot_counter.getStatistics("camera1")
+    assert(stats["analyzed"] == 10)
+    assert(stats["dropped"] == 0)
+    assert(stats["skipped"] == 10)
+
+def test_spot_counter_3():
+    """
+    Workers are busy until the spot counter has handled their results.
+    """
+    worker = findSpots.AnalysisWorker(max_locs = 10)
+    results = []
+    worker.aw_signaler.analysisDone.connect(lambda fa, aw: results.append(fa))
+    worker.setFrameAnalysis(findSpots.FrameAnalysis(frame = makeFrame(0), max_locs = 10, threshold = 100))
+    worker.run()
+    assert(len(results) == 1)
+    assert worker.isBusy()
+    worker.setDone()
+    assert not worker.isBusy()
+
+
+if (__name__ == "__main__"):
+    test_spot_counter_1()
+    test_spot_counter_2()
+    test_spot_counter_3()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""
+Tests of Steve's image pyramid rendering.
+"""
+import numpy
+import pickle
+
+from PyQt5 import QtWidgets
+
+import storm_control.steve.qtMultifieldView as qtMultifieldView
+
+
+class FakeImage(object):
+    """
+    The parts of capture.Image that viewImageItem uses.
+    """
+    def __init__(self, size = 256, **kwds):
+        super().__init__(**kwds)
+        self.data = numpy.arange(size * size, dtype = numpy.uint16).reshape(size, size)
+        self.height = size
+        self.image_max = size * size
+        self.image_min = 0
+        self.parameters_file = "NA"
+        self.width = size
+        self.x_um = 0.0
+        self.y_um = 0.0
+
+app = None
+
+def makeView():
+    global app
+    app = QtWidgets.QApplication.instance()
+    if app is None:
+        app = QtWidgets.QApplication([])
+    qtMultifieldView.pixmap_cache = qtMultifieldView.PixmapCache()
+    view = qtMultifieldView.MultifieldView(None)
+    view.resize(400, 400)
+    return view
+
+def test_steve_pyramid_1():
+    """
+    Images are drawn at the pyramid level that matches the scale.
+    """
+    view = makeView()
+    cache = qtMultifieldView.getPixmapCache()
+    view.addViewImageItem(FakeImage(), 0, 0, 0, 0, "obj1", 1.0, 0.0)
+    item = view.getImageItems()[0]
+
+    assert(item.boundingRect().width() == 256)
+    assert(item.getLevel(1.0) == 0)
+    assert(item.getLevel(0.5) == 1)
+    assert(item.getLevel(0.2) == 2)
+    assert(item.getLevel(0.01) == 3)
+
+    # The first time the image is drawn the pixmap is created immediately.
+    view.setScale(0.25)
+    view.grab()
+    assert(list(item.pyramid) == [2])
+    assert(item.pyramid[2].width() == 64)
+
+    # Then the closest level is drawn while the right level is created.
+    view.setScale(1.0)
+    view.centerOn(item.sceneBoundingRect().center())
+    view.grab()
+    assert(list(item.pyramid) == [2])
+    cache.waitForDone()
+    assert(sorted(item.pyramid) == [0, 2])
+    assert(cache.getStatistics()["pending"] == 0)
+
+    # Changing the contrast keeps the pixmaps until they are re-mapped.
+    view.changeContrast([0, 1000])
+    assert(item.stale == {0, 2})
+    view.grab()
+    cache.waitForDone()
+    assert(item.stale == {2})
+    assert(item.pyramid[0].toImage().pixelColor(10, 0).red() == 255)
+
+    # The pyramid is not saved.
+    state = pickle.loads(pickle.dumps(item.getState()))
+    assert not ("pyramid" in state)
+
+def test_steve_pyramid_2():
+    """
+    The cache stays within its budget, and hidden images are dropped.
+    """
+    view = makeView()
+    cache = qtMultifieldView.getPixmapCache()
+    for i in range(4):
+        view.addViewImageItem(FakeImage(), 300 * i, 0, 0, 0, "obj1", 1.0, 0.0)
+    items = view.getImageItems()
+
+    cache.setBudget(2.5 * qtMultifieldView.pixmapCost(items[0].getPixmap()))
+    for item in items:
+        item.getPixmap()
+    assert(cache.getStatistics()["pixmaps"] == 2)
+    assert(cache.getStatistics()["evicted"] == 2)
+    assert([len(item.pyramid) for item in items] == [0, 0, 1, 1])
+
+    # The least recently used pixmap is dropped first.
+    items[2].getPixmap()
+    items[0].getPixmap()
+    assert([len(item.pyramid) for item in items] == [1, 0, 1, 0])
+
+    view.centerOn(items[0].sceneBoundingRect().center())
+    view.dropHiddenPixmaps()
+    assert([len(item.pyramid) for item in items] == [1, 0, 0, 0])
+
+    # Pixmaps that are created after the images are removed are not cached.
+    for item in items:
+        cache.requestPixmap(item, 1)
+    cache.thread_pool.waitForDone()
+    view.clearMosaic()
+    app.processEvents()
+    assert([len(item.pyramid) for item in items] == [0, 0, 0, 0])
+    assert(cache.getStatistics()["pixmaps"] == 0)
+    assert(cache.getStatistics()["pending"] == 0)
+
+def test_steve_pyramid_3():
+    """
+    Look up table contrast gives the same images as rescaling.
+    """
+    makeView()
+    data = numpy.random.randint(0, 4000, (100, 75)).astype(numpy.uint16)
+    for level in range(qtMultifieldView.n_levels):
+        lut_image = qtMultifieldView.createImage(data, level, 100, 3000)
+        float_image = qtMultifieldView.createImage(data.astype(numpy.float64), level, 100, 3000)
+        assert(lut_image.width() == (100 >> level))
+        assert(lut_image.height() == (75 >> level))
+        diff = lut_image.ndarray.astype(numpy.int32) - float_image.ndarray.astype(numpy.int32)
+        if (level == 0):
+            assert numpy.array_equal(lut_image.ndarray, float_image.ndarray)
+        else:
+            assert (numpy.abs(diff) <= 1).all()
+    assert(qtMultifieldView.getLUT(100, 3000) is qtMultifieldView.getLUT(100, 3000))
+
+    # Signed images are not converted with a look up table.
+    data = numpy.random.randint(-2000, 2000, (100, 75)).astype(numpy.int16)
+    assert not qtMultifieldView.useLUT(data)
+    for level in range(qtMultifieldView.n_levels):
+        int_image = qtMultifieldView.createImage(data, level, -1000, 1000)
+        float_image = qtMultifieldView.createImage(data.astype(numpy.float64), level, -1000, 1000)
+        assert numpy.array_equal(int_image.ndarray, float_image.ndarray)
+
+
+if (__name__ == "__main__"):
+    test_steve_pyramid_1()
+    test_steve_pyramid_2()
+    test_steve_pyramid_3()
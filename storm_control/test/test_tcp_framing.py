@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Tests of TCP message framing.
+"""
+from PyQt5 import QtCore, QtWidgets
+
+import storm_control.sc_library.tcpClient as tcpClient
+import storm_control.sc_library.tcpFraming as tcpFraming
+import storm_control.sc_library.tcpMessage as tcpMessage
+import storm_control.sc_library.tcpServer as tcpServer
+
+
+app = None
+
+def getApp():
+    global app
+    app = QtWidgets.QApplication.instance()
+    if app is None:
+        app = QtWidgets.QApplication([])
+    return app
+
+def waitFor(condition, timeout = 5.0):
+    timer = QtCore.QElapsedTimer()
+    timer.start()
+    while not condition() and (timer.elapsed() < 1000.0 * timeout):
+        app.processEvents(QtCore.QEventLoop.AllEvents, 10)
+    return condition()
+
+def test_tcp_framing_1():
+    """
+    Messages are decoded no matter how the frames are split up.
+    """
+    messages = [tcpMessage.TCPMessage(message_type = "Test", message_data = {"index" : i, "text" : "é" * i})
+                for i in range(20)]
+    data = b""
+    for i, message in enumerate(messages):
+        data += tcpFraming.encodeFrame(message, binary = bool(i % 3 == 0))
+
+    for chunk_size in [1, 7, 64, len(data)]:
+        decoder = tcpFraming.FrameDecoder()
+        decoded = []
+        for i in range(0, len(data), chunk_size):
+            decoded.extend(decoder.addData(data[i:i+chunk_size]))
+        assert([message.getID() for message in decoded] == [message.getID() for message in messages])
+        assert([message.getData("text") for message in decoded] == [message.getData("text") for message in messages])
+        assert(decoder.getStatistics() == {"binary" : 7, "buffered" : 0, "json" : 13})
+        assert decoder.gotBinary()
+
+def test_tcp_framing_2():
+    """
+    Empty lines and corrupt frames are skipped.
+    """
+    message = tcpMessage.TCPMessage(message_type = "Test")
+    decoder = tcpFraming.FrameDecoder()
+    data = b"\n\r\n" + b"{not json\n" + tcpFraming.encodeFrame(message)
+    decoded = decoder.addData(data)
+    assert(len(decoded) == 1)
+    assert(decoded[0].getID() == message.getID())
+    assert not decoder.gotBinary()
+
+    # Partial frames are kept until the rest arrives.
+    frame = tcpFraming.encodeFrame(message, binary = True)
+    assert(decoder.addData(frame[:3]) == [])
+    assert(decoder.getBuffered() == 3)
+    assert(len(decoder.addData(frame[3:])) == 1)
+
+def test_tcp_framing_3():
+    """
+    Large messages are sent as binary frames, but the server only does
+    this for clients that have sent it a binary frame.
+    """
+    getApp()
+    server = tcpServer.TCPServer(binary_threshold = 1000, port = 9615)
+    server.messageReceived.connect(server.sendMessage)
+
+    for [binary_threshold, expected] in [[None, 0], [1000, 1]]:
+        client = tcpClient.TCPClient(binary_threshold = binary_threshold, port = 9615)
+        responses = []
+        client.messageReceived.connect(responses.append)
+        assert client.startCommunication()
+
+        small = tcpMessage.TCPMessage(message_type = "Small")
+        large = tcpMessage.TCPMessage(message_type = "Large", message_data = {"parameters" : "<xml>" * 1000})
+        for message in [small, large, small]:
+            client.sendMessage(message)
+
+        assert waitFor(lambda : (len(responses) == 3))
+        assert(responses[1].getData("parameters") == large.getData("parameters"))
+        assert(server.decoder.getStatistics()["binary"] == expected)
+        assert(client.decoder.getStatistics()["binary"] == expected)
+
+        client.stopCommunication()
+        client.close()
+        assert waitFor(lambda : not server.isConnected())
+
+    server.close()
+
+
+if (__name__ == "__main__"):
+    test_tcp_framing_1()
+    test_tcp_framing_2()
+    test_tcp_framing_3()
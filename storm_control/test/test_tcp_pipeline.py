@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+Tests of having several TCP messages outstanding.
+"""
+from PyQt5 import QtCore, QtWidgets
+
+import storm_control.sc_library.parameters as params
+import storm_control.sc_library.tcpClient as tcpClient
+import storm_control.sc_library.tcpMessage as tcpMessage
+import storm_control.sc_library.tcpServer as tcpServer
+
+import storm_control.hal4000.halLib.halMessage as halMessage
+import storm_control.hal4000.tcpControl.tcpBenchmark as tcpBenchmark
+import storm_control.hal4000.tcpControl.tcpControl as tcpControl
+
+
+app = None
+
+def getApp():
+    global app
+    app = QtWidgets.QApplication.instance()
+    if app is None:
+        app = QtWidgets.QApplication([])
+    return app
+
+def waitFor(condition, timeout = 5.0):
+    timer = QtCore.QElapsedTimer()
+    timer.start()
+    while not condition() and (timer.elapsed() < 1000.0 * timeout):
+        app.processEvents(QtCore.QEventLoop.AllEvents, 10)
+    return condition()
+
+def test_tcp_pipeline_1():
+    """
+    Responses are matched to requests even if they arrive out of order.
+    """
+    getApp()
+    server = tcpServer.TCPServer(port = 9610)
+    received = []
+    server.messageReceived.connect(received.append)
+
+    client = tcpClient.TCPClient(port = 9610)
+    responses = []
+    all_received = []
+    client.messageReceived.connect(responses.append)
+    client.allReceived.connect(lambda : all_received.append(True))
+    assert client.startCommunication()
+
+    messages = [tcpMessage.TCPMessage(message_type = "Test", message_data = {"index" : i}) for i in range(5)]
+    for message in messages:
+        client.sendMessage(message)
+    assert(len(client.getOutstanding()) == 5)
+
+    # The server gets all the messages, even if they arrive together.
+    assert waitFor(lambda : (len(received) == 5))
+    assert([message.getData("index") for message in received] == list(range(5)))
+
+    for message in reversed(received):
+        server.sendMessage(message)
+    assert waitFor(lambda : (len(responses) == 5))
+    assert([message.getID() for message in responses] == [message.getID() for message in reversed(messages)])
+    assert(len(client.getOutstanding()) == 0)
+    assert(all_received == [True])
+
+    client.close()
+    server.close()
+
+def test_tcp_pipeline_2():
+    """
+    Pipelined messages are handled in order, messages that depend on a failed
+    message are not handled.
+    """
+    getApp()
+    server = tcpServer.TCPServer(port = 9611)
+    controller = tcpControl.Controller(parallel_mode = True, server = server, verbose = False)
+
+    actions = []
+    def handleAction(action):
+        actions.append(action.tcp_message.getType())
+        action.was_handled = True
+        if action.tcp_message.isType("Set Parameters"):
+            action.tcp_message.setError(True, "Parameters not found")
+        QtCore.QTimer.singleShot(10, lambda : controller.actionDone(action))
+    controller.controlAction.connect(handleAction)
+
+    client = tcpClient.TCPClient(port = 9611)
+    responses = []
+    client.messageReceived.connect(responses.append)
+    assert client.startCommunication()
+
+    focus = tcpMessage.TCPMessage(message_type = "Check Focus Lock")
+    params = tcpMessage.TCPMessage(message_type = "Set Parameters",
+                                   message_data = {"parameters" : "bad"})
+    movie = tcpMessage.TCPMessage(message_type = "Take Movie",
+                                  message_data = {"length" : 10, "name" : "movie", "overwrite" : True})
+    movie.addDependency(params)
+    movie.setSync(True)
+    for message in [focus, params, movie]:
+        client.sendMessage(message)
+
+    assert waitFor(lambda : (len(responses) == 3))
+    assert(actions == ["Check Focus Lock", "Set Parameters"])
+    assert([message.getID() for message in responses] == [focus.getID(), params.getID(), movie.getID()])
+    assert not responses[0].hasError()
+    assert responses[1].hasError()
+    assert responses[2].hasError()
+    assert(controller.getPending() == 0)
+
+    client.close()
+    server.close()
+
+def test_tcp_pipeline_3():
+    """
+    Pipelining imaging cycles is faster.
+    """
+    getApp()
+    [sequential, errors] = tcpBenchmark.benchmark(n_cycles = 5, parallel = False, port = 9612)
+    assert(errors == 0)
+    [pipelined, errors] = tcpBenchmark.benchmark(n_cycles = 5, parallel = True, port = 9613)
+    assert(errors == 0)
+    assert(pipelined > sequential)
+
+def test_tcp_pipeline_4():
+    """
+    The TCP control module handles pipelined actions one after another.
+    """
+    getApp()
+    halMessage.initializeMessages()
+
+    module_params = params.StormXMLObject()
+    module_params.add("configuration.parallel_mode", False)
+    module_params.add("configuration.tcp_port", 9614)
+    tcp_control = tcpControl.TCPControl(module_params = module_params)
+
+    # HAL is just the test, which responds to each action's message.
+    hal_messages = []
+    def sendMessage(message):
+        if message.isType("tcp message"):
+            hal_messages.append(message)
+    tcp_control.sendMessage = sendMessage
+
+    client = tcpClient.TCPClient(port = 9614)
+    responses = []
+    client.messageReceived.connect(responses.append)
+    assert client.startCommunication()
+
+    messages = [tcpMessage.TCPMessage(message_type = "Move Stage",
+                                      message_data = {"stage_x" : float(i), "stage_y" : 0.0}) for i in range(3)]
+    for message in messages:
+        client.sendMessage(message)
+
+    for i in range(3):
+        assert waitFor(lambda : (len(hal_messages) == i + 1))
+        hal_message = hal_messages[i]
+        assert(hal_message.getData()["tcp message"].getID() == messages[i].getID())
+        hal_message.addResponse(halMessage.HalMessageResponse(source = "stage"))
+        tcp_control.handleResponses(hal_message)
+
+    assert waitFor(lambda : (len(responses) == 3))
+    assert([message.getID() for message in responses] == [message.getID() for message in messages])
+    assert not any([message.hasError() for message in responses])
+    assert(tcp_control.control_action is None)
+
+    client.close()
+    tcp_control.cleanUp(None)
+
+
+if (__name__ == "__main__"):
+    test_tcp_pipeline_1()
+    test_tcp_pipeline_2()
+    test_tcp_pipeline_3()
+    test_tcp_pipeline_4()
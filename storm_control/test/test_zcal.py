@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+Test z calibration z fitting.
+"""
+import numpy
+
+import storm_control.zee_calibrator.zcal as zcal
+
+
+def test_zcal_1():
+    """
+    Vectorized z fitting gives the same answer as Brent's method.
+    """
+    zc = zcal.ZCalibration(None, 2, None, 160.0)
+    zc.wx_fit = numpy.array([2.2, -250.0, 400.0, 0.1, 0.05])
+    zc.wy_fit = numpy.array([2.2, 250.0, 400.0, -0.1, 0.05])
+    zc.calcQuickZ()
+
+    z = numpy.linspace(-350.0, 350.0, 50)
+    wx = zcal.zcalibs[zc.fit_power](zc.wx_fit, z)
+    wy = zcal.zcalibs[zc.fit_power](zc.wy_fit, z)
+
+    [rz, err] = zc.objectZCoords(wx, wy)
+    assert numpy.allclose(rz, z, atol = 1.0e-2)
+    assert numpy.allclose(err, 0.0, atol = 1.0e-4)
+
+    wx += 0.05
+    wy -= 0.03
+    [rz, err] = zc.objectZCoords(wx, wy)
+    [rz_b, err_b] = zc.objectZCoordsBrent(wx, wy)
+    assert numpy.allclose(rz, rz_b, atol = 1.0e-2)
+    assert numpy.allclose(err, err_b, atol = 1.0e-4)
+    assert (err > 0.0).all()
+
+    # Invalid widths.
+    [rz, err] = zc.objectZCoords(numpy.array([-1.0, 2.0]), numpy.array([2.0, 2.0]))
+    assert (err[0] < 0.0)
+    assert (err[1] >= 0.0)
+
+def test_zcal_2():
+    """
+    Grouped object selection gives the same answer as selecting frame by frame.
+    """
+    n_frames = 50
+    n_locs = 5000
+    numpy.random.seed(0)
+
+    zc = zcal.ZCalibration(None, 2, None, 160.0)
+    zc.fit = [0.1, -1.0]
+    zc.frames = n_frames
+    zc.offsets = numpy.zeros((n_frames, 3))
+    zc.offsets[:,0] = numpy.linspace(5.0, 15.0, n_frames)
+    zc.tilt = [5.0, 0.1, -0.2]
+
+    # Unsorted frames, including some that are out of range.
+    zc.i3_data = {"fr" : numpy.random.randint(-2, n_frames + 2, n_locs),
+                  "x" : numpy.random.uniform(0.0, 256.0, n_locs).astype(numpy.float32),
+                  "y" : numpy.random.uniform(0.0, 256.0, n_locs).astype(numpy.float32)}
+    zc.wx = numpy.random.uniform(1.0, 3.0, n_locs)
+    zc.wy = numpy.random.uniform(1.0, 3.0, n_locs)
+    mask = (numpy.random.uniform(size = n_frames) > 0.3)
+
+    def reference():
+        [x, y, wx, wy, sz] = [numpy.array(()) for i in range(5)]
+        for i in range(n_frames):
+            if mask[i]:
+                f_mask = (zc.i3_data["fr"] == i)
+                _wx = zc.wx[f_mask]
+                _wy = zc.wy[f_mask]
+                w_mask = (_wx > (numpy.mean(_wx) - 1.5 * numpy.std(_wx))) & \
+                    (_wx < (numpy.mean(_wx) + 1.5 * numpy.std(_wx))) & \
+                    (_wy > (numpy.mean(_wy) - 1.5 * numpy.std(_wy))) & \
+                    (_wy < (numpy.mean(_wy) + 1.5 * numpy.std(_wy))) & \
+                    ((_wx * _wy) > 2.2)
+                _x = zc.i3_data["x"][f_mask][w_mask]
+                _y = zc.i3_data["y"][f_mask][w_mask]
+                x = numpy.concatenate((x, _x))
+                y = numpy.concatenate((y, _y))
+                wx = numpy.concatenate((wx, _wx[w_mask]))
+                wy = numpy.concatenate((wy, _wy[w_mask]))
+                sz = numpy.concatenate((sz, zc.getFrameZnm(i) + zc.tilt[0] + zc.tilt[1] * _x + zc.tilt[2] * _y))
+        if zc.z_offset is not None:
+            sz -= zc.z_offset
+            z_mask = (sz > -400.0) & (sz < 400.0)
+            return [a[z_mask] for a in [x, y, wx, wy, sz]]
+        return [x, y, wx, wy, sz]
+
+    for z_offset in [None, 250.0]:
+        zc.z_offset = z_offset
+        expected = reference()
+        actual = zc.selectObjects(mask)
+        for i in range(5):
+            assert (actual[i].size == expected[i].size)
+            assert numpy.allclose(actual[i], expected[i])
+    assert (actual[0].size > 0)
+
+
+def test_zcal_3():
+    """
+    Localizations outside of the default look up table range.
+    """
+    zc = zcal.ZCalibration(None, 2, None, 160.0)
+    zc.wx_fit = numpy.array([2.2, -250.0, 400.0, 0.1, 0.05])
+    zc.wy_fit = numpy.array([2.2, 250.0, 400.0, -0.1, 0.05])
+    zc.calcQuickZ()
+
+    z = numpy.array([-900.0, -700.0, 0.0, 650.0, 700.0, 800.0])
+    wx = zcal.zcalibs[zc.fit_power](zc.wx_fit, z)
+    wy = zcal.zcalibs[zc.fit_power](zc.wy_fit, z)
+    [rz, err] = zc.objectZCoords(wx, wy)
+    assert numpy.allclose(rz, z, atol = 1.0e-2)
+    assert numpy.allclose(err, 0.0, atol = 1.0e-4)
+
+    # Far outside of the table, these are fit with Brent's method.
+    z = numpy.array([-6000.0, 6000.0])
+    wx = zcal.zcalibs[zc.fit_power](zc.wx_fit, z)
+    wy = zcal.zcalibs[zc.fit_power](zc.wy_fit, z)
+    [rz, err] = zc.objectZCoords(wx, wy)
+    [rz_b, err_b] = zc.objectZCoordsBrent(wx, wy)
+    assert numpy.allclose(rz, rz_b, atol = 1.0e-2)
+
+if (__name__ == "__main__"):
+    test_zcal_1()
+    test_zcal_2()
+    test_zcal_3()
@@ -14,7 +14,9 @@ import os
 import re
 import scipy
 import scipy.optimize
-import struct
+import scipy.spatial
+
+import storm_control.sc_library.i3reader as i3reader
 
 #
 # different power z calibration functions
@@ -100,58 +102,12 @@ zcalibs = [zcalib0, zcalib1, zcalib2, zcalib3, zcalib4]
 # for a Insight3 file reader you should use that project and not this.
 #
 
-## getV
-#
-# Helper function for reading binary header data.
-#
-# @param fp A file pointer.
-# @param format A string defining the data format.
-# @param size An integer specifying how many bytes to read.
-#
-# @return The unpacked value from the file.
-#
-def getV(fp, format, size):
-    return struct.unpack(format, fp.read(size))[0]
-
 ## i3DataType
 #
 # @return A numpy data type to use for reading Insight3 format files.
 #
 def i3DataType():
-    return numpy.dtype([('x', numpy.float32),   # original x location
-                        ('y', numpy.float32),   # original y location
-                        ('xc', numpy.float32),  # drift corrected x location
-                        ('yc', numpy.float32),  # drift corrected y location
-                        ('h', numpy.float32),   # fit height
-                        ('a', numpy.float32),   # fit area
-                        ('w', numpy.float32),   # fit width
-                        ('phi', numpy.float32), # fit angle (for unconstrained elliptical gaussian)
-                        ('ax', numpy.float32),  # peak aspect ratio
-                        ('bg', numpy.float32),  # fit background
-                        ('i', numpy.float32),   # sum - baseline for pixels included in the peak
-                        ('c', numpy.int32),     # peak category ([0..9] for STORM images)
-                        ('fi', numpy.int32),    # fit iterations
-                        ('fr', numpy.int32),    # frame
-                        ('tl', numpy.int32),    # track length
-                        ('lk', numpy.int32),    # link (id of the next molecule in the trace)
-                        ('z', numpy.float32),   # original z coordinate
-                        ('zc', numpy.float32)]) # drift corrected z coordinate
-
-## maskData
-#
-# Creates a new i3 data structure containing only
-# those elements where mask is True.
-#
-# @param i3data The insight3 format data.
-# @param mask The (numpy) mask.
-#
-# @return An i3data data structure containing only the localizations where mask was true.
-#
-def maskData(i3data, mask):
-    new_i3data = numpy.zeros(mask.sum(), dtype = i3DataType())
-    for field in i3data.dtype.names:
-        new_i3data[field] = i3data[field][mask]
-    return new_i3data
+    return i3reader.i3DataType()
 
 ## posSet
 #
@@ -166,25 +122,6 @@ def posSet(i3data, field, value):
     setI3Field(i3data, field, value)
     setI3Field(i3data, field + 'c', value)
 
-## readHeader
-#
-# @param fp A file pointer.
-#
-# @return [# frames, # localizations, file version, file status]
-#
-def readHeader(fp):
-    version = getV(fp, "4s", 4)
-    frames = getV(fp, "i", 4)
-    status = getV(fp, "i", 4)
-    molecules = getV(fp, "i", 4)
-    if False:
-        print("Version:", version)
-        print("Frames:", frames)
-        print("Status:", status)
-        print("Molecules:", molecules)
-        print("")
-    return [frames, molecules, version, status]
-
 ## readI3File
 #
 # Read the data from an Insight3 format file.
@@ -196,17 +133,8 @@ def readHeader(fp):
 #
 def readI3File(filename, nm_per_pixel):
     print("nm_per_pixel", nm_per_pixel)
-    fp = open(filename, "rb")
-
-    # Read header
-    [frames, molecules, version, status] = readHeader(fp)
-
-    # Read molecule info
-    data = numpy.fromfile(fp, dtype = i3DataType())
-    data = data[:][0:molecules]
-    fp.close()
-
-    return data
+    reader = i3reader.I3Reader(filename)
+    return reader.load(i3DataType().names)
 
 
 ## ZCalibration
@@ -223,6 +151,7 @@ class ZCalibration():
 
         # state variables
         self.edge_loc = 0
+        self.frame_index = None
         self.frames = None
         self.good_stagep = None
         self.good_offsetp = None
@@ -239,6 +168,7 @@ class ZCalibration():
         self.wy_fit = None
         self.z = None
         self.z_offset = 0
+        self.z_table = None
 
         # Is this a molecule list file?
         if filename is not None:
@@ -332,6 +262,21 @@ class ZCalibration():
             self.tilt = results
             return True
 
+    ## frameIndex
+    #
+    # The localizations sorted by frame, this is created once
+    # when the localizations are loaded.
+    #
+    # @return [localization index, localization frame], both sorted by frame.
+    #
+    def frameIndex(self):
+        if self.frame_index is None:
+            fr = self.i3_data['fr']
+            index = numpy.argsort(fr, kind = "stable")
+            index = index[(fr[index] >= 0)]
+            self.frame_index = [index, fr[index]]
+        return self.frame_index
+
     # Get a binned version of the points in the fit
     def getBinnedPoints(self):
         mask = (self.mask != 0)
@@ -464,25 +409,99 @@ class ZCalibration():
     # @param minimum_intensity The minimum intensity
     #
     def loadMolecules(self, filename, minimum_intensity):
-        self.i3_data = readI3File(filename, self.nm_per_pixel)
-        self.i3_data = maskData(self.i3_data, (self.i3_data['i'] > minimum_intensity))
+        # Only load the fields that we use.
+        reader = i3reader.I3Reader(filename)
+        self.i3_data = reader.load(["x", "y", "w", "ax", "i", "c", "fr"],
+                                   mask_fn = lambda chunk: (chunk['i'] > minimum_intensity))
         self.i3_data['fr'] -= 1
+        self.frame_index = None
         self.wx = numpy.sqrt(self.i3_data['w']*self.i3_data['w']/self.i3_data['ax'])/self.nm_per_pixel
         self.wy = numpy.sqrt(self.i3_data['w']*self.i3_data['w']*self.i3_data['ax'])/self.nm_per_pixel
 
     ## objectZCoords
     #
-    # Determines the z coordinates from the x and y widths
+    # Determines the z coordinates from the x and y widths. This
+    # finds the closest point on the calibration curve (in sqrt(w)
+    # space) using a look up table, then refines it with a few
+    # Gauss-Newton steps. All the localizations are done at once.
     #
     # @param wx The localization widths in x.
     # @param wy The localization widths in y.
+    # @param n_steps (Optional) The number of Gauss-Newton steps.
     #
     # @return [molecule z location, fit error]
     #
-    def objectZCoords(self, wx, wy):
+    def objectZCoords(self, wx, wy, n_steps = 4):
+        zcalibs_fn = zcalibs[self.fit_power]
 
-        # roughly estimate z
-        qz = self.quick_z[0] * (wx - wy) + self.quick_z[1]
+        def sqrtW(z):
+            return [numpy.sqrt(zcalibs_fn(self.wx_fit, z)),
+                    numpy.sqrt(zcalibs_fn(self.wy_fit, z))]
+
+        with numpy.errstate(invalid = "ignore"):
+            sx_m = numpy.sqrt(wx)
+            sy_m = numpy.sqrt(wy)
+        good = numpy.isfinite(sx_m) & numpy.isfinite(sy_m)
+
+        # Nearest point in the look up table. The table has to cover the z
+        # range of the localizations, we use the quick z estimates for this.
+        # These are not very accurate far from focus so we add some margin.
+        z_range = None
+        if (self.quick_z is not None) and good.any():
+            zo = self.quick_z[0] * (wx[good] - wy[good]) + self.quick_z[1]
+            z_range = [1.5 * numpy.min(zo), 1.5 * numpy.max(zo)]
+        [z_table, kd_tree] = self.zLookUpTable(z_range = z_range)
+        [dist, index] = kd_tree.query(numpy.column_stack((sx_m[good], sy_m[good])))
+        z = numpy.zeros(sx_m.size)
+        z[good] = z_table[index]
+
+        # Localizations that are closest to the ends of the table are
+        # probably outside of it, these are fit with Brent's method.
+        edge = numpy.zeros(sx_m.size, dtype = bool)
+        if (self.quick_z is not None):
+            edge[good] = (index == 0) | (index == (z_table.size - 1))
+
+        # Refine.
+        dz = 0.01
+        for i in range(n_steps):
+            [sx_c, sy_c] = sqrtW(z)
+            [sx_p, sy_p] = sqrtW(z + dz)
+            dsx = (sx_p - sx_c)/dz
+            dsy = (sy_p - sy_c)/dz
+            tx = sx_m - sx_c
+            ty = sy_m - sy_c
+            denom = dsx * dsx + dsy * dsy
+            step = numpy.zeros(z.size)
+            numpy.divide(tx * dsx + ty * dsy, denom, out = step, where = (denom > 0.0))
+
+            # Don't let the steps get larger than the table spacing.
+            z += numpy.clip(step, -1.0, 1.0)
+
+        [sx_c, sy_c] = sqrtW(z)
+        tx = sx_m - sx_c
+        ty = sy_m - sy_c
+        err = numpy.sqrt(tx * tx + ty * ty)
+
+        if edge.any():
+            [z[edge], err[edge]] = self.objectZCoordsBrent(wx[edge], wy[edge])
+
+        # Mark localizations with invalid widths with a negative error.
+        z[~good] = 0.0
+        err[~good] = -1.0
+        return [z, err]
+
+    ## objectZCoordsBrent
+    #
+    # Determines the z coordinates from the x and y widths, one
+    # localization at a time using Brent's method. This is much
+    # slower than objectZCoords().
+    #
+    # @param wx The localization widths in x.
+    # @param wy The localization widths in y.
+    #
+    # @return [molecule z location, fit error]
+    #
+    def objectZCoordsBrent(self, wx, wy):
 
         # figure out appropriate z function
         global zcalibs
@@ -499,11 +518,12 @@ class ZCalibration():
         
         n_vals = wx.shape[0]
         rz = numpy.zeros((n_vals)) # "real" z, determined only from the moments
+        err = numpy.zeros(n_vals)
         for i in range(n_vals):
             zo = self.quick_z[0] * (wx[i] - wy[i]) + self.quick_z[1]
             rz[i] = scipy.optimize.brent(D, args = (wx[i], wy[i]), brack = [zo - 100.0, zo + 100.0])
+            err[i] = D(rz[i], wx[i], wy[i])
 
-        err = numpy.zeros(wx.shape[0])
         return [rz, err]
 
     ## saveCalibration
@@ -528,40 +548,44 @@ class ZCalibration():
     # @return [x, y, wx, wy, sz] Of the localizations in the correct frames and widths that were not too far from the mean.
     #
     def selectObjects(self, mask):
-        i3_x = self.i3_data['x']
-        i3_y = self.i3_data['y']
-        i3_wx = self.wx
-        i3_wy = self.wy
-
-        x = numpy.array(())
-        y = numpy.array(())
-        sz = numpy.array(()) # i.e. z as determined by the nominal stage position and sample tilt.
-        wx = numpy.array(())
-        wy = numpy.array(())
-        for i in range(self.frames):
-            if mask[i]:
-                
-                f_mask = (self.i3_data['fr'] == i)
-                _x = i3_x[f_mask]
-                _y = i3_y[f_mask]
-                _wx = i3_wx[f_mask]
-                _wy = i3_wy[f_mask]
-
-                max_err = 1.5
-                mwx = scipy.mean(_wx)
-                swx = scipy.std(_wx)
-                mwy = scipy.mean(_wy)
-                swy = scipy.std(_wy)
-                w_mask = (_wx > (mwx - max_err *swx)) & (_wx < (mwx + max_err * swx)) & \
-                    (_wy > (mwy - max_err *swy)) & (_wy < (mwy + max_err * swy)) & \
-                    ((_wx * _wy) > 2.2)
-                    
-                x = numpy.concatenate((x, numpy.ascontiguousarray(_x[w_mask])), 0)
-                y = numpy.concatenate((y, numpy.ascontiguousarray(_y[w_mask])), 0)
-                wx = numpy.concatenate((wx, numpy.ascontiguousarray(_wx[w_mask])), 0)
-                wy = numpy.concatenate((wy, numpy.ascontiguousarray(_wy[w_mask])), 0)
-                tz = self.getFrameZnm(i) + (self.tilt[0] + self.tilt[1] * _x[w_mask] + self.tilt[2] * _y[w_mask])
-                sz = numpy.concatenate((sz, numpy.ascontiguousarray(tz)), 0)
+        [index, fr] = self.frameIndex()
+
+        # Localizations in the frames that we want to analyze.
+        in_range = (fr < self.frames)
+        index = index[in_range]
+        fr = fr[in_range]
+        in_mask = (numpy.asarray(mask)[fr] != 0)
+        index = index[in_mask]
+        fr = fr[in_mask]
+
+        x = self.i3_data['x'][index].astype(numpy.float64)
+        y = self.i3_data['y'][index].astype(numpy.float64)
+        wx = self.wx[index].astype(numpy.float64)
+        wy = self.wy[index].astype(numpy.float64)
+
+        # Per frame mean and standard deviation of the widths.
+        n_per_frame = numpy.bincount(fr, minlength = self.frames)[fr]
+        def frameMeanStd(w):
+            mean = numpy.bincount(fr, weights = w, minlength = self.frames)[fr]/n_per_frame
+            diff = w - mean
+            var = numpy.bincount(fr, weights = diff * diff, minlength = self.frames)[fr]/n_per_frame
+            return [mean, numpy.sqrt(var)]
+
+        max_err = 1.5
+        [mwx, swx] = frameMeanStd(wx)
+        [mwy, swy] = frameMeanStd(wy)
+        w_mask = (wx > (mwx - max_err *swx)) & (wx < (mwx + max_err * swx)) & \
+            (wy > (mwy - max_err *swy)) & (wy < (mwy + max_err * swy)) & \
+            ((wx * wy) > 2.2)
+
+        x = x[w_mask]
+        y = y[w_mask]
+        wx = wx[w_mask]
+        wy = wy[w_mask]
+        fr = fr[w_mask]
+
+        # i.e. z as determined by the nominal stage position and sample tilt.
+        sz = self.getFrameZnm(fr) + (self.tilt[0] + self.tilt[1] * x + self.tilt[2] * y)
 
         if self.z_offset != None:
             sz -= self.z_offset
@@ -640,6 +664,67 @@ class ZCalibration():
         
         return True
 
+    ## zLookUpTable
+    #
+    # Creates (if necessary) a table of the calibration curve
+    # in sqrt(w) space at 1nm intervals, and a KD tree for finding
+    # the closest point in the table.
+    #
+    # @param z_range (Optional) [minimum z, maximum z] that the table should cover,
+    #                the table always covers at least -600nm to 600nm and at most
+    #                -5000nm to 5000nm.
+    #
+    # @return [z values, KD tree]
+    #
+    def zLookUpTable(self, z_range = None):
+        z_min = -600.0
+        z_max = 600.0
+        if z_range is not None:
+            z_min = max(min(z_min, 100.0 * math.floor(z_range[0]/100.0)), -5000.0)
+            z_max = min(max(z_max, 100.0 * math.ceil(z_range[1]/100.0)), 5000.0)
+
+        # The table is only re-created if the coefficients change or if it does not
+        # cover the z range, so it only grows.
+        key = [self.fit_power, tuple(self.wx_fit), tuple(self.wy_fit)]
+        if (self.z_table is None) or (self.z_table[0] != key) or (z_min < self.z_table[1][0]) or (z_max > self.z_table[1][1]):
+            if (self.z_table is not None) and (self.z_table[0] == key):
+                z_min = min(z_min, self.z_table[1][0])
+                z_max = max(z_max, self.z_table[1][1])
+            z = numpy.arange(z_min, z_max + 0.5, 1.0)
+            sx = numpy.sqrt(zcalibs[self.fit_power](self.wx_fit, z))
+            sy = numpy.sqrt(zcalibs[self.fit_power](self.wy_fit, z))
+            mask = numpy.isfinite(sx) & numpy.isfinite(sy)
+            self.z_table = [key, [z_min, z_max], z[mask], scipy.spatial.cKDTree(numpy.column_stack((sx[mask], sy[mask])))]
+        return self.z_table[2:]
+
+
+#
+# Benchmark objectZCoords() against objectZCoordsBrent().
+#
+if (__name__ == "__main__"):
+    import time
+
+    zc = ZCalibration(None, 2, None, 160.0)
+    zc.wx_fit = numpy.array([2.2, -250.0, 400.0, 0.1, 0.05])
+    zc.wy_fit = numpy.array([2.2, 250.0, 400.0, -0.1, 0.05])
+    zc.calcQuickZ()
+
+    n_locs = 10000
+    z = numpy.random.uniform(-400.0, 400.0, n_locs)
+    wx = zcalibs[zc.fit_power](zc.wx_fit, z) + numpy.random.normal(scale = 0.05, size = n_locs)
+    wy = zcalibs[zc.fit_power](zc.wy_fit, z) + numpy.random.normal(scale = 0.05, size = n_locs)
+
+    start_time = time.time()
+    [rz_b, err_b] = zc.objectZCoordsBrent(wx, wy)
+    brent_time = time.time() - start_time
+
+    start_time = time.time()
+    [rz, err] = zc.objectZCoords(wx, wy)
+    vector_time = time.time() - start_time
+
+    print("Brent {0:.3f}s, vectorized {1:.3f}s, {2:.1f}x faster".format(brent_time, vector_time, brent_time/vector_time))
+    print("Maximum z difference {0:.3f}nm".format(numpy.max(numpy.abs(rz - rz_b))))
+
 #
 # The MIT License
 #